@@ -161,6 +161,28 @@ class AccountingCLI( CLI ):
     except:
       self.showTraceback()
 
+  def do_rebuildRollups( self, args ):
+    """
+    Rebuild the rollups of a type from its buckets. Can take a while.
+      Usage : rebuildRollups <typeName>
+      Rollups are defined with the RollupKeys option of the AccountingDB
+    """
+    try:
+      argList = args.split()
+      if argList:
+        typeName = argList[0].strip()
+      else:
+        gLogger.error( "No type name specified" )
+        return
+      acClient = RPCClient( "Accounting/DataStore" )
+      retVal = acClient.rebuildRollups( typeName )
+      if retVal[ 'OK' ]:
+        gLogger.info( "Rollups rebuilt!" )
+      else:
+        gLogger.error( "Error: %s" % retVal[ 'Message' ] )
+    except:
+      self.showTraceback()
+
   def do_showRegisteredTypes( self, args ):
     """
     Get a list of registered types
@@ -226,4 +248,30 @@ class AccountingCLI( CLI ):
         return
       gLogger.info( "Done" )
     except:
-      self.showTraceback()
\ No newline at end of file
+      self.showTraceback()
+
+  def do_showCompactionStatus( self, args ):
+    """
+    Show the progress of the running compaction of the buckets, or of the last one
+      Usage : showCompactionStatus
+    """
+    try:
+      acClient = RPCClient( "Accounting/DataStore" )
+      retVal = acClient.getCompactionStatus()
+      if not retVal[ 'OK' ]:
+        gLogger.error( "Error: %s" % retVal[ 'Message' ] )
+        return
+      status = retVal[ 'Value' ]
+      print "Running: %s" % status[ 'Running' ]
+      for typeName in sorted( status[ 'Types' ] ):
+        print typeName
+        for bucketLength in sorted( status[ 'Types' ][ typeName ] ):
+          stepStatus = status[ 'Types' ][ typeName ][ bucketLength ]
+          print "  %s -> %s: %s, %s of %s chunks, %s buckets moved" % ( bucketLength,
+                                                                       stepStatus.get( 'NextBucketLength', '-' ),
+                                                                       stepStatus[ 'Status' ],
+                                                                       stepStatus.get( 'ChunksDone', 0 ),
+                                                                       stepStatus.get( 'Chunks', '-' ),
+                                                                       stepStatus.get( 'RowsMoved', 0 ) )
+    except:
+      self.showTraceback()
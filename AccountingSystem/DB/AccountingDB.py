@@ -7,15 +7,20 @@ import datetime
 import time
 import threading
 import random
+from decimal import Decimal
 
 from DIRAC.Core.Base.DB import DB
 from DIRAC import S_OK, S_ERROR, gConfig
 from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 from DIRAC.Core.Utilities import List, ThreadSafe, Time, DEncode
 from DIRAC.AccountingSystem.private.TypeLoader import TypeLoader
+from DIRAC.AccountingSystem.private.KeyValueCache import KeyValueCache
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
 
 gSynchro = ThreadSafe.Synchronizer()
+#Seconds between reloads of the rollups catalog. Rollups are built or dropped only twice that time
+#after being added or removed, when all the instances know about them
+ROLLUPS_REFRESH_TIME = 300
 
 class AccountingDB( DB ):
 
@@ -32,18 +37,41 @@ class AccountingDB( DB ):
     self.__queuedRecordsToInsert = []
     self.dbCatalog = {}
     self.dbBucketsLength = {}
-    self.__keysCache = {}
+    self.__keyValueCache = KeyValueCache( self.getCSOption( "KeyValueCacheSize", 100000 ) )
     maxParallelInsertions = self.getCSOption( "ParallelRecordInsertions", 10 )
+    self.__bulkInsertion = self.getCSOption( "BulkRecordInsertion", True )
     self.__threadPool = ThreadPool( 1, maxParallelInsertions )
     self.__threadPool.daemonize()
+    self.__compactionPool = ThreadPool( 1, self.getCSOption( "CompactionThreads", 4 ) )
+    self.__compactionChunkTime = self.getCSOption( "CompactionChunkTime", 86400 )
+    self.__compactionLock = ThreadSafe.Synchronizer()
+    self.__compactionStatus = {}
+    self.__rollups = {}
+    self.__rollupsLoadTime = 0
     self.catalogTableName = _getTableName( "catalog", "Types" )
+    self.rollupsTableName = _getTableName( "catalog", "Rollups" )
+    self.compactionTableName = _getTableName( "catalog", "Compaction" )
     self._createTables( { self.catalogTableName : { 'Fields' : { 'name' : "VARCHAR(64) UNIQUE NOT NULL",
                                                           'keyFields' : "VARCHAR(255) NOT NULL",
                                                           'valueFields' : "VARCHAR(255) NOT NULL",
                                                           'bucketsLength' : "VARCHAR(255) NOT NULL",
                                                        },
                                              'PrimaryKey' : 'name'
-                                           }
+                                           },
+                          self.rollupsTableName : { 'Fields' : { 'typeName' : "VARCHAR(64) NOT NULL",
+                                                                 'keyName' : "VARCHAR(64) NOT NULL",
+                                                                 'status' : "VARCHAR(16) DEFAULT 'Waiting' NOT NULL",
+                                                                 'lastChange' : "INT UNSIGNED DEFAULT 0 NOT NULL"
+                                                               },
+                                                    'UniqueIndexes' : { 'Rollup' : [ 'typeName', 'keyName' ] }
+                                                  },
+                          self.compactionTableName : { 'Fields' : { 'typeName' : "VARCHAR(64) NOT NULL",
+                                                                    'bucketLength' : "MEDIUMINT UNSIGNED NOT NULL",
+                                                                    'watermark' : "INT UNSIGNED NOT NULL",
+                                                                    'rowsMoved' : "BIGINT UNSIGNED DEFAULT 0 NOT NULL"
+                                                                  },
+                                                       'UniqueIndexes' : { 'Step' : [ 'typeName', 'bucketLength' ] }
+                                                     }
                         }
                       )
     self.__loadCatalogFromDB()
@@ -62,6 +90,16 @@ class AccountingDB( DB ):
                                "Accounting",
                                "seconds",
                                gMonitor.OP_MEAN )
+    gMonitor.registerActivity( "keycachehitrate",
+                               "Key value cache hit rate",
+                               "Accounting",
+                               "%",
+                               gMonitor.OP_MEAN )
+    gMonitor.registerActivity( "compactedbuckets",
+                               "Buckets compacted",
+                               "Accounting",
+                               "buckets",
+                               gMonitor.OP_ACUM )
 
     self.__compactTime = datetime.time( hour = 2,
                                         minute = random.randint( 0, 59 ),
@@ -73,6 +111,9 @@ class AccountingDB( DB ):
     self.__lastCompactionEpoch = Time.toEpoch( lcd )
 
     self.__registerTypes()
+    if not self.__readOnly:
+      self.__registerRollups()
+      self.__warmKeyValueCache()
 
   def __loadTablesCreated( self ):
     result = self._query( "show tables" )
@@ -156,6 +197,156 @@ class AccountingDB( DB ):
       bucketsLength = DEncode.decode( typesEntry[3] )[0]
       self.__addToCatalog( typeName, keyFields, valueFields, bucketsLength )
 
+  def __registerRollups( self ):
+    """
+    Create the rollup tables of the keys in the RollupKeys option for the types having them,
+    and remove the ones not wanted anymore. Rollups are Waiting until built, Ready, or Removed.
+    The insertions start writing to a new rollup when they reload the catalog, it is built by
+    a compaction once they all do. A removed rollup is dropped by a compaction once they all stop
+    """
+    rollupKeys = self.getCSOption( "RollupKeys", [] )
+    retVal = self._query( "SELECT `typeName`, `keyName`, `status` FROM `%s`" % self.rollupsTableName )
+    if not retVal[ 'OK' ]:
+      self.log.error( "Can't load the rollups catalog", retVal[ 'Message' ] )
+      return retVal
+    registered = dict( [ ( ( row[0], row[1] ), row[2] ) for row in retVal[ 'Value' ] ] )
+    wanted = set()
+    for typeName in self.dbCatalog:
+      for keyName in rollupKeys:
+        if keyName in self.dbCatalog[ typeName ][ 'keys' ]:
+          wanted.add( ( typeName, keyName ) )
+    result = self.__loadTablesCreated()
+    if not result[ 'OK' ]:
+      return result
+    tablesInThere = result[ 'Value' ]
+    tables = {}
+    for typeName, keyName in wanted:
+      rollupTableName = _getTableName( "rollup", typeName, keyName )
+      if rollupTableName in tablesInThere:
+        continue
+      self.log.info( "Table for rollup by %s of %s has to be created" % ( keyName, typeName ) )
+      rollupFieldsDict = { 'startTime' : "INT UNSIGNED NOT NULL",
+                           'bucketLength' : "MEDIUMINT UNSIGNED NOT NULL",
+                           keyName : "INTEGER NOT NULL",
+                           'entriesInBucket' : "DECIMAL(30,10) NOT NULL" }
+      for valueField in self.dbCatalog[ typeName ][ 'values' ]:
+        rollupFieldsDict[ valueField ] = "DECIMAL(30,10) NOT NULL"
+      tables[ rollupTableName ] = { 'Fields' : rollupFieldsDict,
+                                    'UniqueIndexes' : { 'UniqueConstraint' : [ 'startTime', 'bucketLength', keyName ] }
+                                  }
+    if tables:
+      retVal = self._createTables( tables )
+      if not retVal[ 'OK' ]:
+        self.log.error( "Can't create rollup tables", retVal[ 'Message' ] )
+        return retVal
+    for typeName, keyName in wanted:
+      if ( typeName, keyName ) not in registered:
+        self.insertFields( self.rollupsTableName, [ 'typeName', 'keyName', 'status', 'lastChange' ],
+                           [ typeName, keyName, 'Waiting', int( time.time() ) ] )
+      elif registered[ ( typeName, keyName ) ] == 'Removed':
+        #Not written for a while, built again
+        self.__setRollupStatus( typeName, keyName, 'Waiting' )
+      elif _getTableName( "rollup", typeName, keyName ) in tables:
+        self.__setRollupReady( typeName, keyName, False )
+    for typeName, keyName in set( registered ) - wanted:
+      if registered[ ( typeName, keyName ) ] != 'Removed':
+        self.log.info( "Removing rollup by %s of %s" % ( keyName, typeName ) )
+        self.__setRollupStatus( typeName, keyName, 'Removed' )
+    self.__rollupsLoadTime = 0
+    return S_OK()
+
+  def __getRollups( self, typeName ):
+    """
+    Get { keyName : ready } for the rollups of a type, but the removed ones. The catalog is read again
+    every ROLLUPS_REFRESH_TIME seconds, rollups may be added, built or removed by another instance
+    """
+    if time.time() - self.__rollupsLoadTime > ROLLUPS_REFRESH_TIME:
+      retVal = self._query( "SELECT `typeName`, `keyName`, `status` FROM `%s`" % self.rollupsTableName )
+      if retVal[ 'OK' ]:
+        rollups = {}
+        for rollupTypeName, keyName, status in retVal[ 'Value' ]:
+          if status != 'Removed':
+            rollups.setdefault( rollupTypeName, {} )[ keyName ] = status == 'Ready'
+        self.__rollups = rollups
+      else:
+        self.log.warn( "Can't load the rollups catalog", retVal[ 'Message' ] )
+      self.__rollupsLoadTime = time.time()
+    return self.__rollups.get( typeName, {} )
+
+  def __setRollupReady( self, typeName, keyName, ready ):
+    """
+    Tell the queries whether they can use a rollup, the insertions keep writing to it
+    """
+    status = 'Waiting'
+    if ready:
+      status = 'Ready'
+    retVal = self._update( "UPDATE `%s` SET `status`='%s' WHERE `typeName`='%s' AND `keyName`='%s' AND `status`!='Removed'" % ( self.rollupsTableName,
+                                                                                                                             status,
+                                                                                                                             typeName,
+                                                                                                                             keyName ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    if keyName in self.__rollups.get( typeName, {} ):
+      self.__rollups[ typeName ][ keyName ] = ready
+    return S_OK()
+
+  def __setRollupStatus( self, typeName, keyName, status ):
+    """
+    Add a rollup to the ones the insertions write to, Waiting, or take it out, Removed
+    """
+    retVal = self._update( "UPDATE `%s` SET `status`='%s', `lastChange`=%d WHERE `typeName`='%s' AND `keyName`='%s'" % ( self.rollupsTableName,
+                                                                                                                       status,
+                                                                                                                       int( time.time() ),
+                                                                                                                       typeName,
+                                                                                                                       keyName ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    self.__rollupsLoadTime = 0
+    return S_OK()
+
+  def __getRollupsCatalog( self, typeName ):
+    """
+    Get { keyName : ( status, lastChange ) } for the rollups of a type, from the DB
+    """
+    retVal = self._query( "SELECT `keyName`, `status`, `lastChange` FROM `%s` WHERE `typeName`='%s'" % ( self.rollupsTableName,
+                                                                                                       typeName ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    return S_OK( dict( [ ( row[0], ( row[1], int( row[2] ) ) ) for row in retVal[ 'Value' ] ] ) )
+
+  def __dropRollup( self, typeName, keyName ):
+    retVal = self._update( "DELETE FROM `%s` WHERE `typeName`='%s' AND `keyName`='%s'" % ( self.rollupsTableName,
+                                                                                         typeName,
+                                                                                         keyName ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    self.__rollups.get( typeName, {} ).pop( keyName, None )
+    return self._update( "DROP TABLE IF EXISTS `%s`" % _getTableName( "rollup", typeName, keyName ) )
+
+  def __warmKeyValueCache( self ):
+    """
+    Fill the key value cache from the key tables, up to its size
+    """
+    for typeName in sorted( self.dbCatalog ):
+      for keyName in self.dbCatalog[ typeName ][ 'keys' ]:
+        freeSlots = self.__keyValueCache.freeSlots()
+        if not freeSlots:
+          return S_OK()
+        retVal = self._query( "SELECT `value`, `id` FROM `%s` ORDER BY `id` DESC LIMIT %d" % ( _getTableName( "key", typeName, keyName ),
+                                                                                                  freeSlots ) )
+        if not retVal[ 'OK' ]:
+          self.log.warn( "Can't load the key values", "%s %s: %s" % ( typeName, keyName, retVal[ 'Message' ] ) )
+          continue
+        self.__keyValueCache.addMany( typeName, keyName, retVal[ 'Value' ] )
+    self.log.info( "Loaded key values cache", "%s entries" % self.__keyValueCache.getStats()[ 'Size' ] )
+    return S_OK()
+
+  def getKeyValueCacheStats( self, reset = False ):
+    """
+    Get the size, number of hits and misses, and the hit rate of the key value cache
+    """
+    return S_OK( self.__keyValueCache.getStats( reset ) )
+
   def getWaitingRecordsLifeTime( self ):
     """
     Get the time records can live in the IN tables without no retry
@@ -238,6 +429,10 @@ class AccountingDB( DB ):
         self.__threadPool.generateJobAndQueueIt( self.__insertFromINTable ,
                                                  args = ( recordsToProcess, ) )
     self.log.info( "[PENDING] Got %s records requests for all types" % pending )
+    cacheStats = self.__keyValueCache.getStats( reset = True )
+    if cacheStats[ 'Hits' ] + cacheStats[ 'Misses' ]:
+      gMonitor.addMark( "keycachehitrate", cacheStats[ 'HitRate' ] )
+      self.log.info( "[PENDING] Key value cache", "%.1f%% hits, %s entries" % ( cacheStats[ 'HitRate' ], cacheStats[ 'Size' ] ) )
     self.__doingPendingLockTime = 0
     return S_OK()
 
@@ -465,7 +660,13 @@ class AccountingDB( DB ):
     if not retVal[ 'OK' ]:
       return retVal
     retVal = self._update( "DELETE FROM `%s` WHERE name='%s'" % ( _getTableName( "catalog", "Types" ), typeName ) )
+    retVal = self.__getRollupsCatalog( typeName )
+    if retVal[ 'OK' ]:
+      for keyName in retVal[ 'Value' ]:
+        self.__dropRollup( typeName, keyName )
+    self.__resetCompactionWatermarks( typeName )
     del( self.dbCatalog[ typeName ] )
+    self.__keyValueCache.deleteType( typeName )
     return S_OK()
 
   def __getIdForKeyValue( self, typeName, keyName, keyValue, conn = False ):
@@ -484,9 +685,9 @@ class AccountingDB( DB ):
       return S_OK( retVal[ 'Value' ][0][0] )
     return S_ERROR( "Key id %s for value %s does not exist although it shoud" % ( keyName, keyValue ) )
 
-  def __addKeyValue( self, typeName, keyName, keyValue ):
+  def __normalizeKeyValue( self, keyValue ):
     """
-      Adds a key value to a key table if not existant
+      Key values as stored in the key tables
     """
     #Cast to string just in case
     if not isinstance( keyValue, basestring ):
@@ -494,23 +695,25 @@ class AccountingDB( DB ):
     #No more than 64 chars for keys
     if len( keyValue ) > 64:
       keyValue = keyValue[:64]
+    return keyValue
+
+  def __addKeyValue( self, typeName, keyName, keyValue ):
+    """
+      Adds a key value to a key table if not existant
+    """
+    keyValue = self.__normalizeKeyValue( keyValue )
 
     #Look into the cache
-    if typeName not in self.__keysCache:
-      self.__keysCache[ typeName ] = {}
-    typeCache = self.__keysCache[ typeName ]
-    if keyName not in typeCache:
-      typeCache[ keyName ] = {}
-    keyCache = typeCache[ keyName ]
-    if keyValue in keyCache:
-      return S_OK( keyCache[ keyValue ] )
+    keyId = self.__keyValueCache.get( typeName, keyName, keyValue )
+    if keyId != None:
+      return S_OK( keyId )
     #Retrieve key
     keyTable = _getTableName( "key", typeName, keyName )
     retVal = self.__getIdForKeyValue( typeName, keyName, keyValue )
     if retVal[ 'OK' ]:
-      keyCache[ keyValue ] = retVal[ 'Value' ]
+      self.__keyValueCache.add( typeName, keyName, keyValue, retVal[ 'Value' ] )
       return retVal
-    #Key is not in there
+    #Key is not in there. Another service may be adding it as well, the duplicate is ignored
     retVal = self._getConnection()
     if not retVal[ 'OK' ]:
       return retVal
@@ -522,9 +725,64 @@ class AccountingDB( DB ):
     result = self.__getIdForKeyValue( typeName, keyName, keyValue, connection )
     if not result[ 'OK' ]:
       return result
-    keyCache[ keyValue ] = result[ 'Value' ]
+    self.__keyValueCache.add( typeName, keyName, keyValue, result[ 'Value' ] )
     return result
 
+  def __selectKeyIds( self, keyTable, keyValues, keyIds ):
+    """
+      Fill keyIds with the ids of the keyValues found in the key table
+    """
+    for valuesChunk in List.breakListIntoChunks( list( keyValues ), 1000 ):
+      retVal = self._escapeValues( valuesChunk )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self._query( "SELECT `id`, `value` FROM `%s` WHERE `value` IN ( %s )" % ( keyTable,
+                                                                                           ", ".join( retVal[ 'Value' ] ) ) )
+      if not retVal[ 'OK' ]:
+        return retVal
+      foundIds = dict( [ ( value, iD ) for iD, value in retVal[ 'Value' ] ] )
+      #The comparison of the DB ignores the case and the trailing spaces
+      looseIds = dict( [ ( value.lower().rstrip(), iD ) for value, iD in foundIds.items() ] )
+      for keyValue in valuesChunk:
+        if keyValue in foundIds:
+          keyIds[ keyValue ] = foundIds[ keyValue ]
+        elif keyValue.lower().rstrip() in looseIds:
+          keyIds[ keyValue ] = looseIds[ keyValue.lower().rstrip() ]
+    return S_OK()
+
+  def __addKeyValues( self, typeName, keyName, keyValues ):
+    """
+      Get the ids of several values of a key, adding the ones not yet in the key table
+      Returns S_OK( { normalized key value : id } )
+    """
+    keyIds = {}
+    for keyValue in keyValues:
+      keyValue = self.__normalizeKeyValue( keyValue )
+      if keyValue not in keyIds:
+        keyIds[ keyValue ] = self.__keyValueCache.get( typeName, keyName, keyValue )
+    uncached = [ keyValue for keyValue in keyIds if keyIds[ keyValue ] == None ]
+    if not uncached:
+      return S_OK( keyIds )
+    keyTable = _getTableName( "key", typeName, keyName )
+    retVal = self.__selectKeyIds( keyTable, uncached, keyIds )
+    if not retVal[ 'OK' ]:
+      return retVal
+    missing = [ keyValue for keyValue in uncached if keyIds[ keyValue ] == None ]
+    if missing:
+      self.log.info( "Values for key %s didn't exist, inserting" % keyName, ", ".join( missing ) )
+      #Other threads or services may be inserting the same values, duplicates are skipped
+      retVal = self.insertMany( keyTable, [ 'value' ], [ ( keyValue, ) for keyValue in missing ], ignore = True )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self.__selectKeyIds( keyTable, missing, keyIds )
+      if not retVal[ 'OK' ]:
+        return retVal
+    for keyValue in missing:
+      if keyIds[ keyValue ] == None:
+        return S_ERROR( "Key id %s for value %s does not exist although it shoud" % ( keyName, keyValue ) )
+    self.__keyValueCache.addMany( typeName, keyName, [ ( keyValue, keyIds[ keyValue ] ) for keyValue in uncached ] )
+    return S_OK( keyIds )
+
   def calculateBucketLengthForTime( self, typeName, now, when ):
     """
     Get the expected bucket time for a moment in time
@@ -613,17 +871,104 @@ class AccountingDB( DB ):
     Do the real insert and delete from the in buffer table
     """
     self.log.verbose( "Received bundle to process", "of %s elements" % len( recordTuples ) )
+    typeRecords = {}
     for record in recordTuples:
-      iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
-      result = self.insertRecordDirectly( typeName, startTime, endTime, valuesList )
-      if not result[ 'OK' ]:
-        self._update( "UPDATE `%s` SET taken=0 WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
-        self.log.error( "Can't insert row", result[ 'Message' ] )
-        continue
-      result = self._update( "DELETE FROM `%s` WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
-      if not result[ 'OK' ]:
-        self.log.error( "Can't delete row from the IN table", result[ 'Message' ] )
-      gMonitor.addMark( "insertiontime", Time.toEpoch() - insertionEpoch )
+      typeRecords.setdefault( record[1], [] ).append( record )
+    for typeName in typeRecords:
+      if self.__bulkInsertion:
+        result = self.__bulkInsertFromINTable( typeName, typeRecords[ typeName ] )
+        if result[ 'OK' ]:
+          continue
+        self.log.warn( "Can't insert the bundle at once, inserting the records one by one",
+                       "%s: %s" % ( typeName, result[ 'Message' ] ) )
+      for record in typeRecords[ typeName ]:
+        iD, typeName, startTime, endTime, valuesList, insertionEpoch = record
+        result = self.insertRecordDirectly( typeName, startTime, endTime, list( valuesList ) )
+        if not result[ 'OK' ]:
+          self._update( "UPDATE `%s` SET taken=0 WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
+          self.log.error( "Can't insert row", result[ 'Message' ] )
+          continue
+        result = self._update( "DELETE FROM `%s` WHERE id=%s" % ( _getTableName( "in", typeName ), iD ) )
+        if not result[ 'OK' ]:
+          self.log.error( "Can't delete row from the IN table", result[ 'Message' ] )
+        gMonitor.addMark( "insertiontime", Time.toEpoch() - insertionEpoch )
+
+  def __bulkInsertFromINTable( self, typeName, recordTuples ):
+    """
+    Insert records of a type coming from the in buffer table with a few statements: the key
+    ids are resolved once per key, the raw records go in a multi-row insert, the parts of the
+    records falling in the same bucket are summed before being written, and the records are
+    deleted from the in buffer table at once. All of it in one transaction.
+    """
+    if self.__readOnly:
+      return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
+    if not typeName in self.dbCatalog:
+      return S_ERROR( "Type %s has not been defined in the db" % typeName )
+    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
+    numKeys = len( keyFields )
+    numValues = len( self.dbCatalog[ typeName ][ 'values' ] )
+    #Discover key indexes
+    keyIds = []
+    for keyPos in range( numKeys ):
+      retVal = self.__addKeyValues( typeName, keyFields[ keyPos ], [ record[4][ keyPos ] for record in recordTuples ] )
+      if not retVal[ 'OK' ]:
+        return retVal
+      keyIds.append( retVal[ 'Value' ] )
+    #Raw rows and buckets
+    nowEpoch = int( Time.toEpoch() )
+    typeRows = []
+    buckets = {}
+    for _iD, _typeName, startTime, endTime, valuesList, _insertionEpoch in recordTuples:
+      recordKeys = tuple( [ keyIds[ keyPos ][ self.__normalizeKeyValue( valuesList[ keyPos ] ) ] for keyPos in range( numKeys ) ] )
+      values = [ float( value ) for value in valuesList[ numKeys: ] ]
+      if len( values ) != numValues:
+        return S_ERROR( "Fields mismatch for record %s. %s values and %s expected" % ( typeName, len( values ), numValues ) )
+      typeRows.append( recordKeys + tuple( valuesList[ numKeys: ] ) + ( startTime, endTime ) )
+      for bStartTime, bProportion, bLength in self.calculateBuckets( typeName, startTime, endTime, nowEpoch ):
+        bucketKey = ( bStartTime, bLength ) + recordKeys
+        if bucketKey not in buckets:
+          buckets[ bucketKey ] = [ 0.0 ] * ( numValues + 1 )
+        bucketValues = buckets[ bucketKey ]
+        #HACK: One more record to split in the buckets to be able to count total entries
+        bucketValues[ 0 ] += bProportion
+        for valPos in range( numValues ):
+          bucketValues[ valPos + 1 ] += values[ valPos ] * bProportion
+
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      retVal = self.__startTransaction( connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self.insertMany( _getTableName( "type", typeName ),
+                                self.dbCatalog[ typeName ][ 'typeFields' ],
+                                typeRows,
+                                conn = connObj )
+      if retVal[ 'OK' ]:
+        retVal = self.__writeBucketsBulk( typeName, buckets, connObj = connObj )
+      if retVal[ 'OK' ]:
+        idList = [ str( record[0] ) for record in recordTuples ]
+        retVal = self._update( "DELETE FROM `%s` WHERE id IN ( %s )" % ( _getTableName( "in", typeName ),
+                                                                           ", ".join( idList ) ),
+                               conn = connObj )
+      if retVal[ 'OK' ]:
+        retVal = self.__commitTransaction( connObj )
+      if not retVal[ 'OK' ]:
+        self.__rollbackTransaction( connObj )
+        return retVal
+    finally:
+      connObj.close()
+
+    gMonitor.addMark( "registeradded", len( recordTuples ) )
+    gMonitor.addMark( "registeradded:%s" % typeName, len( recordTuples ) )
+    for record in recordTuples:
+      gMonitor.addMark( "insertiontime", Time.toEpoch() - record[5] )
+    self.log.info( "Inserted bundle", "of %s records for type %s in %s buckets" % ( len( recordTuples ),
+                                                                                   typeName,
+                                                                                   len( buckets ) ) )
+    return S_OK( len( recordTuples ) )
 
 
   def insertRecordDirectly( self, typeName, startTime, endTime, valuesList ):
@@ -740,7 +1085,7 @@ class AccountingDB( DB ):
       return retVal
     return S_OK( numInsertions )
 
-  def __splitInBuckets( self, typeName, startTime, endTime, valuesList, connObj = False ):
+  def __splitInBuckets( self, typeName, startTime, endTime, valuesList, connObj = False, rollups = True ):
     """
     Bucketize a record
     """
@@ -751,7 +1096,7 @@ class AccountingDB( DB ):
     keyValues = valuesList[ :numKeys ]
     valuesList = valuesList[ numKeys: ]
     self.log.verbose( "Splitting entry", " in %s buckets" % len( buckets ) )
-    return self.__writeBuckets( typeName, buckets, keyValues, valuesList, connObj = connObj )
+    return self.__writeBuckets( typeName, buckets, keyValues, valuesList, connObj = connObj, rollups = rollups )
 
   def __deleteFromBuckets( self, typeName, startTime, endTime, valuesList, numInsertions, connObj = False ):
     """
@@ -843,51 +1188,136 @@ class AccountingDB( DB ):
                                                                             tableName,
                                                                             bucketLength )
     cmd += self.__generateSQLConditionForKeys( typeName, keyValues )
-    return self._update( cmd, conn = connObj )
+    retVal = self._update( cmd, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return retVal
+    #Same for the rollups, for the one key they have
+    for keyName in self.__getRollups( typeName ):
+      rollupTableName = _getTableName( "rollup", typeName, keyName )
+      keyValue = keyValues[ self.dbCatalog[ typeName ][ 'keys' ].index( keyName ) ]
+      retVal = self._escapeString( keyValue )
+      if not retVal[ 'OK' ]:
+        return retVal
+      cmd = "UPDATE `%s` SET %s" % ( rollupTableName, ", ".join( sqlValList ).replace( "`%s`." % tableName, "" ) )
+      cmd += " WHERE `startTime`='%s' AND `bucketLength`='%s' AND `%s` = %s" % ( startTime,
+                                                                                bucketLength,
+                                                                                keyName,
+                                                                                retVal[ 'Value' ] )
+      retVal = self._update( cmd, conn = connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+    return S_OK()
 
 
-  def __writeBuckets( self, typeName, buckets, keyValues, valuesList, connObj = False ):
-    """ Insert or update a bucket
+  def __writeBuckets( self, typeName, buckets, keyValues, valuesList, connObj = False, rollups = True ):
+    """ Insert or update a bucket, and the rollups of the type
     """
-#     tableName = _getTableName( "bucket", typeName )
-    #INSERT PART OF THE QUERY
-    sqlFields = [ '`startTime`', '`bucketLength`', '`entriesInBucket`' ]
-    for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
-      sqlFields.append( "`%s`" % self.dbCatalog[ typeName ][ 'keys' ][ keyPos ] )
-    sqlUpData = [ "`entriesInBucket`=`entriesInBucket`+VALUES(`entriesInBucket`)" ]
-    for valPos in range( len( self.dbCatalog[ typeName ][ 'values' ] ) ):
-      valueField = "`%s`" % self.dbCatalog[ typeName ][ 'values' ][ valPos ]
-      sqlFields.append( valueField )
-      sqlUpData.append( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField ) )
-    valuesGroups = []
-    for bucketInfo in buckets:
-      bStartTime = bucketInfo[0]
-      bProportion = bucketInfo[1]
-      bLength = bucketInfo[2]
-      sqlValues = [ bStartTime, bLength, "(%s*%s)" % ( valuesList[-1], bProportion )]
-      for keyPos in range( len( self.dbCatalog[ typeName ][ 'keys' ] ) ):
-        sqlValues.append( keyValues[ keyPos ] )
+    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
+    tablesKeys = [ ( _getTableName( "bucket", typeName ), keyFields ) ]
+    if rollups:
+      for keyName in self.__getRollups( typeName ):
+        tablesKeys.append( ( _getTableName( "rollup", typeName, keyName ), [ keyName ] ) )
+    for tableName, tableKeys in tablesKeys:
+      #INSERT PART OF THE QUERY
+      sqlFields = [ '`startTime`', '`bucketLength`', '`entriesInBucket`' ]
+      for keyField in tableKeys:
+        sqlFields.append( "`%s`" % keyField )
+      sqlUpData = [ "`entriesInBucket`=`entriesInBucket`+VALUES(`entriesInBucket`)" ]
       for valPos in range( len( self.dbCatalog[ typeName ][ 'values' ] ) ):
-#         value = valuesList[ valPos ]
-        sqlValues.append( "(%s*%s)" % ( valuesList[ valPos ], bProportion ) )
-      valuesGroups.append( "( %s )" % ",".join( str( val ) for val in sqlValues ) )
+        valueField = "`%s`" % self.dbCatalog[ typeName ][ 'values' ][ valPos ]
+        sqlFields.append( valueField )
+        sqlUpData.append( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField ) )
+      valuesGroups = []
+      for bucketInfo in buckets:
+        bStartTime = bucketInfo[0]
+        bProportion = bucketInfo[1]
+        bLength = bucketInfo[2]
+        sqlValues = [ bStartTime, bLength, "(%s*%s)" % ( valuesList[-1], bProportion )]
+        for keyField in tableKeys:
+          sqlValues.append( keyValues[ keyFields.index( keyField ) ] )
+        for valPos in range( len( self.dbCatalog[ typeName ][ 'values' ] ) ):
+          sqlValues.append( "(%s*%s)" % ( valuesList[ valPos ], bProportion ) )
+        valuesGroups.append( "( %s )" % ",".join( str( val ) for val in sqlValues ) )
+
+      cmd = "INSERT INTO `%s` ( %s ) " % ( tableName, ", ".join( sqlFields ) )
+      cmd += "VALUES %s " % ", ".join( valuesGroups)
+      cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
 
-    cmd = "INSERT INTO `%s` ( %s ) " % ( _getTableName( "bucket", typeName ), ", ".join( sqlFields ) )
-    cmd += "VALUES %s " % ", ".join( valuesGroups)
-    cmd += "ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
+      for _i in range( max( 1, self.__deadLockRetries ) ):
+        result = self._update( cmd, conn = connObj )
+        if not result[ 'OK' ]:
+          #If failed because of dead lock try restarting
+          if result[ 'Message' ].find( "try restarting transaction" ):
+            continue
+          return result
+        #If OK, break loopo
+        if result[ 'OK' ]:
+          break
 
-    for _i in range( max( 1, self.__deadLockRetries ) ):
-      result = self._update( cmd, conn = connObj )
       if not result[ 'OK' ]:
-        #If failed because of dead lock try restarting
-        if result[ 'Message' ].find( "try restarting transaction" ):
-          continue
-        return result
-      #If OK, break loopo
-      if result[ 'OK' ]:
+        return S_ERROR( "Cannot update bucket: %s" % result[ 'Message' ] )
+    return result
+
+  def __writeBucketsBulk( self, typeName, buckets, connObj = False ):
+    """ Add to the buckets the values of { ( startTime, bucketLength, keyId, ... ) : [ entries, value, ... ] },
+        and to the rollups of the type
+    """
+    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
+    result = self.__addToBuckets( typeName, _getTableName( "bucket", typeName ), keyFields, buckets, connObj )
+    if not result[ 'OK' ]:
+      return result
+    for keyName in self.__getRollups( typeName ):
+      result = self.__addToBuckets( typeName, _getTableName( "rollup", typeName, keyName ), [ keyName ],
+                                    self.__rollupBuckets( typeName, keyName, buckets ), connObj )
+      if not result[ 'OK' ]:
         return result
+    return S_OK( len( buckets ) )
 
-    return S_ERROR( "Cannot update bucket: %s" % result[ 'Message' ] )
+  def __rollupBuckets( self, typeName, keyName, buckets ):
+    """ Sum { ( startTime, bucketLength, keyId, ... ) : [ entries, value, ... ] } buckets by a single key
+    """
+    keyPos = 2 + self.dbCatalog[ typeName ][ 'keys' ].index( keyName )
+    rollupBuckets = {}
+    for bucketKey, bucketValues in buckets.items():
+      rollupKey = ( bucketKey[0], bucketKey[1], bucketKey[ keyPos ] )
+      if rollupKey not in rollupBuckets:
+        rollupBuckets[ rollupKey ] = list( bucketValues )
+      else:
+        rollupValues = rollupBuckets[ rollupKey ]
+        for valPos in range( len( bucketValues ) ):
+          rollupValues[ valPos ] += bucketValues[ valPos ]
+    return rollupBuckets
+
+  def __addToBuckets( self, typeName, tableName, keyFields, buckets, connObj ):
+    """ Add the values of { ( startTime, bucketLength, keyId, ... ) : [ entries, value, ... ] } to a
+        buckets table with the given key fields
+    """
+    sqlFields = [ '`startTime`', '`bucketLength`' ]
+    for keyField in keyFields:
+      sqlFields.append( "`%s`" % keyField )
+    sqlFields.append( '`entriesInBucket`' )
+    sqlUpData = [ "`entriesInBucket`=`entriesInBucket`+VALUES(`entriesInBucket`)" ]
+    for valueField in self.dbCatalog[ typeName ][ 'values' ]:
+      valueField = "`%s`" % valueField
+      sqlFields.append( valueField )
+      sqlUpData.append( "%s=%s+VALUES(%s)" % ( valueField, valueField, valueField ) )
+    cmdStart = "INSERT INTO `%s` ( %s ) VALUES " % ( tableName, ", ".join( sqlFields ) )
+    cmdEnd = " ON DUPLICATE KEY UPDATE %s" % ", ".join( sqlUpData )
+    #Always in the same order, concurrent bundles do not lock each other
+    for bucketKeys in List.breakListIntoChunks( sorted( buckets ), 1000 ):
+      valuesGroups = []
+      for bucketKey in bucketKeys:
+        sqlValues = [ str( int( field ) ) for field in bucketKey ]
+        for value in buckets[ bucketKey ]:
+          if isinstance( value, Decimal ):
+            sqlValues.append( format( value, 'f' ) )
+          else:
+            sqlValues.append( repr( value ) )
+        valuesGroups.append( "( %s )" % ",".join( sqlValues ) )
+      result = self._update( cmdStart + ", ".join( valuesGroups ) + cmdEnd, conn = connObj )
+      if not result[ 'OK' ]:
+        return S_ERROR( "Cannot update buckets: %s" % result[ 'Message' ] )
+    return S_OK()
 
   def __checkFieldsExistsInType( self, typeName, fields, tableType ):
     """
@@ -917,9 +1347,11 @@ class AccountingDB( DB ):
         return S_ERROR( "Order fields %s are not defined" % ", ".join( missing ) )
     return S_OK()
 
-  def retrieveRawRecords( self, typeName, startTime, endTime, condDict, orderFields, connObj = False ):
+  def retrieveRawRecords( self, typeName, startTime, endTime, condDict, orderFields, connObj = False, batchSize = 0 ):
     """
     Get RAW data from the DB
+    If batchSize is given the records are not read at once, the value is an iterator
+    giving lists of at most batchSize records
     """
     if typeName not in self.dbCatalog:
       return S_ERROR( "Type %s not defined" % typeName )
@@ -930,7 +1362,7 @@ class AccountingDB( DB ):
         selectFields[ 1 ].append( key )
     selectFields[ 0 ] = ", ".join( selectFields[ 0 ] )
     return self.__queryType( typeName, startTime, endTime, selectFields,
-                             condDict, False, orderFields, "type" )
+                             condDict, False, orderFields, "type", batchSize = batchSize )
 
   def retrieveBucketedData( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, connObj = False ):
     """
@@ -971,11 +1403,19 @@ class AccountingDB( DB ):
     gMonitor.addMark( "querytime", Time.toEpoch() - startQueryEpoch )
     return result
 
-  def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType, connObj = False ):
+  def __queryType( self, typeName, startTime, endTime, selectFields, condDict, groupFields, orderFields, tableType,
+                   connObj = False, batchSize = 0 ):
     """
     Execute a query over a main table
+    With batchSize the result is streamed with _queryIter
+    Queries over the buckets go to a rollup when it has all the fields needed
     """
     tableName = _getTableName( tableType, typeName )
+    if tableType == "bucket":
+      rollupKey = self.__getRollupForQuery( typeName, selectFields, condDict, groupFields, orderFields )
+      if rollupKey:
+        self.log.verbose( "Querying rollup by %s for %s" % ( rollupKey, typeName ) )
+        tableName = _getTableName( "rollup", typeName, rollupKey )
     cmd = "SELECT"
     sqlLinkList = []
     #Check if groupFields and orderFields are in ( "%s", ( field1, ) ) form
@@ -1075,11 +1515,154 @@ class AccountingDB( DB ):
     if orderFields:
       cmd += " ORDER BY %s" % ( orderFields[0] % tuple( orderFields[1] ) )
     self.log.verbose( cmd )
+    if batchSize:
+      return self._queryIter( cmd, batchSize )
     return self._query( cmd, conn = connObj )
 
+  def __getRollupForQuery( self, typeName, selectFields, condDict, groupFields, orderFields ):
+    """
+    Get the key of a ready rollup having all the fields used by a query over the buckets, False if none
+    """
+    readyKeys = [ keyName for keyName, ready in self.__getRollups( typeName ).items() if ready ]
+    if not readyKeys:
+      return False
+    queryFields = set( selectFields[1] )
+    queryFields.update( condDict )
+    for preGenFields in ( groupFields, orderFields ):
+      if preGenFields:
+        queryFields.update( preGenFields[1] )
+    rollupFields = set( self.dbCatalog[ typeName ][ 'values' ] )
+    rollupFields.update( [ 'startTime', 'bucketLength', 'entriesInBucket' ] )
+    queryKeys = [ field for field in queryFields if field not in rollupFields ]
+    if not queryKeys:
+      return sorted( readyKeys )[0]
+    if len( queryKeys ) == 1 and queryKeys[0] in readyKeys:
+      return queryKeys[0]
+    return False
+
+  def rebuildRollups( self, typeName ):
+    """
+    Rebuild all the rollups of a type from its buckets, but the ones not known yet by all the instances
+    """
+    if self.__readOnly:
+      return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
+    if typeName not in self.dbCatalog:
+      return S_ERROR( "Type %s is not defined" % typeName )
+    return self.__buildRollups( typeName, list( self.__getRollups( typeName ) ) )
+
+  def __buildRollups( self, typeName, keyNames ):
+    """
+    Recalculate the rollups by the keys of a type from its buckets, a chunk of time per transaction.
+    The rollups added or brought back less than twice ROLLUPS_REFRESH_TIME ago are left for later, the
+    insertions of the other instances may not write to them yet. Built rollups are marked as ready to
+    be used by the queries
+    """
+    retVal = self.__getRollupsCatalog( typeName )
+    if not retVal[ 'OK' ]:
+      return retVal
+    rollupsCatalog = retVal[ 'Value' ]
+    bucketTableName = _getTableName( "bucket", typeName )
+    retVal = self._query( "SELECT MIN(`startTime`), MAX(`startTime`) FROM `%s`" % bucketTableName )
+    if not retVal[ 'OK' ]:
+      return retVal
+    chunkLength = self.__compactionChunkTime
+    chunks = [ ( 0, None ) ]
+    if retVal[ 'Value' ] and retVal[ 'Value' ][0][0] is not None:
+      #The first chunk also clears the rows before the buckets, the last one those after
+      firstTime = int( retVal[ 'Value' ][0][0] )
+      lastTime = int( retVal[ 'Value' ][0][1] )
+      chunks = []
+      chunkStart = firstTime - firstTime % chunkLength
+      while chunkStart <= lastTime:
+        chunks.append( ( chunkStart, chunkStart + chunkLength ) )
+        chunkStart += chunkLength
+      chunks[0] = ( 0, chunks[0][1] )
+      chunks[-1] = ( chunks[-1][0], None )
+    for keyName in keyNames:
+      if keyName not in rollupsCatalog or rollupsCatalog[ keyName ][0] == 'Removed':
+        continue
+      if time.time() - rollupsCatalog[ keyName ][1] < 2 * ROLLUPS_REFRESH_TIME:
+        self.log.info( "[ROLLUP] Rollup by %s of %s left for later" % ( keyName, typeName ),
+                       "not all the instances write to it yet" )
+        continue
+      self.log.info( "[ROLLUP] Building rollup by %s of %s in %d chunks" % ( keyName, typeName, len( chunks ) ) )
+      startBuild = time.time()
+      for fromTime, toTime in chunks:
+        for _i in range( max( 1, self.__deadLockRetries ) ):
+          retVal = self.__buildRollupChunk( typeName, keyName, fromTime, toTime )
+          if retVal[ 'OK' ]:
+            break
+        if not retVal[ 'OK' ]:
+          self.log.error( "[ROLLUP] Can't build rollup", "by %s of %s: %s" % ( keyName, typeName, retVal[ 'Message' ] ) )
+          return retVal
+      retVal = self.__setRollupReady( typeName, keyName, True )
+      if not retVal[ 'OK' ]:
+        return retVal
+      self.log.info( "[ROLLUP] Built rollup by %s of %s (took %.2f secs)" % ( keyName, typeName, time.time() - startBuild ) )
+    return S_OK()
+
+  def __buildRollupChunk( self, typeName, keyName, fromTime, toTime ):
+    """
+    Recalculate the rows of a rollup starting from fromTime until toTime, or on if None, in a transaction
+    """
+    rollupTableName = _getTableName( "rollup", typeName, keyName )
+    valueFields = [ "`entriesInBucket`" ]
+    for valueField in self.dbCatalog[ typeName ][ 'values' ]:
+      valueFields.append( "`%s`" % valueField )
+    timeCond = "`startTime` >= %d" % fromTime
+    if toTime is not None:
+      timeCond += " AND `startTime` < %d" % toTime
+    groupFields = "`startTime`, `bucketLength`, `%s`" % keyName
+    insertSQL = "INSERT INTO `%s` ( %s, %s )" % ( rollupTableName, groupFields, ", ".join( valueFields ) )
+    insertSQL += " SELECT %s, %s FROM `%s`" % ( groupFields,
+                                               ", ".join( [ "SUM( %s )" % field for field in valueFields ] ),
+                                               _getTableName( "bucket", typeName ) )
+    insertSQL += " WHERE %s GROUP BY %s" % ( timeCond, groupFields )
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      retVal = self.__startTransaction( connObj )
+      if not retVal[ 'OK' ]:
+        return retVal
+      retVal = self._update( "DELETE FROM `%s` WHERE %s" % ( rollupTableName, timeCond ), conn = connObj )
+      if retVal[ 'OK' ]:
+        retVal = self._update( insertSQL, conn = connObj )
+      if retVal[ 'OK' ]:
+        retVal = self.__commitTransaction( connObj )
+      if not retVal[ 'OK' ]:
+        self.__rollbackTransaction( connObj )
+        return retVal
+    finally:
+      connObj.close()
+    return S_OK()
+
+  def __compactRollups( self, typeName ):
+    """
+    Build the rollups of a type not ready yet and drop the removed ones, once all the instances know
+    about them. The ready ones are kept in line with the buckets by the compaction itself
+    """
+    retVal = self.__getRollupsCatalog( typeName )
+    if not retVal[ 'OK' ]:
+      return retVal
+    notReady = []
+    for keyName, ( status, lastChange ) in retVal[ 'Value' ].items():
+      if status == 'Waiting':
+        notReady.append( keyName )
+      elif status == 'Removed' and time.time() - lastChange >= 2 * ROLLUPS_REFRESH_TIME:
+        self.log.info( "[ROLLUP] Dropping rollup by %s of %s" % ( keyName, typeName ) )
+        retVal = self.__dropRollup( typeName, keyName )
+        if not retVal[ 'OK' ]:
+          return retVal
+    if notReady:
+      return self.__buildRollups( typeName, notReady )
+    return S_OK()
+
   def compactBuckets( self, typeFilter = False ):
     """
-    Compact buckets for all defined types
+    Compact buckets for all defined types. Each step from a bucket length to the next one of each
+    type is a task of the compaction pool, moving the buckets a chunk of time per transaction
     """
     if self.__readOnly:
       return S_ERROR( "ReadOnly mode enabled. No modification allowed" )
@@ -1090,7 +1673,25 @@ class AccountingDB( DB ):
       self.__doingCompaction = True
     finally:
       gSynchro.unlock()
-    slow = True
+    try:
+      self.__compactAllTypes( typeFilter )
+    finally:
+      gSynchro.lock()
+      try:
+        self.__doingCompaction = False
+      finally:
+        gSynchro.unlock()
+    return S_OK()
+
+  def __compactAllTypes( self, typeFilter ):
+    nowEpoch = int( Time.toEpoch() )
+    compactedTypes = []
+    steps = []
+    self.__compactionLock.lock()
+    try:
+      self.__compactionStatus = {}
+    finally:
+      self.__compactionLock.unlock()
     for typeName in self.dbCatalog:
       if typeFilter and typeName.find( typeFilter ) == -1:
         self.log.info( "[COMPACT] Skipping %s" % typeName )
@@ -1098,159 +1699,232 @@ class AccountingDB( DB ):
       if self.dbCatalog[ typeName ][ 'dataTimespan' ] > 0:
         self.log.info( "[COMPACT] Deleting records older that timespan for type %s" % typeName )
         self.__deleteRecordsOlderThanDataTimespan( typeName )
-      self.log.info( "[COMPACT] Compacting %s" % typeName )
-      if slow:
-        self.__slowCompactBucketsForType( typeName )
+      compactedTypes.append( typeName )
+      for bPos in range( len( self.dbBucketsLength[ typeName ] ) - 1 ):
+        self.__updateCompactionStatus( typeName, self.dbBucketsLength[ typeName ][ bPos ][1],
+                                       Status = 'Waiting', RowsMoved = 0, ChunksDone = 0 )
+        steps.append( ( typeName, bPos ) )
+    #Steps touch different bucket lengths and times, they can all go in parallel
+    self.log.info( "[COMPACT] Compacting %d steps of %d types" % ( len( steps ), len( compactedTypes ) ) )
+    results = {}
+    def stepDone( threadedJob, result ):
+      results[ threadedJob.jobId() ] = result
+    def stepFailed( threadedJob, exceptionInfo ):
+      results[ threadedJob.jobId() ] = S_ERROR( "Exception while compacting: %s" % exceptionInfo[1] )
+    for typeName, bPos in steps:
+      self.__compactionPool.generateJobAndQueueIt( self.__compactStepForType,
+                                                   args = ( typeName, bPos, nowEpoch ),
+                                                   sTJId = ( typeName, bPos ),
+                                                   oCallback = stepDone,
+                                                   oExceptionCallback = stepFailed )
+    while len( results ) < len( steps ):
+      self.__compactionPool.processResults()
+      time.sleep( 1 )
+    totalMoved = 0
+    for typeName, bPos in steps:
+      retVal = results[ ( typeName, bPos ) ]
+      if not retVal[ 'OK' ]:
+        self.log.error( "[COMPACT] Can't compact buckets", "%s %s: %s" % ( typeName,
+                                                                          self.dbBucketsLength[ typeName ][ bPos ][1],
+                                                                          retVal[ 'Message' ] ) )
+        self.__updateCompactionStatus( typeName, self.dbBucketsLength[ typeName ][ bPos ][1],
+                                       Status = 'Failed', Error = retVal[ 'Message' ] )
       else:
-        self.__compactBucketsForType( typeName )
-    self.log.info( "[COMPACT] Compaction finished" )
+        totalMoved += retVal[ 'Value' ]
+    for typeName in compactedTypes:
+      retVal = self.__compactRollups( typeName )
+      if not retVal[ 'OK' ]:
+        self.log.error( "[COMPACT] Can't compact rollups", "%s: %s" % ( typeName, retVal[ 'Message' ] ) )
+    self.log.info( "[COMPACT] Compaction finished", "(%d buckets moved, took %d secs)" % ( totalMoved,
+                                                                                        int( Time.toEpoch() ) - nowEpoch ) )
     self.__lastCompactionEpoch = int( Time.toEpoch() )
-    gSynchro.lock()
+
+  def getCompactionStatus( self ):
+    """
+    Get the progress of the current compaction, or of the last one:
+    { 'Running' : bool, 'LastCompaction' : epoch,
+      'Types' : { typeName : { bucketLength : { 'Status', 'Watermark', 'TimeLimit', 'RowsMoved', ... } } } }
+    """
+    self.__compactionLock.lock()
     try:
-      if self.__doingCompaction:
-        self.__doingCompaction = False
+      typesStatus = {}
+      for typeName in self.__compactionStatus:
+        typesStatus[ typeName ] = {}
+        for bucketLength, stepStatus in self.__compactionStatus[ typeName ].items():
+          typesStatus[ typeName ][ bucketLength ] = dict( stepStatus )
     finally:
-      gSynchro.unlock()
-    return S_OK()
+      self.__compactionLock.unlock()
+    return S_OK( { 'Running' : self.__doingCompaction,
+                   'LastCompaction' : self.__lastCompactionEpoch,
+                   'Types' : typesStatus } )
 
-  def __selectForCompactBuckets( self, typeName, timeLimit, bucketLength, nextBucketLength, connObj = False ):
+  def __updateCompactionStatus( self, typeName, bucketLength, **kwargs ):
+    self.__compactionLock.lock()
+    try:
+      self.__compactionStatus.setdefault( typeName, {} ).setdefault( bucketLength, {} ).update( kwargs )
+    finally:
+      self.__compactionLock.unlock()
+
+  def __getCompactionWatermark( self, typeName, bucketLength ):
     """
-    Nasty SQL query to get ideal buckets using grouping by date calculations and adding value contents
+    Get the time before which the buckets of a length have already been compacted, 0 if unknown
     """
-    tableName = _getTableName( "bucket", typeName )
-    selectSQL = "SELECT "
-    sqlSelectList = []
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    for field in self.dbCatalog[ typeName ][ 'values' ]:
-      sqlSelectList.append( "SUM( `%s`.`%s` )" % ( tableName, field ) )
-    sqlSelectList.append( "SUM( `%s`.`entriesInBucket` )" % ( tableName ) )
-    sqlSelectList.append( "MIN( `%s`.`startTime` )" % tableName )
-    sqlSelectList.append( "MAX( `%s`.`startTime` )" % tableName )
-    selectSQL += ", ".join( sqlSelectList )
-    selectSQL += " FROM `%s`" % tableName
-    selectSQL += " WHERE `%s`.`startTime` < '%s' AND" % ( tableName, timeLimit )
-    selectSQL += " `%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    #MAGIC bucketing
-    sqlGroupList = [ _bucketizeDataField( "`%s`.`startTime`" % tableName, nextBucketLength ) ]
-    for field in self.dbCatalog[ typeName ][ 'keys' ]:
-      sqlGroupList.append( "`%s`.`%s`" % ( tableName, field ) )
-    selectSQL += " GROUP BY %s" % ", ".join( sqlGroupList )
-    return self._query( selectSQL, conn = connObj )
+    retVal = self._query( "SELECT `watermark` FROM `%s` WHERE `typeName`='%s' AND `bucketLength`=%d" % ( self.compactionTableName,
+                                                                                                       typeName,
+                                                                                                       bucketLength ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    if not retVal[ 'Value' ]:
+      return S_OK( 0 )
+    return S_OK( int( retVal[ 'Value' ][0][0] ) )
+
+  def __setCompactionWatermark( self, typeName, bucketLength, watermark, rowsMoved, connObj = False ):
+    sqlCmd = "INSERT INTO `%s` ( `typeName`, `bucketLength`, `watermark`, `rowsMoved` )" % self.compactionTableName
+    sqlCmd += " VALUES ( '%s', %d, %d, %d )" % ( typeName, bucketLength, watermark, rowsMoved )
+    sqlCmd += " ON DUPLICATE KEY UPDATE `watermark`=VALUES(`watermark`), `rowsMoved`=`rowsMoved`+VALUES(`rowsMoved`)"
+    return self._update( sqlCmd, conn = connObj )
 
-  def __deleteForCompactBuckets( self, typeName, timeLimit, bucketLength, connObj = False ):
+  def __resetCompactionWatermarks( self, typeName ):
     """
-    Delete compacted buckets
+    Forget the compaction progress of a type, its buckets have changed
     """
-    tableName = _getTableName( "bucket", typeName )
-    deleteSQL = "DELETE FROM `%s` WHERE " % tableName
-    deleteSQL += "`%s`.`startTime` < '%s' AND " % ( tableName, timeLimit )
-    deleteSQL += "`%s`.`bucketLength` = %s" % ( tableName, bucketLength )
-    return self._update( deleteSQL, conn = connObj )
+    return self._update( "DELETE FROM `%s` WHERE `typeName`='%s'" % ( self.compactionTableName, typeName ) )
 
-  def __compactBucketsForType( self, typeName ):
+  def __compactStepForType( self, typeName, bPos, nowEpoch ):
     """
-    Compact all buckets for a given type
+    Move the buckets of the bPos bucket length of a type that are older than its time limit to longer
+    buckets, a chunk of time per transaction. Chunks are aligned with the longer buckets, so the buckets
+    going together are always in the same chunk. The end of each chunk is saved with it as the
+    watermark, a compaction that was interrupted goes on from there
     """
-    nowEpoch = Time.toEpoch()
-    #retVal = self.__startTransaction( connObj )
-    #if not retVal[ 'OK' ]:
-    #  return retVal
-    for bPos in range( len( self.dbBucketsLength[ typeName ] ) - 1 ):
-      self.log.info( "[COMPACT] Query %d of %d" % ( bPos + 1, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-      secondsLimit = self.dbBucketsLength[ typeName ][ bPos ][0]
-      bucketLength = self.dbBucketsLength[ typeName ][ bPos ][1]
-      timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
-      nextBucketLength = self.dbBucketsLength[ typeName ][ bPos + 1 ][1]
-      self.log.info( "[COMPACT] Compacting data newer that %s with bucket size %s" % ( Time.fromEpoch( timeLimit ), bucketLength ) )
-      #Retrieve the data
-      retVal = self.__selectForCompactBuckets( typeName, timeLimit, bucketLength, nextBucketLength )
+    secondsLimit, bucketLength = self.dbBucketsLength[ typeName ][ bPos ]
+    nextBucketLength = self.dbBucketsLength[ typeName ][ bPos + 1 ][1]
+    timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
+    chunkLength = max( nextBucketLength, self.__compactionChunkTime - self.__compactionChunkTime % nextBucketLength )
+    retVal = self.__getCompactionWatermark( typeName, bucketLength )
+    if not retVal[ 'OK' ]:
+      return retVal
+    watermark = retVal[ 'Value' ]
+    self.__updateCompactionStatus( typeName, bucketLength, Status = 'Running', NextBucketLength = nextBucketLength,
+                                   TimeLimit = timeLimit, Watermark = watermark )
+    retVal = self._query( "SELECT MIN(`startTime`) FROM `%s` WHERE `bucketLength`=%d AND `startTime`>=%d AND `startTime`<%d" % ( _getTableName( "bucket", typeName ),
+                                                                                                                          bucketLength,
+                                                                                                                          watermark,
+                                                                                                                          timeLimit ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    if not retVal[ 'Value' ] or retVal[ 'Value' ][0][0] is None:
+      self.log.info( "[COMPACT] Nothing to compact", "for %s with bucket size %s" % ( typeName, bucketLength ) )
+      self.__updateCompactionStatus( typeName, bucketLength, Status = 'Done' )
+      return S_OK( 0 )
+    chunkStart = int( retVal[ 'Value' ][0][0] )
+    chunkStart -= chunkStart % nextBucketLength
+    numChunks = ( timeLimit - chunkStart + chunkLength - 1 ) / chunkLength
+    self.log.info( "[COMPACT] Compacting %s with bucket size %s" % ( typeName, bucketLength ),
+                   "from %s to %s in %d chunks" % ( Time.fromEpoch( chunkStart ), Time.fromEpoch( timeLimit ), numChunks ) )
+    chunksDone = 0
+    totalMoved = 0
+    while chunkStart < timeLimit:
+      chunkEnd = min( chunkStart - chunkStart % chunkLength + chunkLength, timeLimit )
+      startChunk = time.time()
+      for _i in range( max( 1, self.__deadLockRetries ) ):
+        retVal = self.__compactChunk( typeName, bucketLength, nextBucketLength, chunkStart, chunkEnd, nowEpoch )
+        if retVal[ 'OK' ]:
+          break
+        self.log.warn( "[COMPACT] Can't compact chunk", "%s %s from %s: %s" % ( typeName, bucketLength,
+                                                                               Time.fromEpoch( chunkStart ),
+                                                                               retVal[ 'Message' ] ) )
       if not retVal[ 'OK' ]:
-        #self.__rollbackTransaction( connObj )
         return retVal
-      bucketsData = retVal[ 'Value' ]
-      self.log.info( "[COMPACT] Got %d records to compact" % len( bucketsData ) )
-      if len( bucketsData ) == 0:
-        continue
-      retVal = self.__deleteForCompactBuckets( typeName, timeLimit, bucketLength )
+      chunksDone += 1
+      totalMoved += retVal[ 'Value' ]
+      gMonitor.addMark( "compactedbuckets", retVal[ 'Value' ] )
+      self.__updateCompactionStatus( typeName, bucketLength, Watermark = chunkEnd, RowsMoved = totalMoved,
+                                     ChunksDone = chunksDone, Chunks = numChunks )
+      self.log.verbose( "[COMPACT] Compacted chunk %d of %d" % ( chunksDone, numChunks ),
+                        "of %s with bucket size %s: %d buckets moved (took %.2f secs)" % ( typeName, bucketLength,
+                                                                                           retVal[ 'Value' ],
+                                                                                           time.time() - startChunk ) )
+      chunkStart = chunkEnd
+    self.log.info( "[COMPACT] Finished compaction of %s with bucket size %s" % ( typeName, bucketLength ),
+                   "%d buckets moved in %d chunks" % ( totalMoved, chunksDone ) )
+    self.__updateCompactionStatus( typeName, bucketLength, Status = 'Done' )
+    return S_OK( totalMoved )
+
+  def __compactChunk( self, typeName, bucketLength, nextBucketLength, fromTime, toTime, nowEpoch ):
+    """
+    Replace the buckets of bucketLength starting between fromTime and toTime by the longer ones they
+    belong to, and save toTime as the watermark, in a transaction. The rollups get the same change.
+    Returns the number of buckets moved
+    """
+    retVal = self._getConnection()
+    if not retVal[ 'OK' ]:
+      return retVal
+    connObj = retVal[ 'Value' ]
+    try:
+      retVal = self.__startTransaction( connObj )
       if not retVal[ 'OK' ]:
-        #self.__rollbackTransaction( connObj )
         return retVal
-      self.log.info( "[COMPACT] Compacting %s records %s seconds size for %s" % ( len( bucketsData ), bucketLength, typeName ) )
-      #Add data
-      for record in bucketsData:
-        startTime = record[-2]
-        endTime = record[-1]
-        valuesList = record[:-2]
-        retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList )
-        if not retVal[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          self.log.error( "[COMPACT] Error while compacting data for record", "%s: %s" % ( typeName, retVal[ 'Value' ] ) )
-      self.log.info( "[COMPACT] Finished compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-    #return self.__commitTransaction( connObj )
-    return S_OK()
-
-  def __slowCompactBucketsForType( self, typeName ):
-    """
-    Compact all buckets for a given type
-    """
-    nowEpoch = Time.toEpoch()
-    for bPos in range( len( self.dbBucketsLength[ typeName ] ) - 1 ):
-      self.log.info( "[COMPACT] Query %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-      secondsLimit = self.dbBucketsLength[ typeName ][ bPos ][0]
-      bucketLength = self.dbBucketsLength[ typeName ][ bPos ][1]
-      timeLimit = ( nowEpoch - nowEpoch % bucketLength ) - secondsLimit
-      nextBucketLength = self.dbBucketsLength[ typeName ][ bPos + 1 ][1]
-      self.log.info( "[COMPACT] Compacting data newer that %s with bucket size %s for %s" % ( Time.fromEpoch( timeLimit ), bucketLength, typeName ) )
-      querySize = 10000
-      previousRecordsSelected = querySize
-      totalCompacted = 0
-      while previousRecordsSelected == querySize:
-        #Retrieve the data
-        self.log.info( "[COMPACT] Retrieving buckets to compact newer that %s with size %s" % ( Time.fromEpoch( timeLimit ),
-                                                                                                       bucketLength ) )
-        roundStartTime = time.time()
-        result = self.__selectIndividualForCompactBuckets( typeName, timeLimit, bucketLength,
-                                                           nextBucketLength, querySize )
-        if not result[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          return result
-        bucketsData = result[ 'Value' ]
-        previousRecordsSelected = len( bucketsData )
-        selectEndTime = time.time()
-        self.log.info( "[COMPACT] Got %d buckets (%d done) (took %.2f secs)" % ( previousRecordsSelected,
-                                                                                 totalCompacted,
-                                                                                 selectEndTime - roundStartTime ) )
-        if len( bucketsData ) == 0:
-          break
+      rowsMoved = 0
+      retVal = self.__selectForCompactBuckets( typeName, fromTime, toTime, bucketLength, nextBucketLength, connObj = connObj )
+      if retVal[ 'OK' ] and retVal[ 'Value' ]:
+        bucketsData = retVal[ 'Value' ]
+        retVal = self.__deleteForCompactBuckets( typeName, fromTime, toTime, bucketLength, connObj = connObj )
+        if retVal[ 'OK' ]:
+          rowsMoved = retVal[ 'Value' ]
+          compactedBuckets = self.__compactedBuckets( typeName, bucketLength, bucketsData, nowEpoch )
+          retVal = self.__addToBuckets( typeName, _getTableName( "bucket", typeName ), self.dbCatalog[ typeName ][ 'keys' ],
+                                        compactedBuckets, connObj )
+          #The rollups, built or not, have the sums of the buckets moved
+          for keyName in self.__getRollups( typeName ):
+            if not retVal[ 'OK' ]:
+              break
+            rollupTableName = _getTableName( "rollup", typeName, keyName )
+            retVal = self._update( "DELETE FROM `%s` WHERE `startTime` >= %d AND `startTime` < %d AND `bucketLength` = %d" % ( rollupTableName,
+                                                                                                                              fromTime,
+                                                                                                                              toTime,
+                                                                                                                              bucketLength ),
+                                   conn = connObj )
+            if retVal[ 'OK' ]:
+              retVal = self.__addToBuckets( typeName, rollupTableName, [ keyName ],
+                                            self.__rollupBuckets( typeName, keyName, compactedBuckets ), connObj )
+      if retVal[ 'OK' ]:
+        retVal = self.__setCompactionWatermark( typeName, bucketLength, toTime, rowsMoved, connObj = connObj )
+      if retVal[ 'OK' ]:
+        retVal = self.__commitTransaction( connObj )
+      if not retVal[ 'OK' ]:
+        self.__rollbackTransaction( connObj )
+        return retVal
+    finally:
+      connObj.close()
+    return S_OK( rowsMoved )
 
-        result = self.__deleteIndividualForCompactBuckets( typeName, bucketsData )
-        if not result[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          return result
-        bucketsData = result[ 'Value' ]
-        deleteEndTime = time.time()
-        self.log.info( "[COMPACT] Deleted %s out-of-bounds buckets (took %.2f secs)" % ( len( bucketsData ),
-                                                                                         deleteEndTime - selectEndTime ) )
-        #Add data
-        for record in bucketsData:
-          startTime = record[-2]
-          endTime = record[-2] + record[-1]
-          valuesList = record[:-2]
-          retVal = self.__splitInBuckets( typeName, startTime, endTime, valuesList )
-          if not retVal[ 'OK' ]:
-            self.log.error( "[COMPACT] Error while compacting data for buckets", "%s: %s" % ( typeName, retVal[ 'Value' ] ) )
-        totalCompacted += len( bucketsData )
-        insertElapsedTime = time.time() - deleteEndTime
-        self.log.info( "[COMPACT] Records compacted (took %.2f secs, %.2f secs/bucket)" % ( insertElapsedTime,
-                                                                                            insertElapsedTime / len( bucketsData ) ) )
-      self.log.info( "[COMPACT] Finised compaction %d of %d" % ( bPos, len( self.dbBucketsLength[ typeName ] ) - 1 ) )
-    #return self.__commitTransaction( connObj )
-    return S_OK()
+  def __compactedBuckets( self, typeName, bucketLength, bucketsData, nowEpoch ):
+    """
+    Get the { ( startTime, bucketLength, keyId, ... ) : [ entries, value, ... ] } the grouped buckets go to
+    """
+    numKeys = len( self.dbCatalog[ typeName ][ 'keys' ] )
+    buckets = {}
+    for record in bucketsData:
+      keyValues = tuple( record[ :numKeys ] )
+      recordValues = [ record[-3] ] + list( record[ numKeys:-3 ] )
+      for bStartTime, bProportion, bLength in self.calculateBuckets( typeName, int( record[-2] ),
+                                                                     int( record[-1] ) + bucketLength, nowEpoch ):
+        bucketValues = recordValues
+        if bProportion != 1:
+          proportion = Decimal( repr( bProportion ) )
+          bucketValues = [ value * proportion for value in recordValues ]
+        bucketKey = ( bStartTime, bLength ) + keyValues
+        if bucketKey not in buckets:
+          buckets[ bucketKey ] = list( bucketValues )
+        else:
+          for valPos in range( len( bucketValues ) ):
+            buckets[ bucketKey ][ valPos ] += bucketValues[ valPos ]
+    return buckets
 
-  def __selectIndividualForCompactBuckets( self, typeName, timeLimit, bucketLength, nextBucketLength, querySize, connObj = False ):
+  def __selectForCompactBuckets( self, typeName, fromTime, toTime, bucketLength, nextBucketLength, connObj = False ):
     """
-    Nasty SQL query to get ideal buckets using grouping by date calculations and adding value contents
+    Get the buckets of a length between two times grouped by the longer buckets they go to, locking them
     """
     tableName = _getTableName( "bucket", typeName )
     selectSQL = "SELECT "
@@ -1258,43 +1932,32 @@ class AccountingDB( DB ):
     for field in self.dbCatalog[ typeName ][ 'keys' ]:
       sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
     for field in self.dbCatalog[ typeName ][ 'values' ]:
-      sqlSelectList.append( "`%s`.`%s`" % ( tableName, field ) )
-    sqlSelectList.append( "`%s`.`entriesInBucket`" % ( tableName ) )
-    sqlSelectList.append( "`%s`.`startTime`" % tableName )
-    sqlSelectList.append( "`%s`.bucketLength" % ( tableName ) )
+      sqlSelectList.append( "SUM( `%s`.`%s` )" % ( tableName, field ) )
+    sqlSelectList.append( "SUM( `%s`.`entriesInBucket` )" % ( tableName ) )
+    sqlSelectList.append( "MIN( `%s`.`startTime` )" % tableName )
+    sqlSelectList.append( "MAX( `%s`.`startTime` )" % tableName )
     selectSQL += ", ".join( sqlSelectList )
     selectSQL += " FROM `%s`" % tableName
-    selectSQL += " WHERE `%s`.`startTime` < '%s' AND" % ( tableName, timeLimit )
+    selectSQL += " WHERE `%s`.`startTime` >= %d AND `%s`.`startTime` < %d AND" % ( tableName, fromTime, tableName, toTime )
     selectSQL += " `%s`.`bucketLength` = %s" % ( tableName, bucketLength )
     #MAGIC bucketing
-    selectSQL += " LIMIT %d" % querySize
+    sqlGroupList = [ _bucketizeDataField( "`%s`.`startTime`" % tableName, nextBucketLength ) ]
+    for field in self.dbCatalog[ typeName ][ 'keys' ]:
+      sqlGroupList.append( "`%s`.`%s`" % ( tableName, field ) )
+    selectSQL += " GROUP BY %s" % ", ".join( sqlGroupList )
+    #Nobody else touches the buckets until they are moved
+    selectSQL += " FOR UPDATE"
     return self._query( selectSQL, conn = connObj )
 
-  def __deleteIndividualForCompactBuckets( self, typeName, bucketsData, connObj = False ):
+  def __deleteForCompactBuckets( self, typeName, fromTime, toTime, bucketLength, connObj = False ):
     """
     Delete compacted buckets
     """
     tableName = _getTableName( "bucket", typeName )
-    keyFields = self.dbCatalog[ typeName ][ 'keys' ]
-    deleteQueryLimit = 50
-    deletedBuckets = []
-    for bLimit in range( 0, len( bucketsData ) , deleteQueryLimit ):
-      delCondsSQL = []
-      for record in bucketsData[ bLimit : bLimit + deleteQueryLimit ]:
-        condSQL = []
-        for iPos in range( len( keyFields ) ):
-          field = keyFields[ iPos ]
-          condSQL.append( "`%s`.`%s` = %s" % ( tableName, field, record[ iPos ] ) )
-        condSQL.append( "`%s`.`startTime` = %d" % ( tableName, record[-2] ) )
-        condSQL.append( "`%s`.`bucketLength` = %d" % ( tableName, record[-1] ) )
-        delCondsSQL.append( "(%s)" % " AND ".join( condSQL ) )
-      delSQL = "DELETE FROM `%s` WHERE %s" % ( tableName, " OR ".join( delCondsSQL ) )
-      result = self._update( delSQL, conn = connObj )
-      if not result[ 'OK' ]:
-        self.log.error( "Cannot delete individual records for compaction", result[ 'Message' ] )
-      else:
-        deletedBuckets.extend( bucketsData[ bLimit : bLimit + deleteQueryLimit ] )
-    return S_OK( deletedBuckets )
+    deleteSQL = "DELETE FROM `%s` WHERE " % tableName
+    deleteSQL += "`%s`.`startTime` >= %d AND `%s`.`startTime` < %d AND " % ( tableName, fromTime, tableName, toTime )
+    deleteSQL += "`%s`.`bucketLength` = %s" % ( tableName, bucketLength )
+    return self._update( deleteSQL, conn = connObj )
 
   def __deleteRecordsOlderThanDataTimespan( self, typeName ):
     """
@@ -1304,8 +1967,12 @@ class AccountingDB( DB ):
     dataTimespan = self.dbCatalog[ typeName ][ 'dataTimespan' ]
     if dataTimespan < 86400 * 30:
       return
-    for table, field in ( ( _getTableName( "type", typeName ), 'endTime' ),
-                          ( _getTableName( "bucket", typeName ), 'startTime + %s' % self.dbBucketsLength[ typeName ][-1][1] ) ):
+    bucketTimeField = 'startTime + %s' % self.dbBucketsLength[ typeName ][-1][1]
+    tablesFields = [ ( _getTableName( "type", typeName ), 'endTime' ),
+                     ( _getTableName( "bucket", typeName ), bucketTimeField ) ]
+    for keyName in self.__getRollups( typeName ):
+      tablesFields.append( ( _getTableName( "rollup", typeName, keyName ), bucketTimeField ) )
+    for table, field in tablesFields:
       self.log.info( "[COMPACT] Deleting old records for table %s" % table )
       deleteLimit = 100000
       deleted = deleteLimit
@@ -1330,11 +1997,20 @@ class AccountingDB( DB ):
       self.__deleteRecordsOlderThanDataTimespan( typeName )
       self.log.info( "[REBUCKET] Done deleting old records" )
     rawTableName = _getTableName( "type", typeName )
+    #Queries do not use the rollups until they are built again from the new buckets
+    rollupKeys = list( self.__getRollups( typeName ) )
+    for keyName in rollupKeys:
+      retVal = self.__setRollupReady( typeName, keyName, False )
+      if not retVal[ 'OK' ]:
+        return retVal
     #retVal = self.__startTransaction( connObj )
     #if not retVal[ 'OK' ]:
     #  return retVal
     self.log.info( "[REBUCKET] Deleting buckets for %s" % typeName )
     retVal = self._update( "DELETE FROM `%s`" % _getTableName( "bucket", typeName ) )
+    if not retVal[ 'OK' ]:
+      return retVal
+    retVal = self.__resetCompactionWatermarks( typeName )
     if not retVal[ 'OK' ]:
       return retVal
     #Generate the common part of the query
@@ -1416,37 +2092,41 @@ class AccountingDB( DB ):
     for sqlQuery in sqlQueries:
       self.log.info( "[REBUCKET] Executing query #%s..." % queryNum )
       queryNum += 1
-      retVal = self._query( sqlQuery )
+      #Stream the records, there may be too many of them to be held in memory
+      retVal = self._queryIter( sqlQuery )
       if not retVal[ 'OK' ]:
         self.log.error( "[REBUCKET] Can't retrieve data for rebucketing", retVal[ 'Message' ] )
         #self.__rollbackTransaction( connObj )
         return retVal
-      rawData = retVal[ 'Value' ]
-      self.log.info( "[REBUCKET] Retrieved %s records" % len( rawData ) )
       rebucketedRecords = 0
       startQuery = time.time()
       startBlock = time.time()
-      numRecords = len( rawData )
-      for entry in rawData:
-        startT = entry[0]
-        endT = entry[1]
-        values = entry[2:]
-        retVal = self.__splitInBuckets( typeName, startT, endT, values )
-        if not retVal[ 'OK' ]:
-          #self.__rollbackTransaction( connObj )
-          return retVal
-        rebucketedRecords += 1
-        if rebucketedRecords % 1000 == 0:
-          queryAvg = rebucketedRecords / float( time.time() - startQuery )
-          blockAvg = 1000 / float( time.time() - startBlock )
-          startBlock = time.time()
-          perDone = 100 * rebucketedRecords / float ( numRecords )
-          expectedEnd = str( datetime.timedelta( seconds = int( ( numRecords - rebucketedRecords ) / blockAvg ) ) )
-          self.log.info( "[REBUCKET] Rebucketed %.2f%% %s (%.2f r/s block %.2f r/s query | ETA %s )..." % ( perDone, typeName,
-                                                                                                            blockAvg, queryAvg,
-                                                                                                            expectedEnd ) )
+      try:
+        with retVal[ 'Value' ] as recordsIterator:
+          for rawData in recordsIterator:
+            for entry in rawData:
+              startT = entry[0]
+              endT = entry[1]
+              values = entry[2:]
+              retVal = self.__splitInBuckets( typeName, startT, endT, values, rollups = False )
+              if not retVal[ 'OK' ]:
+                #self.__rollbackTransaction( connObj )
+                return retVal
+              rebucketedRecords += 1
+              if rebucketedRecords % 1000 == 0:
+                queryAvg = rebucketedRecords / float( time.time() - startQuery )
+                blockAvg = 1000 / float( time.time() - startBlock )
+                startBlock = time.time()
+                self.log.info( "[REBUCKET] Rebucketed %s records of %s (%.2f r/s block %.2f r/s query)..." % ( rebucketedRecords,
+                                                                                                           typeName,
+                                                                                                           blockAvg,
+                                                                                                           queryAvg ) )
+      except Exception as e:
+        self.log.error( "[REBUCKET] Can't retrieve data for rebucketing", str( e ) )
+        return S_ERROR( "Can't retrieve data for rebucketing %s: %s" % ( typeName, e ) )
+      self.log.info( "[REBUCKET] Rebucketed %s records" % rebucketedRecords )
     #return self.__commitTransaction( connObj )
-    return S_OK()
+    return self.__buildRollups( typeName, rollupKeys )
 
 
   def __startTransaction( self, connObj ):
@@ -1467,7 +2147,7 @@ def _getTableName( tableType, typeName, keyName = None ):
   """
   if not keyName:
     return "ac_%s_%s" % ( tableType, typeName )
-  elif tableType == "key" :
+  elif tableType in ( "key", "rollup" ):
     return "ac_%s_%s_%s" % ( tableType, typeName, keyName )
   else:
-    raise Exception( "Call to _getTableName with tableType as key but with no keyName" )
+    raise Exception( "Call to _getTableName with keyName but with tableType %s" % tableType )
@@ -41,7 +41,7 @@ class MultiAccountingDB( object ):
       self.__dbByType[ acType ] = dbName
 
   def __registerMethods( self ):
-    for methodName in ( 'registerType', 'changeBucketsLength', 'regenerateBuckets',
+    for methodName in ( 'registerType', 'changeBucketsLength', 'regenerateBuckets', 'rebuildRollups',
                         'deleteType', 'insertRecordThroughQueue',
                         'deleteRecord', 'getKeyValues', 'retrieveBucketedData',
                         'calculateBuckets', 'calculateBucketLengthForTime' ):
@@ -64,6 +64,17 @@ class MultiAccountingDB( object ):
   def __db( self, acType ):
     return self.__allDBs[ self.__dbByType.get( acType, self.__defaultDB ) ]
 
+  def getCompactionStatus( self ):
+    status = { 'Running' : False, 'LastCompaction' : 0, 'Types' : {} }
+    for dbName in self.__allDBs:
+      res = self.__allDBs[ dbName ].getCompactionStatus()
+      if not res[ 'OK' ]:
+        return res
+      status[ 'Running' ] = status[ 'Running' ] or res[ 'Value' ][ 'Running' ]
+      status[ 'LastCompaction' ] = max( status[ 'LastCompaction' ], res[ 'Value' ][ 'LastCompaction' ] )
+      status[ 'Types' ].update( res[ 'Value' ][ 'Types' ] )
+    return S_OK( status )
+
   def insertRecordBundleThroughQueue( self, records ):
     recByType = {}
     for record in records:
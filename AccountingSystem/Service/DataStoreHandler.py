@@ -82,6 +82,23 @@ class DataStoreHandler( RequestHandler ):
       return S_ERROR( "Error while recalculating buckets for type:\n %s" % "\n ".join( errorsList ) )
     return S_OK()
 
+  types_rebuildRollups = [ basestring ]
+  def export_rebuildRollups( self, typeName ):
+    """
+      Rebuild the rollups of a type from its buckets. (Only for all powerful admins)
+    """
+    retVal = gConfig.getSections( "/DIRAC/Setups" )
+    if not retVal[ 'OK' ]:
+      return retVal
+    errorsList = []
+    for setup in retVal[ 'Value' ]:
+      retVal = self.__acDB.rebuildRollups( setup, typeName ) #pylint: disable=too-many-function-args
+      if not retVal[ 'OK' ]:
+        errorsList.append( retVal[ 'Message' ] )
+    if errorsList:
+      return S_ERROR( "Error while rebuilding rollups for type:\n %s" % "\n ".join( errorsList ) )
+    return S_OK()
+
   types_getRegisteredTypes = []
   def export_getRegisteredTypes( self ):
     """
@@ -148,6 +165,13 @@ class DataStoreHandler( RequestHandler ):
     """
     return self.__acDB.compactBuckets()
 
+  types_getCompactionStatus = []
+  def export_getCompactionStatus( self ):
+    """
+    Get the progress of the running compaction, or of the last one
+    """
+    return self.__acDB.getCompactionStatus()
+
   types_remove = [ basestring, datetime.datetime, datetime.datetime, list ]
   def export_remove( self, typeName, startTime, endTime, valuesList ):
     """
@@ -0,0 +1,157 @@
+""" Array backed reshaping of the buckets of the accounting reports
+
+    The buckets of a report come from the DB as [ key, startTime, bucketLength, value1, ... ] rows.
+    Spreading them over the buckets of the granularity of the plot one by one, in dictionaries, is
+    what takes most of the time of the fine grained plots with many keys. Here all the keys are done
+    at once with numpy. numpy is optional: without it, isAvailable() is False and DBUtils and
+    BaseReporter do it the old way.
+"""
+
+__RCSID__ = "$Id$"
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+def isAvailable():
+  return numpy is not None
+
+class BucketsMatrix( object ):
+  """
+    Buckets of several keys: one row of values per key and epoch, the rows of a key being together
+    and sorted by epoch. keys is the key index, the rows of keys[ i ] go from keyRows[ i ] to
+    keyRows[ i + 1 ]
+  """
+
+  def __init__( self, keys, keyRows, epochs, values ):
+    self.keys = keys
+    self.keyRows = keyRows
+    self.epochs = epochs
+    self.values = values
+
+  @classmethod
+  def fromDataDict( cls, dataDict, fields ):
+    """
+    Build it from { key : { epoch : [ value1, value2... ] } }, taking the first fields values
+    """
+    keys = list( dataDict )
+    numRows = [ 0 ]
+    epochs = []
+    values = []
+    for key in keys:
+      currentDict = dataDict[ key ]
+      numRows.append( len( currentDict ) )
+      epochs.append( numpy.fromiter( currentDict.iterkeys(), dtype = numpy.int64, count = len( currentDict ) ) )
+      values.extend( [ value[ :fields ] for value in currentDict.itervalues() ] )
+    values = numpy.array( values, dtype = numpy.float64 )
+    if values.ndim != 2 or values.shape[1] != fields:
+      raise ValueError( "Values do not have %s fields" % fields )
+    if epochs:
+      epochs = numpy.concatenate( epochs )
+    else:
+      epochs = numpy.zeros( 0, dtype = numpy.int64 )
+    return cls( keys, numpy.cumsum( numRows ), epochs, values )
+
+  def toDataDict( self ):
+    """
+    Get { key : { epoch : [ value1, value2... ] } }
+    """
+    epochs = self.epochs.tolist()
+    values = self.values.tolist()
+    dataDict = {}
+    for keyPos in range( len( self.keys ) ):
+      firstRow, lastRow = self.keyRows[ keyPos ], self.keyRows[ keyPos + 1 ]
+      dataDict[ self.keys[ keyPos ] ] = dict( zip( epochs[ firstRow:lastRow ], values[ firstRow:lastRow ] ) )
+    return dataDict
+
+  def getKeyData( self, key ):
+    """
+    Get { epoch : [ value1, value2... ] } for a key
+    """
+    if key not in self.keys:
+      return {}
+    keyPos = self.keys.index( key )
+    firstRow, lastRow = self.keyRows[ keyPos ], self.keyRows[ keyPos + 1 ]
+    return dict( zip( self.epochs[ firstRow:lastRow ].tolist(), self.values[ firstRow:lastRow ].tolist() ) )
+
+  def sumValues( self ):
+    """ Drop the proportions column left by spanToGranularity """
+    self.values = self.values[ :, :-1 ]
+
+  def averageValues( self ):
+    """ Divide the values by the proportions column left by spanToGranularity, and drop it """
+    self.values = self.values[ :, :-1 ] / self.values[ :, -1: ]
+
+  def calculateProportionalGauges( self ):
+    """
+    Replace the value1, value2... values by a gauge: value1 / value2 scaled for each epoch so that
+    the gauges of the epoch add up to the sum of value1 over the sum of value2.
+    Returns False, changing nothing, when there are not two values or a value2 is 0
+    """
+    if len( self.values.shape ) != 2 or self.values.shape[1] < 2 or not numpy.all( self.values[ :, 1 ] ):
+      return False
+    ratios = self.values[ :, 0 ] / self.values[ :, 1 ]
+    uniqueEpochs, epochPos = numpy.unique( self.epochs, return_inverse = True )
+    firstSums = numpy.bincount( epochPos, self.values[ :, 0 ], len( uniqueEpochs ) )
+    secondSums = numpy.bincount( epochPos, self.values[ :, 1 ], len( uniqueEpochs ) )
+    ratioSums = numpy.bincount( epochPos, ratios, len( uniqueEpochs ) )
+    factors = numpy.zeros( len( uniqueEpochs ) )
+    nonZero = firstSums != 0
+    factors[ nonZero ] = ( firstSums[ nonZero ] / secondSums[ nonZero ] ) / ratioSums[ nonZero ]
+    self.values = ( ratios * factors[ epochPos ] )[ :, numpy.newaxis ]
+    return True
+
+def spanToGranularity( granularity, bucketsData, keyed = False ):
+  """
+  Spread the buckets over buckets of granularity seconds.
+    - bucketsData : list of [ key, startTime, bucketLength, value1, value2... ], without the key
+                    unless keyed, all of them being then of the key None
+  Returns a BucketsMatrix with the values of the new buckets, the sum of the proportions of the
+  buckets that went in them being the last value
+  """
+  if keyed:
+    keyCodes = {}
+    codes = numpy.fromiter( ( keyCodes.setdefault( bucketData[0], len( keyCodes ) ) for bucketData in bucketsData ),
+                            dtype = numpy.int64, count = len( bucketsData ) )
+    keys = sorted( keyCodes, key = keyCodes.get )
+  else:
+    keys = [ None ] if bucketsData else []
+    codes = numpy.zeros( len( bucketsData ), dtype = numpy.int64 )
+  if not len( bucketsData ):
+    return BucketsMatrix( [], numpy.zeros( 1, dtype = numpy.int64 ), numpy.zeros( 0, dtype = numpy.int64 ),
+                          numpy.zeros( ( 0, 1 ) ) )
+  #The values come as Decimal from the DB, converting the whole block at once is the fastest
+  data = numpy.array( bucketsData, dtype = object )
+  if keyed:
+    data = data[ :, 1: ]
+  data = data.astype( numpy.float64 )
+  starts = data[ :, 0 ].astype( numpy.int64 )
+  lengths = data[ :, 1 ].astype( numpy.int64 )
+  #None values are taken as 0
+  values = data[ :, 2: ]
+  values[ numpy.isnan( values ) ] = 0
+  ends = starts + lengths
+  #Buckets already in the granularity stay where they are, the others are split
+  whole = ( lengths == granularity ) | ( lengths == 0 )
+  firstEpochs = numpy.where( lengths == granularity, starts, starts - starts % granularity )
+  numPieces = numpy.where( whole, 1, ( ends - firstEpochs + granularity - 1 ) // granularity )
+  pieceRows = numpy.repeat( numpy.arange( len( bucketsData ) ), numPieces )
+  pieceNums = numpy.arange( len( pieceRows ) ) - numpy.repeat( numpy.cumsum( numPieces ) - numPieces, numPieces )
+  pieceEpochs = firstEpochs[ pieceRows ] + pieceNums * granularity
+  pieceLengths = numpy.minimum( pieceEpochs + granularity, ends[ pieceRows ] ) - numpy.maximum( pieceEpochs, starts[ pieceRows ] )
+  proportions = numpy.where( whole[ pieceRows ],
+                             1.0,
+                             pieceLengths / numpy.maximum( lengths[ pieceRows ], 1 ).astype( numpy.float64 ) )
+  pieces = numpy.empty( ( len( pieceRows ), values.shape[1] + 1 ) )
+  pieces[ :, :-1 ] = values[ pieceRows ] * proportions[ :, numpy.newaxis ]
+  pieces[ :, -1 ] = proportions
+  #Sum the pieces falling in the same bucket of the same key, keeping the order of the buckets
+  order = numpy.lexsort( ( pieceEpochs, codes[ pieceRows ] ) )
+  pieceEpochs = pieceEpochs[ order ]
+  pieceCodes = codes[ pieceRows ][ order ]
+  firsts = numpy.flatnonzero( numpy.concatenate( ( [ True ],
+                                                   ( pieceEpochs[1:] != pieceEpochs[:-1] ) |
+                                                   ( pieceCodes[1:] != pieceCodes[:-1] ) ) ) )
+  keyRows = numpy.searchsorted( pieceCodes[ firsts ], numpy.arange( len( keys ) + 1 ) )
+  return BucketsMatrix( keys, keyRows, pieceEpochs[ firsts ], numpy.add.reduceat( pieces[ order ], firsts, axis = 0 ) )
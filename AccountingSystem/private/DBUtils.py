@@ -1,5 +1,6 @@
 import types
 from DIRAC.Core.Utilities import Time
+from DIRAC.AccountingSystem.private import BucketsMatrix
 
 class DBUtils:
 
@@ -78,6 +79,14 @@ class DBUtils:
       - field 1: bucketLength
       - fields 2-n: numericalFields
     """
+    if BucketsMatrix.isAvailable():
+      return BucketsMatrix.spanToGranularity( granularity, bucketsData ).getKeyData( None )
+    return self._legacySpanToGranularity( granularity, bucketsData )
+
+  def _legacySpanToGranularity( self, granularity, bucketsData ):
+    """
+    Same as _spanToGranularity, bucket by bucket
+    """
     normData = {}
 
     def addToNormData( bucketDate, data, proportion = 1.0 ):
@@ -124,7 +133,17 @@ class DBUtils:
       - field 1: bucketLength
       - fields 2-n: numericalFields
     """
-    normData = self._spanToGranularity( granularity, bucketsData )
+    if BucketsMatrix.isAvailable():
+      matrix = BucketsMatrix.spanToGranularity( granularity, bucketsData )
+      matrix.sumValues()
+      return matrix.getKeyData( None )
+    return self._legacySumToGranularity( granularity, bucketsData )
+
+  def _legacySumToGranularity( self, granularity, bucketsData ):
+    """
+    Same as _sumToGranularity, bucket by bucket
+    """
+    normData = self._legacySpanToGranularity( granularity, bucketsData )
     for bDate in normData:
       del( normData[ bDate ][-1] )
     return normData
@@ -136,7 +155,17 @@ class DBUtils:
       - field 1: bucketLength
       - fields 2-n: numericalFields
     """
-    normData = self._spanToGranularity( granularity, bucketsData )
+    if BucketsMatrix.isAvailable():
+      matrix = BucketsMatrix.spanToGranularity( granularity, bucketsData )
+      matrix.averageValues()
+      return matrix.getKeyData( None )
+    return self._legacyAverageToGranularity( granularity, bucketsData )
+
+  def _legacyAverageToGranularity( self, granularity, bucketsData ):
+    """
+    Same as _averageToGranularity, bucket by bucket
+    """
+    normData = self._legacySpanToGranularity( granularity, bucketsData )
     for bDate in normData:
       for iP in range( len( normData[ bDate ] ) ):
         normData[ bDate ][iP] = float( normData[ bDate ][iP] ) / normData[ bDate ][-1]
@@ -164,11 +193,10 @@ class DBUtils:
       - dataDict = { 'key' : { time1 : value,  time2 : value... }, 'key2'.. }
     """
     startBucketEpoch = startEpoch - startEpoch % granularity
+    allEpochs = frozenset( range( int( startBucketEpoch ), int( endEpoch ), granularity ) )
     for key in dataDict:
       currentDict = dataDict[ key ]
-      for timeEpoch in range( int( startBucketEpoch ), int( endEpoch ), granularity ):
-        if timeEpoch not in currentDict:
-          currentDict[ timeEpoch ] = 0
+      currentDict.update( dict.fromkeys( allEpochs.difference( currentDict ), 0 ) )
     return dataDict
 
   def _getAccumulationMaxValue( self, dataDict ):
@@ -276,6 +304,20 @@ class DBUtils:
     """
     Get a dict with more than one entry per bucket and list
     """
+    if BucketsMatrix.isAvailable():
+      try:
+        matrix = BucketsMatrix.BucketsMatrix.fromDataDict( dataDict, 2 )
+      except ( ValueError, TypeError ):
+        matrix = None
+      #Otherwise the checks and errors are those of the bucket by bucket version
+      if matrix and matrix.calculateProportionalGauges():
+        return matrix.toDataDict()
+    return self._legacyCalculateProportionalGauges( dataDict )
+
+  def _legacyCalculateProportionalGauges( self, dataDict ):
+    """
+    Same as _calculateProportionalGauges, bucket by bucket
+    """
     bucketSums = {}
     #Calculate total sums in buckets
     for key in dataDict:
@@ -0,0 +1,93 @@
+""" Cache of the ids of the values of the accounting keys
+
+    Used by the AccountingDB to translate Site, User... values into the ids of the key tables
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+from collections import OrderedDict
+
+class KeyValueCache( object ):
+  """
+    Bounded cache of ( typeName, keyName, keyValue ) -> id, the entries used the longest time
+    ago being forgotten first when there are more than maxSize of them.
+
+    Ids of the key tables never change, a cached id stays valid as long as the type exists. The
+    hits and misses are counted to know how well the cache does: see getStats()
+  """
+
+  def __init__( self, maxSize = 100000 ):
+    self.__maxSize = max( 1, maxSize )
+    self.__lock = threading.Lock()
+    self.__cache = OrderedDict()
+    self.__hits = 0
+    self.__misses = 0
+
+  def get( self, typeName, keyName, keyValue ):
+    """ Get the id of the value of the key, None if not known
+    """
+    cKey = ( typeName, keyName, keyValue )
+    self.__lock.acquire()
+    try:
+      try:
+        keyId = self.__cache.pop( cKey )
+      except KeyError:
+        self.__misses += 1
+        return None
+      #Back to the end, as the last one used
+      self.__cache[ cKey ] = keyId
+      self.__hits += 1
+      return keyId
+    finally:
+      self.__lock.release()
+
+  def add( self, typeName, keyName, keyValue, keyId ):
+    """ Add the id of the value of the key
+    """
+    self.addMany( typeName, keyName, [ ( keyValue, keyId ) ] )
+
+  def addMany( self, typeName, keyName, keyIds ):
+    """ Add the ids of several values of the key, given as a list of ( keyValue, id )
+    """
+    self.__lock.acquire()
+    try:
+      for keyValue, keyId in keyIds:
+        cKey = ( typeName, keyName, keyValue )
+        self.__cache.pop( cKey, None )
+        self.__cache[ cKey ] = keyId
+      while len( self.__cache ) > self.__maxSize:
+        self.__cache.popitem( last = False )
+    finally:
+      self.__lock.release()
+
+  def freeSlots( self ):
+    return max( 0, self.__maxSize - len( self.__cache ) )
+
+  def deleteType( self, typeName ):
+    """ Forget the ids of the keys of a type
+    """
+    self.__lock.acquire()
+    try:
+      for cKey in [ cKey for cKey in self.__cache if cKey[0] == typeName ]:
+        del self.__cache[ cKey ]
+    finally:
+      self.__lock.release()
+
+  def getStats( self, reset = False ):
+    """ Get the number of entries, of hits and misses and the hit rate in % since the last reset
+    """
+    self.__lock.acquire()
+    try:
+      lookups = self.__hits + self.__misses
+      stats = { 'Size' : len( self.__cache ),
+                'MaxSize' : self.__maxSize,
+                'Hits' : self.__hits,
+                'Misses' : self.__misses,
+                'HitRate' : 100. * self.__hits / lookups if lookups else 0. }
+      if reset:
+        self.__hits = 0
+        self.__misses = 0
+      return stats
+    finally:
+      self.__lock.release()
@@ -1,6 +1,7 @@
 import time, copy, types
 from DIRAC import S_OK, S_ERROR, gLogger
 from DIRAC.AccountingSystem.private.DBUtils import DBUtils
+from DIRAC.AccountingSystem.private import BucketsMatrix
 from DIRAC.AccountingSystem.private.DataCache import gDataCache
 from DIRAC.Core.Utilities import Time
 from DIRAC.AccountingSystem.private.Plots import generateNoDataPlot, generateTimedStackedBarPlot, generateQualityPlot, generateCumulativePlot, generatePiePlot, generateStackedLinePlot
@@ -156,8 +157,11 @@ class BaseReporter( DBUtils ):
                                           )
     if not retVal[ 'OK' ]:
       return retVal
-    dataDict = self._groupByField( 0, retVal[ 'Value' ] )
     coarsestGranularity = self._getBucketLengthForTime( self._typeName, startTime )
+    if BucketsMatrix.isAvailable():
+      dataDict = self.__transformBucketsMatrix( coarsestGranularity, retVal[ 'Value' ], metadataDict )
+      return S_OK( ( dataDict, coarsestGranularity ) )
+    dataDict = self._groupByField( 0, retVal[ 'Value' ] )
     #Transform!
     for keyField in dataDict:
       if metadataDict[ self._PARAM_CHECK_FOR_NONE ]:
@@ -172,6 +176,27 @@ class BaseReporter( DBUtils ):
       dataDict = self._calculateProportionalGauges( dataDict )
     return S_OK( ( dataDict, coarsestGranularity ) )
 
+  def __transformBucketsMatrix( self, granularity, bucketsData, metadataDict ):
+    """
+    Same transformations as _getTimedData, for all the keys at once with the buckets in a BucketsMatrix
+    """
+    matrix = BucketsMatrix.spanToGranularity( granularity, bucketsData, keyed = True )
+    if metadataDict[ self._PARAM_CONVERT_TO_GRANULARITY ] == "average":
+      matrix.averageValues()
+    else:
+      matrix.sumValues()
+    consolidation = self._PARAM_CONSOLIDATION_FUNCTION in metadataDict
+    proportionalGauges = metadataDict[ self._PARAM_CALCULATE_PROPORTIONAL_GAUGES ]
+    if proportionalGauges and not consolidation and matrix.calculateProportionalGauges():
+      return matrix.toDataDict()
+    dataDict = matrix.toDataDict()
+    if consolidation:
+      for keyField in dataDict:
+        dataDict[ keyField ] = self._executeConsolidation( metadataDict[ self._PARAM_CONSOLIDATION_FUNCTION ], dataDict[ keyField ] )
+    if proportionalGauges:
+      dataDict = self._calculateProportionalGauges( dataDict )
+    return dataDict
+
   def _executeConsolidation( self, functor, dataDict ):
     for timeKey in dataDict:
       dataDict[ timeKey ] = [ functor( *dataDict[ timeKey ] ) ]
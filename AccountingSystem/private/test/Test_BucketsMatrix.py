@@ -0,0 +1,85 @@
+""" Test for the array backed transformations of the buckets, against the bucket by bucket ones
+"""
+
+import copy
+import random
+import unittest
+
+from DIRAC.AccountingSystem.private import BucketsMatrix
+from DIRAC.AccountingSystem.private.DBUtils import DBUtils
+
+def buckets( startEpoch, endEpoch, bucketLength, withNone = False ):
+  """ Buckets of two values """
+  bucketsData = []
+  for bucketEpoch in range( startEpoch, endEpoch, bucketLength ):
+    value = random.random() * 1000
+    if withNone and not random.randint( 0, 5 ):
+      value = None
+    bucketsData.append( [ bucketEpoch, bucketLength, value, random.randint( 1, 100 ) ] )
+  return bucketsData
+
+gNoNumpy = not BucketsMatrix.isAvailable()
+
+class BucketsMatrixTestCase( unittest.TestCase ):
+  """ Base class for the BucketsMatrix test cases
+  """
+  def setUp( self ):
+    self.dbUtils = DBUtils( None, 'Test' )
+    random.seed( 4 )
+
+  def assertDataEqual( self, data, expected ):
+    self.assertEqual( sorted( data ), sorted( expected ) )
+    for key in expected:
+      if isinstance( expected[ key ], dict ):
+        self.assertDataEqual( data[ key ], expected[ key ] )
+      elif isinstance( expected[ key ], list ):
+        self.assertEqual( len( data[ key ] ), len( expected[ key ] ) )
+        for value, expectedValue in zip( data[ key ], expected[ key ] ):
+          self.assertAlmostEqual( value, expectedValue )
+      else:
+        self.assertAlmostEqual( data[ key ], expected[ key ] )
+
+  @unittest.skipIf( gNoNumpy, "numpy is not installed" )
+  def test_granularity( self ):
+    # Hour and day buckets, some not aligned and over the granularity
+    bucketsData = buckets( 86400 * 100, 86400 * 110, 86400, withNone = True )
+    bucketsData += buckets( 86400 * 110, 86400 * 112, 3600, withNone = True )
+    bucketsData += [ [ 86400 * 105 + 600, 7200, 4.5, 1 ], [ 86400 * 106, 0, 3., 1 ], [ 86400 * 107, 86400 * 3, 1., 2 ] ]
+    for granularity in ( 3600, 86400, 604800 ):
+      for method in ( '_spanToGranularity', '_sumToGranularity', '_averageToGranularity' ):
+        expected = getattr( self.dbUtils, '_legacy%s%s' % ( method[1].upper(), method[2:] ) )( granularity, copy.deepcopy( bucketsData ) )
+        self.assertDataEqual( getattr( self.dbUtils, method )( granularity, copy.deepcopy( bucketsData ) ), expected )
+    self.assertEqual( self.dbUtils._sumToGranularity( 3600, [] ), {} )
+
+  @unittest.skipIf( gNoNumpy, "numpy is not installed" )
+  def test_keys( self ):
+    # All the keys at once, as BaseReporter does
+    rows = []
+    expected = {}
+    for i in range( 5 ):
+      bucketsData = buckets( 3600 * i, 3600 * 48, 3600 * ( i + 1 ), withNone = True )
+      expected[ 'site%s' % i ] = self.dbUtils._legacySumToGranularity( 3600, copy.deepcopy( bucketsData ) )
+      rows.extend( [ tuple( [ 'site%s' % i ] + bucketData ) for bucketData in bucketsData ] )
+    random.shuffle( rows )
+    matrix = BucketsMatrix.spanToGranularity( 3600, rows, keyed = True )
+    matrix.sumValues()
+    self.assertDataEqual( matrix.toDataDict(), expected )
+
+  def test_fillWithZero( self ):
+    dataDict = { 'site0' : { 3600 : 1., 3600 * 100 : 5. }, 'site1' : {} }
+    dataDict = self.dbUtils._fillWithZero( 3600, 1800, 3600 * 3, dataDict )
+    self.assertEqual( dataDict, { 'site0' : { 0 : 0, 3600 : 1., 7200 : 0, 3600 * 100 : 5. },
+                                  'site1' : { 0 : 0, 3600 : 0, 7200 : 0 } } )
+
+  @unittest.skipIf( gNoNumpy, "numpy is not installed" )
+  def test_proportionalGauges( self ):
+    dataDict = { 'site%s' % i : self.dbUtils._sumToGranularity( 3600, buckets( 0, 3600 * 48, 3600 * ( i + 1 ) ) )
+                 for i in range( 5 ) }
+    expected = self.dbUtils._legacyCalculateProportionalGauges( copy.deepcopy( dataDict ) )
+    self.assertDataEqual( self.dbUtils._calculateProportionalGauges( copy.deepcopy( dataDict ) ), expected )
+    # Without a second field the checks are the same
+    self.assertRaises( Exception, self.dbUtils._calculateProportionalGauges, { 'site0' : { 0 : [ 1. ] } } )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( BucketsMatrixTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,43 @@
+""" Test for the cache of the ids of the accounting key values
+"""
+
+import unittest
+
+from DIRAC.AccountingSystem.private.KeyValueCache import KeyValueCache
+
+class KeyValueCacheTestCase( unittest.TestCase ):
+  """ Base class for the KeyValueCache test cases
+  """
+  def test_getAndAdd( self ):
+    cache = KeyValueCache( 10 )
+    self.assertEqual( cache.get( 'Job', 'Site', 'LCG.CERN.ch' ), None )
+    cache.add( 'Job', 'Site', 'LCG.CERN.ch', 3 )
+    self.assertEqual( cache.get( 'Job', 'Site', 'LCG.CERN.ch' ), 3 )
+    self.assertEqual( cache.get( 'Job', 'User', 'LCG.CERN.ch' ), None )
+    stats = cache.getStats( reset = True )
+    self.assertEqual( ( stats['Hits'], stats['Misses'], stats['Size'] ), ( 1, 2, 1 ) )
+    self.assertAlmostEqual( stats['HitRate'], 100. / 3 )
+    self.assertEqual( cache.getStats()['Hits'], 0 )
+
+  def test_leastRecentlyUsed( self ):
+    cache = KeyValueCache( 3 )
+    cache.addMany( 'Job', 'Site', [ ( 'site%s' % i, i ) for i in range( 3 ) ] )
+    self.assertEqual( cache.freeSlots(), 0 )
+    cache.get( 'Job', 'Site', 'site0' )
+    cache.add( 'Job', 'Site', 'site3', 3 )
+    # site1 was used the longest time ago
+    self.assertEqual( cache.get( 'Job', 'Site', 'site1' ), None )
+    self.assertEqual( cache.get( 'Job', 'Site', 'site0' ), 0 )
+    self.assertEqual( cache.get( 'Job', 'Site', 'site3' ), 3 )
+
+  def test_deleteType( self ):
+    cache = KeyValueCache()
+    cache.add( 'Job', 'Site', 'site0', 1 )
+    cache.add( 'DataOperation', 'Site', 'site0', 2 )
+    cache.deleteType( 'Job' )
+    self.assertEqual( cache.get( 'Job', 'Site', 'site0' ), None )
+    self.assertEqual( cache.get( 'DataOperation', 'Site', 'site0' ), 2 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( KeyValueCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
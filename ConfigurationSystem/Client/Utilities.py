@@ -485,8 +485,8 @@ def getDBParameters( fullname ):
   defaultQueueSize is the QueueSize to return if the option is not found in the
   CS
 
-  Returns a dictionary with the keys: 'host', 'port', 'user', 'password',
-  'db' and 'queueSize'
+  Returns a dictionary with the keys: 'Host', 'Port', 'User', 'Password',
+  'DBName', 'MaxConnections' and 'ConnectionWaitTimeout'
   """
 
   cs_path = getDatabaseSection( fullname )
@@ -543,4 +543,12 @@ def getDBParameters( fullname ):
   dbName = result['Value']
   parameters[ 'DBName' ] = dbName
 
+  # Limits of the connection pool, no limit means one connection per thread
+  for option, default in ( ( 'MaxConnections', 0 ), ( 'ConnectionWaitTimeout', 30 ) ):
+    value = gConfig.getValue( cs_path + '/' + option, gConfig.getValue( '/Systems/Databases/' + option, default ) )
+    try:
+      parameters[ option ] = int( value )
+    except ( TypeError, ValueError ):
+      return S_ERROR( 'Invalid value for the configuration parameter %s: %s' % ( option, value ) )
+
   return S_OK( parameters )
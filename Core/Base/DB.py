@@ -27,13 +27,16 @@ class DB( MySQL ):
     self.dbUser = dbParameters[ 'User' ]
     self.dbPass = dbParameters[ 'Password' ]
     self.dbName = dbParameters[ 'DBName' ]
+    self.dbMaxConnections = dbParameters[ 'MaxConnections' ]
 
     super( DB, self ).__init__( hostName = self.dbHost,
                                 userName = self.dbUser,
                                 passwd = self.dbPass,
                                 dbName = self.dbName,
                                 port = self.dbPort,
-                                debug = debug )
+                                debug = debug,
+                                maxConnections = self.dbMaxConnections,
+                                connectionWaitTimeout = dbParameters[ 'ConnectionWaitTimeout' ] )
 
     if not self._connected:
       raise RuntimeError( "Can not connect to DB '%s', exiting..." % self.dbName )
@@ -45,6 +48,8 @@ class DB( MySQL ):
     self.log.info( "Port:           " + str( self.dbPort ) )
     #self.log.info("Password:       "+self.dbPass)
     self.log.info( "DBName:         " + self.dbName )
+    if self.dbMaxConnections:
+      self.log.info( "MaxConnections: " + str( self.dbMaxConnections ) )
     self.log.info( "==================================================" )
 
 #############################################################################
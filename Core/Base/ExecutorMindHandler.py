@@ -16,6 +16,9 @@ class ExecutorMindHandler( RequestHandler ):
   MSG_DEFINITIONS = { 'ProcessTask' : { 'taskId' : ( types.IntType, types.LongType ),
                                         'taskStub' : types.StringTypes,
                                         'eType' : types.StringTypes },
+                      'ProcessTasks' : { 'taskIds' : ( types.ListType, types.TupleType ),
+                                         'taskStubs' : ( types.ListType, types.TupleType ),
+                                         'eType' : types.StringTypes },
                       'TaskDone' : { 'taskId' : ( types.IntType, types.LongType ),
                                      'taskStub' : types.StringTypes },
                       'TaskFreeze' : { 'taskId' : ( types.IntType, types.LongType ),
@@ -31,8 +34,11 @@ class ExecutorMindHandler( RequestHandler ):
 
   class MindCallbacks( ExecutorDispatcherCallbacks ):
 
-    def __init__( self, sendTaskCB, dispatchCB, disconnectCB, taskProcCB, taskFreezeCB, taskErrCB ):
+    def __init__( self, sendTaskCB, dispatchCB, disconnectCB, taskProcCB, taskFreezeCB, taskErrCB,
+                  sendTasksCB, taskLaneCB ):
       self.__sendTaskCB = sendTaskCB
+      self.__sendTasksCB = sendTasksCB
+      self.__taskLaneCB = taskLaneCB
       self.__dispatchCB = dispatchCB
       self.__disconnectCB = disconnectCB
       self.__taskProcDB = taskProcCB
@@ -43,6 +49,12 @@ class ExecutorMindHandler( RequestHandler ):
     def cbSendTask( self, taskId, taskObj, eId, eType ):
       return self.__sendTaskCB( taskId, taskObj, eId, eType )
 
+    def cbSendTasks( self, taskIds, taskObjs, eId, eType ):
+      return self.__sendTasksCB( taskIds, taskObjs, eId, eType )
+
+    def cbTaskLane( self, taskId, taskObj ):
+      return self.__taskLaneCB( taskId, taskObj )
+
     def cbDispatch( self, taskId, taskObj, pathExecuted ):
       return self.__dispatchCB( taskId, taskObj, pathExecuted )
 
@@ -71,7 +83,9 @@ class ExecutorMindHandler( RequestHandler ):
                                                          cls.__execDisconnected,
                                                          cls.exec_taskProcessed,
                                                          cls.exec_taskFreeze,
-                                                         cls.exec_taskError )
+                                                         cls.exec_taskError,
+                                                         cls.__sendTasks,
+                                                         cls.exec_taskLane )
     cls.__eDispatch.setCallbacks( cls.__callbacks )
     cls.__allowedClients = []
     if cls.log.shown( "VERBOSE" ):
@@ -86,7 +100,7 @@ class ExecutorMindHandler( RequestHandler ):
     cls.__allowedClients = aClients
 
   @classmethod
-  def __sendTask( self, taskId, taskObj, eId, eType ):
+  def __prepareTask( self, taskId, taskObj, eId ):
     try:
       result = self.exec_prepareToSend( taskId, taskObj, eId )
       if not result[ 'OK' ]:
@@ -101,6 +115,11 @@ class ExecutorMindHandler( RequestHandler ):
       return S_ERROR( "Cannot serialize task %s: %s" % ( taskId, str( excp ) ) )
     if not isReturnStructure( result ):
       raise Exception( "exec_serializeTask does not return a return structure" )
+    return result
+
+  @classmethod
+  def __sendTask( self, taskId, taskObj, eId, eType ):
+    result = self.__prepareTask( taskId, taskObj, eId )
     if not result[ 'OK' ]:
       return result
     taskStub = result[ 'Value' ]
@@ -113,6 +132,32 @@ class ExecutorMindHandler( RequestHandler ):
     msgObj.eType = eType
     return self.srv_msgSend( eId, msgObj )
 
+  @classmethod
+  def __sendTasks( self, taskIds, taskObjs, eId, eType ):
+    failed = {}
+    sendIds = []
+    taskStubs = []
+    for taskId, taskObj in zip( taskIds, taskObjs ):
+      result = self.__prepareTask( taskId, taskObj, eId )
+      if not result[ 'OK' ]:
+        failed[ taskId ] = result[ 'Message' ]
+        continue
+      sendIds.append( taskId )
+      taskStubs.append( result[ 'Value' ] )
+    if not sendIds:
+      return S_OK( failed )
+    result = self.srv_msgCreate( "ProcessTasks" )
+    if not result[ 'OK' ]:
+      return result
+    msgObj = result[ 'Value' ]
+    msgObj.taskIds = sendIds
+    msgObj.taskStubs = taskStubs
+    msgObj.eType = eType
+    result = self.srv_msgSend( eId, msgObj )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( failed )
+
   @classmethod
   def __execDisconnected( cls, trid ):
     result = cls.srv_disconnectClient( trid )
@@ -138,7 +183,12 @@ class ExecutorMindHandler( RequestHandler ):
       numTasks = max( 1, int( kwargs[ 'maxTasks' ] ) )
     except:
       numTasks = 1
-    self.__eDispatch.addExecutor( trid, kwargs[ 'executorTypes' ] )
+    #Executors not knowing about batches get their tasks one by one
+    try:
+      batchSize = max( 1, int( kwargs[ 'taskBatchSize' ] ) )
+    except:
+      batchSize = 1
+    self.__eDispatch.addExecutor( trid, kwargs[ 'executorTypes' ], numTasks, batchSize )
     return self.exec_executorConnected( trid, kwargs[ 'executorTypes' ] )
 
   auth_conn_drop = [ 'all' ]
@@ -237,6 +287,11 @@ class ExecutorMindHandler( RequestHandler ):
     #If a task needs to go to an executor that has not connected. Forget the task?
     cls.__eDispatch.setFreezeOnUnknownExecutor( value )
 
+  @classmethod
+  def setLaneWeights( cls, laneWeights ):
+    #Share of the executors for the tasks of each lane given by exec_taskLane
+    cls.__eDispatch.setLaneWeights( laneWeights )
+
   #######
   # Methods that can be overwritten
   #######
@@ -253,6 +308,11 @@ class ExecutorMindHandler( RequestHandler ):
   def exec_prepareToSend( cls, taskId, taskObj, eId ):
     return S_OK()
 
+  @classmethod
+  def exec_taskLane( cls, taskId, taskObj ):
+    #Lane of the waiting queues for the task, all in the same one by default
+    return S_OK( False )
+
   ########
   #  Methods to be used by the real services
   ########
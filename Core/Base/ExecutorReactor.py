@@ -64,6 +64,7 @@ class ExecutorReactor( object ):
       self.__mindName = mindName
       self.__modules = {}
       self.__maxTasks = 1
+      self.__taskBatchSize = 1
       self.__reconnectSleep = 1
       self.__reconnectRetries = 10
       self.__extraArgs = {}
@@ -77,6 +78,9 @@ class ExecutorReactor( object ):
     def addModule( self, name, exeClass ):
       self.__modules[ name ] = exeClass
       self.__maxTasks = max( self.__maxTasks, exeClass.ex_getOption( "MaxTasks" ) )
+      self.__taskBatchSize = max( self.__taskBatchSize, exeClass.ex_getOption( "TaskBatchSize" ) )
+      #A batch takes as many task slots as tasks it holds
+      self.__maxTasks = max( self.__maxTasks, self.__taskBatchSize )
       self.__reconnectSleep = max( self.__reconnectSleep, exeClass.ex_getOption( "ReconnectSleep" ) )
       self.__reconnectRetries = max( self.__reconnectRetries, exeClass.ex_getOption( "ReconnectRetries" ) )
       self.__extraArgs[ name ] = exeClass.ex_getExtraArguments()
@@ -84,9 +88,11 @@ class ExecutorReactor( object ):
     def connect( self ):
       self.__msgClient = MessageClient( self.__mindName )
       self.__msgClient.subscribeToMessage( 'ProcessTask', self.__processTask )
+      self.__msgClient.subscribeToMessage( 'ProcessTasks', self.__processTasks )
       self.__msgClient.subscribeToDisconnect( self.__disconnected )
       result = self.__msgClient.connect( executorTypes = list( self.__modules.keys() ),
                                          maxTasks = self.__maxTasks,
+                                         taskBatchSize = self.__taskBatchSize,
                                          extraArgs = self.__extraArgs )
       if result[ 'OK' ]:
         self.__aliveLock.alive()
@@ -99,6 +105,7 @@ class ExecutorReactor( object ):
         gLogger.notice( "Trying to reconnect to %s" % self.__mindName )
         result = self.__msgClient.connect( executorTypes = list( self.__modules.keys() ),
                                            maxTasks = self.__maxTasks,
+                                           taskBatchSize = self.__taskBatchSize,
                                            extraArgs = self.__extraArgs )
 
         if result[ 'OK' ]:
@@ -149,10 +156,21 @@ class ExecutorReactor( object ):
       return self.__msgClient.sendMessage( msgObj )
 
     def __processTask( self, msgObj ):
-      eType = msgObj.eType
-      taskId = msgObj.taskId
-      taskStub = msgObj.taskStub
+      return self.__processOneTask( msgObj.eType, msgObj.taskId, msgObj.taskStub )
 
+    def __processTasks( self, msgObj ):
+      eType = msgObj.eType
+      #Tasks come in bundles but each one is answered on its own as soon as it is processed
+      errors = []
+      for taskId, taskStub in zip( msgObj.taskIds, msgObj.taskStubs ):
+        result = self.__processOneTask( eType, taskId, taskStub )
+        if not result[ 'OK' ]:
+          errors.append( "%s: %s" % ( taskId, result[ 'Message' ] ) )
+      if errors:
+        return S_ERROR( "Could not process tasks: %s" % "; ".join( errors ) )
+      return S_OK()
+
+    def __processOneTask( self, eType, taskId, taskStub ):
       result = self.__moduleProcess( eType, taskId, taskStub )
       if not result[ 'OK' ]:
         return self.__sendExecutorError( eType, taskId, result[ 'Message' ] )
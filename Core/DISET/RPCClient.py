@@ -20,6 +20,46 @@ class _MagicMethod( object ):
   def __str__( self ):
     return "<RPCClient method %s>" % self.__remoteFuncName
 
+class RPCBatch( object ):
+  """ Collect RPC calls to send them to the service in a single request:
+
+      with rpcClient.batch() as batch:
+        for jobID in jobIDs:
+          batch.setJobStatus( jobID, 'Done', '', 'JobWrapper' )
+      result = batch.result
+
+      Calls made on the batch return None, batch.result is S_OK( list of the results of
+      the calls ) once the block is left. execute() can also be called explicitly.
+  """
+
+  def __init__( self, innerRPCClient ):
+    self.__innerRPCClient = innerRPCClient
+    self.__calls = []
+    self.result = None
+
+  def __queueCall( self, sFunctionName, args ):
+    self.__calls.append( ( sFunctionName, args ) )
+
+  def execute( self ):
+    """
+    Send the queued calls
+    """
+    calls = self.__calls
+    self.__calls = []
+    self.result = self.__innerRPCClient.executeBatch( calls )
+    return self.result
+
+  def __enter__( self ):
+    return self
+
+  def __exit__( self, excType, excValue, traceback ):
+    if excType is None:
+      self.execute()
+    return False
+
+  def __getattr__( self, attrName ):
+    return _MagicMethod( self.__queueCall, attrName )
+
 class RPCClient( object ):
 
   def __init__( self, *args, **kwargs ):
@@ -35,6 +75,12 @@ class RPCClient( object ):
     retVal = self.__innerRPCClient.executeRPC( sFunctionName, args )
     return retVal
 
+  def batch( self ):
+    """
+    Get an object to queue calls to the service and execute them in a single request
+    """
+    return RPCBatch( self.__innerRPCClient )
+
   def __getattr__( self, attrName ):
     """
     Function for emulating the existance of functions
@@ -119,6 +119,8 @@ class RequestHandler( object ):
     try:
       if actionType == "RPC":
         retVal = self.__doRPC( actionTuple[1] )
+      elif actionType == "Batch":
+        retVal = self.__doBatch( actionTuple[1] )
       elif actionType == "FileTransfer":
         retVal = self.__doFileTransfer( actionTuple[1] )
       elif actionType == "Connection":
@@ -237,6 +239,40 @@ class RequestHandler( object ):
     self.__logRemoteQuery( "RPC/%s" % method, args )
     return self.__RPCCallFunction( method, args )
 
+  def __doBatch( self, methods ):
+    """
+    Execute in order a list of RPC calls received in a single message
+
+    :type methods: string
+    :param methods: Comma separated methods authorized for the batch
+    :return: S_OK with the list of S_OK/S_ERROR results of the calls
+    """
+    retVal = self.__trPool.receive( self.__trid )
+    if not retVal[ 'OK' ]:
+      raise RequestHandler.ConnectionError( "Error while receiving batch %s %s" % ( self.srv_getFormattedRemoteCredentials(),
+                                                                                    retVal[ 'Message' ] ) )
+    calls = retVal[ 'Value' ]
+    if type( calls ) not in ( types.ListType, types.TupleType ):
+      return S_ERROR( "Batch must be a list of ( method, args ) calls" )
+    authorizedMethods = methods.split( "," )
+    results = []
+    for call in calls:
+      if type( call ) not in ( types.ListType, types.TupleType ) or len( call ) != 2 or \
+         type( call[1] ) not in ( types.ListType, types.TupleType ):
+        results.append( S_ERROR( "Invalid batch call %s" % str( call )[:100] ) )
+        continue
+      method, args = call
+      if method not in authorizedMethods:
+        results.append( S_ERROR( "Method %s was not proposed for the batch" % method ) )
+        continue
+      self.serviceInfoDict[ 'actionTuple' ] = ( 'RPC', method )
+      self.__logRemoteQuery( "RPC/%s" % method, args )
+      result = self.__RPCCallFunction( method, args )
+      if not isReturnStructure( result ):
+        result = S_ERROR( "Method %s for action RPC does not return a S_OK/S_ERROR!" % method )
+      results.append( result )
+    return S_OK( results )
+
   def __RPCCallFunction( self, method, args ):
     realMethod = "export_%s" % method
     gLogger.debug( "RPC to %s" % realMethod )
@@ -15,9 +15,13 @@
 
 """
 
+import os
+import fcntl
 import select
+import signal
 import time
 import socket
+import threading
 
 try:
   import multiprocessing
@@ -29,8 +33,10 @@ from DIRAC.Core.DISET.private.Service import Service
 from DIRAC.Core.DISET.private.GatewayService import GatewayService
 from DIRAC.Core.DISET.RequestHandler import RequestHandler
 from DIRAC.Core.Utilities import Time
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.Core.Base.private.ModuleLoader import ModuleLoader
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
+from DIRAC.Core.DISET.private.Poller import Poller
 from DIRAC.ConfigurationSystem.Client.Helpers import Registry
 from DIRAC.ConfigurationSystem.Client import PathFinder
 
@@ -39,6 +45,14 @@ class ServiceReactor( object ):
   __transportExtraKeywords = { 'SSLSessionTimeout' : False, 
                                'IgnoreCRLs': False, 
                                'PacketTimeout': 'timeout' }
+  #Seconds a new connection has in event mode to complete the handshake and send its proposal
+  __proposalTimeout = 60
+  #Seconds between the reports of a worker process to its supervisor
+  __workerReportPeriod = 10
+  #Minimum seconds between two starts of the same worker process
+  __workerRespawnDelay = 10
+  #Seconds a stopping worker process has to finish the queries being served
+  __workerStopGracePeriod = 30
 
   def __init__( self ):
     self.__services = {}
@@ -50,6 +64,23 @@ class ServiceReactor( object ):
     self.__maxFD = 0
     self.__listeningConnections = {}
     self.__stats = ReactorStats()
+    #Event mode: connections handed back by the services and not yet in the poller
+    self.__pendingConnections = []
+    self.__pendingLock = threading.Lock()
+    self.__wakeUpPipe = None
+    self.__poller = None
+    self.__listeners = {}
+    self.__connections = {}
+    #Connections with data left in their buffers after a bounded read, the poller
+    #will not report them again
+    self.__readAgain = set()
+    self.__eventServices = []
+    #Pre-fork mode: services served by worker processes and the workers of each of them
+    self.__workerServices = []
+    self.__workers = {}
+    self.__workerListeners = {}
+    self.__lastLoop = time.time()
+    self.__lastSupervision = 0
 
   def initialize( self, servicesList ):
     try:
@@ -69,6 +100,15 @@ class ServiceReactor( object ):
 
     #Loop again to include the GW in case there is one (included in the __init__)
     for serviceName in self.__services:
+      if serviceName != GatewayService.GATEWAY_NAME and multiprocessing and \
+         self.__services[ serviceName ].getConfig().getCloneProcesses() > 1:
+        #The handler is initialized in each worker process after the fork
+        gLogger.info( "Initializing monitoring of %s" % serviceName )
+        self.__workerServices.append( serviceName )
+        result = self.__services[ serviceName ].initializeMonitoring()
+        if not result[ 'OK' ]:
+          return result
+        continue
       gLogger.info( "Initializing %s" % serviceName )
       result = self.__services[ serviceName ].initialize()
       if not result[ 'OK' ]:
@@ -123,23 +163,177 @@ class ServiceReactor( object ):
       return result
     for svcName in self.__listeningConnections:
       gLogger.always( "Listening at %s" % self.__services[ svcName ].getConfig().getURL() )
-    #Multiple clones not yet working. Disabled by default
-    if False and multiprocessing:
-      for svcName in self.__listeningConnections:
-        clones = self.__services[ svcName ].getConfig().getCloneProcesses()
-        for i in range( 1, clones ):
-          p = multiprocessing.Process( target = self.__startCloneProcess, args = ( svcName, i ) )
-          p.start()
-          gLogger.always( "Started clone process %s for %s" % ( i, svcName ) )
+    if self.__workerServices:
+      #Set before the fork, so that the workers also stop cleanly
+      for sigNum in ( signal.SIGTERM, signal.SIGINT ):
+        signal.signal( sigNum, self.__stopServing )
+      for svcName in self.__workerServices:
+        self.__workers[ svcName ] = {}
+        for workerId in range( 1, self.__services[ svcName ].getConfig().getCloneProcesses() + 1 ):
+          result = self.__startWorker( svcName, workerId )
+          if not result[ 'OK' ]:
+            self.__stopWorkers()
+            self.__closeListeningConnections()
+            return result
+      #The workers accept the connections of their services. Their listeners are kept open for the respawns
+      for svcName in self.__workerServices:
+        self.__workerListeners[ svcName ] = self.__listeningConnections.pop( svcName )
+    self.__serveListeners()
+    if self.__workerServices:
+      self.__stopWorkers()
+      self.__listeningConnections.update( self.__workerListeners )
+      self.__closeListeningConnections()
+    return S_OK()
+
+  def __serveListeners( self ):
+    eventServices = [ svcName for svcName in self.__listeningConnections if self.__services[ svcName ].getConfig().useEventReactor() ]
+    if eventServices:
+      gLogger.always( "Event reactor handles the connections of %s" % ", ".join( eventServices ) )
+      self.__serveEvents( eventServices )
     while self.__alive:
       self.__acceptIncomingConnection()
 
+  def __stopServing( self, signum, frame ):
+    self.__alive = False
+
+  def __tick( self ):
+    """ Called at each iteration of the serving loops. Supervises the workers at most once per second
+    """
+    now = time.time()
+    self.__lastLoop = now
+    if self.__workers and now - self.__lastSupervision > 1:
+      self.__lastSupervision = now
+      self.__superviseWorkers()
+
+  #Pre-fork mode
+
+  def __startWorker( self, svcName, workerId ):
+    reader, writer = multiprocessing.Pipe( False )
+    try:
+      process = multiprocessing.Process( target = self.__runWorker, args = ( svcName, workerId, reader, writer ) )
+      process.start()
+    except Exception as e:
+      return S_ERROR( "Cannot start worker process %s for %s: %s" % ( workerId, svcName, str( e ) ) )
+    #The worker process exits when __runWorker returns, only the supervisor gets here
+    writer.close()
+    self.__workers[ svcName ][ workerId ] = { 'process' : process,
+                                              'pipe' : reader,
+                                              'started' : time.time(),
+                                              'lastLoop' : time.time() }
+    gLogger.always( "Started worker process %s for %s" % ( workerId, svcName ) )
+    return S_OK()
+
   #This function runs in a different process
-  def __startCloneProcess( self, svcName, i ):
-    self.__services[ svcName ].setCloneProcessId( i )
-    self.__alive = i
+  def __runWorker( self, svcName, workerId, reader, writer ):
+    reader.close()
+    self.__workers = {}
+    gThreadScheduler.afterFork()
+    #Serve only the connections of this service. The other listening sockets are just released,
+    #shutting them down would also stop them in the processes sharing them
+    listeners = dict( self.__workerListeners )
+    listeners.update( self.__listeningConnections )
+    self.__listeningConnections = { svcName : listeners.pop( svcName ) }
+    self.__workerListeners = {}
+    for lc in listeners.values():
+      if lc.get( 'socket' ):
+        self.__getOSSocket( lc[ 'socket' ] ).close()
+    #All the workers wake up for a new connection but only one gets it, the others must not block in accept
+    self.__getOSSocket( self.__listeningConnections[ svcName ][ 'socket' ] ).setblocking( 0 )
+    service = self.__services[ svcName ]
+    service.setCloneProcessId( workerId )
+    result = service.initialize()
+    if not result[ 'OK' ]:
+      gLogger.fatal( "Cannot initialize worker process %s for %s" % ( workerId, svcName ), result[ 'Message' ] )
+      return
+    reporter = threading.Thread( target = self.__reportToSupervisor, args = ( service, writer ) )
+    reporter.setDaemon( True )
+    reporter.start()
+    self.__serveListeners()
+    gLogger.always( "Worker process %s for %s is stopping" % ( workerId, svcName ) )
+    self.__getOSSocket( self.__listeningConnections[ svcName ][ 'socket' ] ).close()
+    limit = time.time() + self.__workerStopGracePeriod
+    while service.isProcessing() and time.time() < limit:
+      time.sleep( 0.1 )
+    reporter.join( self.__workerReportPeriod + 1 )
+    self.__sendReport( service, writer )
+
+  def __getOSSocket( self, listeningSocket ):
+    #SSL listening sockets wrap the OS one
+    if hasattr( listeningSocket, "get_socket" ):
+      return listeningSocket.get_socket()
+    return listeningSocket
+
+  def __reportToSupervisor( self, service, writer ):
     while self.__alive:
-      self.__acceptIncomingConnection( svcName )
+      time.sleep( self.__workerReportPeriod )
+      if not self.__sendReport( service, writer ):
+        #The supervisor is gone
+        self.__alive = False
+
+  def __sendReport( self, service, writer ):
+    definitions, marks = service.getMonitor().exportData()
+    try:
+      writer.send( ( self.__lastLoop, definitions, marks ) )
+    except ( IOError, OSError, EOFError ):
+      return False
+    return True
+
+  def __superviseWorkers( self ):
+    now = time.time()
+    for svcName in self.__workers:
+      monitor = self.__services[ svcName ].getMonitor()
+      timeout = self.__services[ svcName ].getConfig().getWorkerHeartbeatTimeout()
+      for workerId in self.__workers[ svcName ]:
+        worker = self.__workers[ svcName ][ workerId ]
+        try:
+          while worker[ 'pipe' ].poll():
+            worker[ 'lastLoop' ], definitions, marks = worker[ 'pipe' ].recv()
+            #The mean activities of the workers are added up, not averaged
+            monitor.importData( definitions, marks, sourceId = workerId )
+        except ( IOError, OSError, EOFError ):
+          pass
+        if worker[ 'process' ].is_alive():
+          if now - max( worker[ 'lastLoop' ], worker[ 'started' ] ) < timeout:
+            continue
+          gLogger.error( "Worker process %s for %s is not responding" % ( workerId, svcName ),
+                         "killing pid %s" % worker[ 'process' ].pid )
+          self.__killWorker( worker )
+        if not self.__alive or now - worker[ 'started' ] < self.__workerRespawnDelay:
+          continue
+        gLogger.error( "Worker process %s for %s has exited" % ( workerId, svcName ),
+                       "exit code %s, starting it again" % worker[ 'process' ].exitcode )
+        worker[ 'pipe' ].close()
+        result = self.__startWorker( svcName, workerId )
+        if not result[ 'OK' ]:
+          gLogger.error( result[ 'Message' ] )
+
+  def __killWorker( self, worker ):
+    try:
+      os.kill( worker[ 'process' ].pid, signal.SIGKILL )
+    except OSError:
+      pass
+    worker[ 'process' ].join( 1 )
+
+  def __stopWorkers( self ):
+    gLogger.always( "Stopping worker processes..." )
+    workers = []
+    for svcName in self.__workers:
+      for workerId in self.__workers[ svcName ]:
+        worker = self.__workers[ svcName ][ workerId ]
+        workers.append( worker )
+        if worker[ 'process' ].is_alive():
+          worker[ 'process' ].terminate()
+    limit = time.time() + self.__workerStopGracePeriod + 5
+    for worker in workers:
+      worker[ 'process' ].join( max( 0, limit - time.time() ) )
+      if worker[ 'process' ].is_alive():
+        self.__killWorker( worker )
+    #Report the last marks of the workers
+    self.__superviseWorkers()
+    for svcName in self.__workers:
+      self.__services[ svcName ].getMonitor().flush( allData = True )
+    self.__workers = {}
+    gLogger.always( "Worker processes stopped" )
 
   def __getListeningSocketsList( self, svcName = False ):
     if svcName:
@@ -153,8 +347,9 @@ class ServiceReactor( object ):
   def __acceptIncomingConnection( self, svcName = False ):
     sockets = self.__getListeningSocketsList( svcName )
     while self.__alive:
+      self.__tick()
       try:
-        inList, _outList, _exList = select.select( sockets, [], [], 10 )
+        inList, _outList, _exList = select.select( sockets, [], [], 1 if self.__workers else 10 )
         if len( inList ) == 0:
           return
         for inSocket in inList:
@@ -167,6 +362,10 @@ class ServiceReactor( object ):
               clientTransport = retVal[ 'Value' ]
       except socket.error:
         return
+      except Exception as e:
+        #The GSI/SSL errors of the accept, also raised in the workers that lose the race for a connection
+        gLogger.verbose( "Could not accept a connection", repr( e ) )
+        return
       self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
       #Is it banned?
       clientIP = clientTransport.getRemoteAddress()[0]
@@ -190,6 +389,206 @@ class ServiceReactor( object ):
         sockets = self.__getListeningSocketsList()
 
 
+  #Event mode
+
+  def __serveEvents( self, eventServices ):
+    """ Multiplex the listening sockets and the connections of the event driven services.
+        Handshakes and proposals are received here without blocking, the service threads
+        only get connections with a complete proposal waiting in their buffer
+    """
+    self.__poller = Poller()
+    self.__eventServices = eventServices
+    #fd -> { 'transport', 'service', 'trid' (only for reused connections), 'handshaking', 'deadline' }
+    self.__connections = {}
+    self.__wakeUpPipe = os.pipe()
+    fcntl.fcntl( self.__wakeUpPipe[0], fcntl.F_SETFL, os.O_NONBLOCK )
+    self.__poller.register( self.__wakeUpPipe[0], Poller.READ )
+    self.__registerListeners()
+    for svcName in eventServices:
+      self.__services[ svcName ].setIdleConnectionHandler( self.__queueIdleConnection )
+    lastCheck = time.time()
+    while self.__alive:
+      self.__tick()
+      accepted = False
+      if self.__readAgain:
+        events = self.__poller.poll( 0 )
+        readyFDs = set( [ fd for fd, _events in events ] )
+        events.extend( [ ( fd, Poller.READ ) for fd in self.__readAgain if fd not in readyFDs ] )
+        self.__readAgain = set()
+      else:
+        events = self.__poller.poll( 1 )
+      for fd, _events in events:
+        #Whatever happens with one connection, the others have to be served
+        try:
+          if fd == self.__wakeUpPipe[0]:
+            self.__adoptPendingConnections()
+          elif fd in self.__listeners:
+            accepted = self.__acceptEventConnection( self.__listeners[ fd ] ) or accepted
+          elif fd in self.__connections:
+            self.__processConnectionEvent( fd )
+        except Exception:
+          gLogger.exception( "Error while serving event", "for descriptor %s" % fd )
+          if fd in self.__connections:
+            try:
+              self.__dropConnection( fd )
+            except Exception:
+              gLogger.exception( "Error while dropping connection", "for descriptor %s" % fd )
+      now = time.time()
+      if now - lastCheck > 1:
+        lastCheck = now
+        self.__expireConnections( now )
+      if accepted and self.__renewContexts():
+        self.__registerListeners()
+
+  def __registerListeners( self ):
+    for fd in self.__listeners:
+      self.__poller.unregister( fd )
+    self.__listeners = {}
+    for svcName in self.__listeningConnections:
+      fd = self.__listeningConnections[ svcName ][ 'socket' ].fileno()
+      self.__listeners[ fd ] = svcName
+      self.__poller.register( fd, Poller.READ )
+
+  def __renewContexts( self ):
+    now = time.time()
+    renewed = False
+    for svcName in self.__listeningConnections:
+      tr = self.__listeningConnections[ svcName ][ 'transport' ]
+      if now - tr.latestServerRenewTime() > self.__services[ svcName ].getConfig().getContextLifeTime():
+        result = tr.renewServerContext()
+        if result[ 'OK' ]:
+          self.__listeningConnections[ svcName ][ 'socket' ] = tr.getSocket()
+          renewed = True
+    return renewed
+
+  def __acceptEventConnection( self, svcName ):
+    try:
+      retVal = self.__listeningConnections[ svcName ][ 'transport' ].acceptConnection()
+    except socket.error as e:
+      gLogger.warn( "Error while accepting a connection: ", str( e ) )
+      return False
+    if not retVal[ 'OK' ]:
+      gLogger.warn( "Error while accepting a connection: ", retVal[ 'Message' ] )
+      return False
+    clientTransport = retVal[ 'Value' ]
+    self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
+    clientIP = clientTransport.getRemoteAddress()[0]
+    if clientIP in Registry.getBannedIPs():
+      gLogger.warn( "Client connected from banned ip %s" % clientIP )
+      clientTransport.close()
+      return True
+    self.__stats.connectionStablished()
+    if svcName not in self.__eventServices:
+      self.__services[ svcName ].handleConnection( clientTransport )
+      return True
+    clientTransport.setBlocking( False )
+    fd = clientTransport.oSocket.fileno()
+    self.__connections[ fd ] = { 'transport' : clientTransport,
+                                 'service' : self.__services[ svcName ],
+                                 'trid' : None,
+                                 'handshaking' : True,
+                                 'deadline' : time.time() + self.__proposalTimeout }
+    self.__poller.register( fd, Poller.READ )
+    #The client has already sent its hello most of the times
+    self.__processConnectionEvent( fd )
+    return True
+
+  def __queueIdleConnection( self, service, trid, clientTransport ):
+    """ Called from the service threads for connections waiting for the next proposal
+    """
+    self.__pendingLock.acquire()
+    try:
+      self.__pendingConnections.append( ( service, trid, clientTransport ) )
+    finally:
+      self.__pendingLock.release()
+    try:
+      os.write( self.__wakeUpPipe[1], "w" )
+    except OSError:
+      pass
+
+  def __adoptPendingConnections( self ):
+    try:
+      while os.read( self.__wakeUpPipe[0], 4096 ):
+        pass
+    except OSError:
+      pass
+    self.__pendingLock.acquire()
+    try:
+      pending = self.__pendingConnections
+      self.__pendingConnections = []
+    finally:
+      self.__pendingLock.release()
+    for service, trid, clientTransport in pending:
+      if not clientTransport:
+        service.closeIdleConnection( trid )
+        continue
+      try:
+        clientTransport.setBlocking( False )
+        fd = clientTransport.oSocket.fileno()
+      except Exception:
+        service.closeIdleConnection( trid )
+        continue
+      self.__connections[ fd ] = { 'transport' : clientTransport,
+                                   'service' : service,
+                                   'trid' : trid,
+                                   'handshaking' : False,
+                                   'deadline' : time.time() + service.getConfig().getConnectionIdleTimeout() }
+      self.__poller.register( fd, Poller.READ )
+      #The client may have pipelined the proposal before the connection got here
+      if clientTransport.byteStream:
+        self.__processConnectionEvent( fd )
+
+  def __processConnectionEvent( self, fd ):
+    conn = self.__connections[ fd ]
+    clientTransport = conn[ 'transport' ]
+    if conn[ 'handshaking' ]:
+      result = clientTransport.serverHandshakeStep()
+      if not result[ 'OK' ]:
+        self.__dropConnection( fd )
+        return
+      if result[ 'Value' ]:
+        if result[ 'Value' ] == 'write':
+          self.__poller.register( fd, Poller.WRITE )
+        else:
+          self.__poller.register( fd, Poller.READ )
+        return
+      conn[ 'handshaking' ] = False
+      self.__poller.register( fd, Poller.READ )
+    #Proposals are limited to 1024 bytes, as in Service._receiveAndCheckProposal
+    result = clientTransport.receiveAvailable( 1024 )
+    if not result[ 'OK' ]:
+      if not conn[ 'trid' ]:
+        gLogger.verbose( "Invalid connection", "%s: %s" % ( clientTransport.getRemoteAddress(), result[ 'Message' ] ) )
+      self.__dropConnection( fd )
+      return
+    if not result[ 'Value' ]:
+      if clientTransport.hasPendingData():
+        self.__readAgain.add( fd )
+      return
+    #The proposal is here, let a service thread do the rest
+    self.__poller.unregister( fd )
+    del self.__connections[ fd ]
+    clientTransport.setBlocking( True )
+    if conn[ 'trid' ]:
+      conn[ 'service' ].handleReusedConnection( conn[ 'trid' ] )
+    else:
+      conn[ 'service' ].handleConnection( clientTransport, handshaken = True )
+
+  def __dropConnection( self, fd ):
+    conn = self.__connections.pop( fd )
+    self.__poller.unregister( fd )
+    if conn[ 'trid' ]:
+      conn[ 'service' ].closeIdleConnection( conn[ 'trid' ] )
+    else:
+      try:
+        conn[ 'transport' ].close()
+      except Exception:
+        pass
+
+  def __expireConnections( self, now ):
+    for fd in [ fd for fd in self.__connections if self.__connections[ fd ][ 'deadline' ] < now ]:
+      self.__dropConnection( fd )
+
   def __closeListeningConnections( self ):
     for svcName in self.__listeningConnections:
       lc = self.__listeningConnections[ svcName ]
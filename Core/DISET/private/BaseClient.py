@@ -1,8 +1,10 @@
 __RCSID__ = "$Id$"
 
+import os
 import time
 import types
 import thread
+from hashlib import md5
 import DIRAC
 from DIRAC.Core.DISET.private.Protocols import gProtocolDict
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
@@ -12,7 +14,9 @@ from DIRAC.ConfigurationSystem.Client.Config import gConfig
 from DIRAC.ConfigurationSystem.Client.PathFinder import getServiceURL
 from DIRAC.Core.Security import CS
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
+from DIRAC.Core.DISET.private.ConnectionPool import getGlobalConnectionPool
 from DIRAC.Core.DISET.ThreadConfig import ThreadConfig
+from DIRAC.Core.DISET.private import Compression
 
 class BaseClient:
 
@@ -31,6 +35,8 @@ class BaseClient:
   KW_PROXY_CHAIN = "proxyChain"
   KW_SKIP_CA_CHECK = "skipCACheck"
   KW_KEEP_ALIVE_LAPSE = "keepAliveLapse"
+  KW_COMPRESSION = "compression"
+  KW_REUSE_CONNECTION = "reuseConnection"
 
   __threadConfig = ThreadConfig()
 
@@ -283,13 +289,24 @@ and this is thread %s
       #raise Exception( msgTxt )
 
 
-  def _connect( self ):
+  def _connect( self, reuseConnection = False ):
+    """ Connect to the service. If reuseConnection is set an idle connection left by a previous
+        call is taken from the connection pool when possible, the result then has 'reused' set
+    """
 
     self.__discoverExtraCredentials()
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     if self.__enableThreadCheck:
       self.__checkThreadID()
+    if reuseConnection and self.__canReuseConnections():
+      transport = getGlobalConnectionPool().checkout( self.__getConnectionKey() )
+      if transport:
+        gLogger.debug( "Reusing connection to: %s" % self.serviceURL )
+        trid = getGlobalTransportPool().add( transport )
+        result = S_OK( ( trid, transport ) )
+        result[ 'reused' ] = True
+        return result
     gLogger.debug( "Connecting to: %s" % self.serviceURL )
     try:
       transport = gProtocolDict[ self.__URLTuple[0] ][ 'transport' ]( self.__URLTuple[1:3], **self.kwargs )
@@ -324,25 +341,83 @@ and this is thread %s
   def _disconnect( self, trid ):
     getGlobalTransportPool().close( trid )
 
-  def _proposeAction( self, transport, action ):
+  def _releaseConnection( self, trid ):
+    """ Park the connection in the connection pool if the service keeps it open, close it otherwise.
+        Only to be called once the last request sent has been completely answered
+    """
+    transportPool = getGlobalTransportPool()
+    transport = transportPool.get( trid )
+    if transport and transport.getReuseLapse() and self.__canReuseConnections():
+      #Idle connections are not in the transport pool so that no keep alive is sent through them
+      transportPool.remove( trid )
+      if getGlobalConnectionPool().checkin( self.__getConnectionKey(), transport ):
+        return
+      transport.close()
+      return
+    self._disconnect( trid )
+
+  def __canReuseConnections( self ):
+    return self.kwargs.get( self.KW_REUSE_CONNECTION, True )
+
+  def __getConnectionKey( self ):
+    """ Connections can only be shared between clients talking to the same host with the same credentials
+    """
+    credentials = []
+    for kw in ( self.KW_USE_CERTIFICATES, self.KW_PROXY_LOCATION, self.KW_SKIP_CA_CHECK ):
+      credentials.append( self.kwargs.get( kw ) )
+    if self.kwargs.get( self.KW_PROXY_STRING ):
+      credentials.append( md5( self.kwargs[ self.KW_PROXY_STRING ] ).hexdigest() )
+    else:
+      credentials.append( os.environ.get( 'X509_USER_PROXY' ) )
+    return ( "%s://%s:%s" % tuple( self.__URLTuple[:3] ), tuple( credentials ) )
+
+  def _proposeAction( self, transport, action, pipelinedData = None ):
+    """ Send the action proposal and get the answer of the service.
+        pipelinedData is sent right after the proposal without waiting for the answer. It can only
+        be used on connections on which the service already accepted a proposal, since those never
+        get a delegation request in between.
+    """
     if not self.__initStatus[ 'OK' ]:
       return self.__initStatus
     stConnectionInfo = ( ( self.__URLTuple[3], self.setup, self.vo ),
                          action,
-                         self.__extraCredentials )
+                         self.__extraCredentials,
+                         self.__getCapabilities() )
     retVal = transport.sendData( S_OK( stConnectionInfo ) )
     if not retVal[ 'OK' ]:
       return retVal
+    if pipelinedData is not None:
+      retVal = transport.sendData( pipelinedData )
+      if not retVal[ 'OK' ]:
+        return retVal
+    #The service tells again at each proposal whether it keeps the connection afterwards
+    transport.setReuseLapse( 0 )
     serverReturn = transport.receiveData()
     #TODO: Check if delegation is required
     if serverReturn[ 'OK' ] and 'Value' in serverReturn and type( serverReturn[ 'Value' ] ) == types.DictType:
       gLogger.debug( "There is a server requirement" )
       serverRequirements = serverReturn[ 'Value' ]
+      if 'compression' in serverRequirements:
+        gLogger.debug( "Server agreed to compress data with %s" % serverRequirements[ 'compression' ] )
+        transport.setCompression( serverRequirements[ 'compression' ],
+                                  serverRequirements.get( 'compressionThreshold', 0 ) )
+      if 'reuseConnection' in serverRequirements:
+        transport.setReuseLapse( serverRequirements[ 'reuseConnection' ] )
       if 'delegate' in serverRequirements:
         gLogger.debug( "A delegation is requested" )
         serverReturn = self.__delegateCredentials( transport, serverRequirements[ 'delegate' ] )
     return serverReturn
 
+  def __getCapabilities( self ):
+    """ Optional features this client supports, for the service to choose from
+    """
+    capabilities = {}
+    if self.kwargs.get( self.KW_COMPRESSION, True ):
+      capabilities[ 'compression' ] = Compression.getAvailableAlgorithms()
+    if self.__canReuseConnections():
+      capabilities[ 'reuseConnection' ] = True
+    return capabilities
+
   def __delegateCredentials( self, transport, delegationRequest ):
     retVal = gProtocolDict[ self.__URLTuple[0] ][ 'delegation' ]( delegationRequest, self.kwargs )
     if not retVal[ 'OK' ]:
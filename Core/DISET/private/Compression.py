@@ -0,0 +1,85 @@
+""" Compression of the DEncoded body of DISET messages
+
+    Compression is negotiated per connection during the proposal exchange: the client
+    offers the algorithms it knows about, the service picks the first one of its own
+    list that the client also supports. zlib is always available, lz4 only if the lz4
+    python module is installed.
+"""
+
+__RCSID__ = "$Id$"
+
+import zlib
+
+try:
+  from lz4 import block as lz4Block
+except ImportError:
+  lz4Block = None
+
+#Prefix marking a compressed message on the wire, it replaces no prefix before the length
+gMagics = { 'zlib' : 'dcz',
+            'lz4' : 'dc4' }
+
+gDefaultLevel = 6
+
+def getAvailableAlgorithms():
+  """ Algorithms that can be used in this installation, by order of preference
+  """
+  if lz4Block:
+    return [ 'lz4', 'zlib' ]
+  return [ 'zlib' ]
+
+def chooseAlgorithm( offered, allowed ):
+  """ Select the first algorithm allowed by the service which is offered by the client
+      and available here, or None
+  """
+  available = getAvailableAlgorithms()
+  for algorithm in allowed:
+    if algorithm in offered and algorithm in available:
+      return algorithm
+  return None
+
+def getAlgorithmForMagic( magic ):
+  for algorithm in gMagics:
+    if gMagics[ algorithm ] == magic:
+      return algorithm
+  return None
+
+def compress( algorithm, data, level = gDefaultLevel ):
+  if algorithm == 'zlib':
+    return zlib.compress( data, level )
+  if algorithm == 'lz4':
+    return lz4Block.compress( data )
+  raise ValueError( "Unknown compression algorithm %s" % algorithm )
+
+def decompress( algorithm, data ):
+  if algorithm == 'zlib':
+    return zlib.decompress( data )
+  if algorithm == 'lz4':
+    if not lz4Block:
+      raise ValueError( "Received lz4 compressed data but lz4 is not available" )
+    return lz4Block.decompress( data )
+  raise ValueError( "Unknown compression algorithm %s" % algorithm )
+
+class _BufferingDecompressor( object ):
+  """ Decompressor for algorithms that can only work on the whole message
+  """
+
+  def __init__( self, algorithm ):
+    self.__algorithm = algorithm
+    self.__buffer = bytearray()
+
+  def decompress( self, data ):
+    self.__buffer.extend( data )
+    return ""
+
+  def flush( self ):
+    data = decompress( self.__algorithm, str( self.__buffer ) )
+    self.__buffer = bytearray()
+    return data
+
+def getStreamDecompressor( algorithm ):
+  """ Object with decompress( chunk ) and flush() methods to decompress a message piece by piece
+  """
+  if algorithm == 'zlib':
+    return zlib.decompressobj()
+  return _BufferingDecompressor( algorithm )
@@ -0,0 +1,168 @@
+""" Per process pool of idle client connections to DISET services
+
+    After an RPC call the connection is parked here if the service agreed to keep it open, so that
+    the next call to the same service with the same credentials skips the TCP connection and the
+    SSL handshake. Parked connections are taken out of the global TransportPool so that no keep
+    alive is sent on them, and are closed once they have been idle for too long.
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import time
+import select
+import threading
+from DIRAC.ConfigurationSystem.Client.Config import gConfig
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+
+class ConnectionPool( object ):
+
+  #Seconds before the server idle timeout at which a parked connection is not used any more
+  expirationMargin = 5
+
+  def __init__( self, maxIdlePerHost = 4, maxIdleTime = 50 ):
+    self.__maxIdlePerHost = maxIdlePerHost
+    self.__maxIdleTime = maxIdleTime
+    self.__lock = threading.Lock()
+    #( host, credentials ) -> list of ( transport, expiration time ), most recently used last
+    self.__idle = {}
+    self.__pid = os.getpid()
+    self.__stats = { 'hits' : 0, 'misses' : 0, 'parked' : 0, 'evicted' : 0, 'stale' : 0 }
+    self.__evictionTask = None
+
+  def __checkPid( self ):
+    """ Connections inherited from the parent process must not be shared with it
+    """
+    if self.__pid != os.getpid():
+      self.__pid = os.getpid()
+      self.__idle = {}
+
+  def __startEviction( self ):
+    if self.__evictionTask:
+      return
+    result = gThreadScheduler.addPeriodicTask( 30, self.evictIdle )
+    if result[ 'OK' ]:
+      self.__evictionTask = result[ 'Value' ]
+
+  def checkout( self, key ):
+    """ Get an idle connection for key, or None if there is none usable
+    """
+    toClose = []
+    transport = None
+    self.__lock.acquire()
+    try:
+      self.__checkPid()
+      idleList = self.__idle.get( key, [] )
+      now = time.time()
+      while idleList:
+        candidate, expiration = idleList.pop()
+        if expiration < now:
+          self.__stats[ 'evicted' ] += 1
+          toClose.append( candidate )
+        elif not self.__isAlive( candidate ):
+          self.__stats[ 'stale' ] += 1
+          toClose.append( candidate )
+        else:
+          transport = candidate
+          break
+      if not idleList and key in self.__idle:
+        del self.__idle[ key ]
+      if transport:
+        self.__stats[ 'hits' ] += 1
+      else:
+        self.__stats[ 'misses' ] += 1
+    finally:
+      self.__lock.release()
+    self.__close( toClose )
+    return transport
+
+  def checkin( self, key, transport ):
+    """ Park a connection whose last request has been fully answered.
+        Returns False if it could not be kept, the caller then has to close it
+    """
+    idleTime = min( self.__maxIdleTime, transport.getReuseLapse() - self.expirationMargin )
+    if idleTime <= 0:
+      return False
+    self.__lock.acquire()
+    try:
+      self.__checkPid()
+      numIdle = sum( [ len( self.__idle[ idleKey ] ) for idleKey in self.__idle if idleKey[0] == key[0] ] )
+      if numIdle >= self.__maxIdlePerHost:
+        return False
+      self.__idle.setdefault( key, [] ).append( ( transport, time.time() + idleTime ) )
+      self.__stats[ 'parked' ] += 1
+    finally:
+      self.__lock.release()
+    self.__startEviction()
+    return True
+
+  def __isAlive( self, transport ):
+    """ An idle connection must have nothing to read, otherwise the server closed it
+    """
+    try:
+      inList, _outList, _exList = select.select( [ transport.getSocket() ], [], [], 0 )
+    except Exception:
+      return False
+    return not inList
+
+  def __close( self, transports ):
+    for transport in transports:
+      try:
+        transport.close()
+      except Exception:
+        pass
+
+  def evictIdle( self ):
+    """ Close the connections that have been idle for too long
+    """
+    toClose = []
+    self.__lock.acquire()
+    try:
+      self.__checkPid()
+      now = time.time()
+      for key in list( self.__idle ):
+        idleList = [ idle for idle in self.__idle[ key ] if idle[1] >= now ]
+        toClose.extend( [ idle[0] for idle in self.__idle[ key ] if idle[1] < now ] )
+        if idleList:
+          self.__idle[ key ] = idleList
+        else:
+          del self.__idle[ key ]
+      self.__stats[ 'evicted' ] += len( toClose )
+    finally:
+      self.__lock.release()
+    self.__close( toClose )
+
+  def closeAll( self ):
+    self.__lock.acquire()
+    try:
+      toClose = [ idle[0] for key in self.__idle for idle in self.__idle[ key ] ]
+      self.__idle = {}
+    finally:
+      self.__lock.release()
+    self.__close( toClose )
+
+  def getStats( self ):
+    """ Counters of the pool, reuseRate is the fraction of requested connections taken from the pool
+    """
+    self.__lock.acquire()
+    try:
+      stats = dict( self.__stats )
+      stats[ 'idle' ] = sum( [ len( self.__idle[ key ] ) for key in self.__idle ] )
+    finally:
+      self.__lock.release()
+    requested = stats[ 'hits' ] + stats[ 'misses' ]
+    if requested:
+      stats[ 'reuseRate' ] = float( stats[ 'hits' ] ) / requested
+    else:
+      stats[ 'reuseRate' ] = 0.0
+    return stats
+
+
+gConnectionPool = None
+
+def getGlobalConnectionPool():
+  global gConnectionPool
+  if not gConnectionPool:
+    gConnectionPool = ConnectionPool( gConfig.getValue( "/DIRAC/ConnectionPool/MaxIdlePerHost", 4 ),
+                                      gConfig.getValue( "/DIRAC/ConnectionPool/MaxIdleTime", 50 ) )
+  return gConnectionPool
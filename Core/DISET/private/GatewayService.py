@@ -1,6 +1,7 @@
 
 import os
 import cStringIO
+import types
 import DIRAC
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.Core.Utilities import List, Time
@@ -50,16 +51,18 @@ class GatewayService( Service ):
     return S_OK()
 
   #Threaded process function
-  def _processInThread( self, clientTransport ):
-    #Handshake
-    try:
-      clientTransport.handshake()
-    except:
-      return
-    #Add to the transport pool
-    trid = self._transportPool.add( clientTransport )
+  def _processInThread( self, clientTransport, trid = None, handshaken = False ):
     if not trid:
-      return
+      #Handshake, unless the reactor already did it
+      if not handshaken:
+        try:
+          clientTransport.handshake()
+        except:
+          return
+      #Add to the transport pool
+      trid = self._transportPool.add( clientTransport )
+      if not trid:
+        return
     #Receive and check proposal
     result = self._receiveAndCheckProposal( trid )
     if not result[ 'OK' ]:
@@ -188,6 +191,9 @@ class GatewayService( Service ):
     elif actionType == "RPC":
       gLogger.info( "Forwarding %s/%s action to %s for %s" % ( actionType, actionMethod, targetService, idString ) )
       retVal = self.__forwardRPCCall( targetService, clientInitArgs, actionMethod, retVal[ 'Value' ] )
+    elif actionType == "Batch":
+      gLogger.info( "Forwarding %s/%s action to %s for %s" % ( actionType, actionMethod, targetService, idString ) )
+      retVal = self.__forwardBatchCall( targetService, clientInitArgs, retVal[ 'Value' ] )
     elif actionType == "Connection" and actionMethod == "new":
       gLogger.info( "Initiating a messaging connection to %s for %s" % ( targetService, idString ) )
       retVal = self._msgForwarder.addClient( trid, targetService, clientInitArgs, retVal[ 'Value' ] )
@@ -215,6 +221,20 @@ class GatewayService( Service ):
     methodObj = getattr( rpcClient, method )
     return methodObj( *params )
 
+  def __forwardBatchCall( self, targetService, clientInitArgs, calls ):
+    if type( calls ) not in ( types.ListType, types.TupleType ):
+      return S_ERROR( "Invalid batch of calls" )
+    for call in calls:
+      if type( call ) not in ( types.ListType, types.TupleType ) or len( call ) != 2:
+        return S_ERROR( "Invalid batch of calls" )
+    rpcClient = RPCClient( targetService, **clientInitArgs )
+    retVal = rpcClient.executeBatch( calls )
+    if retVal[ 'OK' ]:
+      for result in retVal[ 'Value' ]:
+        if isinstance( result, dict ):
+          result.pop( 'rpcStub', None )
+    return retVal
+
   def __forwardFileTransferCall( self, targetService, clientInitArgs, method,
                                  params, clientTransport ):
     transferRelay = TransferRelay( targetService, **clientInitArgs )
@@ -4,40 +4,140 @@ __RCSID__ = "$Id$"
 import types
 from DIRAC.Core.DISET.private.BaseClient import BaseClient
 from DIRAC.Core.Utilities.ReturnValues import S_OK, S_ERROR
+from DIRAC.Core.Utilities import DEncode
 
 
 class InnerRPCClient( BaseClient ):
 
-  __retry = 0
-  
+  #Retries of a call whose proposal could not get through, a closed idle connection for instance
+  __maxRetries = 3
+
   def executeRPC( self, functionName, args ):
     stub = ( self._getBaseStub(), functionName, args )
-    retVal = self._connect()
+    return self.__executeAction( ( "RPC", functionName ), args, stub )
+
+  def executeBatch( self, calls ):
+    """ Execute a list of ( functionName, args ) RPC calls in a single request.
+
+        The service authorizes each method once and executes the calls in order. Returns
+        S_OK( list of the S_OK/S_ERROR results of the calls ), or S_ERROR if the batch itself
+        could not be executed. Services that do not know about batches get the calls one by one.
+    """
+    if not calls:
+      return S_OK( [] )
+    calls = [ ( functionName, tuple( args ) ) for functionName, args in calls ]
+    methods = ",".join( sorted( set( [ call[0] for call in calls ] ) ) )
+    retVal = self.__executeAction( ( "Batch", methods ), calls )
+    if not retVal[ 'OK' ]:
+      #Services and gateways that do not know about batches
+      if retVal[ 'Message' ] in ( "Batch is not a known action type", "Unknown type of action (Batch)" ):
+        return S_OK( [ self.executeRPC( functionName, args ) for functionName, args in calls ] )
+      return retVal
+    results = retVal[ 'Value' ]
+    if type( results ) != types.ListType or len( results ) != len( calls ):
+      return S_ERROR( "Received an invalid batch result" )
+    baseStub = self._getBaseStub()
+    for iPos in range( len( calls ) ):
+      if type( results[ iPos ] ) == types.DictType:
+        results[ iPos ][ 'rpcStub' ] = ( baseStub, calls[ iPos ][0], calls[ iPos ][1] )
+    return S_OK( results )
+
+  def __executeAction( self, action, args, stub = None, retry = 0 ):
+    retVal = self._connect( reuseConnection = True )
     if not retVal[ 'OK' ]:
-      retVal[ 'rpcStub' ] = stub
+      if stub:
+        retVal[ 'rpcStub' ] = stub
       return retVal
+    reused = retVal.get( 'reused', False )
     trid, transport = retVal[ 'Value' ]
+    answered = False
     try:
-      retVal = self._proposeAction( transport, ( "RPC", functionName ) )
+      if reused:
+        #The service already accepted a proposal on this connection, the arguments can go along with it
+        retVal = self._proposeAction( transport, action, S_OK( args ) )
+      else:
+        retVal = self._proposeAction( transport, action )
       if not retVal['OK']:
         if retVal['Message'] == "Unauthorized query":  # TODO: DErno will help!:
-          retVal[ 'rpcStub' ] = stub
+          if stub:
+            retVal[ 'rpcStub' ] = stub
           return retVal
-        else:  # we have network problem or the service is not responding  
-          if self.__retry < 3:
-            self.__retry += 1
-            return self.executeRPC( functionName, args )
+        else:  # we have network problem or the service is not responding (or closed the idle connection)
+          if retry < self.__maxRetries and retVal['Message'] != "%s is not a known action type" % action[0]:
+            return self.__executeAction( action, args, stub, retry + 1 )
           else:
-            retVal[ 'rpcStub' ] = stub
+            if stub:
+              retVal[ 'rpcStub' ] = stub
             return retVal
 
-      retVal = transport.sendData( S_OK( args ) )
-      if not retVal[ 'OK' ]:
-        return retVal
+      if not reused:
+        retVal = transport.sendData( S_OK( args ) )
+        if not retVal[ 'OK' ]:
+          return retVal
       receivedData = transport.receiveData()
       if type( receivedData ) == types.DictType:
-        receivedData[ 'rpcStub' ] = stub
+        if stub:
+          receivedData[ 'rpcStub' ] = stub
+        #An error may come from the network, only keep connections that surely work
+        answered = receivedData[ 'OK' ]
       return receivedData
+    finally:
+      if answered:
+        self._releaseConnection( trid )
+      else:
+        self._disconnect( trid )
+
+  def executeRPCStream( self, functionName, args, depth = 2 ):
+    """ Execute an RPC call whose result is decoded lazily while it is received.
+
+        The result dictionary is walked down to depth ( >= 1 ) levels, see DEncode.iterDecode,
+        so that huge bulk results can be processed with bounded memory. If the call fails an
+        S_ERROR is returned as usual, otherwise S_OK( iterator ) where the iterator yields the
+        ( keyPath, value ) items found under 'Value', e.g. ( ( 'Value', 'Successful', lfn ), value ).
+        The connection is kept open until the iterator is exhausted or discarded.
+    """
+    retVal = self._connect()
+    if not retVal[ 'OK' ]:
+      return retVal
+    trid, transport = retVal[ 'Value' ]
+    retVal = self._proposeAction( transport, ( "RPC", functionName ) )
+    if retVal[ 'OK' ]:
+      retVal = transport.sendData( S_OK( args ) )
+    if retVal[ 'OK' ]:
+      retVal = transport.receiveDataStream()
+    if not retVal[ 'OK' ]:
+      self._disconnect( trid )
+      return retVal
+    items = self.__streamItems( trid, DEncode.iterDecode( retVal[ 'Value' ], depth ) )
+    #Start the generator so that discarding it always closes the connection
+    items.next()
+    #The return structure keys before 'OK' are only there in case of error
+    errorDict = {}
+    try:
+      for keyPath, value in items:
+        if keyPath == ( 'OK', ):
+          break
+        if len( keyPath ) == 1:
+          errorDict[ keyPath[0] ] = value
+        else:
+          #Only the CallStack list is deep enough to be walked
+          errorDict.setdefault( keyPath[0], [] ).append( value )
+      else:
+        return S_ERROR( "Received an invalid return structure for %s" % functionName )
+    except Exception as e:
+      items.close()
+      return S_ERROR( "Error while receiving %s result: %s" % ( functionName, str( e ) ) )
+    if not value:
+      items.close()
+      errorDict[ 'OK' ] = False
+      return errorDict
+    return S_OK( items )
+
+  def __streamItems( self, trid, items ):
+    try:
+      yield None
+      for item in items:
+        yield item
     finally:
       self._disconnect( trid )
 
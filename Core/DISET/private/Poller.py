@@ -0,0 +1,77 @@
+""" Wait for events on many sockets at once, with epoll when available and poll otherwise
+"""
+
+__RCSID__ = "$Id$"
+
+import select
+
+class Poller( object ):
+
+  READ = 1
+  WRITE = 2
+  ERROR = 4
+
+  def __init__( self ):
+    if hasattr( select, "epoll" ):
+      self.__poller = select.epoll()
+      self.__flags = { self.READ : select.EPOLLIN, self.WRITE : select.EPOLLOUT,
+                       self.ERROR : select.EPOLLERR | select.EPOLLHUP }
+      self.__timeoutFactor = 1
+    else:
+      self.__poller = select.poll()
+      self.__flags = { self.READ : select.POLLIN, self.WRITE : select.POLLOUT,
+                       self.ERROR : select.POLLERR | select.POLLHUP | select.POLLNVAL }
+      #poll timeout is in milliseconds
+      self.__timeoutFactor = 1000
+    self.__registered = set()
+
+  def __toNative( self, events ):
+    native = 0
+    for flag in ( self.READ, self.WRITE ):
+      if events & flag:
+        native |= self.__flags[ flag ]
+    return native
+
+  def __fromNative( self, native ):
+    events = 0
+    for flag in self.__flags:
+      if native & self.__flags[ flag ]:
+        events |= flag
+    return events
+
+  def register( self, fd, events ):
+    """ Wait for READ and/or WRITE events on fd. Errors are always reported
+    """
+    if fd in self.__registered:
+      try:
+        self.__poller.modify( fd, self.__toNative( events ) )
+        return
+      except ( IOError, OSError ):
+        #The descriptor number has been reused after a close
+        pass
+    self.__poller.register( fd, self.__toNative( events ) )
+    self.__registered.add( fd )
+
+  def unregister( self, fd ):
+    if fd not in self.__registered:
+      return
+    self.__registered.discard( fd )
+    try:
+      self.__poller.unregister( fd )
+    except ( IOError, OSError, KeyError, ValueError ):
+      #Already closed
+      pass
+
+  def poll( self, timeout ):
+    """ List of ( fd, events ) ready, waiting at most timeout seconds
+    """
+    try:
+      ready = self.__poller.poll( timeout * self.__timeoutFactor )
+    except ( IOError, select.error ):
+      #Interrupted by a signal
+      return []
+    return [ ( fd, self.__fromNative( native ) ) for fd, native in ready ]
+
+  def close( self ):
+    if hasattr( self.__poller, "close" ):
+      self.__poller.close()
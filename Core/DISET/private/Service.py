@@ -5,12 +5,14 @@ import DIRAC
 import threading
 from DIRAC import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
-from DIRAC.Core.Utilities import Time, MemStat
+from DIRAC.Core.Utilities import Time, MemStat, List
 from DIRAC.Core.DISET.private.LockManager import LockManager
 from DIRAC.FrameworkSystem.Client.MonitoringClient import MonitoringClient
 from DIRAC.Core.DISET.private.ServiceConfiguration import ServiceConfiguration
 from DIRAC.Core.DISET.private.TransportPool import getGlobalTransportPool
 from DIRAC.Core.DISET.private.MessageBroker import MessageBroker, MessageSender
+from DIRAC.Core.DISET.private import Compression
+from DIRAC.Core.DISET.private.Poller import Poller
 from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
 from DIRAC.Core.Utilities.ThreadPool import ThreadPool
 from DIRAC.Core.Utilities.ReturnValues import isReturnStructure
@@ -44,10 +46,18 @@ class Service( object ):
     self._transportPool = getGlobalTransportPool()
     self.__cloneId = 0
     self.__maxFD = 0
+    #trid -> time since the connection is waiting for the next proposal of the client
+    self.__idleConnections = {}
+    self.__idleLock = threading.Lock()
+    self.__idleWatcher = None
+    self.__idleConnectionHandler = None
 
   def setCloneProcessId( self, cloneId ):
+    """ Run as the worker process cloneId of the service. The monitoring data is reported
+        by the supervisor process, so that all the workers appear as a single component
+    """
     self.__cloneId = cloneId
-    self._monitor.setComponentName( "%s-Clone:%s" % ( self._name, cloneId ) )
+    self._monitor.setForwardMode( True )
 
   def _isMetaAction( self, action ):
     referedAction = Service.SVC_VALID_ACTIONS[ action ]
@@ -222,6 +232,11 @@ class Service( object ):
     self._monitor.registerActivity( 'ActiveQueries', "Active queries", 'Framework', 'threads', MonitoringClient.OP_MEAN )
     self._monitor.registerActivity( 'RunningThreads', "Running threads", 'Framework', 'threads', MonitoringClient.OP_MEAN )
     self._monitor.registerActivity( 'MaxFD', "Max File Descriptors", 'Framework', 'fd', MonitoringClient.OP_MEAN )
+    self._monitor.registerActivity( 'EncodedBytesSent', "Encoded bytes sent", 'Framework', 'bytes', MonitoringClient.OP_SUM )
+    self._monitor.registerActivity( 'WireBytesSent', "Bytes sent after compression", 'Framework', 'bytes', MonitoringClient.OP_SUM )
+    self._monitor.registerActivity( 'CompressionRatio', "Compression ratio of replies", 'Framework', 'ratio', MonitoringClient.OP_MEAN )
+    self._monitor.registerActivity( 'ReusedConnections', "Queries received through reused connections", 'Framework', 'queries', MonitoringClient.OP_RATE )
+    self._monitor.registerActivity( 'IdleConnections', "Connections waiting for a query", 'Framework', 'connections', MonitoringClient.OP_MEAN )
 
     self._monitor.setComponentExtraParam( 'DIRACVersion', DIRAC.version )
     self._monitor.setComponentExtraParam( 'platform', DIRAC.getPlatform() )
@@ -244,22 +259,56 @@ class Service( object ):
     self._monitor.addMark( 'ActiveQueries', self._threadPool.numWorkingThreads() )
     self._monitor.addMark( 'RunningThreads', threading.activeCount() )
     self._monitor.addMark( 'MaxFD', self.__maxFD )
+    self._monitor.addMark( 'IdleConnections', len( self.__idleConnections ) )
     self.__maxFD = 0
 
 
   def getConfig( self ):
     return self._cfg
 
+  def getMonitor( self ):
+    return self._monitor
+
+  def initializeMonitoring( self ):
+    """ Set up only the monitoring of the service. Used by the supervisor of the worker processes,
+        which reports their activity without serving any query itself
+    """
+    self._url = self._cfg.getURL()
+    if not self._url:
+      return S_ERROR( "Could not build service URL for %s" % self._name )
+    result = self._loadHandlerInit()
+    if not result[ 'OK' ]:
+      return result
+    self._handler = result[ 'Value' ]
+    return self._initMonitoring()
+
+  def isProcessing( self ):
+    """ Whether there are queries being served or waiting for a thread
+    """
+    return self._threadPool.isWorking()
+
   #End of initialization functions
 
-  def handleConnection( self, clientTransport ):
+  def handleConnection( self, clientTransport, handshaken = False ):
+    """ Serve a new connection. handshaken is set if the reactor did the handshake and
+        already buffered the proposal
+    """
     self._stats[ 'connections' ] += 1
     self._monitor.setComponentExtraParam( 'queries', self._stats[ 'connections' ] )
     self._threadPool.generateJobAndQueueIt( self._processInThread,
-                                             args = ( clientTransport, ) )
+                                             args = ( clientTransport, None, handshaken ) )
+
+  def setIdleConnectionHandler( self, handler ):
+    """ Hand the connections waiting for the next proposal to handler( service, trid, transport )
+        instead of watching them from a thread of the service. handler then calls either
+        handleReusedConnection or closeIdleConnection for each of them
+    """
+    self.__idleConnectionHandler = handler
 
   #Threaded process function
-  def _processInThread( self, clientTransport ):
+  def _processInThread( self, clientTransport, trid = None, handshaken = False ):
+    """ Serve a proposal. trid is only given for connections kept open after a previous proposal
+    """
     self.__maxFD = max( self.__maxFD, clientTransport.oSocket.fileno() )
     self._lockManager.lockGlobal()
     try:
@@ -267,18 +316,27 @@ class Service( object ):
     except Exception:
       monReport = False
     try:
-      #Handshake
-      try:
-        result = clientTransport.handshake()
-        if not result[ 'OK' ]:
-          clientTransport.close()
+      if trid:
+        #Authorization modifies the credentials, start again from the ones of the handshake
+        credDict = clientTransport.getConnectingCredentials()
+        credDict.clear()
+        credDict.update( self._transportPool.getAssociatedData( trid, 'handshakeCredentials' ) )
+      else:
+        #Handshake
+        try:
+          if not handshaken:
+            result = clientTransport.handshake()
+            if not result[ 'OK' ]:
+              clientTransport.close()
+              return
+        except:
           return
-      except:
-        return
-      #Add to the transport pool
-      trid = self._transportPool.add( clientTransport )
-      if not trid:
-        return
+        #Add to the transport pool
+        trid = self._transportPool.add( clientTransport )
+        if not trid:
+          return
+        self._transportPool.associateData( trid, 'handshakeCredentials',
+                                           dict( clientTransport.getConnectingCredentials() ) )
       #Receive and check proposal
       result = self._receiveAndCheckProposal( trid )
       if not result[ 'OK' ]:
@@ -297,12 +355,113 @@ class Service( object ):
       if result[ 'closeTransport' ] or not result[ 'OK' ]:
         if not result[ 'OK' ]:
           gLogger.error( "Error processing proposal", result[ 'Message' ] )
-        self._transportPool.close( trid )
+          self._transportPool.close( trid )
+        elif clientTransport.getReuseLapse():
+          self.__addIdleConnection( trid )
+        else:
+          self._transportPool.close( trid )
       return result
     finally:
       self._lockManager.unlockGlobal()
       if monReport:
         self.__endReportToMonitoring( *monReport )
+      self.__reportTraffic( clientTransport )
+
+  def __addIdleConnection( self, trid ):
+    """ Keep the connection open until the client sends another proposal or the idle timeout expires
+    """
+    accepted = False
+    self.__idleLock.acquire()
+    try:
+      if len( self.__idleConnections ) < self._cfg.getMaxIdleConnections():
+        self.__idleConnections[ trid ] = time.time()
+        accepted = True
+        if not self.__idleConnectionHandler and ( not self.__idleWatcher or not self.__idleWatcher.isAlive() ):
+          self.__idleWatcher = threading.Thread( target = self.__watchIdleConnections )
+          self.__idleWatcher.setDaemon( True )
+          self.__idleWatcher.start()
+    finally:
+      self.__idleLock.release()
+    if not accepted:
+      self._transportPool.close( trid )
+    elif self.__idleConnectionHandler:
+      self.__idleConnectionHandler( self, trid, self._transportPool.get( trid ) )
+
+  def __popIdleConnection( self, trid ):
+    self.__idleLock.acquire()
+    try:
+      return self.__idleConnections.pop( trid, None ) is not None
+    finally:
+      self.__idleLock.release()
+
+  def handleReusedConnection( self, trid ):
+    """ Serve the proposal the client sent through a connection kept open
+    """
+    if not self.__popIdleConnection( trid ):
+      return
+    clientTransport = self._transportPool.get( trid )
+    if not clientTransport:
+      return
+    self._monitor.addMark( 'ReusedConnections' )
+    self._threadPool.generateJobAndQueueIt( self._processInThread,
+                                             args = ( clientTransport, trid ) )
+
+  def closeIdleConnection( self, trid ):
+    if self.__popIdleConnection( trid ):
+      self._transportPool.close( trid )
+
+  def __watchIdleConnections( self ):
+    #select cannot watch descriptors over FD_SETSIZE, which busy services reach easily
+    poller = Poller()
+    watched = {}
+    while True:
+      idleTimeout = self._cfg.getConnectionIdleTimeout()
+      now = time.time()
+      expired = []
+      idle = {}
+      self.__idleLock.acquire()
+      try:
+        for trid in self.__idleConnections:
+          transport = self._transportPool.get( trid )
+          if not transport or now - self.__idleConnections[ trid ] > idleTimeout:
+            expired.append( trid )
+          else:
+            try:
+              idle[ transport.getSocket().fileno() ] = trid
+            except Exception:
+              #The socket is already closed
+              expired.append( trid )
+      finally:
+        self.__idleLock.release()
+      for fd in watched.keys():
+        if watched[ fd ] != idle.get( fd ):
+          poller.unregister( fd )
+          del watched[ fd ]
+      for trid in expired:
+        self.closeIdleConnection( trid )
+      if not idle:
+        time.sleep( 1 )
+        continue
+      for fd in idle:
+        if fd not in watched:
+          poller.register( fd, Poller.READ )
+          watched[ fd ] = idle[ fd ]
+      for fd, _events in poller.poll( 1 ):
+        trid = watched.pop( fd, None )
+        if trid is None:
+          continue
+        #The descriptor goes back to the service, errors included, the handler will find out
+        poller.unregister( fd )
+        self.handleReusedConnection( trid )
+
+  def __reportTraffic( self, clientTransport ):
+    trafficStats = clientTransport.getTrafficStats( reset = True )
+    if not trafficStats[ 'rawBytes' ]:
+      return
+    self._monitor.addMark( 'EncodedBytesSent', trafficStats[ 'rawBytes' ] )
+    self._monitor.addMark( 'WireBytesSent', trafficStats[ 'sentBytes' ] )
+    if clientTransport.getCompression() and trafficStats[ 'sentBytes' ]:
+      self._monitor.addMark( 'CompressionRatio', float( trafficStats[ 'rawBytes' ] ) / trafficStats[ 'sentBytes' ] )
 
 
   def _createIdentityString( self, credDict, clientTransport = None ):
@@ -328,9 +487,13 @@ class Service( object ):
     #Receive the action proposal
     retVal = clientTransport.receiveData( 1024 )
     if not retVal[ 'OK' ]:
-      gLogger.error( "Invalid action proposal", "%s %s" % ( self._createIdentityString( credDict,
-                                                                                        clientTransport ),
-                                                            retVal[ 'Message' ] ) )
+      if clientTransport.getReuseLapse():
+        #Most likely the client closed a connection kept open after its previous proposal
+        gLogger.debug( "Connection kept open closed by client", retVal[ 'Message' ] )
+      else:
+        gLogger.error( "Invalid action proposal", "%s %s" % ( self._createIdentityString( credDict,
+                                                                                          clientTransport ),
+                                                              retVal[ 'Message' ] ) )
       return S_ERROR( "Invalid action proposal" )
     proposalTuple = retVal[ 'Value' ]
     gLogger.debug( "Received action from client", "/".join( list( proposalTuple[1] ) ) )
@@ -343,15 +506,38 @@ class Service( object ):
       return S_ERROR( "%s is not up in this server" % requestedService )
     #Check if the action is valid
     requestedActionType = proposalTuple[1][0]
-    if requestedActionType not in Service.SVC_VALID_ACTIONS:
+    if requestedActionType == 'Batch':
+      #A batch of RPC calls is authorized once per method
+      result = self._authorizeBatch( proposalTuple[1], trid, credDict )
+    elif requestedActionType not in Service.SVC_VALID_ACTIONS:
       return S_ERROR( "%s is not a known action type" % requestedActionType )
-    #Check if it's authorized
-    result = self._authorizeProposal( proposalTuple[1], trid, credDict )
+    else:
+      #Check if it's authorized
+      result = self._authorizeProposal( proposalTuple[1], trid, credDict )
     if not result[ 'OK' ]:
       return result
+    self.__negotiateCapabilities( clientTransport, proposalTuple )
     #Proposal is OK
     return S_OK( proposalTuple )
 
+  def __negotiateCapabilities( self, clientTransport, proposalTuple ):
+    """ Enable the features offered by the client that the service accepts for RPC and Batch actions:
+        compression of the reply and keeping the connection open for the next proposal.
+        Older clients send no capabilities as fourth element of the proposal
+    """
+    clientTransport.setReuseLapse( 0 )
+    if proposalTuple[1][0] not in ( 'RPC', 'Batch' ) or len( proposalTuple ) < 4 or type( proposalTuple[3] ) != dict:
+      return
+    capabilities = proposalTuple[3]
+    algorithm = Compression.chooseAlgorithm( capabilities.get( 'compression', [] ),
+                                             self._cfg.getCompressionAlgorithms() )
+    if algorithm:
+      clientTransport.setCompression( algorithm,
+                                      self._cfg.getCompressionThreshold(),
+                                      self._cfg.getCompressionLevel() )
+    if capabilities.get( 'reuseConnection' ):
+      clientTransport.setReuseLapse( self._cfg.getConnectionIdleTimeout() )
+
   def _authorizeProposal( self, actionTuple, trid, credDict ):
     #Find CS path for the Auth rules
     referedAction = self._isMetaAction( actionTuple[0] )
@@ -401,6 +587,18 @@ class Service( object ):
                                       self._name, "/".join( actionTuple ) )
     return result
 
+  def _authorizeBatch( self, actionTuple, trid, credDict ):
+    """ Authorize each of the comma separated RPC methods of a Batch action
+    """
+    methods = List.fromChar( actionTuple[1], "," )
+    if not methods:
+      return S_ERROR( "Empty batch" )
+    for method in methods:
+      result = self._authorizeProposal( ( 'RPC', method ), trid, credDict )
+      if not result[ 'OK' ]:
+        return result
+    return S_OK()
+
   def _instantiateHandler( self, trid, proposalTuple = None ):
     """
     Generate an instance of the handler for a given service
@@ -430,8 +628,19 @@ class Service( object ):
     return S_OK( handlerInstance )
 
   def _processProposal( self, trid, proposalTuple, handlerObj ):
-    #Notify the client we're ready to execute the action
-    retVal = self._transportPool.send( trid, S_OK() )
+    #Notify the client we're ready to execute the action, how it may compress its data
+    #and whether the connection will be kept open afterwards
+    clientTransport = self._transportPool.get( trid )
+    requirements = {}
+    if clientTransport and clientTransport.getCompression():
+      requirements[ 'compression' ] = clientTransport.getCompression()
+      requirements[ 'compressionThreshold' ] = self._cfg.getCompressionThreshold()
+    if clientTransport and clientTransport.getReuseLapse():
+      requirements[ 'reuseConnection' ] = clientTransport.getReuseLapse()
+    if requirements:
+      retVal = self._transportPool.send( trid, S_OK( requirements ) )
+    else:
+      retVal = self._transportPool.send( trid, S_OK() )
     if not retVal[ 'OK' ]:
       return retVal
 
@@ -86,6 +86,53 @@ class ServiceConfiguration:
     except:
       return 1
 
+  def getWorkerHeartbeatTimeout( self ):
+    """ Seconds without news from a worker process before it is considered hung and replaced
+    """
+    try:
+      return int( self.getOption( "WorkerHeartbeatTimeout" ) )
+    except:
+      return 120
+
+  def getCompressionAlgorithms( self ):
+    """ Compression algorithms accepted for RPC replies, by order of preference. None by default
+    """
+    optionValue = self.getOption( "Compression" )
+    if optionValue:
+      return List.fromChar( optionValue )
+    return []
+
+  def getCompressionThreshold( self ):
+    try:
+      return int( self.getOption( "CompressionThreshold" ) )
+    except:
+      return 65536
+
+  def getCompressionLevel( self ):
+    try:
+      return int( self.getOption( "CompressionLevel" ) )
+    except:
+      return 6
+
+  def getConnectionIdleTimeout( self ):
+    """ Seconds an RPC connection is kept open waiting for the next request of the client, 0 to close it
+    """
+    try:
+      return max( 0, int( self.getOption( "ConnectionIdleTimeout" ) ) )
+    except:
+      return 60
+
+  def getMaxIdleConnections( self ):
+    try:
+      return int( self.getOption( "MaxIdleConnections" ) )
+    except:
+      return 200
+
+  def useEventReactor( self ):
+    """ Whether the reactor does the handshake and receives the proposal itself instead of a service thread
+    """
+    return str( self.getOption( "EventReactor" ) ).lower() in ( "y", "yes", "true", "1" )
+
   def getPort( self ):
     try:
       return int( self.getOption( "Port" ) )
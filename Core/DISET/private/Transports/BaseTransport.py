@@ -1,13 +1,16 @@
 __RCSID__ = "$Id$"
 
 import time
+import errno
 import select
+import socket
 import cStringIO
 from hashlib import md5
 
 from DIRAC.Core.Utilities.ReturnValues import S_ERROR, S_OK
 from DIRAC.FrameworkSystem.Client.Logger import gLogger
 from DIRAC.Core.Utilities import DEncode
+from DIRAC.Core.DISET.private import Compression
 
 class BaseTransport( object ):
 
@@ -32,6 +35,11 @@ class BaseTransport( object ):
     self.waitingForKeepAlivePong = False
     self.__keepAliveLapse = 0
     self.oSocket = None
+    self.__compression = None
+    self.__compressionThreshold = 0
+    self.__compressionLevel = Compression.gDefaultLevel
+    self.__reuseLapse = 0
+    self.__trafficStats = { 'rawBytes' : 0, 'sentBytes' : 0 }
     if 'keepAliveLapse' in kwargs:
       try:
         self.__keepAliveLapse = max( 150, int( kwargs[ 'keepAliveLapse' ] ) )
@@ -52,6 +60,17 @@ class BaseTransport( object ):
   def handshake( self ):
     return S_OK()
 
+  def serverHandshakeStep( self ):
+    """ Advance the handshake of a server side connection without waiting for the peer.
+        Returns S_OK( 'read' or 'write' ) with the event to wait for, or S_OK( None ) once done
+    """
+    return S_OK( None )
+
+  def setBlocking( self, blocking ):
+    """ Switch the connection between blocking operation and non blocking mode for event loops
+    """
+    self.oSocket.setblocking( blocking )
+
   def close( self ):
     self.oSocket.close()
 
@@ -68,6 +87,33 @@ class BaseTransport( object ):
   def latestServerRenewTime( self ):
     return self.__lastServerRenewTimestamp
 
+  def setCompression( self, algorithm, threshold = 0, level = Compression.gDefaultLevel ):
+    """ Compress the messages sent from now on whose encoded size is at least threshold bytes.
+        The peer must have agreed to it. algorithm None disables compression
+    """
+    self.__compression = algorithm
+    self.__compressionThreshold = threshold
+    self.__compressionLevel = level
+
+  def getCompression( self ):
+    return self.__compression
+
+  def setReuseLapse( self, lapse ):
+    """ Seconds the server keeps the connection open between two requests, 0 if it is closed after each one
+    """
+    self.__reuseLapse = lapse
+
+  def getReuseLapse( self ):
+    return self.__reuseLapse
+
+  def getTrafficStats( self, reset = False ):
+    """ Encoded bytes given to sendData and bytes actually sent for them, since the last reset
+    """
+    trafficStats = dict( self.__trafficStats )
+    if reset:
+      self.__trafficStats = { 'rawBytes' : 0, 'sentBytes' : 0 }
+    return trafficStats
+
   def getConnectingCredentials( self ):
     return self.peerCredentials
 
@@ -110,9 +156,61 @@ class BaseTransport( object ):
   def _write( self, buffer ):
     return S_OK( self.oSocket.send( buffer ) )
 
+  def _readAvailable( self, bufSize = 16384 ):
+    """ Read what has already arrived on a non blocking connection, possibly nothing
+    """
+    try:
+      data = self.oSocket.recv( bufSize )
+    except socket.error as e:
+      if e.args[0] in ( errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR ):
+        return S_OK( "" )
+      return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+    if not data:
+      return S_ERROR( "Connection closed by peer" )
+    return S_OK( data )
+
+  def hasPendingData( self ):
+    """ Whether data has already been read from the socket but not returned by _readAvailable
+    """
+    return False
+
+  def receiveAvailable( self, maxBufferSize = 0 ):
+    """ Buffer what the peer has sent without blocking.
+        Returns S_OK( True ) once a whole message is buffered, receiveData then returns it
+        without reading from the network
+    """
+    retVal = self._readAvailable()
+    if not retVal[ 'OK' ]:
+      return retVal
+    self.byteStream += retVal[ 'Value' ]
+    magic = self.byteStream[ :3 ]
+    lengthStart = 0
+    if magic == BaseTransport.keepAliveMagic or Compression.getAlgorithmForMagic( magic ):
+      lengthStart = 3
+    iSeparatorPosition = self.byteStream.find( ":", lengthStart, lengthStart + 10 )
+    if iSeparatorPosition == -1:
+      if len( self.byteStream ) > lengthStart + 10:
+        return S_ERROR( "Invalid message header" )
+      return S_OK( False )
+    try:
+      pkgSize = int( self.byteStream[ lengthStart : iSeparatorPosition ] )
+    except ValueError:
+      return S_ERROR( "Invalid message header" )
+    if maxBufferSize and pkgSize > maxBufferSize:
+      return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
+    return S_OK( len( self.byteStream ) > iSeparatorPosition + pkgSize )
+
   def sendData( self, uData, prefix = False ):
     self.__updateLastActionTimestamp()
     sCodedData = DEncode.encode( uData )
+    self.__trafficStats[ 'rawBytes' ] += len( sCodedData )
+    if not prefix and self.__compression and len( sCodedData ) >= self.__compressionThreshold:
+      try:
+        sCodedData = Compression.compress( self.__compression, sCodedData, self.__compressionLevel )
+        prefix = Compression.gMagics[ self.__compression ]
+      except Exception as e:
+        return S_ERROR( "Could not compress data to send: %s" % str( e ) )
+    self.__trafficStats[ 'sentBytes' ] += len( sCodedData )
     if prefix:
       dataToSend = "%s%s:%s" % ( prefix, len( sCodedData ), sCodedData )
     else:
@@ -143,27 +241,11 @@ class BaseTransport( object ):
     #Buffer size can't be less than 0
     maxBufferSize = max( maxBufferSize, 0 )
     try:
-      #Look either for message length of keep alive magic string
-      iSeparatorPosition = self.byteStream.find( ":", 0, 10 )
+      retVal = self.__waitForHeader( maxBufferSize )
+      if not retVal[ 'OK' ]:
+        return retVal
+      isKeepAlive, compression, iSeparatorPosition = retVal[ 'Value' ]
       keepAliveMagicLen = len( BaseTransport.keepAliveMagic )
-      isKeepAlive = self.byteStream.find( BaseTransport.keepAliveMagic, 0, keepAliveMagicLen ) == 0
-      #While not found the message length or the ka, keep receiving
-      while iSeparatorPosition == -1 and not isKeepAlive:
-        retVal = self._read( 16384 )
-        #If error return
-        if not retVal[ 'OK' ]:
-          return retVal
-        #If closed return error
-        if not retVal[ 'Value' ]:
-          return S_ERROR( "Peer closed connection" )
-        #New data!
-        self.byteStream += retVal[ 'Value' ]
-        #Look again for either message length of ka magic string
-        iSeparatorPosition = self.byteStream.find( ":", 0, 10 )
-        isKeepAlive = self.byteStream.find( BaseTransport.keepAliveMagic, 0, keepAliveMagicLen ) == 0
-        #Over the limit?
-        if maxBufferSize and len( self.byteStream ) > maxBufferSize and iSeparatorPosition == -1 :
-          return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
       #Keep alive magic!
       if isKeepAlive:
         gLogger.debug( "Received keep alive header" )
@@ -172,7 +254,7 @@ class BaseTransport( object ):
         return self.__processKeepAlive( maxBufferSize, blockAfterKeepAlive )
       #From here it must be a real message!
       #Process the size and remove the msg length from the bytestream
-      pkgSize = int( self.byteStream[ :iSeparatorPosition ] )
+      pkgSize = int( self.byteStream[ 3 if compression else 0 : iSeparatorPosition ] )
       pkgData = self.byteStream[ iSeparatorPosition + 1: ]
       readSize = len( pkgData )
       if readSize >= pkgSize:
@@ -203,6 +285,11 @@ class BaseTransport( object ):
           pkgMem.seek( 0, 0 )
           data = pkgMem.read( pkgSize )
           self.byteStream = pkgMem.read()
+      if compression:
+        try:
+          data = Compression.decompress( compression, data )
+        except Exception as e:
+          return S_ERROR( "Could not decompress received data: %s" % str( e ) )
       try:
         data = DEncode.decode( data )[0]
       except Exception as e:
@@ -215,6 +302,95 @@ class BaseTransport( object ):
       gLogger.exception( "Network error while receiving data" )
       return S_ERROR( "Network error while receiving data: %s" % str( e ) )
 
+  def __waitForHeader( self, maxBufferSize ):
+    """ Read until the byte stream starts with either a message length, possibly after a
+        compression magic, or the keep alive magic.
+        Returns S_OK( ( isKeepAlive, compression algorithm or None, position of the length separator ) )
+    """
+    keepAliveMagicLen = len( BaseTransport.keepAliveMagic )
+    while True:
+      #Look either for message length of keep alive magic string
+      compression = Compression.getAlgorithmForMagic( self.byteStream[ :3 ] )
+      lengthStart = 3 if compression else 0
+      iSeparatorPosition = self.byteStream.find( ":", lengthStart, lengthStart + 10 )
+      isKeepAlive = self.byteStream.find( BaseTransport.keepAliveMagic, 0, keepAliveMagicLen ) == 0
+      if iSeparatorPosition > -1 or isKeepAlive:
+        return S_OK( ( isKeepAlive, compression, iSeparatorPosition ) )
+      #Over the limit?
+      if maxBufferSize and len( self.byteStream ) > maxBufferSize:
+        return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
+      #While not found the message length or the ka, keep receiving
+      retVal = self._read( 16384 )
+      #If error return
+      if not retVal[ 'OK' ]:
+        return retVal
+      #If closed return error
+      if not retVal[ 'Value' ]:
+        return S_ERROR( "Peer closed connection" )
+      #New data!
+      self.byteStream += retVal[ 'Value' ]
+
+  def receiveDataStream( self, maxBufferSize = 0 ):
+    """ Receive the next message without assembling nor decoding it.
+
+        Returns S_OK( generator ) yielding the DEncoded message in chunks of at most packetSize
+        bytes as they arrive from the network, to be fed to DEncode.iterDecode. The generator
+        raises IOError if the connection fails before the whole message has been received.
+        The message must be consumed completely before anything else is read from the transport.
+    """
+    self.__updateLastActionTimestamp()
+    if self.receivedMessages:
+      return S_OK( iter( [ DEncode.encode( self.receivedMessages.pop( 0 ) ) ] ) )
+    #Buffer size can't be less than 0
+    maxBufferSize = max( maxBufferSize, 0 )
+    try:
+      while True:
+        retVal = self.__waitForHeader( maxBufferSize )
+        if not retVal[ 'OK' ]:
+          return retVal
+        isKeepAlive, compression, iSeparatorPosition = retVal[ 'Value' ]
+        if not isKeepAlive:
+          break
+        #Answer the keep alive and look for the real message after it
+        self.byteStream = self.byteStream[ len( BaseTransport.keepAliveMagic ): ]
+        retVal = self.__processKeepAlive( maxBufferSize, blockAfterKeepAlive = False )
+        if not retVal[ 'OK' ]:
+          return retVal
+      pkgSize = int( self.byteStream[ 3 if compression else 0 : iSeparatorPosition ] )
+      if maxBufferSize and pkgSize > maxBufferSize:
+        return S_ERROR( "Read limit exceeded (%s chars)" % maxBufferSize )
+      pkgData = self.byteStream[ iSeparatorPosition + 1: ]
+      self.byteStream = pkgData[ pkgSize: ]
+      pkgData = pkgData[ :pkgSize ]
+    except Exception as e:
+      gLogger.exception( "Network error while receiving data" )
+      return S_ERROR( "Network error while receiving data: %s" % str( e ) )
+    chunks = self.__streamMessage( pkgData, pkgSize - len( pkgData ) )
+    if compression:
+      chunks = self.__decompressStream( compression, chunks )
+    return S_OK( chunks )
+
+  def __streamMessage( self, firstChunk, pendingSize ):
+    if firstChunk:
+      yield firstChunk
+    while pendingSize > 0:
+      retVal = self._read( min( self.packetSize, pendingSize ), skipReadyCheck = True )
+      if not retVal[ 'OK' ]:
+        raise IOError( retVal[ 'Message' ] )
+      self.__updateLastActionTimestamp()
+      pendingSize -= len( retVal[ 'Value' ] )
+      yield retVal[ 'Value' ]
+
+  def __decompressStream( self, compression, chunks ):
+    decompressor = Compression.getStreamDecompressor( compression )
+    for chunk in chunks:
+      data = decompressor.decompress( chunk )
+      if data:
+        yield data
+    data = decompressor.flush()
+    if data:
+      yield data
+
   def __processKeepAlive( self, maxBufferSize, blockAfterKeepAlive = True ):
     gLogger.debug( "Received Keep Alive" )
     #Next message down the stream will be the ka data
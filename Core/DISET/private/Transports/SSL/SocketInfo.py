@@ -23,6 +23,7 @@ class SocketInfo:
 
   def __init__( self, infoDict, sslContext = None ):
     self.__retry = 0
+    self.__handshakeStarted = False
     self.infoDict = infoDict
     if sslContext:
       self.sslContext = sslContext
@@ -301,6 +302,27 @@ class SocketInfo:
     self.sslSocket.set_accept_state()
     return self.__sslHandshake()
 
+  def doServerHandshakeStep( self ):
+    """ Advance the server handshake on a non blocking socket as far as possible.
+        Returns S_OK( ( 'read' or 'write', None ) ) while waiting for the peer
+        and S_OK( ( None, peer credentials ) ) once done
+    """
+    if not self.__handshakeStarted:
+      self.sslSocket.set_accept_state()
+      self.__handshakeStarted = True
+    try:
+      self.sslSocket.do_handshake()
+    except GSI.SSL.WantReadError:
+      return S_OK( ( 'read', None ) )
+    except GSI.SSL.WantWriteError:
+      return S_OK( ( 'write', None ) )
+    except Exception, v:
+      gLogger.warn( "Error while handshaking", v )
+      return S_ERROR( "Error while handshaking" )
+    credentialsDict = self.gatherPeerCredentials()
+    gLogger.debug( "", "Authenticated peer (%s)" % credentialsDict[ 'DN' ] )
+    return S_OK( ( None, credentialsDict ) )
+
   #@gSynchro
   def __sslHandshake( self ):
     start = time.time()
@@ -102,6 +102,23 @@ class SSLTransport( BaseTransport ):
       self.peerCredentials[ key ] = creds[ key ]
     return S_OK()
 
+  def serverHandshakeStep( self ):
+    retVal = self.oSocketInfo.doServerHandshakeStep()
+    if not retVal[ 'OK' ]:
+      return retVal
+    waitFor, creds = retVal[ 'Value' ]
+    if waitFor:
+      return S_OK( waitFor )
+    for key in creds.keys():
+      self.peerCredentials[ key ] = creds[ key ]
+    return S_OK( None )
+
+  def setBlocking( self, blocking ):
+    if blocking:
+      self.oSocket.settimeout( self.oSocketInfo.infoDict[ 'timeout' ] )
+    else:
+      self.oSocket.settimeout( 0 )
+
   def setClientSocket( self, oSocket ):
     if self.serverMode():
       raise RuntimeError( "Must be initialized as client mode" )
@@ -144,6 +161,38 @@ class SSLTransport( BaseTransport ):
     finally:
       self.__unlock()
 
+  def _readAvailable( self, bufSize = 16384, maxSize = 65536 ):
+    #Decrypted data may be waiting in the SSL buffers without the socket being readable.
+    #At most maxSize bytes are read, the caller shares its thread with other connections
+    self.__lock()
+    try:
+      dataList = []
+      readSize = 0
+      while readSize < maxSize:
+        try:
+          data = self.oSocket.recv( bufSize )
+        except ( GSI.SSL.WantReadError, GSI.SSL.WantWriteError ):
+          break
+        except GSI.SSL.ZeroReturnError:
+          data = ""
+        except Exception as e:
+          return S_ERROR( "Exception while reading from peer: %s" % str( e ) )
+        if not data:
+          if dataList:
+            break
+          return S_ERROR( "Connection closed by peer" )
+        dataList.append( data )
+        readSize += len( data )
+      return S_OK( "".join( dataList ) )
+    finally:
+      self.__unlock()
+
+  def hasPendingData( self ):
+    try:
+      return self.oSocket.pending() > 0
+    except Exception:
+      return False
+
   def isLocked( self ):
     return self.__locked
 
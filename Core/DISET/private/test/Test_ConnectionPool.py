@@ -0,0 +1,98 @@
+""" Test cases for DIRAC.Core.DISET.private.ConnectionPool
+"""
+
+__RCSID__ = "$Id$"
+
+import socket
+import unittest
+
+# sut
+from DIRAC.Core.DISET.private.ConnectionPool import ConnectionPool
+
+class FakeTransport( object ):
+  """ Just the bits of a transport the pool uses, over a local socket pair
+  """
+
+  def __init__( self, reuseLapse = 60 ):
+    self.oSocket, self.peerSocket = socket.socketpair()
+    self.reuseLapse = reuseLapse
+    self.closed = False
+
+  def getSocket( self ):
+    return self.oSocket
+
+  def getReuseLapse( self ):
+    return self.reuseLapse
+
+  def close( self ):
+    self.closed = True
+    self.oSocket.close()
+    self.peerSocket.close()
+
+class ConnectionPoolTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.pool = ConnectionPool( maxIdlePerHost = 2, maxIdleTime = 50 )
+    self.key = ( "dips://host:9130", ( None, None, False, None ) )
+
+  def tearDown( self ):
+    self.pool.closeAll()
+
+  def test_reuse( self ):
+    self.assertEqual( self.pool.checkout( self.key ), None )
+    transport = FakeTransport()
+    self.assertTrue( self.pool.checkin( self.key, transport ) )
+    self.assertTrue( self.pool.checkout( self.key ) is transport )
+    self.assertEqual( self.pool.checkout( self.key ), None )
+    stats = self.pool.getStats()
+    self.assertEqual( stats[ 'hits' ], 1 )
+    self.assertEqual( stats[ 'misses' ], 2 )
+    self.assertAlmostEqual( stats[ 'reuseRate' ], 1. / 3 )
+    transport.close()
+
+  def test_credentials( self ):
+    transport = FakeTransport()
+    self.pool.checkin( self.key, transport )
+    self.assertEqual( self.pool.checkout( ( self.key[0], ( True, None, False, None ) ) ), None )
+    self.assertTrue( self.pool.checkout( self.key ) is transport )
+    transport.close()
+
+  def test_maxPerHost( self ):
+    transports = [ FakeTransport() for _i in range( 3 ) ]
+    self.assertTrue( self.pool.checkin( self.key, transports[0] ) )
+    self.assertTrue( self.pool.checkin( ( self.key[0], ( True, ) ), transports[1] ) )
+    self.assertFalse( self.pool.checkin( self.key, transports[2] ) )
+    self.assertTrue( self.pool.checkin( ( "dips://other:9130", self.key[1] ), transports[2] ) )
+    self.assertEqual( self.pool.getStats()[ 'idle' ], 3 )
+
+  def test_notReusable( self ):
+    transport = FakeTransport( reuseLapse = 0 )
+    self.assertFalse( self.pool.checkin( self.key, transport ) )
+    transport.close()
+
+  def test_closedByServer( self ):
+    transport = FakeTransport()
+    self.pool.checkin( self.key, transport )
+    transport.peerSocket.close()
+    self.assertEqual( self.pool.checkout( self.key ), None )
+    self.assertTrue( transport.closed )
+    self.assertEqual( self.pool.getStats()[ 'stale' ], 1 )
+
+  def test_eviction( self ):
+    transport = FakeTransport( reuseLapse = 5 + ConnectionPool.expirationMargin )
+    self.pool.checkin( self.key, transport )
+    self.pool.evictIdle()
+    self.assertEqual( self.pool.getStats()[ 'idle' ], 1 )
+    #Pretend the idle time is over
+    self.pool._ConnectionPool__idle[ self.key ] = [ ( transport, 0 ) ]
+    self.pool.evictIdle()
+    self.assertTrue( transport.closed )
+    self.assertEqual( self.pool.getStats()[ 'idle' ], 0 )
+
+#############################################################################
+# Test Suite run
+#############################################################################
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ConnectionPoolTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
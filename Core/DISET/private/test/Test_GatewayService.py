@@ -0,0 +1,61 @@
+""" Test cases for DIRAC.Core.DISET.private.GatewayService
+"""
+
+__RCSID__ = "$Id$"
+
+import unittest
+
+from mock import MagicMock
+
+from DIRAC import S_OK
+
+# sut
+from DIRAC.Core.DISET.private.GatewayService import GatewayService
+
+class FakeThreadPool( object ):
+  """ Runs the queued jobs at once
+  """
+
+  def generateJobAndQueueIt( self, function, args = () ):
+    function( *args )
+
+class GatewayServiceTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    # Only what serving a connection needs, no configuration
+    self.gateway = GatewayService.__new__( GatewayService )
+    self.gateway._stats = { 'connections' : 0 }
+    self.gateway._monitor = MagicMock()
+    self.gateway._threadPool = FakeThreadPool()
+    self.gateway._executeAction = MagicMock( return_value = S_OK( 'Forwarded' ) )
+    self.transport = MagicMock()
+    self.transport.getConnectingCredentials.return_value = {}
+    self.transport.receiveData.return_value = S_OK( ( ( 'Framework/Test', 'Setup', 'VO' ), ( 'RPC', 'ping' ), None ) )
+    self.transport.getCompression.return_value = False
+    self.transport.getReuseLapse.return_value = 0
+    self.gateway._transportPool = MagicMock()
+    self.gateway._transportPool.add.return_value = 'trid'
+    self.gateway._transportPool.get.return_value = self.transport
+    self.gateway._transportPool.send.return_value = S_OK()
+
+  def test_handleConnection( self ):
+    self.gateway.handleConnection( self.transport )
+    self.assertTrue( self.transport.handshake.called )
+    self.assertTrue( self.gateway._executeAction.called )
+    self.gateway._transportPool.close.assert_called_with( 'trid' )
+
+  def test_handshakenConnection( self ):
+    self.gateway.handleConnection( self.transport, handshaken = True )
+    self.assertFalse( self.transport.handshake.called )
+    self.assertTrue( self.gateway._executeAction.called )
+    self.gateway._transportPool.close.assert_called_with( 'trid' )
+
+  def test_failedHandshake( self ):
+    self.transport.handshake.side_effect = Exception( 'Handshake failed' )
+    self.gateway.handleConnection( self.transport )
+    self.assertFalse( self.gateway._transportPool.add.called )
+    self.assertFalse( self.gateway._executeAction.called )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( GatewayServiceTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,57 @@
+""" Test cases for DIRAC.Core.DISET.private.Poller
+"""
+
+__RCSID__ = "$Id$"
+
+import socket
+import unittest
+
+# sut
+from DIRAC.Core.DISET.private.Poller import Poller
+
+class PollerTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.poller = Poller()
+    self.sock, self.peer = socket.socketpair()
+
+  def tearDown( self ):
+    self.poller.close()
+    self.sock.close()
+    self.peer.close()
+
+  def test_read( self ):
+    self.poller.register( self.sock.fileno(), Poller.READ )
+    self.assertEqual( self.poller.poll( 0 ), [] )
+    self.peer.send( "x" )
+    self.assertEqual( self.poller.poll( 1 ), [ ( self.sock.fileno(), Poller.READ ) ] )
+
+  def test_write( self ):
+    self.poller.register( self.sock.fileno(), Poller.WRITE )
+    self.assertEqual( self.poller.poll( 1 ), [ ( self.sock.fileno(), Poller.WRITE ) ] )
+    #Registering again changes the events
+    self.poller.register( self.sock.fileno(), Poller.READ )
+    self.assertEqual( self.poller.poll( 0 ), [] )
+
+  def test_unregister( self ):
+    self.poller.register( self.sock.fileno(), Poller.READ )
+    self.poller.unregister( self.sock.fileno() )
+    self.peer.send( "x" )
+    self.assertEqual( self.poller.poll( 0 ), [] )
+    #Unknown descriptors are ignored
+    self.poller.unregister( self.sock.fileno() )
+
+  def test_peerClosed( self ):
+    self.poller.register( self.sock.fileno(), Poller.READ )
+    self.peer.close()
+    ready = self.poller.poll( 1 )
+    self.assertEqual( len( ready ), 1 )
+    self.assertTrue( ready[0][1] & Poller.READ )
+
+#############################################################################
+# Test Suite run
+#############################################################################
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( PollerTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
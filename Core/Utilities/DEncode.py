@@ -21,6 +21,8 @@ _dateTimeObject = datetime.datetime.utcnow()
 _dateTimeType = type( _dateTimeObject )
 _dateType = type( _dateTimeObject.date() )
 _timeType = type( _dateTimeObject.time() )
+_stringType = types.StringType
+_intType = types.IntType
 
 g_dEncodeFunctions = {}
 g_dDecodeFunctions = {}
@@ -170,18 +172,49 @@ g_dEncodeFunctions[ types.NoneType ] = encodeNone
 g_dDecodeFunctions[ 'n' ] = decodeNone
 
 #Encode and decode a list
-def encodeList( lValue, eList ):
-  eList.append( "l" )
+#
+# Containers are what takes the time: strings and ints, by far the most common items
+# in DIRAC payloads, are handled inline instead of through one call per item.
+# Everything else still goes through the tables.
+
+def _encodeSequence( tag, lValue, eList ):
+  append = eList.append
+  extend = eList.extend
+  encodeTable = g_dEncodeFunctions
+  append( tag )
   for uObject in lValue:
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
-  eList.append( "e" )
+    oType = type( uObject )
+    if oType is _stringType:
+      extend( ( 's', str( len( uObject ) ), ':', uObject ) )
+    elif oType is _intType:
+      extend( ( "i", str( uObject ), "e" ) )
+    else:
+      encodeTable[ oType ]( uObject, eList )
+  append( "e" )
+
+def encodeList( lValue, eList ):
+  _encodeSequence( "l", lValue, eList )
 
 def decodeList( data, i ):
   oL = []
+  append = oL.append
+  index = data.index
+  decodeTable = g_dDecodeFunctions
   i += 1
-  while data[ i ] != "e":
-    ob, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
-    oL.append( ob )
+  tag = data[ i ]
+  while tag != "e":
+    if tag == "s":
+      colon = index( ":", i )
+      i = colon + 1 + int( data[ i + 1 : colon ] )
+      append( data[ colon + 1 : i ] )
+    elif tag == "i":
+      end = index( "e", i )
+      append( int( data[ i + 1 : end ] ) )
+      i = end + 1
+    else:
+      ob, i = decodeTable[ tag ]( data, i )
+      append( ob )
+    tag = data[ i ]
   return( oL, i + 1 )
 
 g_dEncodeFunctions[ types.ListType ] = encodeList
@@ -189,10 +222,7 @@ g_dDecodeFunctions[ "l" ] = decodeList
 
 #Encode and decode a tuple
 def encodeTuple( lValue, eList ):
-  eList.append( "t" )
-  for uObject in lValue:
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
-  eList.append( "e" )
+  _encodeSequence( "t", lValue, eList )
 
 def decodeTuple( data, i ):
   oL, i = decodeList( data, i )
@@ -203,42 +233,229 @@ g_dDecodeFunctions[ "t" ] = decodeTuple
 
 #Encode and decode a dictionary
 def encodeDict( dValue, eList ):
-  eList.append( "d" )
+  append = eList.append
+  extend = eList.extend
+  encodeTable = g_dEncodeFunctions
+  append( "d" )
   for key in sorted( dValue ):
-    g_dEncodeFunctions[ type( key ) ]( key, eList )
-    g_dEncodeFunctions[ type( dValue[key] ) ]( dValue[key], eList )
-  eList.append( "e" )
+    if type( key ) is _stringType:
+      extend( ( 's', str( len( key ) ), ':', key ) )
+    else:
+      encodeTable[ type( key ) ]( key, eList )
+    value = dValue[ key ]
+    oType = type( value )
+    if oType is _stringType:
+      extend( ( 's', str( len( value ) ), ':', value ) )
+    elif oType is _intType:
+      extend( ( "i", str( value ), "e" ) )
+    else:
+      encodeTable[ oType ]( value, eList )
+  append( "e" )
 
 def decodeDict( data, i ):
   oD = {}
+  index = data.index
+  decodeTable = g_dDecodeFunctions
   i += 1
-  while data[ i ] != "e":
-    k, i = g_dDecodeFunctions[ data[ i ] ]( data, i )
-    oD[ k ], i = g_dDecodeFunctions[ data[ i ] ]( data, i )
+  tag = data[ i ]
+  while tag != "e":
+    if tag == "s":
+      colon = index( ":", i )
+      i = colon + 1 + int( data[ i + 1 : colon ] )
+      key = data[ colon + 1 : i ]
+    else:
+      key, i = decodeTable[ tag ]( data, i )
+    tag = data[ i ]
+    if tag == "s":
+      colon = index( ":", i )
+      i = colon + 1 + int( data[ i + 1 : colon ] )
+      oD[ key ] = data[ colon + 1 : i ]
+    elif tag == "i":
+      end = index( "e", i )
+      oD[ key ] = int( data[ i + 1 : end ] )
+      i = end + 1
+    else:
+      oD[ key ], i = decodeTable[ tag ]( data, i )
+    tag = data[ i ]
   return ( oD, i + 1 )
 
 g_dEncodeFunctions[ types.DictType ] = encodeDict
 g_dDecodeFunctions[ "d" ] = decodeDict
 
 
+#Single-pass decoder
+#
+# Consumes exactly the same stream as decode(), but walks the structure in one loop
+# with an explicit stack instead of recursing, and handles the common tokens inline.
+# Anything it does not handle inline (datetimes, floats, extra registered types) goes
+# through the g_dDecodeFunctions table. It is the item decoder of iterDecode, which
+# needs to retry items cut by the end of a chunk cheaply and at any depth.
+
+def fastDecode( data, i = 0 ):
+  if not data:
+    return data
+  decodeTable = g_dDecodeFunctions
+  index = data.index
+  #Stack of ( container, kind, pending dict key, key is pending ) of the enclosing
+  #containers. kind is True for dicts, False for lists and None for tuples
+  stack = []
+  push = stack.append
+  pop = stack.pop
+  current = None
+  kind = False
+  key = None
+  haveKey = False
+  while True:
+    tag = data[ i ]
+    if tag == "s":
+      colon = index( ":", i )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      value = data[ colon + 1 : end ]
+      i = end
+    elif tag == "i":
+      end = index( "e", i )
+      value = int( data[ i + 1 : end ] )
+      i = end + 1
+    elif tag == "e":
+      if current is None or haveKey:
+        raise ValueError( "Unexpected end of container at position %s" % i )
+      i += 1
+      value = current
+      if kind is None:
+        value = tuple( value )
+      if not stack:
+        return ( value, i )
+      current, kind, key, haveKey = pop()
+    elif tag == "d" or tag == "l" or tag == "t":
+      push( ( current, kind, key, haveKey ) )
+      if tag == "d":
+        current = {}
+        kind = True
+      else:
+        current = []
+        kind = False if tag == "l" else None
+      haveKey = False
+      i += 1
+      continue
+    elif tag == "n":
+      value = None
+      i += 1
+    elif tag == "b":
+      value = data[ i + 1 ] != "0"
+      i += 2
+    elif tag == "u":
+      colon = index( ":", i )
+      end = colon + 1 + int( data[ i + 1 : colon ] )
+      value = unicode( data[ colon + 1 : end ], 'utf-8' )
+      i = end
+    elif tag == "I":
+      end = index( "e", i )
+      value = long( data[ i + 1 : end ] )
+      i = end + 1
+    else:
+      value, i = decodeTable[ tag ]( data, i )
+    if kind is True:
+      if haveKey:
+        current[ key ] = value
+        haveKey = False
+      else:
+        key = value
+        haveKey = True
+    elif current is None:
+      return ( value, i )
+    else:
+      current.append( value )
+
+#Incremental decoding
+
+class _IncompleteData( Exception ):
+  pass
+
+def iterDecode( chunks, depth = 1 ):
+  """ Decode a DEncoded stream delivered in pieces, without ever holding it whole.
+
+      chunks is an iterable of strings which, concatenated, make one DEncoded object.
+      Dictionaries and lists down to depth levels are walked without being built, and
+      ( keyPath, value ) is yielded for every value found at that depth (or above it, if
+      it is not a dictionary or a list), keyPath being the tuple of dictionary keys and
+      list indexes leading to it. Only the current chunk and the item being decoded are
+      kept in memory. ValueError is raised if the stream ends before the object does.
+  """
+  chunks = iter( chunks )
+  exhausted = False
+  data = ""
+  i = 0
+  #Containers being walked as [ isDict, next list index ]
+  stack = []
+  keyPath = []
+  while True:
+    try:
+      dataLen = len( data )
+      if i >= dataLen:
+        raise _IncompleteData()
+      if len( keyPath ) < len( stack ):
+        #Next key of a dictionary, next index of a list, or end of the container
+        if data[ i ] == "e":
+          i += 1
+          stack.pop()
+          if not stack:
+            return
+          keyPath.pop()
+        elif stack[-1][0]:
+          key, end = fastDecode( data, i )
+          if end > dataLen or ( end == dataLen and not exhausted ):
+            raise _IncompleteData()
+          keyPath.append( key )
+          i = end
+        else:
+          keyPath.append( stack[-1][1] )
+          stack[-1][1] += 1
+        continue
+      tag = data[ i ]
+      if len( stack ) < depth and ( tag == "d" or tag == "l" ):
+        stack.append( [ tag == "d", 0 ] )
+        i += 1
+        continue
+      value, end = fastDecode( data, i )
+      #A complete item is followed at least by the end of its container, and a
+      #truncated string value does not raise, hence the check
+      if end > dataLen or ( end == dataLen and not exhausted ):
+        raise _IncompleteData()
+      i = end
+    except ( _IncompleteData, IndexError, ValueError ):
+      if exhausted:
+        raise ValueError( "DEncoded stream ended in the middle of an object" )
+      #Keep the undecoded tail and append at least one chunk. If the tail was already
+      #big, read until its size doubles so that a big item is not retried too often
+      pending = bytearray( buffer( data, i ) )
+      tailSize = len( pending )
+      while True:
+        try:
+          pending.extend( chunks.next() )
+        except StopIteration:
+          exhausted = True
+          break
+        if len( pending ) >= 2 * tailSize:
+          break
+      data = str( pending )
+      del pending
+      i = 0
+      continue
+    yield ( tuple( keyPath ), value )
+    if not stack:
+      return
+    keyPath.pop()
+
 #Encode function
 def encode( uObject ):
-  try:
-    eList = []
-    #print "ENCODE FUNCTION : %s" % g_dEncodeFunctions[ type( uObject ) ]
-    g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
-    return "".join( eList )
-  except Exception:
-    raise
+  eList = []
+  g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+  return "".join( eList )
 
 def decode( data ):
   if not data:
     return data
-  try:
-    #print "DECODE FUNCTION : %s" % g_dDecodeFunctions[ sStream [ iIndex ] ]
-    return g_dDecodeFunctions[ data[ 0 ] ]( data, 0 )
-  except Exception:
-    raise
+  return g_dDecodeFunctions[ data[ 0 ] ]( data, 0 )
 
 
 if __name__ == "__main__":
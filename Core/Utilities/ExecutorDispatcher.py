@@ -16,20 +16,23 @@ class ExecutorState( object ):
     self.__lock = threading.Lock()
     self.__typeToId = {}
     self.__maxTasks = {}
+    self.__maxBatch = {}
     self.__execTasks = {}
     self.__taskInExec = {}
 
   def _internals( self ):
     return { 'type2id' : dict( self.__typeToId ),
              'maxTasks' : dict( self.__maxTasks ),
+             'maxBatch' : dict( self.__maxBatch ),
              'execTasks' : dict( self.__execTasks ),
              'tasksInExec' : dict( self.__taskInExec ),
              'locked' : self.__lock.locked() }
 
-  def addExecutor( self, eId, eTypes, maxTasks = 1 ):
+  def addExecutor( self, eId, eTypes, maxTasks = 1, maxBatch = 1 ):
     self.__lock.acquire()
     try:
       self.__maxTasks[ eId ] = max( 1, maxTasks )
+      self.__maxBatch[ eId ] = max( 1, maxBatch )
       if eId not in self.__execTasks:
         self.__execTasks[ eId ] = set()
       if type( eTypes ) not in ( types.ListType, types.TupleType ):
@@ -53,6 +56,7 @@ class ExecutorState( object ):
         tasks.append( taskId )
       self.__execTasks.pop( eId )
       self.__maxTasks.pop( eId )
+      self.__maxBatch.pop( eId )
       return tasks
     finally:
       self.__lock.release()
@@ -75,6 +79,12 @@ class ExecutorState( object ):
     except KeyError:
       return 0
 
+  def batchSize( self, eId ):
+    try:
+      return min( self.__maxBatch[ eId ], self.freeSlots( eId ) )
+    except KeyError:
+      return 0
+
   def getFreeExecutors( self, eType ):
     execs = {}
     try:
@@ -136,6 +146,14 @@ class ExecutorState( object ):
       self.__lock.release()
 
 class ExecutorQueues:
+  """
+    Waiting queues of the tasks per executor type. Each queue is split in lanes ( per owner group,
+    job type... ). Lanes are served in proportion to their weight ( 1 by default ) with stride
+    scheduling: a lane with twice the weight of another gets twice as many tasks popped while both
+    have tasks waiting, and a lane never waits behind a crowded one.
+  """
+
+  DEFAULT_LANE = "Default"
 
   def __init__( self, log = False ):
     if log:
@@ -146,86 +164,172 @@ class ExecutorQueues:
     self.__queues = {}
     self.__lastUse = {}
     self.__taskInQueue = {}
+    self.__laneWeights = {}
+    self.__lanePass = {}
+    self.__globalPass = {}
+    self.__laneWaits = {}
 
   def _internals( self ):
-    return { 'queues' : dict( self.__queues ),
+    return { 'queues' : dict( [ ( eType, dict( self.__queues[ eType ] ) ) for eType in self.__queues ] ),
              'lastUse' : dict( self.__lastUse ),
              'taskInQueue' : dict( self.__taskInQueue ),
+             'laneWeights' : dict( self.__laneWeights ),
+             'lanePass' : dict( self.__lanePass ),
              'locked' : self.__lock.locked() }
 
   def getExecutorList( self ):
     return [ eType for eType in self.__queues ]
 
-  def pushTask( self, eType, taskId, ahead = False ):
-    self.__log.verbose( "Pushing task %s into waiting queue for executor %s" % ( taskId, eType ) )
+  def setLaneWeights( self, laneWeights ):
+    self.__lock.acquire()
+    try:
+      self.__laneWeights = dict( [ ( lane, max( 0.001, float( laneWeights[ lane ] ) ) ) for lane in laneWeights ] )
+    finally:
+      self.__lock.release()
+
+  def __laneWeight( self, lane ):
+    try:
+      return self.__laneWeights[ lane ]
+    except KeyError:
+      return 1.0
+
+  def __waitingInType( self, eType ):
+    return sum( [ len( laneQueue ) for laneQueue in self.__queues[ eType ].values() ] )
+
+  def pushTask( self, eType, taskId, ahead = False, lane = False ):
+    if not lane:
+      lane = self.DEFAULT_LANE
+    self.__log.verbose( "Pushing task %s into %s lane of the waiting queue for executor %s" % ( taskId, lane, eType ) )
     self.__lock.acquire()
     try:
       if taskId in self.__taskInQueue:
-        if self.__taskInQueue[ taskId ] != eType:
+        if self.__taskInQueue[ taskId ][0] != eType:
           errMsg = "Task %s cannot be queued because it's already queued for %s" % ( taskId,
-                                                                                    self.__taskInQueue[ taskId ] )
+                                                                                    self.__taskInQueue[ taskId ][0] )
           self.__log.fatal( errMsg )
           return 0
         else:
-          return len( self.__queues[ eType ] )
+          return self.__waitingInType( eType )
       if eType not in self.__queues:
-        self.__queues[ eType ] = []
+        self.__queues[ eType ] = {}
+        self.__lanePass[ eType ] = {}
+        self.__globalPass[ eType ] = 0.0
+      eQueues = self.__queues[ eType ]
+      if not eQueues.get( lane ):
+        #A lane becoming active does not get the turns it missed while it was empty
+        eQueues[ lane ] = []
+        self.__lanePass[ eType ][ lane ] = max( self.__lanePass[ eType ].get( lane, 0.0 ),
+                                                self.__globalPass[ eType ] )
       self.__lastUse[ eType ] = time.time()
       if ahead:
-        self.__queues[ eType ].insert( 0, taskId )
+        eQueues[ lane ].insert( 0, taskId )
       else:
-        self.__queues[ eType ].append( taskId )
-      self.__taskInQueue[ taskId ] = eType
-      return len( self.__queues[ eType ] )
+        eQueues[ lane ].append( taskId )
+      self.__taskInQueue[ taskId ] = ( eType, lane, time.time() )
+      return self.__waitingInType( eType )
     finally:
       self.__lock.release()
 
-  def popTask( self, eTypes ):
+  def __nextLane( self, eType ):
+    bestLane = None
+    for lane in self.__queues[ eType ]:
+      if not self.__queues[ eType ][ lane ]:
+        continue
+      if bestLane == None or ( self.__lanePass[ eType ][ lane ], lane ) < ( self.__lanePass[ eType ][ bestLane ], bestLane ):
+        bestLane = lane
+    return bestLane
+
+  def popTasks( self, eTypes, maxTasks = 1 ):
+    """ Pop up to maxTasks tasks waiting for the first of eTypes with tasks waiting
+        Returns ( eType, [ taskId ] ) or None if there is no task
+    """
     if type( eTypes ) not in ( types.ListType, types.TupleType ):
       eTypes = [ eTypes ]
     self.__lock.acquire()
-    for eType in eTypes:
-      try:
-        taskId = self.__queues[ eType ].pop( 0 )
-        del( self.__taskInQueue[ taskId ] )
-        #Found! release and return!
-        self.__lock.release()
+    try:
+      for eType in eTypes:
+        if eType not in self.__queues:
+          continue
+        taskIds = []
+        while len( taskIds ) < maxTasks:
+          lane = self.__nextLane( eType )
+          if lane == None:
+            break
+          taskId = self.__queues[ eType ][ lane ].pop( 0 )
+          pushTime = self.__taskInQueue.pop( taskId )[2]
+          self.__globalPass[ eType ] = self.__lanePass[ eType ][ lane ]
+          self.__lanePass[ eType ][ lane ] += 1.0 / self.__laneWeight( lane )
+          if lane not in self.__laneWaits:
+            self.__laneWaits[ lane ] = []
+          self.__laneWaits[ lane ].append( time.time() - pushTime )
+          taskIds.append( taskId )
+        if not taskIds:
+          continue
+        #Found! return!
         self.__lastUse[ eType ] = time.time()
-        self.__log.verbose( "Popped task %s from executor %s waiting queue" % ( taskId, eType ) )
-        return ( taskId, eType )
-      except IndexError:
-        continue
-      except KeyError:
-        continue
-    self.__lock.release()
-    #Not found. release and return None
+        self.__log.verbose( "Popped tasks %s from executor %s waiting queue" % ( taskIds, eType ) )
+        return ( eType, taskIds )
+    finally:
+      self.__lock.release()
+    #Not found. return None
     return None
 
+  def popTask( self, eTypes ):
+    pData = self.popTasks( eTypes )
+    if pData == None:
+      return None
+    return ( pData[1][0], pData[0] )
+
   def getState( self ):
     self.__lock.acquire()
     try:
       qInfo = {}
       for qName in self.__queues:
-        qInfo[ qName ] = list( self.__queues[ qName ] )
+        qInfo[ qName ] = []
+        for lane in sorted( self.__queues[ qName ] ):
+          qInfo[ qName ].extend( self.__queues[ qName ][ lane ] )
     finally:
       self.__lock.release()
     return qInfo
 
+  def getLaneState( self ):
+    """ Get the number of tasks waiting per executor type and lane
+    """
+    self.__lock.acquire()
+    try:
+      lInfo = {}
+      for eType in self.__queues:
+        lInfo[ eType ] = dict( [ ( lane, len( laneQueue ) ) for lane, laneQueue in self.__queues[ eType ].items() ] )
+    finally:
+      self.__lock.release()
+    return lInfo
+
+  def getLaneWaits( self ):
+    """ Get and forget the times the tasks popped since the last call have waited, per lane
+    """
+    self.__lock.acquire()
+    try:
+      laneWaits = self.__laneWaits
+      self.__laneWaits = {}
+    finally:
+      self.__lock.release()
+    return laneWaits
+
   def deleteTask( self, taskId ):
     self.__log.verbose( "Deleting task %s from waiting queues" % taskId )
     self.__lock.acquire()
     try:
       try:
-        eType = self.__taskInQueue[ taskId ]
+        eType, lane, _pushTime = self.__taskInQueue[ taskId ]
         del( self.__taskInQueue[ taskId ] )
         self.__lastUse[ eType ] = time.time()
       except KeyError:
         return False
       try:
-        iPos = self.__queues[ eType ].index( taskId )
+        iPos = self.__queues[ eType ][ lane ].index( taskId )
       except ValueError:
         return False
-      del( self.__queues[ eType ][ iPos ] )
+      del( self.__queues[ eType ][ lane ][ iPos ] )
       return True
     finally:
       self.__lock.release()
@@ -234,7 +338,7 @@ class ExecutorQueues:
     self.__lock.acquire()
     try:
       try:
-        return len( self.__queues[ eType ] )
+        return self.__waitingInType( eType )
       except KeyError:
         return 0
     finally:
@@ -248,6 +352,20 @@ class ExecutorDispatcherCallbacks:
   def cbSendTask( self, taskId, taskObj, eId, eType ):
     return S_ERROR( "No send task callback defined" )
 
+  def cbSendTasks( self, taskIds, taskObjs, eId, eType ):
+    """ Send several tasks to an executor at once
+        Returns S_OK( { taskId : errorMsg } ) with the tasks that could not be sent
+    """
+    failed = {}
+    for taskId, taskObj in zip( taskIds, taskObjs ):
+      result = self.cbSendTask( taskId, taskObj, eId, eType )
+      if not result[ 'OK' ]:
+        failed[ taskId ] = result[ 'Message' ]
+    return S_OK( failed )
+
+  def cbTaskLane( self, taskId, taskObj ):
+    return S_OK( False )
+
   def cbDisconectExecutor( self, eId ):
     return S_ERROR( "No disconnect callback defined" )
 
@@ -276,6 +394,7 @@ class ExecutorDispatcher:
       self.eType = False
       self.sendTime = 0
       self.retries = 0
+      self.lane = None
 
     def __repr__( self ):
       rS = "<ETask %s" % self.taskId
@@ -299,6 +418,7 @@ class ExecutorDispatcher:
     self.__states = ExecutorState( self.__log )
     self.__cbHolder = ExecutorDispatcherCallbacks()
     self.__monitor = monitor
+    self.__monitoredLanes = set()
     gThreadScheduler.addPeriodicTask( 60, self.__doPeriodicStuff )
     #If a task is frozen too many times, send error or forget task?
     self.__failedOnTooFrozen = True
@@ -323,6 +443,10 @@ class ExecutorDispatcher:
   def setFreezeOnUnknownExecutor( self, value ):
     self.__freezeOnUnknownExecutor = value
 
+  def setLaneWeights( self, laneWeights ):
+    #Share of the executors each lane gets when several have tasks waiting. Unknown lanes weight 1
+    self.__queues.setLaneWeights( laneWeights )
+
 
   def _internals( self ):
     return { 'idMap' : dict( self.__idMap ),
@@ -355,8 +479,24 @@ class ExecutorDispatcher:
       except KeyError:
         pass
     self.__monitor.addMark( "executors", len( self.__idMap ) )
-
-  def addExecutor( self, eId, eTypes, maxTasks = 1 ):
+    laneDepths = {}
+    laneState = self.__queues.getLaneState()
+    for eType in laneState:
+      for lane in laneState[ eType ]:
+        laneDepths[ lane ] = laneDepths.get( lane, 0 ) + laneState[ eType ][ lane ]
+    laneWaits = self.__queues.getLaneWaits()
+    for lane in set( laneDepths ).union( laneWaits ):
+      if lane not in self.__monitoredLanes:
+        self.__monitoredLanes.add( lane )
+        self.__monitor.registerActivity( "queueDepth-%s" % lane, "Tasks waiting in %s lane" % lane,
+                                         "Executors", "tasks", self.__monitor.OP_MEAN, 300 )
+        self.__monitor.registerActivity( "queueTime-%s" % lane, "Waiting time of the tasks in %s lane" % lane,
+                                         "Executors", "seconds", self.__monitor.OP_MEAN, 300 )
+      self.__monitor.addMark( "queueDepth-%s" % lane, laneDepths.get( lane, 0 ) )
+      for waitTime in laneWaits.get( lane, [] ):
+        self.__monitor.addMark( "queueTime-%s" % lane, waitTime )
+
+  def addExecutor( self, eId, eTypes, maxTasks = 1, maxBatch = 1 ):
     self.__log.verbose( "Adding new %s executor to the pool %s" % ( eId, ", ".join ( eTypes ) ) )
     self.__executorsLock.acquire()
     try:
@@ -365,7 +505,7 @@ class ExecutorDispatcher:
       if type( eTypes ) not in ( types.ListType, types.TupleType ):
         eTypes = [ eTypes ]
       self.__idMap[ eId ] = list( eTypes )
-      self.__states.addExecutor( eId, eTypes, maxTasks )
+      self.__states.addExecutor( eId, eTypes, maxTasks, maxBatch )
       for eType in eTypes:
         if eType not in self.__execTypes:
           self.__execTypes[ eType ] = 0
@@ -397,9 +537,9 @@ class ExecutorDispatcher:
           eTask = self.__tasks[ taskId ]
         except KeyError:
           #Task already removed
-          pass
+          continue
         if eTask.eType:
-          self.__queues.pushTask( eTask.eType, taskId, ahead = True )
+          self.__queueTask( eTask.eType, taskId, ahead = True )
         else:
           self.__dispatchTask( taskId )
     finally:
@@ -507,6 +647,31 @@ class ExecutorDispatcher:
     except KeyError:
       return None
 
+  def __getTaskLane( self, taskId ):
+    try:
+      eTask = self.__tasks[ taskId ]
+    except KeyError:
+      return False
+    #The lane depends on things that do not change ( owner, type ), ask once
+    if eTask.lane != None:
+      return eTask.lane
+    try:
+      result = self.__cbHolder.cbTaskLane( taskId, eTask.taskObj )
+    except:
+      self.__log.exception( "Exception while calling task lane callback" )
+      result = S_ERROR( "Exception while calling task lane callback" )
+    if not isReturnStructure( result ):
+      self.__log.fatal( "Task lane callback did not return a S_OK/S_ERROR structure" )
+      result = S_ERROR( "Task lane callback did not return a S_OK/S_ERROR structure" )
+    if not result[ 'OK' ]:
+      self.__log.warn( "Could not get the lane of task %s, using the default one: %s" % ( taskId, result[ 'Message' ] ) )
+      return False
+    eTask.lane = result[ 'Value' ]
+    return eTask.lane
+
+  def __queueTask( self, eType, taskId, ahead = False ):
+    return self.__queues.pushTask( eType, taskId, ahead = ahead, lane = self.__getTaskLane( taskId ) )
+
   def __dispatchTask( self, taskId, defrozeIfNeeded = True ):
     self.__log.verbose( "Dispatching task %s" % taskId )
     #If task already in executor skip
@@ -542,7 +707,7 @@ class ExecutorDispatcher:
       self.__log.verbose( "Executor type %s has not connected. Forgetting task %s" % ( eType, taskId ) )
       return self.removeTask( taskId )
 
-    self.__queues.pushTask( eType, taskId )
+    self.__queueTask( eType, taskId )
     self.__fillExecutors( eType, defrozeIfNeeded = defrozeIfNeeded )
     return S_OK()
 
@@ -748,11 +913,13 @@ class ExecutorDispatcher:
       result = self.__sendTaskToExecutor( eId, eType )
       if not result[ 'OK' ]:
         self.__log.error( "Could not send task to executor", "%s" % result[ 'Message' ] )
+        #The tasks are back in the queue, trying again right now would fail the same way
+        break
       else:
         if not result[ 'Value' ]:
           #No more tasks for eType
           break
-        self.__log.verbose( "Task %s was sent to %s" % ( result[ 'Value'], eId ) )
+        self.__log.verbose( "Tasks %s were sent to %s" % ( result[ 'Value'], eId ) )
       eId = self.__states.getIdleExecutor( eType )
     self.__log.verbose( "No more idle executors for %s" % eType )
 
@@ -773,40 +940,60 @@ class ExecutorDispatcher:
         except ValueError:
           pass
         searchTypes.append( eType )
-    pData = self.__queues.popTask( searchTypes ) 
+    pData = self.__queues.popTasks( searchTypes, max( 1, self.__states.batchSize( eId ) ) )
     if pData == None:
       self.__log.verbose( "No more tasks for %s" % eTypes )
       return S_OK()
-    taskId, eType = pData
-    self.__log.verbose( "Sending task %s to %s=%s" % ( taskId, eType, eId ) )
-    self.__states.addTask( eId, taskId )
-    result = self.__msgTaskToExecutor( taskId, eId, eType )
+    eType, taskIds = pData
+    self.__log.verbose( "Sending tasks %s to %s=%s" % ( taskIds, eType, eId ) )
+    for taskId in taskIds:
+      self.__states.addTask( eId, taskId )
+    result = self.__msgTasksToExecutor( taskIds, eId, eType )
     if not result[ 'OK' ]:
-      self.__queues.pushTask( eType, taskId, ahead = True )
-      self.__states.removeTask( taskId )
-      return result
-    return S_OK( taskId )
-
-  def __msgTaskToExecutor( self, taskId, eId, eType ):
-    try:
-      self.__tasks[ taskId ].sendTime = time.time()
-    except KeyError:
-      return S_ERROR( "Task %s has been deleted" % taskId )
+      failed = dict( [ ( taskId, result[ 'Message' ] ) for taskId in taskIds ] )
+    else:
+      failed = result[ 'Value' ]
+    #Failed tasks go back where they were
+    for taskId in reversed( taskIds ):
+      if taskId in failed:
+        self.__queueTask( eType, taskId, ahead = True )
+        self.__states.removeTask( taskId )
+    sentIds = [ taskId for taskId in taskIds if taskId not in failed ]
+    if not sentIds:
+      return S_ERROR( "Could not send tasks: %s" % "; ".join( [ "%s: %s" % ( taskId, failed[ taskId ] ) for taskId in taskIds ] ) )
+    return S_OK( sentIds )
+
+  def __msgTasksToExecutor( self, taskIds, eId, eType ):
+    taskObjs = []
+    failed = {}
+    for taskId in taskIds:
+      try:
+        self.__tasks[ taskId ].sendTime = time.time()
+        taskObjs.append( self.__tasks[ taskId ].taskObj )
+      except KeyError:
+        failed[ taskId ] = "Task %s has been deleted" % taskId
+    toSend = [ taskId for taskId in taskIds if taskId not in failed ]
+    if not toSend:
+      return S_OK( failed )
     try:
-      result = self.__cbHolder.cbSendTask( taskId, self.__tasks[ taskId ].taskObj, eId, eType )
+      if len( toSend ) == 1:
+        result = self.__cbHolder.cbSendTask( toSend[0], taskObjs[0], eId, eType )
+        if isReturnStructure( result ) and not result[ 'OK' ]:
+          result = S_OK( { toSend[0] : result[ 'Message' ] } )
+      else:
+        result = self.__cbHolder.cbSendTasks( toSend, taskObjs, eId, eType )
     except:
-      self.__log.exception( "Exception while sending task to executor" )
-      return S_ERROR( "Exception while sending task to executor" )
-    if isReturnStructure( result ):
-      return result
-    else:
+      self.__log.exception( "Exception while sending tasks to executor" )
+      return S_ERROR( "Exception while sending tasks to executor" )
+    if not isReturnStructure( result ):
       errMsg = "Send task callback did not send back an S_OK/S_ERROR structure"
       self.__log.fatal( errMsg )
-      return S_ERROR( "Send task callback did not send back an S_OK/S_ERROR structure" )
-    #Seems an executor problem
-    self.__log.verbose( "Disconnecting executor" )
-    self.removeExecutor( eId )
-    return S_ERROR( "Exception while sending task to executor" )
+      return S_ERROR( errMsg )
+    if not result[ 'OK' ]:
+      return result
+    if result[ 'Value' ]:
+      failed.update( result[ 'Value' ] )
+    return S_OK( failed )
 
 if __name__ == "__main__":
   def testExecState():
@@ -39,6 +39,16 @@
     Returns S_OK with fetchall() out in Value or S_ERROR upon failure.
 
 
+    _queryIter( cmd, [batchSize], [conn] )
+
+    Executes SQL command "cmd" with an unbuffered server side cursor on a
+    connection of its own, or on the connection "conn" if given. Returns S_OK
+    with a QueryIterator in Value, which gives the rows in lists of at most
+    "batchSize" rows without holding the whole result in memory, or S_ERROR
+    upon failure. The connection is given back when the iterator is exhausted
+    or closed.
+
+
     _update( cmd, [conn] )
 
     Executes SQL command "cmd" and issue a commit
@@ -59,7 +69,22 @@
     Gets a connection from the Queue (or open a new one if none is available)
     Returns S_OK with connection in Value or S_ERROR
     the calling method is responsible for closing this connection once it is no
-    longer needed.
+    longer needed. Closing it gives it back to the pool, it is also given back
+    when it is garbage collected.
+
+
+    insertMany( tableName, fields, rows, [conn], [ignore] )
+    updateMany( tableName, updateFields, keyFields, rows, [conn] )
+
+    Bulk writes of many rows with parameterized queries, chunked to fit in
+    the max_allowed_packet of the server. The statements are built once per
+    table and fields.
+
+
+    With maxConnections set, at most maxConnections are open to the server.
+    The connection of a thread is checked out while it is in use by a _query,
+    _update, an open transaction or a connection of _getConnection not closed
+    yet, and threads wait for a free one up to connectionWaitTimeout seconds.
 
 
 
@@ -148,9 +173,11 @@
 """
 
 import collections
+import functools
 import time
 import threading
 import MySQLdb
+from MySQLdb.cursors import SSCursor
 
 from DIRAC                      import gLogger
 from DIRAC                      import S_OK, S_ERROR
@@ -170,6 +197,10 @@ __RCSID__ = "$Id$"
 
 
 MAXCONNECTRETRY = 10
+# Rows sent at most in a single query by the bulk methods
+MAXBULKROWS = 10000
+# Rows given at once by the iterators of _queryIter
+QUERYITERBATCH = 1000
 
 def _checkFields( inFields, inValues ):
   """
@@ -207,6 +238,113 @@ def _quotedList( fieldList = None ):
   return ', '.join( quotedFields )
 
 
+def _sqlValueSize( value ):
+  """
+    Size of a value in a query, with its quotes
+  """
+  return len( str( value ) ) + 2
+
+
+class PooledConnection( object ):
+  """
+    Connection given by _getConnection. The connection of the thread stays checked out
+    of the pool until it is closed or garbage collected, the rest goes to the MySQLdb
+    connection.
+  """
+
+  def __init__( self, conn, release ):
+    self.__conn = conn
+    self.__release = release
+
+  def __getattr__( self, name ):
+    return getattr( self.__conn, name )
+
+  def close( self ):
+    """ Give back the connection to the pool. It is kept open for the next queries
+    """
+    release = self.__release
+    self.__release = None
+    if release:
+      release()
+
+  def __del__( self ):
+    try:
+      self.close()
+    except Exception:
+      pass
+
+
+class QueryIterator( object ):
+  """
+    Iterator over the result of a query executed with an unbuffered cursor.
+    Each step gives a list of at most batchSize rows.
+
+    The rows are kept on the server side until they are read, so the connection
+    can not be used for anything else meanwhile. It is given back to the pool once
+    all the rows have been read, and closed if the iteration ends before (close(),
+    leaving a with block or garbage collection).
+  """
+
+  def __init__( self, cursor, batchSize, release ):
+    self.__cursor = cursor
+    self.__batchSize = max( 1, int( batchSize ) )
+    self.__release = release
+    self.__exhausted = False
+    self.rowsRead = 0
+
+  def __iter__( self ):
+    return self
+
+  def next( self ):
+    if not self.__cursor:
+      raise StopIteration
+    try:
+      rows = self.__cursor.fetchmany( self.__batchSize )
+    except Exception:
+      self.close()
+      raise
+    if not rows:
+      self.__exhausted = True
+      self.close()
+      raise StopIteration
+    self.rowsRead += len( rows )
+    return list( rows )
+
+  def close( self ):
+    """ Give back the connection, it is closed unless all the rows were read
+    """
+    if not self.__cursor:
+      return
+    cursor = self.__cursor
+    self.__cursor = None
+    if self.__exhausted:
+      try:
+        cursor.close()
+      except Exception:
+        self.__exhausted = False
+      self.__release( self.__exhausted )
+      return
+    #Closing the cursor would read all the pending rows, close the connection first
+    self.__release( False )
+    try:
+      cursor.close()
+    except Exception:
+      pass
+
+  def __enter__( self ):
+    return self
+
+  def __exit__( self, excType, excValue, traceback ):
+    self.close()
+    return False
+
+  def __del__( self ):
+    try:
+      self.close()
+    except Exception:
+      pass
+
+
 class MySQL( object ):
   """
   Basic multithreaded DIRAC MySQL Client Class
@@ -216,9 +354,20 @@ class MySQL( object ):
   class ConnectionPool( object ):
     """
     Management of connections per thread
+
+    By default each thread keeps its connection, and at most 10 spare connections are kept.
+    If maxConnections is set, no more than maxConnections are opened. A connection is then
+    checked out for a query and checked in once done, threads wait up to waitTimeout seconds
+    for a free one when all of them are in use. The gets of a thread are counted, its connection
+    is checked in when all of them have been released and no transaction is open in it.
     """
 
-    def __init__( self, host, user, passwd, port = 3306, graceTime = 600 ):
+    #Connections idle for longer are pinged before being used
+    __pingIdleTime = 60
+    #Seconds between cleanings of the connections of dead or idle threads
+    __cleanPeriod = 10
+
+    def __init__( self, host, user, passwd, port = 3306, graceTime = 600, maxConnections = 0, waitTimeout = 30 ):
       self.__host = host
       self.__user = user
       self.__passwd = passwd
@@ -228,20 +377,78 @@ class MySQL( object ):
       self.__maxSpares = 10
       self.__lastClean = 0
       self.__assigned = {}
+      self.__maxConnections = maxConnections
+      self.__waitTimeout = waitTimeout
+      self.__openConnections = 0
+      self.__poolCondition = threading.Condition()
+      self.__inTransaction = set()
+      #Gets not released yet, by thread
+      self.__holds = {}
+      self.__stats = {}
 
     @property
     def __thid( self ):
       return threading.current_thread()
 
-    def __newConn( self ):
+    def setMaxConnections( self, maxConnections, waitTimeout ):
+      """ Raise the limits of a bounded pool. The mode of the pool is set by its first user
+      """
+      if not self.__maxConnections:
+        return
+      self.__maxConnections = max( self.__maxConnections, maxConnections )
+      self.__waitTimeout = max( self.__waitTimeout, waitTimeout )
+
+    def __count( self, dbName, key, value = 1 ):
+      self.__poolCondition.acquire()
+      try:
+        if dbName not in self.__stats:
+          self.__stats[ dbName ] = { 'Checkouts' : 0, 'Waits' : 0, 'WaitTime' : 0.0, 'Timeouts' : 0,
+                                     'Created' : 0, 'Closed' : 0 }
+        self.__stats[ dbName ][ key ] += value
+      finally:
+        self.__poolCondition.release()
+
+    def getStats( self, dbName ):
+      """ Usage counters of the pool by dbName, together with the current state of the pool
+      """
+      self.__poolCondition.acquire()
+      try:
+        stats = dict( self.__stats.get( dbName, {} ) )
+        stats[ 'MaxConnections' ] = self.__maxConnections
+        stats[ 'SpareConnections' ] = len( self.__spares )
+        stats[ 'AssignedConnections' ] = len( self.__assigned )
+        if self.__maxConnections:
+          stats[ 'OpenConnections' ] = self.__openConnections
+        else:
+          stats[ 'OpenConnections' ] = len( self.__spares ) + len( self.__assigned )
+      finally:
+        self.__poolCondition.release()
+      return stats
+
+    def __newConn( self, dbName ):
       conn = MySQLdb.connect( host = self.__host,
                               port = self.__port,
                               user = self.__user,
                               passwd = self.__passwd )
 
       self.__execute( conn, "SET AUTOCOMMIT=1" )
+      self.__count( dbName, 'Created' )
       return conn
 
+    def __close( self, conn, dbName ):
+      try:
+        conn.close()
+      except Exception:
+        pass
+      self.__count( dbName, 'Closed' )
+      if self.__maxConnections:
+        self.__poolCondition.acquire()
+        try:
+          self.__openConnections -= 1
+          self.__poolCondition.notify()
+        finally:
+          self.__poolCondition.release()
+
     def __execute( self, conn, cmd ):
       cursor = conn.cursor()
       res = cursor.execute( cmd )
@@ -251,8 +458,18 @@ class MySQL( object ):
 
     def get( self, dbName, retries = 10 ):
       retries = max( 0, min( MAXCONNECTRETRY, retries ) )
-      self.clean()
-      return self.__getWithRetry( dbName, retries, retries )
+      now = time.time()
+      if now - self.__lastClean > self.__cleanPeriod:
+        self.clean( now )
+      result = self.__getWithRetry( dbName, retries, retries )
+      if result[ 'OK' ] and self.__maxConnections:
+        thid = self.__thid
+        self.__poolCondition.acquire()
+        try:
+          self.__holds[ thid ] = self.__holds.get( thid, 0 ) + 1
+        finally:
+          self.__poolCondition.release()
+      return result
 
 
     def __getWithRetry( self, dbName, totalRetries, retriesLeft ):
@@ -260,17 +477,16 @@ class MySQL( object ):
       if sleepTime > 0:
         time.sleep( sleepTime )
       try:
-        conn, lastName, thid = self.__innerGet()
+        conn, lastName, thid, lastUse = self.__innerGet( dbName )
       except MySQLdb.MySQLError, excp:
         if retriesLeft >= 0:
           return self.__getWithRetry( dbName, totalRetries, retriesLeft - 1 )
         return S_ERROR( DErrno.EMYSQL, "Could not connect: %s" % excp )
+      if not conn:
+        return S_ERROR( DErrno.EMYSQL, "No free connection to %s after %s seconds" % ( dbName, self.__waitTimeout ) )
 
-      if not self.__ping( conn ):
-        try:
-          self.__assigned.pop( thid )
-        except KeyError:
-          pass
+      if time.time() - lastUse > self.__pingIdleTime and not self.__ping( conn ):
+        self.__discard( thid )
         if retriesLeft >= 0:
           return self.__getWithRetry( dbName, totalRetries, retriesLeft )
         return S_ERROR( DErrno.EMYSQL, "Could not connect" )
@@ -298,33 +514,173 @@ class MySQL( object ):
       except:
         return False
 
-    def __innerGet( self ):
+    def __innerGet( self, dbName ):
       thid = self.__thid
       now = time.time()
       if thid in self.__assigned:
         data = self.__assigned[ thid ]
-        conn = data[0]
+        lastUse = data[2]
         data[2] = now
-        return data[0], data[1], thid
+        return data[0], data[1], thid, lastUse
       # Not cached
+      if self.__maxConnections:
+        conn, connName, lastUse = self.__checkout( dbName )
+        if not conn:
+          return None, "", thid, 0
+      else:
+        self.__count( dbName, 'Checkouts' )
+        try:
+          conn, connName, lastUse = self.__spares.pop()
+        except IndexError:
+          conn = self.__newConn( dbName )
+          connName = ""
+          lastUse = now
+
+      self.__assigned[ thid ] = [ conn, connName, now ]
+      return conn, connName, thid, lastUse
+
+    def __checkout( self, dbName ):
+      """ Take a spare connection, or open a new one if the limit allows it. Otherwise wait for one
+      """
+      start = time.time()
+      waited = False
+      conn = None
+      self.__poolCondition.acquire()
+      try:
+        while True:
+          if self.__spares:
+            conn, connName, lastUse = self.__spares.pop()
+            break
+          if self.__openConnections < self.__maxConnections:
+            self.__openConnections += 1
+            break
+          timeLeft = self.__waitTimeout - ( time.time() - start )
+          if timeLeft <= 0:
+            self.__count( dbName, 'Timeouts' )
+            return None, "", 0
+          waited = True
+          self.__poolCondition.wait( timeLeft )
+        self.__count( dbName, 'Checkouts' )
+        if waited:
+          self.__count( dbName, 'Waits' )
+          self.__count( dbName, 'WaitTime', time.time() - start )
+      finally:
+        self.__poolCondition.release()
+      if not conn:
+        try:
+          conn = self.__newConn( dbName )
+        except MySQLdb.MySQLError:
+          self.__poolCondition.acquire()
+          try:
+            self.__openConnections -= 1
+            self.__poolCondition.notify()
+          finally:
+            self.__poolCondition.release()
+          raise
+        connName = ""
+        lastUse = time.time()
+      return conn, connName, lastUse
+
+    def release( self, thid = None ):
+      """ Release a get of the thread. In a bounded pool its connection is checked in once all its
+          gets are released, unless a transaction is open in it
+      """
+      if not self.__maxConnections:
+        return
+      if thid is None:
+        thid = self.__thid
+      self.__poolCondition.acquire()
       try:
-        conn, dbName = self.__spares.pop()
-      except IndexError:
-        conn = self.__newConn()
-        dbName = ""
+        holds = self.__holds.get( thid, 0 )
+        if holds > 1:
+          self.__holds[ thid ] = holds - 1
+          return
+        if not holds:
+          #Already taken back by the cleaning
+          return
+        del self.__holds[ thid ]
+      finally:
+        self.__poolCondition.release()
+      if thid in self.__inTransaction:
+        return
+      self.__pop( thid )
+
+    def getDedicated( self, dbName ):
+      """ Get a connection not assigned to the thread, for a query that keeps it busy for long
+          (e.g. an unbuffered cursor). It has to be given back with releaseDedicated
+      """
+      try:
+        if self.__maxConnections:
+          conn, connName, lastUse = self.__checkout( dbName )
+          if not conn:
+            return S_ERROR( DErrno.EMYSQL, "No free connection to %s after %s seconds" % ( dbName, self.__waitTimeout ) )
+        else:
+          self.__count( dbName, 'Checkouts' )
+          try:
+            conn, connName, lastUse = self.__spares.pop()
+          except IndexError:
+            conn = self.__newConn( dbName )
+            connName = ""
+            lastUse = time.time()
+      except MySQLdb.MySQLError, excp:
+        return S_ERROR( DErrno.EMYSQL, "Could not connect: %s" % excp )
 
-      self.__assigned[ thid ] = [ conn, dbName, now ]
-      return conn, dbName, thid
+      if time.time() - lastUse > self.__pingIdleTime and not self.__ping( conn ):
+        self.__close( conn, connName )
+        return S_ERROR( DErrno.EMYSQL, "Could not connect" )
+      if connName != dbName:
+        try:
+          conn.select_db( dbName )
+        except MySQLdb.MySQLError, excp:
+          self.__close( conn, connName )
+          return S_ERROR( DErrno.EMYSQL, "Could not select db %s: %s" % ( dbName, excp ) )
+      return S_OK( conn )
+
+    def releaseDedicated( self, conn, dbName, reuse = True ):
+      """ Give back a connection obtained with getDedicated. It is closed if it can not be
+          reused, e.g. when an unbuffered result was not read until the end
+      """
+      if not reuse:
+        self.__close( conn, dbName )
+        return
+      self.__checkin( conn, dbName, time.time() )
+
+    def __checkin( self, conn, dbName, lastUse ):
+      if self.__maxConnections:
+        self.__poolCondition.acquire()
+        try:
+          self.__spares.append( ( conn, dbName, lastUse ) )
+          self.__poolCondition.notify()
+        finally:
+          self.__poolCondition.release()
+      elif len( self.__spares ) < self.__maxSpares:
+        self.__spares.append( ( conn, dbName, lastUse ) )
+      else:
+        self.__close( conn, dbName )
 
     def __pop( self, thid ):
+      self.__holds.pop( thid, None )
       try:
         data = self.__assigned.pop( thid )
-        if len( self.__spares ) < self.__maxSpares:
-          self.__spares.append( ( data[0], data[1] ) )
-        else:
-          data[ 0 ].close()
       except KeyError:
-        pass
+        return
+      if thid in self.__inTransaction:
+        #The thread left without finishing its transaction
+        self.__inTransaction.discard( thid )
+        try:
+          data[0].rollback()
+        except MySQLdb.MySQLError:
+          self.__close( data[0], data[1] )
+          return
+      self.__checkin( data[0], data[1], data[2] )
+
+    def __discard( self, thid ):
+      try:
+        data = self.__assigned.pop( thid )
+      except KeyError:
+        return
+      self.__inTransaction.discard( thid )
+      self.__close( data[0], data[1] )
 
     def clean( self, now = False ):
       if not now:
@@ -339,6 +695,20 @@ class MySQL( object ):
           continue
         if now - data[2] > self.__graceTime:
           self.__pop( thid )
+      if not self.__maxConnections:
+        return
+      #Close the connections not needed lately
+      idle = []
+      self.__poolCondition.acquire()
+      try:
+        for spare in list( self.__spares ):
+          if now - spare[2] > self.__graceTime:
+            self.__spares.remove( spare )
+            idle.append( spare )
+      finally:
+        self.__poolCondition.release()
+      for conn, dbName, _lastUse in idle:
+        self.__close( conn, dbName )
 
     def transactionStart( self, dbName ):
       result = self.get( dbName )
@@ -346,9 +716,14 @@ class MySQL( object ):
         return result
       conn = result[ 'Value' ]
       try:
-        return S_OK( self.__execute( conn, "START TRANSACTION WITH CONSISTENT SNAPSHOT" ) )
+        result = S_OK( self.__execute( conn, "START TRANSACTION WITH CONSISTENT SNAPSHOT" ) )
       except MySQLdb.MySQLError, excp:
+        self.release()
         return S_ERROR( DErrno.EMYSQL, "Could not begin transaction: %s" % excp )
+      #The open transaction keeps the connection with the thread until its end
+      self.__inTransaction.add( self.__thid )
+      self.release()
+      return result
 
     def transactionCommit( self, dbName ):
       result = self.get( dbName )
@@ -360,6 +735,9 @@ class MySQL( object ):
         return S_OK( result )
       except MySQLdb.MySQLError, excp:
         return S_ERROR( DErrno.EMYSQL, "Could not commit transaction: %s" % excp )
+      finally:
+        self.__inTransaction.discard( self.__thid )
+        self.release()
 
     def transactionRollback( self, dbName ):
       result = self.get( dbName )
@@ -371,12 +749,17 @@ class MySQL( object ):
         return S_OK( result )
       except MySQLdb.MySQLError, excp:
         return S_ERROR( DErrno.EMYSQL, "Could not rollback transaction: %s" % excp )
+      finally:
+        self.__inTransaction.discard( self.__thid )
+        self.release()
 
   __connectionPools = {}
 
-  def __init__( self, hostName = 'localhost', userName = 'dirac', passwd = 'dirac', dbName = '', port = 3306, debug = False ):
+  def __init__( self, hostName = 'localhost', userName = 'dirac', passwd = 'dirac', dbName = '', port = 3306, debug = False,
+                maxConnections = 0, connectionWaitTimeout = 30 ):
     """
     set MySQL connection parameters and try to connect
+    maxConnections bounds the number of connections to the server, 0 keeps one connection per thread
     """
     global gInstancesCount, gDebugFile
     gInstancesCount += 1
@@ -398,8 +781,14 @@ class MySQL( object ):
     self.__port = port
     cKey = ( self.__hostName, self.__userName, self.__passwd, self.__port )
     if cKey not in MySQL.__connectionPools:
-      MySQL.__connectionPools[ cKey ] = MySQL.ConnectionPool( *cKey )
+      MySQL.__connectionPools[ cKey ] = MySQL.ConnectionPool( *cKey,
+                                                              maxConnections = maxConnections,
+                                                              waitTimeout = connectionWaitTimeout )
     self.__connectionPool = MySQL.__connectionPools[ cKey ]
+    self.__connectionPool.setMaxConnections( maxConnections, connectionWaitTimeout )
+    # Statements of the bulk methods, by table and fields
+    self.__statements = {}
+    self.__maxAllowedPacket = 0
 
     self.__initialized = True
     result = self._connect()
@@ -458,11 +847,6 @@ class MySQL( object ):
     It also includes quotation marks " around the given string
     """
 
-    retDict = self.__getConnection()
-    if not retDict['OK']:
-      return retDict
-    connection = retDict['Value']
-
     try:
       myString = str( myString )
     except ValueError:
@@ -486,7 +870,13 @@ class MySQL( object ):
           self.log.debug( '__escape_string: Could not escape string', '"%s"' % myString )
           return S_ERROR( DErrno.EMYSQL, '__escape_string: Could not escape string' )
 
-      escape_string = connection.escape_string( str( myString ) )
+      retDict = self.__getConnection()
+      if not retDict['OK']:
+        return retDict
+      try:
+        escape_string = retDict['Value'].escape_string( str( myString ) )
+      finally:
+        self.__connectionPool.release()
       self.log.debug( '__escape_string: returns', '"%s"' % escape_string )
       return S_OK( '"%s"' % escape_string )
     except Exception as x:
@@ -640,6 +1030,7 @@ class MySQL( object ):
       cursor.close()
     except Exception:
       pass
+    self.__connectionPool.release()
 
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
@@ -648,6 +1039,58 @@ class MySQL( object ):
     return retDict
 
 
+  def _queryIter( self, cmd, batchSize = QUERYITERBATCH, debug = False, conn = None ):
+    """
+    execute MySQL query command with an unbuffered cursor, for results too large to be
+    held in memory at once
+    return S_OK structure with a QueryIterator giving lists of at most batchSize rows
+    return S_ERROR upon error
+
+    The query runs on a connection of its own, taken from the pool and given back once
+    the iterator is exhausted or closed. Close it (or use it in a with block) when the
+    iteration may stop before the end.
+    With conn, the query runs on that connection instead, which can not be used for
+    anything else until the iterator is exhausted or closed. It stays open, closing
+    the iterator early then reads the rows left.
+    """
+    if debug:
+      self.logger.debug( '_queryIter:', cmd )
+    else:
+      if self.logger._minLevel == self.logger._logLevels.getLevelValue( 'DEBUG' ):
+        self.logger.verbose( '_queryIter:', cmd )
+      else:
+        self.logger.verbose( '_queryIter:', cmd[:min( len( cmd ) , 512 )] )
+
+    if not self.__initialized:
+      error = 'DB not properly initialized'
+      gLogger.error( error )
+      return S_ERROR( DErrno.EMYSQL, error )
+
+    if conn:
+      connection = conn
+
+      def release( reuse ):
+        pass
+    else:
+      retDict = self.__connectionPool.getDedicated( self.__dbName )
+      if not retDict['OK']:
+        return retDict
+      connection = retDict[ 'Value' ]
+
+      def release( reuse ):
+        self.__connectionPool.releaseDedicated( connection, self.__dbName, reuse )
+
+    try:
+      cursor = connection.cursor( SSCursor )
+      cursor.execute( cmd )
+    except Exception, x:
+      self.log.warn( '_queryIter:', cmd )
+      release( False )
+      return self._except( '_queryIter', x, 'Execution failed.' )
+
+    return S_OK( QueryIterator( cursor, batchSize, release ) )
+
+
   def _update( self, cmd, conn = None, debug = False ):
     """ execute MySQL update command
         return S_OK with number of updated registers upon success
@@ -688,6 +1131,7 @@ class MySQL( object ):
       cursor.close()
     except Exception:
       pass
+    self.__connectionPool.release()
 
     if gDebugFile:
       print >> gDebugFile, time.time() - start, cmd.replace( '\n', '' )
@@ -726,9 +1170,13 @@ class MySQL( object ):
       self.logger.execption( error )
       # # rollback, put back connection to the pool
       connection.rollback()
+      if not conn:
+        self.__connectionPool.release()
       return S_ERROR( DErrno.EMYSQL, error )
     # # close cursor, put back connection to the pool
     cursor.close()
+    if not conn:
+      self.__connectionPool.release()
     return S_OK( cmdRet )
 
   def _createViews( self, viewsDict, force = False ):
@@ -981,7 +1429,10 @@ class MySQL( object ):
     self.log.debug( '_getConnection:' )
 
     retDict = self.__getConnection( trial = 0 )
-    return retDict
+    if not retDict[ 'OK' ]:
+      return retDict
+    return S_OK( PooledConnection( retDict[ 'Value' ],
+                                   functools.partial( self.__connectionPool.release, threading.current_thread() ) ) )
 
   def __getConnection( self, conn = None, trial = 0 ):
     """
@@ -1000,6 +1451,15 @@ class MySQL( object ):
 
     return self.__connectionPool.get( self.__dbName )
 
+  def getConnectionPoolStats( self ):
+    """
+    Usage of the connection pool by this DB: checkouts, waits for a free connection and the
+    time spent in them, timeouts, and connections created and closed
+
+    :return: S_OK( dict )
+    """
+    return S_OK( self.__connectionPool.getStats( self.__dbName ) )
+
 ########################################################################################
 #
 #  Transaction functions
@@ -1488,6 +1948,158 @@ class MySQL( object ):
                          ( table, inFieldString, inValueString ), conn, debug = True )
 
 
+  def __getMaxAllowedPacket( self ):
+    """
+    Size limit of a query for the server, 1MB (the MySQL default) if it cannot be known
+    """
+    if not self.__maxAllowedPacket:
+      retDict = self._query( "SELECT @@max_allowed_packet", debug = True )
+      try:
+        self.__maxAllowedPacket = int( retDict['Value'][0][0] )
+      except Exception:
+        return 1048576
+    return self.__maxAllowedPacket
+
+  def __chunkRows( self, rows, sqlSize ):
+    """
+    Split the rows in chunks that fit in a query. sqlSize gives the size of the SQL
+    generated for a row
+    """
+    # Half of the limit, to leave room for the escaping and the statement itself
+    maxSize = self.__getMaxAllowedPacket() / 2
+    chunk = []
+    chunkSize = 0
+    for row in rows:
+      rowSize = sqlSize( row )
+      if chunk and ( chunkSize + rowSize > maxSize or len( chunk ) >= MAXBULKROWS ):
+        yield chunk
+        chunk = []
+        chunkSize = 0
+      chunk.append( row )
+      chunkSize += rowSize
+    if chunk:
+      yield chunk
+
+  def __executeChunks( self, methodName, cmdList, conn = None ):
+    """
+    Execute the ( cmd, args, many ) of cmdList, with executemany if many is set
+    Return S_OK with the number of affected rows
+    """
+    retDict = self.__getConnection( conn = conn )
+    if not retDict['OK']:
+      return retDict
+    connection = retDict['Value']
+
+    affected = 0
+    try:
+      cursor = connection.cursor()
+      for cmd, args, many in cmdList:
+        self.log.verbose( '%s:' % methodName, cmd[:min( len( cmd ), 512 )] )
+        if many:
+          affected += cursor.executemany( cmd, args )
+        else:
+          affected += cursor.execute( cmd, args )
+      retDict = S_OK( affected )
+    except Exception as x:
+      self.log.warn( '%s: %s' % ( methodName, str( x ) ) )
+      retDict = self._except( methodName, x, 'Execution failed.' )
+
+    try:
+      cursor.close()
+    except Exception:
+      pass
+    self.__connectionPool.release()
+
+    return retDict
+
+  def insertMany( self, tableName, fields, rows, conn = None, ignore = False ):
+    """
+      Insert the rows, sequences of values for "fields", in "tableName" with as few
+      queries as the size of the rows allows.
+      The values are passed as parameters of the queries, they need no escaping.
+      With ignore, rows with duplicated keys are skipped
+      return S_OK( number of inserted rows )
+    """
+    key = ( 'insert', tableName, tuple( fields ), ignore )
+    if key not in self.__statements:
+      table = _quotedList( [tableName] )
+      fieldString = _quotedList( fields )
+      if not table or not fieldString:
+        error = 'Invalid tableName or fields arguments'
+        self.log.warn( 'insertMany:', error )
+        return S_ERROR( DErrno.EMYSQL, error )
+      self.__statements[ key ] = 'INSERT %sINTO %s ( %s ) VALUES ( %s )' % ( 'IGNORE ' if ignore else '',
+                                                                            table, fieldString,
+                                                                            ', '.join( [ '%s' ] * len( fields ) ) )
+    cmd = self.__statements[ key ]
+
+    rows = [ tuple( row ) for row in rows ]
+    for row in rows:
+      if len( row ) != len( fields ):
+        return S_ERROR( DErrno.EMYSQL, 'Mismatch between fields and values of a row.' )
+    if not rows:
+      return S_OK( 0 )
+
+    # executemany sends each chunk as a single multi-row INSERT, a row adds "( values ), "
+    sqlSize = lambda row : sum( [ _sqlValueSize( value ) + 2 for value in row ] ) + 4
+    return self.__executeChunks( 'insertMany', [ ( cmd, chunk, True ) for chunk in self.__chunkRows( rows, sqlSize ) ],
+                                 conn )
+
+  def updateMany( self, tableName, updateFields, keyFields, rows, conn = None ):
+    """
+      Update "updateFields" of the rows of "tableName" identified by "keyFields".
+      Each row is a sequence of the values of updateFields followed by the values of keyFields.
+      Each chunk of rows is updated by a single UPDATE query.
+      return S_OK( number of updated rows )
+    """
+    key = ( 'update', tableName, tuple( updateFields ), tuple( keyFields ) )
+    if key not in self.__statements:
+      table = _quotedList( [tableName] )
+      if not table or not _quotedList( updateFields ) or not _quotedList( keyFields ):
+        error = 'Invalid tableName, updateFields or keyFields arguments'
+        self.log.warn( 'updateMany:', error )
+        return S_ERROR( DErrno.EMYSQL, error )
+      keyCond = ' AND '.join( [ '%s = %%s' % _quotedList( [ field ] ) for field in keyFields ] )
+      self.__statements[ key ] = ( 'UPDATE %s SET ' % table,
+                                   [ _quotedList( [ field ] ) for field in updateFields ],
+                                   'WHEN %s THEN %%s' % keyCond,
+                                   '( %s )' % keyCond )
+    cmdStart, quotedFields, whenString, whereString = self.__statements[ key ]
+
+    numFields = len( updateFields )
+    rows = [ tuple( row ) for row in rows ]
+    for row in rows:
+      if len( row ) != numFields + len( keyFields ):
+        return S_ERROR( DErrno.EMYSQL, 'Mismatch between fields and values of a row.' )
+    if not rows:
+      return S_OK( 0 )
+
+    # A row adds a WHEN per field, repeating its keys, and a condition with its keys
+    whenSize = len( whenString ) + 1
+    whereSize = len( whereString ) + 4
+    def sqlSize( row ):
+      keysSize = sum( [ _sqlValueSize( value ) for value in row[ numFields: ] ] )
+      return sum( [ whenSize + keysSize + _sqlValueSize( value ) for value in row[ :numFields ] ] ) + \
+             whereSize + keysSize
+
+    cmdList = []
+    for chunk in self.__chunkRows( rows, sqlSize ):
+      whens = ' '.join( [ whenString ] * len( chunk ) )
+      setList = []
+      args = []
+      for iField in range( numFields ):
+        setList.append( '%s = CASE %s ELSE %s END' % ( quotedFields[ iField ], whens, quotedFields[ iField ] ) )
+        for row in chunk:
+          args.extend( row[ numFields: ] )
+          args.append( row[ iField ] )
+      for row in chunk:
+        args.extend( row[ numFields: ] )
+      cmd = '%s%s WHERE %s' % ( cmdStart, ', '.join( setList ), ' OR '.join( [ whereString ] * len( chunk ) ) )
+      cmdList.append( ( cmd, tuple( args ), False ) )
+
+    return self.__executeChunks( 'updateMany', cmdList, conn )
+
+
   def executeStoredProcedure( self, packageName, parameters, outputIds, output = True, array = None, conn = False ):
     conDict = self._getConnection()
     if not conDict['OK']:
@@ -1511,7 +2123,7 @@ class MySQL( object ):
       cursor.close()
     except Exception:
       pass
-
+    connection.close()
 
     return retDict
 
@@ -1537,7 +2149,7 @@ class MySQL( object ):
       cursor.close()
     except Exception:
       pass
-
+    connection.close()
 
     return retDict
 
@@ -149,6 +149,13 @@ class ThreadScheduler:
   def __destroyExecutor( self ):
     self.__thId = False
 
+  def afterFork( self ):
+    """ Threads do not survive a fork. Start a new executor in the child process for the scheduled tasks
+    """
+    self.__thId = False
+    if self.__hood:
+      self.__createExecutorIfNeeded()
+
   @gSchedulerLock
   def __timeToNextTask( self ):
     if not self.__hood:
@@ -0,0 +1,119 @@
+""" Test cases for DIRAC.Core.Utilities.DEncode module: the codec must keep the wire
+    format, and the single-pass decoder must accept exactly the same stream as decode.
+"""
+
+__RCSID__ = "$Id$"
+
+import unittest
+import datetime
+
+# sut
+from DIRAC.Core.Utilities import DEncode
+
+class DEncodeTestCase( unittest.TestCase ):
+  """ Base class for the DEncode test cases
+  """
+
+  def setUp( self ):
+    now = datetime.datetime( 2016, 3, 4, 12, 34, 56, 789 )
+    self.samples = [ 0, -12, 2 ** 70, 3.5, 2.0 * 10 ** 20, 2.0 * 10 ** -10, True, False, None,
+                     "", "a:b:e", u"\xe9t\xe9", now, now.date(), now.time(),
+                     [], (), {}, [ 1, [ 2, ( 3, { 4 : "5" } ) ] ],
+                     { 'OK' : True, 'Value' : { 'Successful' : { '/lfn/a' : { 'CERN-disk' : 'srm://a' } },
+                                                'Failed' : { '/lfn/b' : 'No such file' } } },
+                     { 1 : { 'JobID' : 1, 'Status' : u'Running', 'CPUTime' : 12.5,
+                             'SubmissionTime' : now, 'Reschedules' : 0L, 'Tags' : ( 'MultiProcessor', ) } } ]
+
+  def tearDown( self ):
+    pass
+
+class DEncodeSuccess( DEncodeTestCase ):
+
+  def test_wireCompatibility( self ):
+    for sample in self.samples:
+      data = DEncode.encode( sample )
+      self.assertEqual( DEncode.fastDecode( data ), DEncode.decode( data ) )
+
+  def test_roundTrip( self ):
+    for sample in self.samples:
+      data = DEncode.encode( sample )
+      value, length = DEncode.decode( data )
+      self.assertEqual( value, sample )
+      self.assertEqual( type( value ), type( sample ) )
+      self.assertEqual( length, len( data ) )
+
+  def test_wireFormat( self ):
+    sample = { 'a' : [ 1, 'bc', ( 2L, u'd' ) ], 1 : None, 'e' : { 'f' : True, 'g' : 'h' } }
+    data = "di1ens1:ali1es2:bctI2eu1:dees1:eds1:fb1s1:gs1:hee"
+    self.assertEqual( DEncode.encode( sample ), data )
+    self.assertEqual( DEncode.decode( data ), ( sample, len( data ) ) )
+
+  def test_trailingData( self ):
+    data = DEncode.encode( [ 1, 2 ] )
+    self.assertEqual( DEncode.decode( data + "i3e" ), ( [ 1, 2 ], len( data ) ) )
+
+  def test_deepNesting( self ):
+    # The decoder does not recurse, so it is not bound by the interpreter recursion limit
+    data = "l" * 5001 + "e" * 5001
+    nested, length = DEncode.fastDecode( data )
+    self.assertEqual( length, len( data ) )
+    for _i in xrange( 5000 ):
+      self.assertEqual( len( nested ), 1 )
+      nested = nested[0]
+    self.assertEqual( nested, [] )
+
+  def test_empty( self ):
+    self.assertEqual( DEncode.decode( "" ), "" )
+
+class IterDecodeSuccess( DEncodeTestCase ):
+
+  def _chunks( self, data, size ):
+    return ( data[i:i + size] for i in xrange( 0, len( data ), size ) )
+
+  def test_items( self ):
+    result = { 'OK' : True, 'Value' : { 'Failed' : { '/a' : 'No such file' },
+                                        'Successful' : { '/b' : { 'SE1' : 'pfn1' }, '/c' : { 'SE2' : 'pfn2' } } } }
+    data = DEncode.encode( result )
+    for size in ( 1, 3, 10, len( data ) ):
+      self.assertEqual( list( DEncode.iterDecode( self._chunks( data, size ), 3 ) ),
+                        [ ( ( 'OK', ), True ),
+                          ( ( 'Value', 'Failed', '/a' ), 'No such file' ),
+                          ( ( 'Value', 'Successful', '/b' ), { 'SE1' : 'pfn1' } ),
+                          ( ( 'Value', 'Successful', '/c' ), { 'SE2' : 'pfn2' } ) ] )
+
+  def test_lists( self ):
+    data = DEncode.encode( { 'OK' : True, 'Value' : [ { 'FileID' : 1 }, { 'FileID' : 2 } ] } )
+    self.assertEqual( list( DEncode.iterDecode( self._chunks( data, 2 ), 2 ) ),
+                      [ ( ( 'OK', ), True ),
+                        ( ( 'Value', 0 ), { 'FileID' : 1 } ),
+                        ( ( 'Value', 1 ), { 'FileID' : 2 } ) ] )
+
+  def test_wholeObject( self ):
+    for sample in self.samples:
+      data = DEncode.encode( sample )
+      self.assertEqual( list( DEncode.iterDecode( self._chunks( data, 4 ), 0 ) ), [ ( (), sample ) ] )
+
+class DEncodeFailure( DEncodeTestCase ):
+
+  def test_unknownType( self ):
+    self.assertRaises( KeyError, DEncode.encode, object() )
+
+  def test_corruptedData( self ):
+    self.assertRaises( Exception, DEncode.decode, "ds1:ae" )
+    self.assertRaises( Exception, DEncode.decode, "l" )
+    self.assertRaises( Exception, DEncode.decode, "x" )
+
+  def test_truncatedStream( self ):
+    data = DEncode.encode( { 'OK' : True, 'Value' : { 'a' : 'bcd' } } )
+    self.assertRaises( ValueError, list, DEncode.iterDecode( [ data[:-3] ], 2 ) )
+
+#############################################################################
+# Test Suite run
+#############################################################################
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( DEncodeTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DEncodeSuccess ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( IterDecodeSuccess ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DEncodeFailure ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,110 @@
+""" Test for the lanes and the batches of the ExecutorDispatcher
+"""
+
+__RCSID__ = "$Id$"
+
+import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.Core.Utilities.ExecutorDispatcher import ExecutorQueues, ExecutorDispatcher, \
+                                                    ExecutorDispatcherCallbacks
+
+class LaneCallbacks( ExecutorDispatcherCallbacks ):
+  """ Tasks go through one executor type, in the lane of their object, and are kept when sent
+  """
+  def __init__( self, failTasks = None ):
+    self.sent = []
+    self.failTasks = failTasks or []
+
+  def cbDispatch( self, taskId, taskObj, pathExecuted ):
+    if pathExecuted:
+      return S_OK()
+    return S_OK( "Type1" )
+
+  def cbTaskLane( self, taskId, taskObj ):
+    return S_OK( taskObj )
+
+  def cbSendTask( self, taskId, taskObj, eId, eType ):
+    if taskId in self.failTasks:
+      return S_ERROR( "Cannot send %s" % taskId )
+    self.sent.append( [ taskId ] )
+    return S_OK()
+
+  def cbSendTasks( self, taskIds, taskObjs, eId, eType ):
+    self.sent.append( list( taskIds ) )
+    return S_OK( {} )
+
+class ExecutorQueuesTestCase( unittest.TestCase ):
+  """ Lanes of the waiting queues
+  """
+  def setUp( self ):
+    self.queues = ExecutorQueues()
+
+  def test_fifoInLane( self ):
+    for i in range( 3 ):
+      self.assertEqual( self.queues.pushTask( "Type1", "t%s" % i ), i + 1 )
+    self.assertEqual( self.queues.popTask( "Type1" ), ( "t0", "Type1" ) )
+    self.queues.pushTask( "Type1", "t0", ahead = True )
+    self.assertEqual( self.queues.popTasks( "Type1", 5 ), ( "Type1", [ "t0", "t1", "t2" ] ) )
+    self.assertEqual( self.queues.popTask( "Type1" ), None )
+
+  def test_weights( self ):
+    self.queues.setLaneWeights( { "user" : 3 } )
+    for i in range( 100 ):
+      self.queues.pushTask( "Type1", "p%s" % i, lane = "production" )
+    for i in range( 9 ):
+      self.queues.pushTask( "Type1", "u%s" % i, lane = "user" )
+    eType, taskIds = self.queues.popTasks( "Type1", 12 )
+    # The user tasks do not wait behind the production ones
+    self.assertEqual( len( [ taskId for taskId in taskIds if taskId[0] == "u" ] ), 9 )
+    self.assertEqual( self.queues.getLaneState(), { "Type1" : { "production" : 97, "user" : 0 } } )
+    self.assertEqual( len( self.queues.getLaneWaits()[ "user" ] ), 9 )
+    self.assertEqual( self.queues.getLaneWaits(), {} )
+
+  def test_newLane( self ):
+    for i in range( 10 ):
+      self.queues.pushTask( "Type1", "p%s" % i, lane = "production" )
+    self.queues.popTasks( "Type1", 5 )
+    # A lane coming late shares from then on, it does not get the turns it missed
+    for i in range( 10 ):
+      self.queues.pushTask( "Type1", "u%s" % i, lane = "user" )
+    taskIds = self.queues.popTasks( "Type1", 4 )[1]
+    self.assertEqual( sorted( [ taskId[0] for taskId in taskIds ] ), [ "p", "p", "u", "u" ] )
+
+  def test_deleteTask( self ):
+    self.queues.pushTask( "Type1", "t1", lane = "user" )
+    self.assertEqual( self.queues.pushTask( "Type2", "t1" ), 0 )
+    self.assertTrue( self.queues.deleteTask( "t1" ) )
+    self.assertFalse( self.queues.deleteTask( "t1" ) )
+    self.assertEqual( self.queues.waitingTasks( "Type1" ), 0 )
+
+class ExecutorDispatcherTestCase( unittest.TestCase ):
+  """ Batches sent to the executors
+  """
+  def test_batches( self ):
+    dispatcher = ExecutorDispatcher()
+    callbacks = LaneCallbacks()
+    dispatcher.setCallbacks( callbacks )
+    dispatcher.addExecutor( "e1", [ "Type1" ], maxTasks = 1 )
+    for taskId in range( 4 ):
+      dispatcher.addTask( taskId, "lane%s" % ( taskId % 2 ) )
+    self.assertEqual( callbacks.sent, [ [ 0 ] ] )
+    dispatcher.addExecutor( "e2", [ "Type1" ], maxTasks = 4, maxBatch = 2 )
+    self.assertEqual( callbacks.sent, [ [ 0 ], [ 1, 2 ], [ 3 ] ] )
+    dispatcher.taskProcessed( "e2", 1 )
+    self.assertEqual( sorted( dispatcher.getTaskIds() ), [ 0, 2, 3 ] )
+
+  def test_failedSend( self ):
+    dispatcher = ExecutorDispatcher()
+    callbacks = LaneCallbacks( failTasks = [ 0 ] )
+    dispatcher.setCallbacks( callbacks )
+    dispatcher.addTask( 0, "lane0" )
+    dispatcher.addExecutor( "e1", [ "Type1" ] )
+    # The task is back in its queue
+    self.assertEqual( callbacks.sent, [] )
+    self.assertEqual( dispatcher._internals()[ 'queues' ][ 'queues' ][ 'Type1' ], { 'lane0' : [ 0 ] } )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ExecutorQueuesTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( ExecutorDispatcherTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
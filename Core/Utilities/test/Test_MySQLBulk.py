@@ -0,0 +1,77 @@
+""" Test cases for the bulk writes of DIRAC.Core.Utilities.MySQL.MySQL
+"""
+
+__RCSID__ = "$Id$"
+
+import unittest
+
+from mock import MagicMock, patch
+
+# sut
+from DIRAC.Core.Utilities.MySQL import MySQL
+
+#Small enough to split the rows in several queries
+MAXALLOWEDPACKET = 4000
+
+class BulkWritesTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.cursor = MagicMock()
+    self.cursor.execute.side_effect = lambda cmd, args = None : 1
+    self.cursor.executemany.side_effect = lambda cmd, args : len( args )
+    self.cursor.fetchall.return_value = ( ( MAXALLOWEDPACKET, ), )
+    self.cursor.lastrowid = None
+    conn = MagicMock()
+    conn.cursor.return_value = self.cursor
+    self.connectPatcher = patch( 'DIRAC.Core.Utilities.MySQL.MySQLdb.connect', return_value = conn )
+    self.connectPatcher.start()
+    self.db = MySQL( 'host-%s' % self.id(), 'user', 'passwd', 'TestDB' )
+
+  def tearDown( self ):
+    self.connectPatcher.stop()
+
+  def __sqlSize( self, cmd, args ):
+    return len( cmd % tuple( [ "'%s'" % arg for arg in args ] ) )
+
+  def test_insertMany( self ):
+    rows = [ ( i, 'x' * 50 ) for i in range( 200 ) ]
+    result = self.db.insertMany( 'Table', [ 'ID', 'Value' ], rows )
+    self.assertTrue( result[ 'OK' ], result.get( 'Message' ) )
+    self.assertEqual( result[ 'Value' ], 200 )
+    calls = self.cursor.executemany.call_args_list
+    self.assertTrue( len( calls ) > 1 )
+    self.assertEqual( calls[0][0][0], 'INSERT INTO `Table` ( `ID`, `Value` ) VALUES ( %s, %s )' )
+    self.assertEqual( sum( [ list( call[0][1] ) for call in calls ], [] ), rows )
+    for call in calls:
+      values = ", ".join( [ "( %s )" % ", ".join( [ "'%s'" % value for value in row ] ) for row in call[0][1] ] )
+      self.assertTrue( len( values ) < MAXALLOWEDPACKET )
+
+  def test_updateMany( self ):
+    rows = [ ( 'Done', 'x' * 50, i ) for i in range( 100 ) ]
+    result = self.db.updateMany( 'Jobs', [ 'Status', 'MinorStatus' ], [ 'JobID' ], rows )
+    self.assertTrue( result[ 'OK' ], result.get( 'Message' ) )
+    calls = [ call for call in self.cursor.execute.call_args_list if call[0][0].startswith( 'UPDATE' ) ]
+    self.assertTrue( len( calls ) > 1 )
+    self.assertEqual( result[ 'Value' ], len( calls ) )
+    #The chunks take half of the limit, the rest is left for the escaping
+    for call in calls:
+      self.assertTrue( self.__sqlSize( *call[0] ) < MAXALLOWEDPACKET / 2 + 100 )
+    cmd, args = calls[0][0]
+    numRows = cmd.count( ' OR ' ) + 1
+    self.assertTrue( cmd.startswith( 'UPDATE `Jobs` SET `Status` = CASE WHEN `JobID` = %s THEN %s' ) )
+    self.assertTrue( cmd.endswith( 'WHERE ( `JobID` = %s ) OR ( `JobID` = %s )' + ' OR ( `JobID` = %s )' * ( numRows - 2 ) ) )
+    #The keys and values of each field, then the keys of the WHERE
+    self.assertEqual( list( args[:4] ), [ 0, 'Done', 1, 'Done' ] )
+    self.assertEqual( list( args[ 2 * numRows : 2 * numRows + 2 ] ), [ 0, 'x' * 50 ] )
+    self.assertEqual( list( args[ 4 * numRows: ] ), range( numRows ) )
+
+  def test_mismatch( self ):
+    self.assertFalse( self.db.insertMany( 'Table', [ 'ID', 'Value' ], [ ( 1, ) ] )[ 'OK' ] )
+    self.assertFalse( self.db.updateMany( 'Jobs', [ 'Status' ], [ 'JobID' ], [ ( 'Done', ) ] )[ 'OK' ] )
+    self.assertFalse( self.cursor.executemany.called )
+
+#############################################################################
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( BulkWritesTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
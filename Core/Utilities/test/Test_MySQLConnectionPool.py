@@ -0,0 +1,214 @@
+""" Test cases for the bounded mode of DIRAC.Core.Utilities.MySQL.MySQL.ConnectionPool
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+import unittest
+
+from mock import MagicMock, patch
+
+from DIRAC import S_OK
+
+# sut
+from DIRAC.Core.Utilities.MySQL import MySQL, QueryIterator
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.DirectoryLevelTree import DirectoryLevelTree
+from DIRAC.DataManagementSystem.DB.FileCatalogComponents.FileManager import FileManager
+
+class ConnectionPoolTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.connectPatcher = patch( 'DIRAC.Core.Utilities.MySQL.MySQLdb.connect', side_effect = lambda **kw : MagicMock() )
+    self.connect = self.connectPatcher.start()
+    self.pool = MySQL.ConnectionPool( 'host', 'user', 'passwd', maxConnections = 2, waitTimeout = 0.2 )
+
+  def tearDown( self ):
+    self.connectPatcher.stop()
+
+  def __getInThread( self, results ):
+    def getConnection():
+      results.append( self.pool.get( 'TestDB' ) )
+    th = threading.Thread( target = getConnection )
+    th.start()
+    th.join()
+
+  def test_threadKeepsItsConnection( self ):
+    first = self.pool.get( 'TestDB' )
+    self.assertTrue( first[ 'OK' ] )
+    self.assertTrue( self.pool.get( 'TestDB' )[ 'Value' ] is first[ 'Value' ] )
+    self.assertEqual( self.connect.call_count, 1 )
+
+  def test_checkinReusesConnection( self ):
+    first = self.pool.get( 'TestDB' )[ 'Value' ]
+    self.pool.release()
+    results = []
+    self.__getInThread( results )
+    self.assertTrue( results[0][ 'Value' ] is first )
+    self.assertEqual( self.connect.call_count, 1 )
+    stats = self.pool.getStats( 'TestDB' )
+    self.assertEqual( stats[ 'Checkouts' ], 2 )
+    self.assertEqual( stats[ 'Created' ], 1 )
+
+  def test_exhaustedPool( self ):
+    results = []
+    self.__getInThread( results )
+    self.__getInThread( results )
+    self.assertTrue( results[0][ 'OK' ] and results[1][ 'OK' ] )
+    #Both connections are still checked out by the finished threads
+    result = self.pool.get( 'TestDB' )
+    self.assertFalse( result[ 'OK' ] )
+    stats = self.pool.getStats( 'TestDB' )
+    self.assertEqual( stats[ 'Timeouts' ], 1 )
+    self.assertEqual( stats[ 'OpenConnections' ], 2 )
+    #Connections of dead threads are taken back by the cleaning
+    self.pool.clean()
+    self.assertTrue( self.pool.get( 'TestDB' )[ 'OK' ] )
+    self.assertEqual( self.connect.call_count, 2 )
+
+  def test_transactionKeepsConnection( self ):
+    conn = self.pool.get( 'TestDB' )[ 'Value' ]
+    self.assertTrue( self.pool.transactionStart( 'TestDB' )[ 'OK' ] )
+    self.pool.release()
+    self.assertTrue( self.pool.get( 'TestDB' )[ 'Value' ] is conn )
+    self.assertTrue( self.pool.transactionCommit( 'TestDB' )[ 'OK' ] )
+    #The last get is not released yet
+    self.assertEqual( self.pool.getStats( 'TestDB' )[ 'AssignedConnections' ], 1 )
+    self.pool.release()
+    self.assertEqual( self.pool.getStats( 'TestDB' )[ 'AssignedConnections' ], 0 )
+
+  def test_nestedGets( self ):
+    conn = self.pool.get( 'TestDB' )[ 'Value' ]
+    self.assertTrue( self.pool.get( 'TestDB' )[ 'Value' ] is conn )
+    self.pool.release()
+    #The first get still holds the connection
+    self.assertEqual( self.pool.getStats( 'TestDB' )[ 'AssignedConnections' ], 1 )
+    self.pool.release()
+    self.assertEqual( self.pool.getStats( 'TestDB' )[ 'AssignedConnections' ], 0 )
+    #Extra releases do not check in the connection of a later get
+    self.pool.release()
+    self.assertTrue( self.pool.get( 'TestDB' )[ 'Value' ] is conn )
+    self.pool.release()
+    self.pool.release()
+    self.assertEqual( self.pool.getStats( 'TestDB' )[ 'SpareConnections' ], 1 )
+
+  def test_dedicatedConnection( self ):
+    conn = self.pool.getDedicated( 'TestDB' )[ 'Value' ]
+    self.assertEqual( self.pool.getStats( 'TestDB' )[ 'AssignedConnections' ], 0 )
+    self.pool.releaseDedicated( conn, 'TestDB' )
+    self.assertTrue( self.pool.get( 'TestDB' )[ 'Value' ] is conn )
+    self.pool.release()
+    conn = self.pool.getDedicated( 'TestDB' )[ 'Value' ]
+    self.pool.releaseDedicated( conn, 'TestDB', reuse = False )
+    self.assertTrue( conn.close.called )
+    stats = self.pool.getStats( 'TestDB' )
+    self.assertEqual( stats[ 'OpenConnections' ], 0 )
+    self.assertEqual( stats[ 'Closed' ], 1 )
+
+class DBConnectionsTestCase( unittest.TestCase ):
+  """ The pool used by a DB class and a FileCatalog component, with a single connection
+  """
+
+  def setUp( self ):
+    def newConnection( **kwargs ):
+      conn = MagicMock()
+      conn.cursor.return_value.execute.return_value = 0
+      conn.cursor.return_value.lastrowid = 1
+      conn.escape_string.side_effect = lambda value : value
+      return conn
+    self.connectPatcher = patch( 'DIRAC.Core.Utilities.MySQL.MySQLdb.connect', side_effect = newConnection )
+    self.connect = self.connectPatcher.start()
+    #A host of its own, the pools are shared by the DBs on the same server
+    self.db = MySQL( 'host-%s' % self.id(), 'user', 'passwd', 'TestDB', maxConnections = 1, connectionWaitTimeout = 0.2 )
+
+  def tearDown( self ):
+    self.connectPatcher.stop()
+
+  def __inThread( self, function, *args ):
+    results = []
+    th = threading.Thread( target = lambda : results.append( function( *args ) ) )
+    th.start()
+    th.join()
+    return results[0]
+
+  def test_queries( self ):
+    for _i in range( 3 ):
+      self.assertTrue( self.__inThread( self.db._query, "SELECT 1" )[ 'OK' ] )
+      self.assertTrue( self.__inThread( self.db._update, "UPDATE T SET A=1" )[ 'OK' ] )
+    self.assertEqual( self.connect.call_count, 1 )
+
+  def test_getConnection( self ):
+    conn = self.db._getConnection()[ 'Value' ]
+    #A query without conn does not give back the connection held by the thread
+    self.assertTrue( self.db._query( "SELECT 1" )[ 'OK' ] )
+    self.assertTrue( self.db._query( "SELECT 1", conn = conn )[ 'OK' ] )
+    self.assertFalse( self.__inThread( self.db._query, "SELECT 1" )[ 'OK' ] )
+    conn.close()
+    conn.close()
+    self.assertTrue( self.__inThread( self.db._query, "SELECT 1" )[ 'OK' ] )
+    self.assertEqual( self.connect.call_count, 1 )
+    self.assertFalse( self.connect.return_value.close.called )
+
+  def test_connectionNotClosed( self ):
+    tree = DirectoryLevelTree( self.db )
+    #makeDir takes a connection and does not close it, it is given back when it is collected
+    for _i in range( 3 ):
+      result = self.__inThread( tree.makeDir, '/' )
+      self.assertTrue( result[ 'OK' ], result.get( 'Message' ) )
+    stats = self.db.getConnectionPoolStats()[ 'Value' ]
+    self.assertEqual( stats[ 'Timeouts' ], 0 )
+    self.assertEqual( stats[ 'AssignedConnections' ], 0 )
+    self.assertEqual( self.connect.call_count, 1 )
+
+  def test_queryIterOnConnection( self ):
+    conn = self.db._getConnection()[ 'Value' ]
+    conn.cursor.return_value.fetchmany.side_effect = [ ( ( 1, ), ), () ]
+    result = self.db._queryIter( "SELECT 1", 10, conn = conn )
+    self.assertTrue( result[ 'OK' ], result.get( 'Message' ) )
+    self.assertEqual( list( result[ 'Value' ] ), [ [ ( 1, ) ] ] )
+    self.assertEqual( self.connect.call_count, 1 )
+    conn.close()
+
+  def test_directoryReplicas( self ):
+    rows = [ ( ( 'file1', 1, 1, '' ), ( 'file1', 1, 2, '' ), ( 'file2', 2, 1, '' ) ), () ]
+    self.connect.side_effect = None
+    self.connect.return_value.cursor.return_value.fetchmany.side_effect = rows
+    self.connect.return_value.cursor.return_value.execute.return_value = 0
+    self.db.lfnPfnConvention = 'Strong'
+    #The SE names not cached are read from the DB
+    self.db.seManager = MagicMock()
+    self.db.seManager.getSEName.side_effect = lambda seID : self.db._query( "SELECT 1" ) and S_OK( 'SE%d' % seID )
+    result = self.__inThread( FileManager( self.db ).getDirectoryReplicas, 1, '/dir', True )
+    self.assertTrue( result[ 'OK' ], result.get( 'Message' ) )
+    self.assertEqual( result[ 'Value' ], { 'file1' : { 'SE1' : '', 'SE2' : '' }, 'file2' : { 'SE1' : '' } } )
+    self.assertEqual( self.db.getConnectionPoolStats()[ 'Value' ][ 'Timeouts' ], 0 )
+
+class QueryIteratorTestCase( unittest.TestCase ):
+
+  def setUp( self ):
+    self.cursor = MagicMock()
+    self.cursor.fetchmany.side_effect = [ ( ( 1, ), ( 2, ) ), ( ( 3, ), ), () ]
+    self.released = []
+
+  def test_batches( self ):
+    iterator = QueryIterator( self.cursor, 2, self.released.append )
+    self.assertEqual( list( iterator ), [ [ ( 1, ), ( 2, ) ], [ ( 3, ) ] ] )
+    self.assertEqual( iterator.rowsRead, 3 )
+    self.cursor.fetchmany.assert_called_with( 2 )
+    self.assertEqual( self.released, [ True ] )
+
+  def test_earlyExit( self ):
+    with QueryIterator( self.cursor, 2, self.released.append ) as iterator:
+      for _rows in iterator:
+        break
+    #The connection is not reused, and closed before the cursor
+    self.assertEqual( self.released, [ False ] )
+    iterator.close()
+    self.assertEqual( self.released, [ False ] )
+
+#############################################################################
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( ConnectionPoolTestCase )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( DBConnectionsTestCase ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( QueryIteratorTestCase ) )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -705,10 +705,8 @@ class DirectoryTreeBase:
       if not result['OK']:
         failed[path] = result['Message']
         continue
-      fileDict = result['Value']
-      successful[path] = {} 
-      for fileName in fileDict:
-        successful[path][fileName] = fileDict[fileName]  
+      # No copy, the replicas of large directories take a lot of memory
+      successful[path] = result['Value']
         
     result = S_OK( {'Successful':successful, 'Failed':failed} )
     
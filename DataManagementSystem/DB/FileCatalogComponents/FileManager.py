@@ -447,9 +447,8 @@ class FileManager( FileManagerBase ):
     if not insertTuples:
       return S_OK({'Successful':successful,'Failed':failed})
 
-    req = "INSERT INTO FC_Replicas (FileID,SEID,Status) VALUES %s" % \
-          (','.join(["(%d,%d,%d)" % (tuple_[0],tuple_[1],statusID) for tuple_ in insertTuples]))
-    res = self.db._update(req,connection)
+    res = self.db.insertMany( 'FC_Replicas', ['FileID', 'SEID', 'Status'],
+                              [( tuple_[0], tuple_[1], statusID ) for tuple_ in insertTuples], conn = connection )
     if not res['OK']:
       return res
     res = self._getRepIDsForReplica(insertTuples, connection=connection)
@@ -756,8 +755,9 @@ class FileManager( FileManagerBase ):
       fileIDDict[repID] = ( fileID, seID, statusID )
     return S_OK(fileIDDict)
 
-  def _getDirectoryReplicas( self, dirID, allStatus=False, connection=False ):
+  def _getDirectoryReplicas( self, dirID, allStatus=False, connection=False, batchSize=0 ):
     """ Get replicas for files in a given directory
+        With batchSize, the replicas are streamed in lists of at most batchSize replicas
     """
     replicaStatusIDs = []
     if not allStatus:
@@ -789,5 +789,7 @@ class FileManager( FileManagerBase ):
       if fileStatusIDs:
         req += ' AND FF.Status in (%s)' % intListToString( fileStatusIDs )                                                                             
     
+    if batchSize:
+      return self.db._queryIter( req, batchSize, conn = connection )
     result = self.db._query( req, connection )
     return result
@@ -14,6 +14,9 @@ from DIRAC.Core.Utilities.Pfn               import pfnparse, pfnunparse
 import os
 import stat
 
+# Replicas read at once from the DB by getDirectoryReplicas
+DIRECTORY_REPLICAS_BATCH = 10000
+
 class FileManagerBase( object ):
 
   def __init__( self, database = None ):
@@ -167,9 +170,11 @@ class FileManagerBase( object ):
     
     return S_ERROR( "To be implemented on derived class" )
 
-  def _getDirectoryReplicas( self, dirID, allStatus = False, connection = False ):
+  def _getDirectoryReplicas( self, dirID, allStatus = False, connection = False, batchSize = 0 ):
     """ To be implemented on derived class
     Should return with only one value, being a list of all the replicas (FileName,FileID,SEID,PFN)
+    If batchSize is given, the value is an iterator giving lists of at most batchSize replicas,
+    read through the given connection if any, through a connection of its own otherwise
      """
 
     return S_ERROR( "To be implemented on derived class" )
@@ -1158,23 +1163,34 @@ class FileManagerBase( object ):
         :param allStatus : whether all replicas and file status are considered
                           If False, take the visibleFileStatus and visibleReplicaStatus values from the configuration
     """
-    connection = self._getConnection( connection )
-    result = self._getDirectoryReplicas( dirID, allStatus, connection)
+    # The replicas are streamed, large directories are not read at once from the DB.
+    # No other connection is taken while the stream holds one
+    result = self._getDirectoryReplicas( dirID, allStatus, connection, batchSize = DIRECTORY_REPLICAS_BATCH )
     if not result['OK']:
       return result
     
-    resultDict = {}
+    # Only the replicas of each file are kept, not the rows read
+    fileReplicas = {}
+    try:
+      with result['Value'] as replicaBatches:
+        for replicas in replicaBatches:
+          for fileName, _fileID, seID, pfn in replicas:
+            fileReplicas.setdefault( fileName, {} )[seID] = pfn
+    except Exception as e:
+      return S_ERROR( "Failed to get the replicas of directory %s: %s" % ( dirID, e ) )
+
     seDict = {}
-    for fileName, fileID, seID, pfn in result['Value']:
-      resultDict.setdefault( fileName, {} )
-      if not seID in seDict:
-        res = self.db.seManager.getSEName(seID)
-        if not res['OK']:
-          seDict[seID] = 'Unknown'
-        else:  
-          seDict[seID] = res['Value']
-      se = seDict[seID]    
-      resultDict[fileName][se] = pfn
+    resultDict = {}
+    for fileName, seReplicas in fileReplicas.items():
+      resultDict[fileName] = {}
+      for seID, pfn in seReplicas.items():
+        if not seID in seDict:
+          res = self.db.seManager.getSEName(seID)
+          if not res['OK']:
+            seDict[seID] = 'Unknown'
+          else:  
+            seDict[seID] = res['Value']
+        resultDict[fileName][seDict[seID]] = pfn
 
     return S_OK( resultDict )
 
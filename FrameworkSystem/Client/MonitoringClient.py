@@ -79,6 +79,8 @@ class MonitoringClient( object ):
     self.sourceDict[ 'componentLocation' ] = "unknown"
     self.activitiesDefinitions = {}
     self.activitiesMarks = {}
+    #Marks of the mean activities imported from other clients, by activity, bucket time and source
+    self.sourcesMarks = {}
     self.definitionsToSend = {}
     self.marksToSend = {}
     self.__compRegistrationExtraDict = {}
@@ -88,6 +90,7 @@ class MonitoringClient( object ):
     self.timeStep = 60
     self.__initialized = False
     self.__enabled = True
+    self.__forwardMode = False
 
   @property
   def activitiesLock( self ):
@@ -107,6 +110,12 @@ class MonitoringClient( object ):
   def enable( self ):
     self.__enabled = True
 
+  def setForwardMode( self, forward ):
+    """ Keep the marks to be collected with exportData instead of sending them to the Monitoring service.
+        Used by the worker processes of a service, whose supervisor reports for all of them
+    """
+    self.__forwardMode = forward
+
   def setComponentExtraParam( self, name, value ):
     if name in ( 'version', 'DIRACVersion', 'description', 'startTime', 'platform' ):
       self.__compRegistrationExtraDict[ name ] = str( value )
@@ -240,6 +249,61 @@ class MonitoringClient( object ):
     finally:
       self.activitiesLock.release()
 
+  def exportData( self ):
+    """
+    Take out the marks added so far, together with the definitions of their activities.
+    The result can be merged into another client with importData
+
+    :return: ( activities definitions, { activity : { bucket time : [ marks ] } } )
+    """
+    if not self.__initialized:
+      return ( {}, {} )
+    self.activitiesLock.acquire()
+    try:
+      definitions = dict( [ ( acName, dict( self.activitiesDefinitions[ acName ] ) ) for acName in self.activitiesMarks
+                            if self.activitiesMarks[ acName ] ] )
+      marks = dict( [ ( acName, self.activitiesMarks[ acName ] ) for acName in definitions ] )
+      for acName in marks:
+        self.activitiesMarks[ acName ] = {}
+    finally:
+      self.activitiesLock.release()
+    return ( definitions, marks )
+
+  def importData( self, definitions, marks, sourceId = None ):
+    """
+    Merge the marks exported by another client. The marks of the mean activities of a source
+    are averaged separately and the means of all the sources are added up, so that N worker
+    processes with 4 active queries each report 4*N active queries
+
+    :type  definitions: dict
+    :param definitions: Definitions of the activities of the marks
+    :type  marks: dict
+    :param marks: Marks lists by activity and bucket time
+    :type  sourceId: hashable
+    :param sourceId: Client the marks come from. Without it the marks are merged as if they had been added here
+    """
+    if not self.__initialized:
+      return
+    for acName in definitions:
+      if acName not in self.activitiesDefinitions:
+        acDef = definitions[ acName ]
+        self.registerActivity( acName, acDef[ 'description' ], acDef[ 'category' ],
+                               acDef[ 'unit' ], acDef[ 'type' ], acDef[ 'bucketLength' ] )
+    self.activitiesLock.acquire()
+    try:
+      for acName in marks:
+        if acName not in self.activitiesMarks:
+          continue
+        if sourceId is not None and self.activitiesDefinitions[ acName ][ 'type' ] == self.OP_MEAN:
+          acMarks = self.sourcesMarks.setdefault( acName, {} )
+          for markTime in marks[ acName ]:
+            acMarks.setdefault( markTime, {} ).setdefault( sourceId, [] ).extend( marks[ acName ][ markTime ] )
+        else:
+          for markTime in marks[ acName ]:
+            self.activitiesMarks[ acName ].setdefault( markTime, [] ).extend( marks[ acName ][ markTime ] )
+    finally:
+      self.activitiesLock.release()
+
   def __consolidateMarks( self, allData ):
     """
       Copies all marks except last step ones
@@ -267,13 +331,32 @@ class MonitoringClient( object ):
           if self.activitiesDefinitions[ key ][ 'type' ] == self.OP_MEAN:
             totalValue /= len( consolidatedMarks[ key ][ markTime ] )
           consolidatedMarks[ key ][ markTime ] = totalValue
+    #Add up the means of the imported sources
+    remainderSourcesMarks = {}
+    for key in self.sourcesMarks:
+      if allData:
+        lastStepToSend = int( Time.toEpoch() )
+      else:
+        lastStepToSend = self.__UTCStepTime( key )
+      remainderSourcesMarks[ key ] = {}
+      for markTime in self.sourcesMarks[ key ]:
+        if markTime >= lastStepToSend:
+          remainderSourcesMarks[ key ][ markTime ] = self.sourcesMarks[ key ][ markTime ]
+          continue
+        sourcesMarks = self.sourcesMarks[ key ][ markTime ]
+        totalValue = consolidatedMarks.setdefault( key, {} ).get( markTime, 0 )
+        for sourceId in sourcesMarks:
+          totalValue += sum( sourcesMarks[ sourceId ] ) / len( sourcesMarks[ sourceId ] )
+        consolidatedMarks[ key ][ markTime ] = totalValue
+    for key in consolidatedMarks.keys():
       if len( consolidatedMarks[ key ] ) == 0:
         del( consolidatedMarks[ key ] )
     self.activitiesMarks = remainderMarks
+    self.sourcesMarks = remainderSourcesMarks
     return consolidatedMarks
 
   def flush( self, allData = False ):
-    if not self.__enabled or not self.__initialized:
+    if not self.__enabled or not self.__initialized or self.__forwardMode:
       return
     self.flushingLock.acquire()
     self.logger.debug( "Sending information to server" )
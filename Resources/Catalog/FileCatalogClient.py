@@ -5,7 +5,7 @@ import os
 
 from DIRAC import S_OK, S_ERROR
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry import getVOMSAttributeForGroup, getDNForUsername
-from DIRAC.Resources.Catalog.Utilities                 import checkCatalogArguments
+from DIRAC.Resources.Catalog.Utilities                 import checkCatalogArguments, checkArgumentFormat
 from DIRAC.Resources.Catalog.FileCatalogClientBase     import FileCatalogClientBase
 
 __RCSID__ = "$Id$"
@@ -207,6 +207,45 @@ class FileCatalogClient( FileCatalogClientBase ):
         pathDict[lfn] = detailsDict
     return result
 
+  def iterDirectoryReplicas( self, lfns, allStatus = False, timeout = 120 ):
+    """ Same as getDirectoryReplicas, but the result is decoded while it is received so that
+        huge directories can be processed with bounded memory.
+
+        Returns S_OK( iterator ) where the iterator yields ( 'Successful', lfn, replicaDict )
+        for each file and ( 'Failed', path, errorMessage ) for each failed directory.
+    """
+    result = checkArgumentFormat( lfns, generateMap = True )
+    if not result['OK']:
+      return result
+    lfnDict, lfnMap = result['Value']
+    rpcClient = self._getRPC( timeout = timeout )
+    # Value / Successful / directory / file name -> replicas
+    result = rpcClient.executeRPCStream( 'getDirectoryReplicas', ( lfnDict, allStatus ), 4 )
+    if not result['OK']:
+      return result
+    return S_OK( self.__iterReplicaItems( result['Value'], lfnMap ) )
+
+  @staticmethod
+  def __iterReplicaItems( items, lfnMap ):
+    """ Turn the streamed getDirectoryReplicas result items into replicas per LFN.
+        SEPrefixes come before Successful in the stream, as keys are sorted.
+    """
+    seDict = {}
+    for keyPath, value in items:
+      if len( keyPath ) < 3:
+        continue
+      resultType, path = keyPath[1:3]
+      if resultType == 'SEPrefixes':
+        seDict[path] = value
+      elif resultType == 'Failed':
+        yield ( 'Failed', lfnMap.get( path, path ), value )
+      elif resultType == 'Successful' and len( keyPath ) == 4:
+        lfn = '%s/%s' % ( path, os.path.basename( keyPath[3] ) )
+        for se in value:
+          if not value[se] and se in seDict:
+            value[se] = seDict[se] + lfn
+        yield ( 'Successful', lfn, value )
+
   def findFilesByMetadata( self, metaDict, path = '/', timeout = 120 ):
     """ Find files given the meta data query and the path
     """
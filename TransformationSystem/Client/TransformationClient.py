@@ -160,6 +160,46 @@ class TransformationClient( Client ):
     return S_OK( transformationFiles )
 
 
+  def iterTransformationFiles( self, condDict = None, older = None, newer = None, timeStamp = None,
+                               orderAttribute = None, limit = None, timeout = 1800 ):
+    """ Same as getTransformationFiles, but the files are decoded while they are received and
+        handed out one by one, so that huge transformations can be processed with bounded memory.
+
+        Returns S_OK( iterator ) where the iterator yields the file dictionaries. The first page is
+        requested before returning, later pages are requested as the iteration proceeds and the
+        iterator raises RuntimeError if one of them cannot be obtained.
+    """
+    rpcClient = self._getRPC( timeout = timeout )
+    if condDict is None:
+      condDict = {}
+    if timeStamp is None:
+      timeStamp = 'LastUpdate'
+    limit = limit if limit else 10000
+    res = rpcClient.executeRPCStream( 'getTransformationFiles',
+                                      ( condDict, older, newer, timeStamp, orderAttribute, limit, 0 ), 2 )
+    if not res['OK']:
+      return res
+    return S_OK( self.__iterTransformationFilePages( rpcClient, res['Value'],
+                                                    ( condDict, older, newer, timeStamp, orderAttribute ), limit ) )
+
+  @staticmethod
+  def __iterTransformationFilePages( rpcClient, items, args, limit ):
+    """ Yield the files of the page being received, then get the next ones as long as pages are full
+    """
+    offset = 0
+    while True:
+      nFiles = 0
+      for _keyPath, fileDict in items:
+        nFiles += 1
+        yield fileDict
+      if nFiles < limit:
+        return
+      offset += limit
+      res = rpcClient.executeRPCStream( 'getTransformationFiles', args + ( limit, offset ), 2 )
+      if not res['OK']:
+        raise RuntimeError( "Error getting files for transformation (offset %d): %s" % ( offset, res['Message'] ) )
+      items = res['Value']
+
   def getTransformationTasks( self, condDict = None, older = None, newer = None, timeStamp = None,
                               orderAttribute = None, limit = 10000, inputVector = False ):
     """ gets all the transformation tasks for a transformation, incrementally.
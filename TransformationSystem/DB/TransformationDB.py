@@ -1199,13 +1199,22 @@ class TransformationDB( DB ):
     if not res['OK']:
       return res
     _fileIDs, lfnFileIDs = res['Value']
+    # DataFiles has no unique index on LFN, insert each new LFN only once
+    newLFNs = []
+    knownLFNs = set( lfnFileIDs )
     for lfn in lfns:
-      if lfn not in lfnFileIDs:
-        req = "INSERT INTO DataFiles (LFN,Status) VALUES ('%s','New');" % lfn
-        res = self._update( req, connection )
-        if not res['OK']:
-          return res
-        lfnFileIDs[lfn] = res['lastRowId']
+      if lfn not in knownLFNs:
+        knownLFNs.add( lfn )
+        newLFNs.append( lfn )
+    if not newLFNs:
+      return S_OK( lfnFileIDs )
+    res = self.insertMany( 'DataFiles', ['LFN', 'Status'], [( lfn, 'New' ) for lfn in newLFNs], conn = connection )
+    if not res['OK']:
+      return res
+    res = self.__getFileIDsForLfns( newLFNs, connection = connection )
+    if not res['OK']:
+      return res
+    lfnFileIDs.update( res['Value'][1] )
     return S_OK( lfnFileIDs )
 
   def __setDataFileStatus( self, fileIDs, status, connection = False ):
@@ -7,26 +7,35 @@
 
     This agent will take care of removing user jobs,
     while production jobs should be removed by the TransformationCleaningAgent.
+
+    With the PartitionMode option, the tables of the JobDB and of the JobLoggingDB are partitioned
+    on the JobID, per month of submission (bounds estimated ahead from the rate of new JobIDs) or per
+    PartitionSize JobIDs, and the partitions holding only jobs to remove are dropped at once, archived
+    before if PartitionArchive is set. Partitioning the tables the first time rebuilds them, it is
+    only done if PartitionTables is set.
 """
 
 __RCSID__ = "$Id$"
 
-from DIRAC                                                     import S_OK, gLogger
+from DIRAC                                                     import S_OK, S_ERROR, gLogger
 from DIRAC.Core.Base.AgentModule                               import AgentModule
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations       import Operations
 from DIRAC.WorkloadManagementSystem.DB.JobDB                   import JobDB
 from DIRAC.WorkloadManagementSystem.DB.TaskQueueDB             import TaskQueueDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB            import JobLoggingDB
 from DIRAC.WorkloadManagementSystem.Client.SandboxStoreClient  import SandboxStoreClient
+from DIRAC.WorkloadManagementSystem.private.JobPartitions      import JobPartitions
 from DIRAC.RequestManagementSystem.Client.Request              import Request
 from DIRAC.RequestManagementSystem.Client.Operation            import Operation
 from DIRAC.RequestManagementSystem.Client.File                 import File
 from DIRAC.RequestManagementSystem.Client.ReqClient            import ReqClient
 
 import DIRAC.Core.Utilities.Time as Time
+from DIRAC.Core.Utilities.List import breakListIntoChunks
 
 import time
 import os
+import datetime
 
 
 class JobCleaningAgent( AgentModule ):
@@ -55,6 +64,13 @@ class JobCleaningAgent( AgentModule ):
     self.jobByJob = False
     self.throttlingPeriod = 0.
 
+    self.partitionMode = ''
+    self.partitionSize = 1000000
+    self.partitionTables = False
+    self.partitionArchive = ''
+    self.jobPartitions = None
+    self.loggingPartitions = None
+
     self.removeStatusDelay = {'Done':7,
                               'Killed':1,
                               'Failed':7 }
@@ -83,6 +99,19 @@ class JobCleaningAgent( AgentModule ):
     self.removeStatusDelay['Killed'] = self.am_getOption( 'RemoveStatusDelay/Killed', 7 )
     self.removeStatusDelay['Failed'] = self.am_getOption( 'RemoveStatusDelay/Failed', 7 )
 
+    self.partitionMode = self.am_getOption( 'PartitionMode', '' )
+    if self.partitionMode not in ( '', 'Month', 'JobID' ):
+      return S_ERROR( "Unknown PartitionMode %s, should be Month or JobID" % self.partitionMode )
+    if self.partitionMode:
+      self.partitionSize = self.am_getOption( 'PartitionSize', 1000000 )
+      self.partitionTables = self.am_getOption( 'PartitionTables', False )
+      self.partitionArchive = self.am_getOption( 'PartitionArchive', '' )
+      if self.partitionArchive and not os.path.isabs( self.partitionArchive ):
+        self.partitionArchive = os.path.join( self.am_getWorkDirectory(), self.partitionArchive )
+      self.jobPartitions = JobPartitions( self.jobDB, self.jobDB.PARTITIONED_TABLES )
+      self.loggingPartitions = JobPartitions( self.jobLoggingDB, self.jobLoggingDB.PARTITIONED_TABLES )
+      gLogger.info( "Job tables partitioned per %s" % self.partitionMode )
+
     return S_OK()
 
   def __getAllowedJobTypes( self ):
@@ -110,6 +139,13 @@ class JobCleaningAgent( AgentModule ):
     result = self.__getAllowedJobTypes()
     if not result[ 'OK' ]:
       return result
+
+    if self.partitionMode:
+      partResult = self.__checkPartitions()
+      if not partResult[ 'OK' ]:
+        gLogger.error( 'Failed to add the new job partitions', partResult[ 'Message' ] )
+      else:
+        self.__removePartitions( result[ 'Value' ] )
     
     # No jobs in the system subject to removal
     if not result['Value']:
@@ -213,6 +249,163 @@ class JobCleaningAgent( AgentModule ):
       gLogger.info( 'Deleted %d jobs from JobDB, %d errors' % ( count, error_count ) )
     return S_OK()
 
+  def __checkPartitions( self ):
+    """ Add the partitions for the next jobs, partitioning the tables the first time if PartitionTables
+        is set
+    """
+    result = self.jobDB.getNextJobID()
+    if not result[ 'OK' ]:
+      return result
+    nextJobID = result[ 'Value' ]
+    result = self.jobPartitions.getPartitions()
+    if not result[ 'OK' ]:
+      return result
+    partitions = [ ( partition[ 'Name' ], partition[ 'UpperBound' ] ) for partition in result[ 'Value' ]
+                   if partition[ 'UpperBound' ] is not None ]
+    lastBound = 0
+    if partitions:
+      lastBound = partitions[-1][1]
+
+    if self.partitionMode == 'Month':
+      # Partition pYYYYMM gets the jobs submitted in the month YYYYMM. For pMax to stay empty, and
+      # splitting it to stay cheap, the bound has to be set before the month ends: it is estimated
+      # from the JobIDs used since the last full partition started, and the partition of the next
+      # month is kept ahead
+      thisMonth = Time.date().replace( day = 1 )
+      nextMonth = ( thisMonth + 31 * Time.day ).replace( day = 1 )
+      if not partitions or partitions[-1][0] < nextMonth.strftime( 'p%Y%m' ):
+        fromJobID = 0
+        for partition in result[ 'Value' ]:
+          if partition[ 'UpperBound' ] is not None and partition[ 'UpperBound' ] <= nextJobID:
+            fromJobID = partition[ 'LowerBound' ]
+        result = self.__getJobIDRate( fromJobID, nextJobID )
+        if not result[ 'OK' ]:
+          return result
+        jobIDRate = result[ 'Value' ]
+        if jobIDRate is None:
+          # Nothing to estimate from yet, the month is closed when it is over
+          lastMonth = ( thisMonth - Time.day ).strftime( 'p%Y%m' )
+          if ( not partitions or partitions[-1][0] < lastMonth ) and nextJobID > lastBound:
+            partitions.append( ( lastMonth, nextJobID ) )
+        else:
+          for month in ( thisMonth, nextMonth ):
+            name = month.strftime( 'p%Y%m' )
+            monthEnd = ( month + 31 * Time.day ).replace( day = 1 )
+            timeLeft = datetime.datetime( monthEnd.year, monthEnd.month, monthEnd.day ) - Time.dateTime()
+            upperBound = nextJobID + int( jobIDRate * ( timeLeft.days * 86400 + timeLeft.seconds ) ) + 1
+            # A month already covered by the partitions before gets none
+            if ( not partitions or partitions[-1][0] < name ) and upperBound > lastBound:
+              partitions.append( ( name, upperBound ) )
+              lastBound = upperBound
+    else:
+      # Keep a whole empty partition ahead, splitting the last one is then cheap
+      while lastBound <= nextJobID + self.partitionSize:
+        lastBound = ( lastBound / self.partitionSize + 1 ) * self.partitionSize
+        partitions.append( ( 'id%d' % lastBound, lastBound ) )
+
+    for jobPartitions in ( self.jobPartitions, self.loggingPartitions ):
+      result = jobPartitions.setPartitions( partitions, create = self.partitionTables )
+      if not result[ 'OK' ]:
+        return result
+    return S_OK()
+
+  def __getJobIDRate( self, fromJobID, nextJobID ):
+    """ Get the number of JobIDs used per second since the submission of the first job from fromJobID,
+        None if there is not at least a day of jobs to tell
+    """
+    result = self.jobDB.getFirstJobSubmission( fromJobID )
+    if not result[ 'OK' ] or not result[ 'Value' ]:
+      return result
+    jobID, submissionTime = result[ 'Value' ]
+    elapsed = Time.dateTime() - submissionTime
+    if elapsed < Time.day:
+      return S_OK( None )
+    return S_OK( float( nextJobID - jobID ) / ( elapsed.days * 86400 + elapsed.seconds ) )
+
+  def __removePartitions( self, cleanJobTypes ):
+    """ Remove the partitions holding only jobs to be removed
+    """
+    result = self.jobDB.getNextJobID()
+    if not result[ 'OK' ]:
+      return result
+    nextJobID = result[ 'Value' ]
+    result = self.jobPartitions.getPartitions()
+    if not result[ 'OK' ]:
+      return result
+    for partition in result[ 'Value' ]:
+      # Only the partitions no new job can go to
+      if partition[ 'UpperBound' ] is None or partition[ 'UpperBound' ] > nextJobID:
+        continue
+      result = self.jobDB.getPartitionSummary( partition[ 'Name' ] )
+      if not result[ 'OK' ]:
+        gLogger.warn( 'Cannot get the jobs of partition %s' % partition[ 'Name' ], result[ 'Message' ] )
+        continue
+      if not self.__isRemovable( result[ 'Value' ], cleanJobTypes ):
+        continue
+      result = self.__removePartition( partition[ 'Name' ] )
+      if not result[ 'OK' ]:
+        gLogger.error( 'Failed to remove partition %s' % partition[ 'Name' ], result[ 'Message' ] )
+    return S_OK()
+
+  def __isRemovable( self, summary, cleanJobTypes ):
+    """ Tell if all the jobs of a partition summary would be removed by removeJobsByStatus
+    """
+    now = Time.dateTime()
+    for ( jobType, status ), ( _count, lastUpdate ) in summary.items():
+      if status == 'Deleted':
+        continue
+      if jobType not in cleanJobTypes or status not in self.removeStatusDelay:
+        return False
+      if not lastUpdate or lastUpdate >= now - self.removeStatusDelay[ status ] * Time.day:
+        return False
+    return True
+
+  def __removePartition( self, partition ):
+    """ Remove the sandboxes of the jobs of a partition and drop it from the JobDB and the
+        JobLoggingDB, archiving it before if requested
+    """
+    result = self.jobDB.getPartitionJobs( partition )
+    if not result[ 'OK' ]:
+      return result
+    jobList = result[ 'Value' ]
+    self.log.notice( "Removing partition %s with %s jobs" % ( partition, len( jobList ) ) )
+
+    sandboxClient = SandboxStoreClient( useCertificates = True )
+    for jobChunk in breakListIntoChunks( jobList, self.maxJobsAtOnce ):
+      result = sandboxClient.unassignJobs( jobChunk )
+      if not result[ 'OK' ]:
+        return S_ERROR( "Cannot unassign jobs to sandboxes: %s" % result[ 'Message' ] )
+    result = self.deleteJobOversizedSandbox( jobList )
+    if not result[ 'OK' ]:
+      return result
+    if result[ 'Value' ][ 'Failed' ]:
+      return S_ERROR( "Cannot schedule removal of %s oversized sandboxes" % len( result[ 'Value' ][ 'Failed' ] ) )
+
+    if self.partitionArchive:
+      for jobPartitions in ( self.jobPartitions, self.loggingPartitions ):
+        result = jobPartitions.archivePartition( partition, self.partitionArchive )
+        if not result[ 'OK' ]:
+          return result
+
+    result = self.loggingPartitions.hasPartition( partition )
+    if not result[ 'OK' ]:
+      return result
+    if result[ 'Value' ]:
+      result = self.loggingPartitions.dropPartition( partition )
+    else:
+      for jobChunk in breakListIntoChunks( jobList, self.maxJobsAtOnce ):
+        result = self.jobLoggingDB.deleteJob( [ str( jobID ) for jobID in jobChunk ] )
+        if not result[ 'OK' ]:
+          break
+    if not result[ 'OK' ]:
+      return result
+
+    result = self.jobPartitions.dropPartition( partition )
+    if not result[ 'OK' ]:
+      return result
+    gLogger.info( 'Removed partition %s with %d jobs' % ( partition, len( jobList ) ) )
+    return S_OK()
+
   def deleteJobOversizedSandbox( self, jobIDList ):
     """ Delete the job oversized sandbox files from storage elements
     """ 
@@ -221,16 +414,17 @@ class JobCleaningAgent( AgentModule ):
     successful = {}
 
     lfnDict = {}
+    result = self.jobDB.getJobsParameter( jobIDList, 'OutputSandboxLFN' )
+    if not result['OK']:
+      gLogger.warn( 'Error interrogating JobDB: %s' % result['Message'] )
+      return result
+    jobLFNs = result['Value']
     for jobID in jobIDList:
-      result = self.jobDB.getJobParameter( jobID, 'OutputSandboxLFN' )
-      if result['OK']:
-        lfn = result['Value']
-        if lfn:
-          lfnDict[lfn] = jobID
-        else:
-          successful[jobID] = 'No oversized sandbox found'
+      lfn = jobLFNs.get( int( jobID ) )
+      if lfn:
+        lfnDict[lfn] = jobID
       else:
-        gLogger.warn( 'Error interrogating JobDB: %s' % result['Message'] )
+        successful[jobID] = 'No oversized sandbox found'
     if not lfnDict:
       return S_OK( {'Successful':successful, 'Failed':failed} )   
 
@@ -24,6 +24,8 @@ from DIRAC.Resources.Computing.ComputingElementFactory     import ComputingEleme
 from DIRAC.WorkloadManagementSystem.Client.ServerUtils     import pilotAgentsDB, jobDB
 from DIRAC.WorkloadManagementSystem.Service.WMSUtilities   import getGridEnv
 from DIRAC.WorkloadManagementSystem.private.ConfigHelper   import findGenericPilotCredentials
+from DIRAC.WorkloadManagementSystem.private.CEThreadPool   import CEThreadPool
+from DIRAC.WorkloadManagementSystem.private.PilotWrapperCache import PilotWrapperCache
 from DIRAC.FrameworkSystem.Client.ProxyManagerClient       import gProxyManager
 from DIRAC.AccountingSystem.Client.Types.Pilot             import Pilot as PilotAccounting
 from DIRAC.AccountingSystem.Client.DataStoreClient         import gDataStoreClient
@@ -88,6 +90,10 @@ class SiteDirector( AgentModule ):
 
     self.proxy = None
 
+    self.ceThreadPool = None
+    self.ceTimeout = 0
+    self.pilotWrapperCache = None
+
     self.updateStatus = True
     self.getOutput = False
     self.sendAccounting = True
@@ -147,6 +153,17 @@ class SiteDirector( AgentModule ):
     self.failedQueueCycleFactor = self.am_getOption( 'FailedQueueCycleFactor', 10 )
     self.pilotStatusUpdateCycleFactor = self.am_getOption( 'PilotStatusUpdateCycleFactor', 10 )
     self.addPilotsToEmptySites = self.am_getOption( 'AddPilotsToEmptySites', False )
+    # The CEs are served in parallel, a slow CE only delays its own queues
+    self.ceTimeout = self.am_getOption( 'CETimeout', 600 )
+    if not self.ceThreadPool:
+      self.ceThreadPool = CEThreadPool( self.am_getOption( 'CEThreads', 10 ),
+                                        self.am_getOption( 'CEThreadsPerCE', 1 ) )
+    # Pilot files and proxies are compressed once, the HTCondorCE pilot wrappers, which must outlive
+    # the submission, kept in a bounded directory
+    pilotWrapperCacheSize = self.am_getOption( 'PilotWrapperCacheSize', 100 )
+    if pilotWrapperCacheSize > 0 and not self.pilotWrapperCache:
+      self.pilotWrapperCache = PilotWrapperCache( os.path.join( self.workingDirectory, 'PilotWrappers' ),
+                                                  pilotWrapperCacheSize * 1024 * 1024 )
 
     # Flags
     self.updateStatus = self.am_getOption( 'UpdatePilotStatus', True )
@@ -428,8 +445,7 @@ class SiteDirector( AgentModule ):
 
     queues = self.queueDict.keys()
     random.shuffle( queues )
-    totalSubmittedPilots = 0
-    matchedQueues = 0
+    tasks = []
     for queue in queues:
 
       # Check if the queue failed previously
@@ -439,190 +455,215 @@ class SiteDirector( AgentModule ):
         self.failedQueues[queue] += 1
         continue
 
-      ce = self.queueDict[queue]['CE']
-      ceName = self.queueDict[queue]['CEName']
-      ceType = self.queueDict[queue]['CEType']
-      queueName = self.queueDict[queue]['QueueName']
-      siteName = self.queueDict[queue]['Site']
-      platform = self.queueDict[queue]['Platform']
-      siteMask = siteName in siteMaskList
+      tasks.append( ( self.queueDict[queue]['CEName'], queue, self._submitPilotsToQueue,
+                      ( queue, siteMaskList, anySite, jobSites, testSites ) ) )
 
-      if not anySite and siteName not in jobSites:
-        self.log.verbose( "Skipping queue %s at %s: no workload expected" % (queueName, siteName) )
-        continue
-      if not siteMask and siteName not in testSites:
-        self.log.verbose( "Skipping queue %s: site %s not in the mask" % (queueName, siteName) )
+    # The queues of different CEs are served in parallel
+    result = self.ceThreadPool.execute( tasks, self.ceTimeout )
+    if not result['OK']:
+      return result
+    totalSubmittedPilots = 0
+    matchedQueues = 0
+    for queue, queueResult in result['Value']['Results'].items():
+      if not queueResult['OK']:
+        self.log.error( 'Failed to submit pilots to queue %s' % queue, queueResult['Message'] )
         continue
+      matched, submittedPilots = queueResult['Value']
+      if matched:
+        matchedQueues += 1
+      totalSubmittedPilots += submittedPilots
 
-      if 'CPUTime' in self.queueDict[queue]['ParametersDict'] :
-        queueCPUTime = int( self.queueDict[queue]['ParametersDict']['CPUTime'] )
-      else:
-        self.log.warn( 'CPU time limit is not specified for queue %s, skipping...' % queue )
-        continue
-      if queueCPUTime > self.maxQueueLength:
-        queueCPUTime = self.maxQueueLength
-
-      # Prepare the queue description to look for eligible jobs
-      ceDict = ce.getParameterDict()
-      ceDict[ 'GridCE' ] = ceName
-      #if not siteMask and 'Site' in ceDict:
-      #  self.log.info( 'Site not in the mask %s' % siteName )
-      #  self.log.info( 'Removing "Site" from matching Dict' )
-      #  del ceDict[ 'Site' ]
-      if not siteMask:
-        ceDict['JobType'] = "Test"
-      if self.vo:
-        ceDict['Community'] = self.vo
-      if self.voGroups:
-        ceDict['OwnerGroup'] = self.voGroups
+    self.log.info( "%d pilots submitted in total in this cycle, %d matched queues" % ( totalSubmittedPilots, matchedQueues ) )
+    self.__logCEStatistics()
+    return S_OK()
 
-      # This is a hack to get rid of !
-      ceDict['SubmitPool'] = self.defaultSubmitPools
+  def _submitPilotsToQueue( self, queue, siteMaskList, anySite, jobSites, testSites ):
+    """ Submit the pilots needed by the eligible jobs of a queue
+        Returns S_OK( ( whether jobs were matched to the queue, number of pilots submitted ) )
+    """
+    ce = self.queueDict[queue]['CE']
+    ceName = self.queueDict[queue]['CEName']
+    ceType = self.queueDict[queue]['CEType']
+    queueName = self.queueDict[queue]['QueueName']
+    siteName = self.queueDict[queue]['Site']
+    platform = self.queueDict[queue]['Platform']
+    siteMask = siteName in siteMaskList
+
+    if not anySite and siteName not in jobSites:
+      self.log.verbose( "Skipping queue %s at %s: no workload expected" % (queueName, siteName) )
+      return S_OK( ( False, 0 ) )
+    if not siteMask and siteName not in testSites:
+      self.log.verbose( "Skipping queue %s: site %s not in the mask" % (queueName, siteName) )
+      return S_OK( ( False, 0 ) )
+
+    if 'CPUTime' in self.queueDict[queue]['ParametersDict'] :
+      queueCPUTime = int( self.queueDict[queue]['ParametersDict']['CPUTime'] )
+    else:
+      self.log.warn( 'CPU time limit is not specified for queue %s, skipping...' % queue )
+      return S_OK( ( False, 0 ) )
+    if queueCPUTime > self.maxQueueLength:
+      queueCPUTime = self.maxQueueLength
+
+    # Prepare the queue description to look for eligible jobs
+    ceDict = ce.getParameterDict()
+    ceDict[ 'GridCE' ] = ceName
+    #if not siteMask and 'Site' in ceDict:
+    #  self.log.info( 'Site not in the mask %s' % siteName )
+    #  self.log.info( 'Removing "Site" from matching Dict' )
+    #  del ceDict[ 'Site' ]
+    if not siteMask:
+      ceDict['JobType'] = "Test"
+    if self.vo:
+      ceDict['Community'] = self.vo
+    if self.voGroups:
+      ceDict['OwnerGroup'] = self.voGroups
 
-      result = Resources.getCompatiblePlatforms( platform )
-      if not result['OK']:
-        continue
-      ceDict['Platform'] = result['Value']
+    # This is a hack to get rid of !
+    ceDict['SubmitPool'] = self.defaultSubmitPools
 
-      # Get the number of eligible jobs for the target site/queue
-      result = rpcMatcher.getMatchingTaskQueues( ceDict )
-      if not result['OK']:
-        self.log.error( 'Could not retrieve TaskQueues from TaskQueueDB', result['Message'] )
-        return result
-      taskQueueDict = result['Value']
-      if not taskQueueDict:
-        self.log.verbose( 'No matching TQs found for %s' % queue )
-        continue
+    result = Resources.getCompatiblePlatforms( platform )
+    if not result['OK']:
+      return S_OK( ( False, 0 ) )
+    ceDict['Platform'] = result['Value']
 
-      matchedQueues += 1
-      totalTQJobs = 0
-      tqIDList = taskQueueDict.keys()
-      for tq in taskQueueDict:
-        totalTQJobs += taskQueueDict[tq]['Jobs']
-
-      self.log.verbose( '%d job(s) from %d task queue(s) are eligible for %s queue' % (totalTQJobs, len( tqIDList ), queue) )
-
-      # Get the number of already waiting pilots for these task queues
-      totalWaitingPilots = 0
-      manyWaitingPilotsFlag = False
-      if self.pilotWaitingFlag:
-        lastUpdateTime = dateTime() - self.pilotWaitingTime * second
-        result = pilotAgentsDB.countPilots( { 'TaskQueueID': tqIDList,
-                                              'Status': WAITING_PILOT_STATUS },
-                                              None, lastUpdateTime )
-        if not result['OK']:
-          self.log.error( 'Failed to get Number of Waiting pilots', result['Message'] )
-          totalWaitingPilots = 0
-        else:
-          totalWaitingPilots = result['Value']
-          self.log.verbose( 'Waiting Pilots for TaskQueue %s:' % tqIDList, totalWaitingPilots )
-      if totalWaitingPilots >= totalTQJobs:
-        self.log.verbose( "%d waiting pilots already for all the available jobs" % totalWaitingPilots )
-        manyWaitingPilotsFlag = True
-        if not self.addPilotsToEmptySites:
-          continue
+    # Get the number of eligible jobs for the target site/queue
+    result = RPCClient( "WorkloadManagement/Matcher" ).getMatchingTaskQueues( ceDict )
+    if not result['OK']:
+      self.log.error( 'Could not retrieve TaskQueues from TaskQueueDB', result['Message'] )
+      return result
+    taskQueueDict = result['Value']
+    if not taskQueueDict:
+      self.log.verbose( 'No matching TQs found for %s' % queue )
+      return S_OK( ( False, 0 ) )
+
+    totalTQJobs = 0
+    tqIDList = taskQueueDict.keys()
+    for tq in taskQueueDict:
+      totalTQJobs += taskQueueDict[tq]['Jobs']
 
-      self.log.verbose( "%d waiting pilots for the total of %d eligible jobs for %s" % (totalWaitingPilots, totalTQJobs, queue) )
+    self.log.verbose( '%d job(s) from %d task queue(s) are eligible for %s queue' % (totalTQJobs, len( tqIDList ), queue) )
 
-      # Get the working proxy
-      cpuTime = queueCPUTime + 86400
-      self.log.verbose( "Getting pilot proxy for %s/%s %d long" % ( self.pilotDN, self.pilotGroup, cpuTime ) )
-      result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, cpuTime )
+    # Get the number of already waiting pilots for these task queues
+    totalWaitingPilots = 0
+    manyWaitingPilotsFlag = False
+    if self.pilotWaitingFlag:
+      lastUpdateTime = dateTime() - self.pilotWaitingTime * second
+      result = pilotAgentsDB.countPilots( { 'TaskQueueID': tqIDList,
+                                            'Status': WAITING_PILOT_STATUS },
+                                            None, lastUpdateTime )
       if not result['OK']:
-        return result
-      self.proxy = result['Value']
-      ce.setProxy( self.proxy, cpuTime - 60 )
+        self.log.error( 'Failed to get Number of Waiting pilots', result['Message'] )
+        totalWaitingPilots = 0
+      else:
+        totalWaitingPilots = result['Value']
+        self.log.verbose( 'Waiting Pilots for TaskQueue %s:' % tqIDList, totalWaitingPilots )
+    if totalWaitingPilots >= totalTQJobs:
+      self.log.verbose( "%d waiting pilots already for all the available jobs" % totalWaitingPilots )
+      manyWaitingPilotsFlag = True
+      if not self.addPilotsToEmptySites:
+        return S_OK( ( True, 0 ) )
+
+    self.log.verbose( "%d waiting pilots for the total of %d eligible jobs for %s" % (totalWaitingPilots, totalTQJobs, queue) )
+
+    # Get the working proxy
+    cpuTime = queueCPUTime + 86400
+    self.log.verbose( "Getting pilot proxy for %s/%s %d long" % ( self.pilotDN, self.pilotGroup, cpuTime ) )
+    result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, cpuTime )
+    if not result['OK']:
+      return result
+    proxy = result['Value']
+    ce.setProxy( proxy, cpuTime - 60 )
 
-      # Get the number of available slots on the target site/queue
-      totalSlots = self.getQueueSlots( queue, manyWaitingPilotsFlag )
-      if totalSlots == 0:
-        self.log.debug( '%s: No slots available' % queue )
-        continue
+    # Get the number of available slots on the target site/queue
+    totalSlots = self.getQueueSlots( queue, manyWaitingPilotsFlag )
+    if totalSlots == 0:
+      self.log.debug( '%s: No slots available' % queue )
+      return S_OK( ( True, 0 ) )
 
-      if manyWaitingPilotsFlag:
-        # Throttle submission of extra pilots to empty sites
-        pilotsToSubmit = self.maxPilotsToSubmit/10 + 1
-      else:
-        pilotsToSubmit = max( 0, min( totalSlots, totalTQJobs - totalWaitingPilots ) )
-        self.log.info( '%s: Slots=%d, TQ jobs=%d, Pilots: waiting %d, to submit=%d' % \
-                                ( queue, totalSlots, totalTQJobs, totalWaitingPilots, pilotsToSubmit ) )
+    if manyWaitingPilotsFlag:
+      # Throttle submission of extra pilots to empty sites
+      pilotsToSubmit = self.maxPilotsToSubmit/10 + 1
+    else:
+      pilotsToSubmit = max( 0, min( totalSlots, totalTQJobs - totalWaitingPilots ) )
+      self.log.info( '%s: Slots=%d, TQ jobs=%d, Pilots: waiting %d, to submit=%d' % \
+                              ( queue, totalSlots, totalTQJobs, totalWaitingPilots, pilotsToSubmit ) )
 
-      # Limit the number of pilots to submit to MAX_PILOTS_TO_SUBMIT
-      pilotsToSubmit = min( self.maxPilotsToSubmit, pilotsToSubmit )
+    # Limit the number of pilots to submit to MAX_PILOTS_TO_SUBMIT
+    pilotsToSubmit = min( self.maxPilotsToSubmit, pilotsToSubmit )
 
-      while pilotsToSubmit > 0:
-        self.log.info( 'Going to submit %d pilots to %s queue' % ( pilotsToSubmit, queue ) )
+    submittedPilots = 0
+    while pilotsToSubmit > 0:
+      self.log.info( 'Going to submit %d pilots to %s queue' % ( pilotsToSubmit, queue ) )
 
-        bundleProxy = self.queueDict[queue].get( 'BundleProxy', False )
-        jobExecDir = ''
-        jobExecDir = self.queueDict[queue]['ParametersDict'].get( 'JobExecDir', jobExecDir )
-        httpProxy = self.queueDict[queue]['ParametersDict'].get( 'HttpProxy', '' )
+      bundleProxy = self.queueDict[queue].get( 'BundleProxy', False )
+      jobExecDir = ''
+      jobExecDir = self.queueDict[queue]['ParametersDict'].get( 'JobExecDir', jobExecDir )
+      httpProxy = self.queueDict[queue]['ParametersDict'].get( 'HttpProxy', '' )
 
-        result = self.getExecutable( queue, pilotsToSubmit, bundleProxy, httpProxy, jobExecDir )
-        if not result['OK']:
-          return result
+      result = self.getExecutable( queue, pilotsToSubmit, bundleProxy, httpProxy, jobExecDir, proxy = proxy )
+      if not result['OK']:
+        return result
 
-        executable, pilotSubmissionChunk = result['Value']
-        result = ce.submitJob( executable, '', pilotSubmissionChunk )
-        ### FIXME: The condor thing only transfers the file with some
-        ### delay, so when we unlink here the script is gone
-        ### FIXME 2: but at some time we need to clean up the pilot wrapper scripts...
-        if ceType != 'HTCondorCE':
-          os.unlink( executable )
+      executable, pilotSubmissionChunk = result['Value']
+      result = ce.submitJob( executable, '', pilotSubmissionChunk )
+      ### FIXME: The condor thing only transfers the file with some
+      ### delay, so when we unlink here the script is gone
+      ### FIXME 2: but at some time we need to clean up the pilot wrapper scripts...
+      if ceType != 'HTCondorCE':
+        os.unlink( executable )
+      if not result['OK']:
+        self.log.error( 'Failed submission to queue %s:\n' % queue, result['Message'] )
+        pilotsToSubmit = 0
+        self.failedQueues[queue] += 1
+        continue
+
+      pilotsToSubmit = pilotsToSubmit - pilotSubmissionChunk
+      # Add pilots to the PilotAgentsDB assign pilots to TaskQueue proportionally to the
+      # task queue priorities
+      pilotList = result['Value']
+      self.queueSlots[queue]['AvailableSlots'] -= len( pilotList )
+      submittedPilots += len( pilotList )
+      self.log.info( 'Submitted %d pilots to %s@%s' % ( len( pilotList ), queueName, ceName ) )
+      stampDict = {}
+      if result.has_key( 'PilotStampDict' ):
+        stampDict = result['PilotStampDict']
+      tqPriorityList = []
+      sumPriority = 0.
+      for tq in taskQueueDict:
+        sumPriority += taskQueueDict[tq]['Priority']
+        tqPriorityList.append( ( tq, sumPriority ) )
+      tqDict = {}
+      for pilotID in pilotList:
+        rndm = random.random() * sumPriority
+        for tq, prio in tqPriorityList:
+          if rndm < prio:
+            tqID = tq
+            break
+        if not tqDict.has_key( tqID ):
+          tqDict[tqID] = []
+        tqDict[tqID].append( pilotID )
+
+      for tqID, pilotList in tqDict.items():
+        result = pilotAgentsDB.addPilotTQReference( pilotList,
+                                                    tqID,
+                                                    self.pilotDN,
+                                                    self.pilotGroup,
+                                                    self.localhost,
+                                                    ceType,
+                                                    '',
+                                                    stampDict )
         if not result['OK']:
-          self.log.error( 'Failed submission to queue %s:\n' % queue, result['Message'] )
-          pilotsToSubmit = 0
-          self.failedQueues[queue] += 1
+          self.log.error( 'Failed add pilots to the PilotAgentsDB: ', result['Message'] )
           continue
-
-        pilotsToSubmit = pilotsToSubmit - pilotSubmissionChunk
-        # Add pilots to the PilotAgentsDB assign pilots to TaskQueue proportionally to the
-        # task queue priorities
-        pilotList = result['Value']
-        self.queueSlots[queue]['AvailableSlots'] -= len( pilotList )
-        totalSubmittedPilots += len( pilotList )
-        self.log.info( 'Submitted %d pilots to %s@%s' % ( len( pilotList ), queueName, ceName ) )
-        stampDict = {}
-        if result.has_key( 'PilotStampDict' ):
-          stampDict = result['PilotStampDict']
-        tqPriorityList = []
-        sumPriority = 0.
-        for tq in taskQueueDict:
-          sumPriority += taskQueueDict[tq]['Priority']
-          tqPriorityList.append( ( tq, sumPriority ) )
-        tqDict = {}
-        for pilotID in pilotList:
-          rndm = random.random() * sumPriority
-          for tq, prio in tqPriorityList:
-            if rndm < prio:
-              tqID = tq
-              break
-          if not tqDict.has_key( tqID ):
-            tqDict[tqID] = []
-          tqDict[tqID].append( pilotID )
-
-        for tqID, pilotList in tqDict.items():
-          result = pilotAgentsDB.addPilotTQReference( pilotList,
-                                                      tqID,
-                                                      self.pilotDN,
-                                                      self.pilotGroup,
-                                                      self.localhost,
-                                                      ceType,
-                                                      '',
-                                                      stampDict )
+        for pilot in pilotList:
+          result = pilotAgentsDB.setPilotStatus(pilot, 'Submitted', ceName,
+                                                'Successfully submitted by the SiteDirector',
+                                                siteName, queueName )
           if not result['OK']:
-            self.log.error( 'Failed add pilots to the PilotAgentsDB: ', result['Message'] )
+            self.log.error( 'Failed to set pilot status: ', result['Message'] )
             continue
-          for pilot in pilotList:
-            result = pilotAgentsDB.setPilotStatus(pilot, 'Submitted', ceName,
-                                                  'Successfully submitted by the SiteDirector',
-                                                  siteName, queueName )
-            if not result['OK']:
-              self.log.error( 'Failed to set pilot status: ', result['Message'] )
-              continue
 
-    self.log.info( "%d pilots submitted in total in this cycle, %d matched queues" % ( totalSubmittedPilots, matchedQueues ) )
-    return S_OK()
+    return S_OK( ( True, submittedPilots ) )
 
   def getQueueSlots( self, queue, manyWaitingPilotsFlag ):
     """ Get the number of available slots in the queue
@@ -680,19 +721,26 @@ class SiteDirector( AgentModule ):
       return totalSlots
 
 #####################################################################################
-  def getExecutable( self, queue, pilotsToSubmit, bundleProxy = True, httpProxy = '', jobExecDir = '', processors = 1 ):
-    """ Prepare the full executable for queue
+  def getExecutable( self, queue, pilotsToSubmit, bundleProxy = True, httpProxy = '', jobExecDir = '', processors = 1,
+                     proxy = None ):
+    """ Prepare the full executable for queue, bundling the given proxy or the last one obtained
     """
 
-    proxy = None
-    if bundleProxy:
+    if not bundleProxy:
+      proxy = None
+    elif proxy is None:
       proxy = self.proxy
     pilotOptions, pilotsToSubmit = self._getPilotOptions( queue, pilotsToSubmit, processors )
     if pilotOptions is None:
       self.log.error( "Pilot options empty, error in compilation" )
       return S_ERROR( "Errors in compiling pilot options" )
     self.log.verbose( 'pilotOptions: ', ' '.join( pilotOptions ) )
-    executable = self._writePilotScript( self.workingDirectory, pilotOptions, proxy, httpProxy, jobExecDir )
+    # The HTCondorCE wrappers can not be removed after the submission, they go to the bounded directory
+    cacheWrapper = self.queueDict[queue]['CEType'] == 'HTCondorCE'
+    executable = self._writePilotScript( self.workingDirectory, pilotOptions, proxy, httpProxy, jobExecDir,
+                                         cacheWrapper = cacheWrapper )
+    if not isinstance( executable, basestring ):
+      return executable
     return S_OK( [ executable, pilotsToSubmit ] )
 
 #####################################################################################
@@ -814,22 +862,29 @@ class SiteDirector( AgentModule ):
 
 #####################################################################################
   def _writePilotScript( self, workingDirectory, pilotOptions, proxy = None,
-                         httpProxy = '', pilotExecDir = '' ):
-    """ Bundle together and write out the pilot executable script, admix the proxy if given
+                         httpProxy = '', pilotExecDir = '', cacheWrapper = False ):
+    """ Bundle together and write out the pilot executable script, admix the proxy if given.
+        With cacheWrapper, the script goes to the pilot wrapper cache if there is one
     """
 
     try:
       compressedAndEncodedProxy = ''
       proxyFlag = 'False'
       if proxy is not None:
-        compressedAndEncodedProxy = base64.encodestring( bz2.compress( proxy.dumpAllToString()['Value'] ) )
+        if self.pilotWrapperCache:
+          result = self.pilotWrapperCache.getEncodedProxy( proxy )
+          if not result['OK']:
+            return result
+          compressedAndEncodedProxy = result['Value']
+        else:
+          compressedAndEncodedProxy = base64.encodestring( bz2.compress( proxy.dumpAllToString()['Value'] ) )
         proxyFlag = 'True'
-      compressedAndEncodedPilot = base64.encodestring( bz2.compress( open( self.pilot, "rb" ).read(), 9 ) )
-      compressedAndEncodedInstall = base64.encodestring( bz2.compress( open( self.install, "rb" ).read(), 9 ) )
+      compressedAndEncodedPilot = self.__encodeFile( self.pilot )
+      compressedAndEncodedInstall = self.__encodeFile( self.install )
       compressedAndEncodedExtra = {}
       for module in self.extraModules:
         moduleName = os.path.basename( module )
-        compressedAndEncodedExtra[moduleName] = base64.encodestring( bz2.compress( open( module, "rb" ).read(), 9 ) )
+        compressedAndEncodedExtra[moduleName] = self.__encodeFile( module )
     except:
       self.log.exception( 'Exception during file compression of proxy, dirac-pilot or dirac-install' )
       return S_ERROR( 'Exception during file compression of proxy, dirac-pilot or dirac-install' )
@@ -896,191 +951,237 @@ EOF
         'pilotOptions': ' '.join( pilotOptions ),
         'proxyFlag': proxyFlag }
 
+    if self.pilotWrapperCache and cacheWrapper:
+      result = self.pilotWrapperCache.writeWrapper( localPilot )
+      if not result['OK']:
+        self.log.error( 'Failed to write the pilot wrapper', result['Message'] )
+        return result
+      return result['Value']
+
     fd, name = tempfile.mkstemp( suffix = '_pilotwrapper.py', prefix = 'DIRAC_', dir = workingDirectory )
     pilotWrapper = os.fdopen( fd, 'w' )
     pilotWrapper.write( localPilot )
     pilotWrapper.close()
     return name
 
-  def updatePilotStatus( self ):
-    """ Update status of pilots in transient states
+  def __encodeFile( self, path ):
+    """ Compressed and base64 encoded content of a pilot file
     """
-    for queue in self.queueDict:
-      ce = self.queueDict[queue]['CE']
-      ceName = self.queueDict[queue]['CEName']
-      queueName = self.queueDict[queue]['QueueName']
-      ceType = self.queueDict[queue]['CEType']
-      siteName = self.queueDict[queue]['Site']
-      abortedPilots = 0
+    if self.pilotWrapperCache:
+      return self.pilotWrapperCache.getEncodedFile( path )
+    return base64.encodestring( bz2.compress( open( path, "rb" ).read(), 9 ) )
 
-      result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
-                                            'Queue':queueName,
-                                            'GridType':ceType,
-                                            'GridSite':siteName,
-                                            'Status':TRANSIENT_PILOT_STATUS,
-                                            'OwnerDN': self.pilotDN,
-                                            'OwnerGroup': self.pilotGroup } )
+  def updatePilotStatus( self ):
+    """ Update status of pilots in transient states, the CEs being polled in parallel
+    """
+    # The pilots in transient states first, then those in final states, possibly set by the job agent,
+    # to get their output and send their accounting
+    for function in ( self._updateQueuePilotStatus, self._checkQueueFinalPilots ):
+      tasks = [ ( self.queueDict[queue]['CEName'], queue, function, ( queue, ) ) for queue in self.queueDict ]
+      result = self.ceThreadPool.execute( tasks, self.ceTimeout )
       if not result['OK']:
-        self.log.error( 'Failed to select pilots: %s' % result['Message'] )
-        continue
-      pilotRefs = result['Value']
-      if not pilotRefs:
-        continue
+        return result
+      for queue, queueResult in result['Value']['Results'].items():
+        if not queueResult['OK']:
+          self.log.error( 'Failed to update the pilots of queue %s' % queue, queueResult['Message'] )
 
-      result = pilotAgentsDB.getPilotInfo( pilotRefs )
-      if not result['OK']:
-        self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-        continue
-      pilotDict = result['Value']
+    self.__logCEStatistics()
+    return S_OK()
 
-      stampedPilotRefs = []
-      for pRef in pilotDict:
-        if pilotDict[pRef]['PilotStamp']:
-          stampedPilotRefs.append( pRef + ":::" + pilotDict[pRef]['PilotStamp'] )
-        else:
-          stampedPilotRefs = list( pilotRefs )
-          break
+  def _updateQueuePilotStatus( self, queue ):
+    """ Update status of the pilots of a queue in transient states
+    """
+    ce = self.queueDict[queue]['CE']
+    ceName = self.queueDict[queue]['CEName']
+    queueName = self.queueDict[queue]['QueueName']
+    ceType = self.queueDict[queue]['CEType']
+    siteName = self.queueDict[queue]['Site']
+    abortedPilots = 0
+
+    result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
+                                          'Queue':queueName,
+                                          'GridType':ceType,
+                                          'GridSite':siteName,
+                                          'Status':TRANSIENT_PILOT_STATUS,
+                                          'OwnerDN': self.pilotDN,
+                                          'OwnerGroup': self.pilotGroup } )
+    if not result['OK']:
+      self.log.error( 'Failed to select pilots: %s' % result['Message'] )
+      return result
+    pilotRefs = result['Value']
+    if not pilotRefs:
+      return S_OK()
 
-      result = ce.isProxyValid()
-      if not result['OK']:
-        result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 23400 )
-        if not result['OK']:
-          return result
-        self.proxy = result['Value']
-        ce.setProxy( self.proxy, 23300 )
+    result = pilotAgentsDB.getPilotInfo( pilotRefs )
+    if not result['OK']:
+      self.log.error( 'Failed to get pilots info from DB', result['Message'] )
+      return result
+    pilotDict = result['Value']
+
+    stampedPilotRefs = []
+    for pRef in pilotDict:
+      if pilotDict[pRef]['PilotStamp']:
+        stampedPilotRefs.append( pRef + ":::" + pilotDict[pRef]['PilotStamp'] )
+      else:
+        stampedPilotRefs = list( pilotRefs )
+        break
 
-      result = ce.getJobStatus( stampedPilotRefs )
+    result = ce.isProxyValid()
+    if not result['OK']:
+      result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 23400 )
       if not result['OK']:
-        self.log.error( 'Failed to get pilots status from CE', '%s: %s' % ( ceName, result['Message'] ) )
-        continue
-      pilotCEDict = result['Value']
+        return result
+      ce.setProxy( result['Value'], 23300 )
 
-      for pRef in pilotRefs:
-        newStatus = ''
-        oldStatus = pilotDict[pRef]['Status']
-        ceStatus = pilotCEDict[pRef]
-        lastUpdateTime = pilotDict[pRef]['LastUpdateTime']
-        sinceLastUpdate = dateTime() - lastUpdateTime
-
-        if oldStatus == ceStatus and ceStatus != "Unknown":
-          # Normal status did not change, continue
+    result = ce.getJobStatus( stampedPilotRefs )
+    if not result['OK']:
+      self.log.error( 'Failed to get pilots status from CE', '%s: %s' % ( ceName, result['Message'] ) )
+      return result
+    pilotCEDict = result['Value']
+
+    for pRef in pilotRefs:
+      newStatus = ''
+      oldStatus = pilotDict[pRef]['Status']
+      ceStatus = pilotCEDict[pRef]
+      lastUpdateTime = pilotDict[pRef]['LastUpdateTime']
+      sinceLastUpdate = dateTime() - lastUpdateTime
+
+      if oldStatus == ceStatus and ceStatus != "Unknown":
+        # Normal status did not change, continue
+        continue
+      elif ceStatus == "Unknown" and oldStatus == "Unknown":
+        if sinceLastUpdate < 3600*second:
+          # Allow 1 hour of Unknown status assuming temporary problems on the CE
           continue
-        elif ceStatus == "Unknown" and oldStatus == "Unknown":
-          if sinceLastUpdate < 3600*second:
-            # Allow 1 hour of Unknown status assuming temporary problems on the CE
-            continue
+        else:
+          newStatus = 'Aborted'
+      elif ceStatus == "Unknown" and not oldStatus in FINAL_PILOT_STATUS:
+        # Possible problems on the CE, let's keep the Unknown status for a while
+        newStatus = 'Unknown'
+      elif ceStatus != 'Unknown' :
+        # Update the pilot status to the new value
+        newStatus = ceStatus
+
+      if newStatus:
+        self.log.info( 'Updating status to %s for pilot %s' % ( newStatus, pRef ) )
+        result = pilotAgentsDB.setPilotStatus( pRef, newStatus, '', 'Updated by SiteDirector' )
+        if newStatus == "Aborted":
+          abortedPilots += 1
+      # Retrieve the pilot output now
+      if newStatus in FINAL_PILOT_STATUS:
+        if pilotDict[pRef]['OutputReady'].lower() == 'false' and self.getOutput:
+          self.log.info( 'Retrieving output for pilot %s' % pRef )
+          pilotStamp = pilotDict[pRef]['PilotStamp']
+          pRefStamp = pRef
+          if pilotStamp:
+            pRefStamp = pRef + ':::' + pilotStamp
+          result = ce.getJobOutput( pRefStamp )
+          if not result['OK']:
+            self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
           else:
-            newStatus = 'Aborted'
-        elif ceStatus == "Unknown" and not oldStatus in FINAL_PILOT_STATUS:
-          # Possible problems on the CE, let's keep the Unknown status for a while
-          newStatus = 'Unknown'
-        elif ceStatus != 'Unknown' :
-          # Update the pilot status to the new value
-          newStatus = ceStatus
-
-        if newStatus:
-          self.log.info( 'Updating status to %s for pilot %s' % ( newStatus, pRef ) )
-          result = pilotAgentsDB.setPilotStatus( pRef, newStatus, '', 'Updated by SiteDirector' )
-          if newStatus == "Aborted":
-            abortedPilots += 1
-        # Retrieve the pilot output now
-        if newStatus in FINAL_PILOT_STATUS:
-          if pilotDict[pRef]['OutputReady'].lower() == 'false' and self.getOutput:
-            self.log.info( 'Retrieving output for pilot %s' % pRef )
-            pilotStamp = pilotDict[pRef]['PilotStamp']
-            pRefStamp = pRef
-            if pilotStamp:
-              pRefStamp = pRef + ':::' + pilotStamp
-            result = ce.getJobOutput( pRefStamp )
-            if not result['OK']:
-              self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
+            output, error = result['Value']
+            if output:
+              result = pilotAgentsDB.storePilotOutput( pRef, output, error )
+              if not result['OK']:
+                self.log.error( 'Failed to store pilot output', result['Message'] )
             else:
-              output, error = result['Value']
-              if output:
-                result = pilotAgentsDB.storePilotOutput( pRef, output, error )
-                if not result['OK']:
-                  self.log.error( 'Failed to store pilot output', result['Message'] )
-              else:
-                self.log.warn( 'Empty pilot output not stored to PilotDB' )
-
-      # If something wrong in the queue, make a pause for the job submission
-      if abortedPilots:
-        self.failedQueues[queue] += 1
+              self.log.warn( 'Empty pilot output not stored to PilotDB' )
 
-    # The pilot can be in Done state set by the job agent check if the output is retrieved
-    for queue in self.queueDict:
-      ce = self.queueDict[queue]['CE']
+    # If something wrong in the queue, make a pause for the job submission
+    if abortedPilots:
+      self.failedQueues[queue] += 1
 
-      if not ce.isProxyValid( 120 ):
-        result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 1000 )
+    return S_OK()
+
+  def _checkQueueFinalPilots( self, queue ):
+    """ Retrieve the output and send the accounting of the pilots of a queue in final states
+    """
+    ce = self.queueDict[queue]['CE']
+
+    if not ce.isProxyValid( 120 ):
+      result = gProxyManager.getPilotProxyFromDIRACGroup( self.pilotDN, self.pilotGroup, 1000 )
+      if not result['OK']:
+        return result
+      ce.setProxy( result['Value'], 940 )
+
+    ceName = self.queueDict[queue]['CEName']
+    queueName = self.queueDict[queue]['QueueName']
+    ceType = self.queueDict[queue]['CEType']
+    siteName = self.queueDict[queue]['Site']
+    result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
+                                          'Queue':queueName,
+                                          'GridType':ceType,
+                                          'GridSite':siteName,
+                                          'OutputReady':'False',
+                                          'Status':FINAL_PILOT_STATUS} )
+
+    if not result['OK']:
+      self.log.error( 'Failed to select pilots', result['Message'] )
+      return result
+    pilotRefs = result['Value']
+    if not pilotRefs:
+      return S_OK()
+    result = pilotAgentsDB.getPilotInfo( pilotRefs )
+    if not result['OK']:
+      self.log.error( 'Failed to get pilots info from DB', result['Message'] )
+      return result
+    pilotDict = result['Value']
+    if self.getOutput:
+      for pRef in pilotRefs:
+        self.log.info( 'Retrieving output for pilot %s' % pRef )
+        pilotStamp = pilotDict[pRef]['PilotStamp']
+        pRefStamp = pRef
+        if pilotStamp:
+          pRefStamp = pRef + ':::' + pilotStamp
+        result = ce.getJobOutput( pRefStamp )
         if not result['OK']:
-          return result
-        ce.setProxy( self.proxy, 940 )
+          self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
+        else:
+          output, error = result['Value']
+          result = pilotAgentsDB.storePilotOutput( pRef, output, error )
+          if not result['OK']:
+            self.log.error( 'Failed to store pilot output', result['Message'] )
 
-      ceName = self.queueDict[queue]['CEName']
-      queueName = self.queueDict[queue]['QueueName']
-      ceType = self.queueDict[queue]['CEType']
-      siteName = self.queueDict[queue]['Site']
+    # Check if the accounting is to be sent
+    if self.sendAccounting:
       result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
                                             'Queue':queueName,
                                             'GridType':ceType,
                                             'GridSite':siteName,
-                                            'OutputReady':'False',
+                                            'AccountingSent':'False',
                                             'Status':FINAL_PILOT_STATUS} )
 
       if not result['OK']:
         self.log.error( 'Failed to select pilots', result['Message'] )
-        continue
+        return result
       pilotRefs = result['Value']
       if not pilotRefs:
-        continue
+        return S_OK()
       result = pilotAgentsDB.getPilotInfo( pilotRefs )
       if not result['OK']:
         self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-        continue
+        return result
       pilotDict = result['Value']
-      if self.getOutput:
-        for pRef in pilotRefs:
-          self.log.info( 'Retrieving output for pilot %s' % pRef )
-          pilotStamp = pilotDict[pRef]['PilotStamp']
-          pRefStamp = pRef
-          if pilotStamp:
-            pRefStamp = pRef + ':::' + pilotStamp
-          result = ce.getJobOutput( pRefStamp )
-          if not result['OK']:
-            self.log.error( 'Failed to get pilot output', '%s: %s' % ( ceName, result['Message'] ) )
-          else:
-            output, error = result['Value']
-            result = pilotAgentsDB.storePilotOutput( pRef, output, error )
-            if not result['OK']:
-              self.log.error( 'Failed to store pilot output', result['Message'] )
-
-      # Check if the accounting is to be sent
-      if self.sendAccounting:
-        result = pilotAgentsDB.selectPilots( {'DestinationSite':ceName,
-                                              'Queue':queueName,
-                                              'GridType':ceType,
-                                              'GridSite':siteName,
-                                              'AccountingSent':'False',
-                                              'Status':FINAL_PILOT_STATUS} )
-
-        if not result['OK']:
-          self.log.error( 'Failed to select pilots', result['Message'] )
-          continue
-        pilotRefs = result['Value']
-        if not pilotRefs:
-          continue
-        result = pilotAgentsDB.getPilotInfo( pilotRefs )
-        if not result['OK']:
-          self.log.error( 'Failed to get pilots info from DB', result['Message'] )
-          continue
-        pilotDict = result['Value']
-        result = self.sendPilotAccounting( pilotDict )
-        if not result['OK']:
-          self.log.error( 'Failed to send pilot agent accounting' )
+      result = self.sendPilotAccounting( pilotDict )
+      if not result['OK']:
+        self.log.error( 'Failed to send pilot agent accounting' )
+        return result
 
     return S_OK()
 
+  def __logCEStatistics( self ):
+    """ Report the time spent with each CE since the last report
+    """
+    statistics = self.ceThreadPool.getStatistics( reset = True )
+    for ceName in sorted( statistics, key = lambda ce: -statistics[ce]['TotalTime'] ):
+      ceStatistics = statistics[ceName]
+      self.log.verbose( "CE %s: %d operations (%d failed) in %.1f s, longest %.1f s" % \
+                        ( ceName, ceStatistics['Tasks'], ceStatistics['Failed'],
+                          ceStatistics['TotalTime'], ceStatistics['MaxTime'] ) )
+    if statistics:
+      slowest = max( statistics, key = lambda ce: statistics[ce]['MaxTime'] )
+      self.log.info( "Slowest CE: %s, longest operation %.1f s" % ( slowest, statistics[slowest]['MaxTime'] ) )
+
   def sendPilotAccounting( self, pilotDict ):
     """ Send pilot accounting record
     """
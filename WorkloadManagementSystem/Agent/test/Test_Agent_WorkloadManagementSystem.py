@@ -5,10 +5,12 @@
 import unittest, importlib
 from mock import MagicMock
 
-from DIRAC import gLogger
+from DIRAC import gLogger, S_OK
+from DIRAC.Core.Utilities import Time
 
 # sut
 from DIRAC.WorkloadManagementSystem.Agent.SiteDirector import SiteDirector
+from DIRAC.WorkloadManagementSystem.Agent.JobCleaningAgent import JobCleaningAgent
 
 class AgentsTestCase( unittest.TestCase ):
   """ Base class for the Agents test cases
@@ -36,6 +38,71 @@ class SiteDirectorBaseSuccess( AgentsTestCase ):
     self.sd.queueDict['aQueue']['ParametersDict'] = {}
     _res = self.sd._getPilotOptions( 'aQueue', 10 )
 
+class JobCleaningAgentPartitions( unittest.TestCase ):
+  """ Month partitions of the JobCleaningAgent
+  """
+  def setUp( self ):
+    self.jca_m = importlib.import_module( 'DIRAC.WorkloadManagementSystem.Agent.JobCleaningAgent' )
+    self.jca_m.AgentModule = MagicMock()
+    self.jca = JobCleaningAgent()
+    self.jca.partitionMode = 'Month'
+    self.jca.jobDB = MagicMock()
+    self.jca.jobDB.getNextJobID.return_value = S_OK( 3000 )
+    # 2000 JobIDs used in the last 20 days
+    self.jca.jobDB.getFirstJobSubmission.return_value = S_OK( ( 1000, Time.dateTime() - 20 * Time.day ) )
+    self.jca.jobPartitions = MagicMock()
+    self.jca.jobPartitions.setPartitions.return_value = S_OK()
+    self.jca.loggingPartitions = MagicMock()
+    self.jca.loggingPartitions.setPartitions.return_value = S_OK()
+    self.thisMonth = Time.date().replace( day = 1 )
+    self.lastMonth = ( self.thisMonth - Time.day ).strftime( 'p%Y%m' )
+    self.nextMonth = ( self.thisMonth + 31 * Time.day ).replace( day = 1 )
+
+  def __setPartitions( self, partitions ):
+    lowerBound = 0
+    value = []
+    for name, upperBound in partitions + [ ( 'pMax', None ) ]:
+      value.append( { 'Name' : name, 'LowerBound' : lowerBound, 'UpperBound' : upperBound, 'Rows' : 0 } )
+      lowerBound = upperBound
+    self.jca.jobPartitions.getPartitions.return_value = S_OK( value )
+
+  def __newPartitions( self ):
+    result = self.jca._JobCleaningAgent__checkPartitions()
+    self.assertTrue( result['OK'] )
+    partitions = self.jca.jobPartitions.setPartitions.call_args[0][0]
+    self.assertEqual( partitions, self.jca.loggingPartitions.setPartitions.call_args[0][0] )
+    return partitions
+
+  def test_nextMonthAhead( self ):
+    self.__setPartitions( [ ( self.lastMonth, 1000 ), ( self.thisMonth.strftime( 'p%Y%m' ), 5000 ) ] )
+    partitions = self.__newPartitions()
+    self.jca.jobDB.getFirstJobSubmission.assert_called_with( 0 )
+    self.assertEqual( len( partitions ), 3 )
+    name, upperBound = partitions[-1]
+    self.assertEqual( name, self.nextMonth.strftime( 'p%Y%m' ) )
+    # At 100 JobIDs a day, the next month ends between 3000 + 100 * 28 and 3000 + 100 * 62
+    self.assertTrue( 5800 <= upperBound <= 9300 )
+
+  def test_nextMonthThere( self ):
+    self.__setPartitions( [ ( self.thisMonth.strftime( 'p%Y%m' ), 5000 ), ( self.nextMonth.strftime( 'p%Y%m' ), 8000 ) ] )
+    partitions = self.__newPartitions()
+    self.assertFalse( self.jca.jobDB.getFirstJobSubmission.called )
+    self.assertEqual( len( partitions ), 2 )
+
+  def test_firstPartitions( self ):
+    self.__setPartitions( [] )
+    partitions = self.__newPartitions()
+    self.assertEqual( [ name for name, _upperBound in partitions ],
+                      [ self.thisMonth.strftime( 'p%Y%m' ), self.nextMonth.strftime( 'p%Y%m' ) ] )
+    # pMax stays empty
+    self.assertTrue( 3000 < partitions[0][1] < partitions[1][1] )
+
+  def test_noRate( self ):
+    self.jca.jobDB.getFirstJobSubmission.return_value = S_OK( ( 1000, Time.dateTime() - Time.hour ) )
+    self.__setPartitions( [ ( 'p200001', 1000 ) ] )
+    partitions = self.__newPartitions()
+    self.assertEqual( partitions, [ ( 'p200001', 1000 ), ( self.lastMonth, 3000 ) ] )
+
 
 #############################################################################
 # Test Suite run
@@ -44,6 +111,7 @@ class SiteDirectorBaseSuccess( AgentsTestCase ):
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( AgentsTestCase )
   suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( SiteDirectorBaseSuccess ) )
+  suite.addTest( unittest.defaultTestLoader.loadTestsFromTestCase( JobCleaningAgentPartitions ) )
   testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
 
 # EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#EOF#
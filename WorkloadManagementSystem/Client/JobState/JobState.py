@@ -197,11 +197,13 @@ class JobState( object ):
 
     logDB = JobState.__db.log
     gLogger.verbose( "Adding logging records for %s" % self.__jid )
+    records = []
     for record, updateTime, source in jobLog:
       gLogger.verbose( "Logging records for %s: %s %s %s" % ( self.__jid, record, updateTime, source ) )
-      record[ 'date' ] = updateTime
-      record[ 'source' ] = source
-      result = self.__retryFunction( 5, logDB.addLoggingRecord, ( self.__jid, ), record )
+      records.append( ( self.__jid, record.get( 'status', 'idem' ), record.get( 'minor', 'idem' ),
+                        record.get( 'application', 'idem' ), updateTime, source ) )
+    if records:
+      result = self.__retryFunction( 5, logDB.addLoggingRecords, ( records, ) )
       if not result[ 'OK' ]:
         return result
 
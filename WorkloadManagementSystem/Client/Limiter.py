@@ -78,7 +78,9 @@ class Limiter( object ):
     return orCond
 
   def getNegativeCondForSite( self, siteName ):
-    """ Generate a negative query based on the limits set on the site
+    """ Generate a negative query based on the limits set on the site.
+        The running limits are evaluated on each call from the job counters of the JobDB,
+        so that they take into account the jobs just matched
     """
     # Check if Limits are imposed onto the site
     negativeCond = {}
@@ -100,6 +102,20 @@ class Limiter( object ):
 
     return negativeCond
 
+  def hasLimits( self, siteName ):
+    """ Whether the negative conditions of the site can change with each match, because it has
+        running limits or matching delays
+    """
+    for checkOption, section in ( ( "JobScheduling/CheckJobLimits", self.__runningLimitSection ),
+                                  ( "JobScheduling/CheckMatchingDelay", self.__matchingDelaySection ) ):
+      if not self.__opsHelper.getValue( checkOption, True ):
+        continue
+      result = self.__extractCSData( "%s/%s" % ( section, siteName ) )
+      # Assume limits if they can not be known
+      if not result[ 'OK' ] or result[ 'Value' ]:
+        return True
+    return False
+
   def __mergeCond( self, negCond, addCond ):
     """ Merge two negative dicts
     """
@@ -158,15 +174,10 @@ class Limiter( object ):
       if attName not in self.jobDB.jobAttributeNames:
         self.log.error( "Attribute %s does not exist. Check the job limits" % attName )
         continue
-      cK = "Running:%s:%s" % ( siteName, attName )
-      data = self.condCache.get( cK )
-      if not data:
-        result = self.jobDB.getCounters( 'Jobs', [ attName ], { 'Site' : siteName, 'Status' : [ 'Running', 'Matched', 'Stalled' ] } )
-        if not result[ 'OK' ]:
-          return result
-        data = result[ 'Value' ]
-        data = dict( [ ( k[0][ attName ], k[1] )  for k in data ] )
-        self.condCache.add( cK, 10, data )
+      result = self.jobDB.getCachedCounters( attName, siteName, [ 'Running', 'Matched', 'Stalled' ] )
+      if not result[ 'OK' ]:
+        return result
+      data = result[ 'Value' ]
       for attValue in limitsDict[ attName ]:
         limit = limitsDict[ attName ][ attValue ]
         running = data.get( attValue, 0 )
@@ -29,8 +29,12 @@ class Matcher( object ):
   """ Logic for matching
   """
 
-  def __init__( self, pilotAgentsDB = None, jobDB = None, tqDB = None, jlDB = None, opsHelper = None ):
+  def __init__( self, pilotAgentsDB = None, jobDB = None, tqDB = None, jlDB = None, opsHelper = None,
+                limiter = None, snapshot = None ):
     """ c'tor
+
+        snapshot is a snapshot of a MatchingSnapshot, giving the site mask instead of querying it
+        for each resource
     """
     if pilotAgentsDB:
       self.pilotAgentsDB = pilotAgentsDB
@@ -56,7 +60,14 @@ class Matcher( object ):
 
     self.log = gLogger.getSubLogger( "Matcher" )
 
-    self.limiter = Limiter( jobDB = self.jobDB, opsHelper = self.opsHelper )
+    if limiter:
+      self.limiter = limiter
+    else:
+      self.limiter = Limiter( jobDB = self.jobDB, opsHelper = self.opsHelper )
+
+    self.snapshot = snapshot
+    if self.snapshot:
+      self.log.verbose( "Using matching snapshot version %s" % self.snapshot['Version'] )
 
 
   def selectJob( self, resourceDescription, credDict ):
@@ -78,12 +89,105 @@ class Matcher( object ):
       return {}
 
     jobID = result['jobId']
-    resAtt = self.jobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup', 'Status'] )
-    if not resAtt['OK']:
-      raise RuntimeError( 'Could not retrieve job attributes' )
-    if not resAtt['Value']:
+    resultDict = self._getMatchedJob( resourceDict, jobID )
+
+    matchTime = time.time() - startTime
+    self.log.info( "Match time: [%s]" % str( matchTime ) )
+    gMonitor.addMark( "matchTime", matchTime )
+
+    pilotInfoReportedFlag = resourceDict.get( 'PilotInfoReportedFlag', False )
+    if not pilotInfoReportedFlag:
+      self._updatePilotInfo( resourceDict )
+    self._updatePilotJobMapping( resourceDict, jobID )
+
+    return resultDict
+
+  def selectJobs( self, resourceDescriptions, credDict, numJobs = 1 ):
+    """ Bulk job selection: up to numJobs jobs for a resource description with several slots,
+        or for each of a list of resource descriptions.
+        The negative conditions of the Limiter are evaluated once per resource, or before each job
+        at the sites with running limits or matching delays, so that the jobs of the request count
+        against them.
+
+        Returns a list with a dictionary like the one of selectJob per matched job
+    """
+
+    startTime = time.time()
+
+    if not isinstance( resourceDescriptions, list ):
+      resourceDescriptions = [ resourceDescriptions ]
+    # Check all the descriptions before taking any job out of the task queues
+    resourceDicts = [ self._getResourceDict( resourceDescription, credDict )
+                      for resourceDescription in resourceDescriptions ]
+
+    limitedSites = {}
+    matchedJobs = []
+    errors = []
+    for resourceDict in resourceDicts:
+      site = resourceDict['Site']
+      if site not in limitedSites:
+        limitedSites[site] = self.limiter.hasLimits( site )
+      batchSize = 1 if limitedSites[site] else numJobs
+      matchedJobIDs = []
+      jobsLeft = numJobs
+      while jobsLeft > 0:
+        negativeCond = self.limiter.getNegativeCondForSite( site )
+        result = self.tqDB.matchAndGetJobs( resourceDict, min( batchSize, jobsLeft ), negativeCond = negativeCond )
+        if not result['OK']:
+          # Jobs already taken out of the task queues for other resources are still served
+          self.log.error( "Failed to match jobs", result['Message'] )
+          errors.append( result['Message'] )
+          break
+        jobIDs = [ jobID for jobID, _tqID in result['Value']['jobs'] ]
+        if not jobIDs:
+          break
+        jobsLeft -= len( jobIDs )
+
+        result = self._getJobsData( jobIDs )
+        if not result['OK']:
+          self.log.error( "Could not retrieve the matched jobs", result['Message'] )
+          errors.append( result['Message'] )
+          break
+        jobsData = result['Value']
+
+        # Serving the job updates the counters of the running limits and the matching delays
+        for jobID in jobIDs:
+          try:
+            matchedJobs.append( self._getMatchedJob( resourceDict, jobID, jobsData.get( jobID, {} ) ) )
+            matchedJobIDs.append( jobID )
+          except RuntimeError, rte:
+            self.log.error( "Could not serve matched job", "%s: %s" % ( jobID, rte ) )
+
+      if matchedJobIDs and not resourceDict.get( 'PilotInfoReportedFlag', False ):
+        self._updatePilotInfo( resourceDict )
+      for jobID in matchedJobIDs:
+        self._updatePilotJobMapping( resourceDict, jobID )
+
+    if not matchedJobs:
+      if errors:
+        raise RuntimeError( errors[-1] )
+      self.log.info( "No match found" )
+      return []
+
+    matchTime = time.time() - startTime
+    self.log.info( "Match time for %s jobs: [%s]" % ( len( matchedJobs ), str( matchTime ) ) )
+    gMonitor.addMark( "matchTime", matchTime )
+
+    return matchedJobs
+
+  def _getMatchedJob( self, resourceDict, jobID, jobData = None ):
+    """ Check the job taken out of the task queues, set it as matched and get what the pilot needs to run it
+
+        jobData is the data of the job as given by JobDB.getJobsData, fetched here if not given
+    """
+    if jobData is None:
+      result = self._getJobsData( [ jobID ] )
+      if not result['OK']:
+        raise RuntimeError( 'Could not retrieve job attributes' )
+      jobData = result['Value'].get( jobID )
+    if not jobData:
       raise RuntimeError( "No attributes returned for job" )
-    if not resAtt['Value']['Status'] == 'Waiting':
+    if not jobData['Status'] == 'Waiting':
       self.log.error( 'Job matched by the TQ is not in Waiting state', str( jobID ) )
       result = self.tqDB.deleteJob( jobID )
       if not result[ 'OK' ]:
@@ -92,43 +196,31 @@ class Matcher( object ):
 
     self._reportStatus( resourceDict, jobID )
 
-    result = self.jobDB.getJobJDL( jobID )
-    if not result['OK']:
+    if not jobData['JDL']:
       raise RuntimeError( "Failed to get the job JDL" )
 
     resultDict = {}
-    resultDict['JDL'] = result['Value']
+    resultDict['JDL'] = jobData['JDL']
     resultDict['JobID'] = jobID
 
-    matchTime = time.time() - startTime
-    self.log.info( "Match time: [%s]" % str( matchTime ) )
-    gMonitor.addMark( "matchTime", matchTime )
-
     # Get some extra stuff into the response returned
-    resOpt = self.jobDB.getJobOptParameters( jobID )
-    if resOpt['OK']:
-      for key, value in resOpt['Value'].items():
-        resultDict[key] = value
-    resAtt = self.jobDB.getJobAttributes( jobID, ['OwnerDN', 'OwnerGroup'] )
-    if not resAtt['OK']:
-      raise RuntimeError( 'Could not retrieve job attributes' )
-    if not resAtt['Value']:
-      raise RuntimeError( 'No attributes returned for job' )
+    for key, value in jobData['OptimizerParameters'].items():
+      resultDict[key] = value
 
     if self.opsHelper.getValue( "JobScheduling/CheckMatchingDelay", True ):
       self.limiter.updateDelayCounters( resourceDict['Site'], jobID )
 
-    pilotInfoReportedFlag = resourceDict.get( 'PilotInfoReportedFlag', False )
-    if not pilotInfoReportedFlag:
-      self._updatePilotInfo( resourceDict )
-    self._updatePilotJobMapping( resourceDict, jobID )
-
-    resultDict['DN'] = resAtt['Value']['OwnerDN']
-    resultDict['Group'] = resAtt['Value']['OwnerGroup']
+    resultDict['DN'] = jobData['OwnerDN']
+    resultDict['Group'] = jobData['OwnerGroup']
     resultDict['PilotInfoReportedFlag'] = True
 
     return resultDict
 
+  def _getJobsData( self, jobIDs ):
+    """ Get in one go what is needed to serve the matched jobs
+    """
+    return self.jobDB.getJobsData( jobIDs, [ 'OwnerDN', 'OwnerGroup', 'Status' ], optParamList = [], jdl = True )
+
 
   def _getResourceDict( self, resourceDescription, credDict ):
     """ from resourceDescription to resourceDict (just various mods)
@@ -258,11 +350,14 @@ class Matcher( object ):
       raise RuntimeError( "Missing Site Name in Resource JDL" )
 
     # Get common site mask and check the agent site
-    result = self.jobDB.getSiteMask( siteState = 'Active' )
-    if not result['OK']:
-      self.log.error( "Internal error", "getSiteMask: %s" % result['Message'] )
-      raise RuntimeError( "Internal error" )
-    maskList = result['Value']
+    if self.snapshot:
+      maskList = self.snapshot['SiteMask']
+    else:
+      result = self.jobDB.getSiteMask( siteState = 'Active' )
+      if not result['OK']:
+        self.log.error( "Internal error", "getSiteMask: %s" % result['Message'] )
+        raise RuntimeError( "Internal error" )
+      maskList = result['Value']
 
     if resourceDict['Site'] not in maskList:
       return False
@@ -0,0 +1,161 @@
+""" Snapshot of the matching conditions shared by the matcher threads and processes
+
+    Utilities and classes here are used by the MatcherHandler
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import time
+import fcntl
+import tempfile
+import threading
+
+from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC.Core.Utilities import DEncode
+from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
+from DIRAC.WorkloadManagementSystem.Client.Limiter import Limiter
+
+class MatchingSnapshot( object ):
+  """
+    Periodically refreshed view of the conditions checked for every pilot: the active sites
+    of the site mask, per VO.
+
+    A snapshot is a dict with the VO, the Version, the creation Time and the SiteMask. It is never
+    modified once created, so a match can use the same view for all its steps. If a directory is
+    given, snapshots are also shared with the other processes of the host through a file per VO:
+    only the process holding the lock of the file builds a new one.
+
+    The running limits and the matching delays change with every match, they are evaluated by
+    the Limiter of the VO for each request.
+  """
+
+  def __init__( self, jobDB, refreshPeriod = 10, cacheDirectory = '' ):
+    """
+    :param jobDB: JobDB used to build the snapshots
+    :param refreshPeriod: seconds a snapshot is valid
+    :param cacheDirectory: directory of the snapshot files, no sharing between processes if empty
+    """
+    self.__jobDB = jobDB
+    self.__refreshPeriod = refreshPeriod
+    self.__cacheDirectory = cacheDirectory
+    self.__snapshots = {}
+    self.__limiters = {}
+    self.__lock = threading.Lock()
+    self.__refreshLock = threading.Lock()
+    self.log = gLogger.getSubLogger( "MatchingSnapshot" )
+    if self.__cacheDirectory and not os.path.isdir( self.__cacheDirectory ):
+      os.makedirs( self.__cacheDirectory )
+
+  def getLimiter( self, vo ):
+    """ Limiter of the VO, kept for the life of the process so that the matching delays apply
+    """
+    self.__lock.acquire()
+    try:
+      if vo not in self.__limiters:
+        self.__limiters[ vo ] = Limiter( jobDB = self.__jobDB, opsHelper = Operations( vo = vo ) )
+      return self.__limiters[ vo ]
+    finally:
+      self.__lock.release()
+
+  def getSnapshot( self, vo ):
+    """ Get the current snapshot of the VO, refreshing it if it is too old
+    """
+    snapshot = self.__snapshots.get( vo )
+    if snapshot and not self.__isOutdated( snapshot ):
+      return S_OK( snapshot )
+    #Only one thread refreshes, the others go on with the current snapshot
+    if not self.__refreshLock.acquire( not snapshot ):
+      return S_OK( snapshot )
+    try:
+      snapshot = self.__snapshots.get( vo )
+      if snapshot and not self.__isOutdated( snapshot ):
+        return S_OK( snapshot )
+      if self.__cacheDirectory:
+        result = self.__refreshShared( vo, snapshot )
+      else:
+        result = self.__build( vo, snapshot[ 'Version' ] + 1 if snapshot else 1 )
+      if not result[ 'OK' ]:
+        if snapshot:
+          self.log.warn( "Could not refresh the matching snapshot, keeping version %s" % snapshot[ 'Version' ],
+                         result[ 'Message' ] )
+          return S_OK( snapshot )
+        return result
+      self.__snapshots[ vo ] = result[ 'Value' ]
+      return result
+    finally:
+      self.__refreshLock.release()
+
+  def __isOutdated( self, snapshot ):
+    return time.time() - snapshot[ 'Time' ] > self.__refreshPeriod
+
+  def __build( self, vo, version ):
+    """ Build a new snapshot from the DB and the CS
+    """
+    result = self.__jobDB.getSiteMask( 'Active' )
+    if not result[ 'OK' ]:
+      return result
+    siteMask = result[ 'Value' ]
+    self.log.verbose( "New matching snapshot for VO '%s': version %s" % ( vo, version ) )
+    return S_OK( { 'VO' : vo,
+                   'Version' : version,
+                   'Time' : time.time(),
+                   'SiteMask' : siteMask } )
+
+  def __refreshShared( self, vo, snapshot ):
+    """ Take the snapshot of the file if it is recent, build and write a new one otherwise
+    """
+    fileName = os.path.join( self.__cacheDirectory, "MatchingSnapshot.%s" % ( vo or 'default' ) )
+    fileSnapshot = self.__readFile( fileName )
+    if fileSnapshot and not self.__isOutdated( fileSnapshot ):
+      return S_OK( fileSnapshot )
+    versions = [ 0 ]
+    for previous in ( snapshot, fileSnapshot ):
+      if previous:
+        versions.append( previous[ 'Version' ] )
+
+    try:
+      lockFD = os.open( "%s.lock" % fileName, os.O_WRONLY | os.O_CREAT, 0644 )
+    except OSError, excp:
+      return S_ERROR( "Cannot open the lock of %s: %s" % ( fileName, excp ) )
+    try:
+      try:
+        fcntl.flock( lockFD, fcntl.LOCK_EX | fcntl.LOCK_NB )
+      except IOError:
+        #Another process is building it, go on with the last one known
+        if fileSnapshot and fileSnapshot[ 'Version' ] >= max( versions ):
+          return S_OK( fileSnapshot )
+        if snapshot:
+          return S_OK( snapshot )
+        fcntl.flock( lockFD, fcntl.LOCK_EX )
+        fileSnapshot = self.__readFile( fileName )
+        if fileSnapshot:
+          return S_OK( fileSnapshot )
+      result = self.__build( vo, max( versions ) + 1 )
+      if result[ 'OK' ]:
+        self.__writeFile( fileName, result[ 'Value' ] )
+      return result
+    finally:
+      os.close( lockFD )
+
+  def __readFile( self, fileName ):
+    if not os.path.isfile( fileName ):
+      return None
+    try:
+      with open( fileName ) as snapshotFile:
+        return DEncode.decode( snapshotFile.read() )[0]
+    except Exception, excp:
+      self.log.warn( "Cannot read the matching snapshot", "%s: %s" % ( fileName, excp ) )
+      return None
+
+  def __writeFile( self, fileName, snapshot ):
+    #Written aside and renamed, readers see either the old or the new snapshot
+    try:
+      tmpFD, tmpName = tempfile.mkstemp( dir = self.__cacheDirectory )
+      try:
+        os.write( tmpFD, DEncode.encode( snapshot ) )
+      finally:
+        os.close( tmpFD )
+      os.rename( tmpName, fileName )
+    except Exception, excp:
+      self.log.warn( "Cannot write the matching snapshot", "%s: %s" % ( fileName, excp ) )
@@ -147,6 +147,34 @@ class MatcherTestCase( ClientsTestCase ):
 
     self.assertEqual( res, resExpected )
 
+  def test_selectJobs( self ):
+
+    self.matcher._getResourceDict = lambda resourceDescription, credDict : resourceDescription
+    self.matcher._getMatchedJob = lambda resourceDict, jobID, jobData : { 'JobID' : jobID }
+    self.matcher.limiter = MagicMock()
+    self.jobDBMock.getJobsData.return_value = S_OK( {} )
+    resourceDescription = { 'Site' : 'DIRAC.Jenkins.ch' }
+
+    # Without limits at the site the jobs are taken at once
+    self.matcher.limiter.hasLimits.return_value = False
+    self.tqDBMock.matchAndGetJobs.return_value = S_OK( { 'jobs' : [ ( 1, 10 ), ( 2, 10 ), ( 3, 11 ) ] } )
+    res = self.matcher.selectJobs( resourceDescription, {}, numJobs = 3 )
+    self.assertEqual( [ job['JobID'] for job in res ], [ 1, 2, 3 ] )
+    self.assertEqual( self.tqDBMock.matchAndGetJobs.call_count, 1 )
+
+    # With limits the negative conditions are evaluated again for each job
+    self.matcher.limiter.hasLimits.return_value = True
+    self.matcher.limiter.getNegativeCondForSite.side_effect = [ {}, { 'JobType' : [ 'MCSimulation' ] }, {} ]
+    self.tqDBMock.matchAndGetJobs.reset_mock()
+    self.tqDBMock.matchAndGetJobs.side_effect = [ S_OK( { 'jobs' : [ ( 4, 10 ) ] } ),
+                                                  S_OK( { 'jobs' : [ ( 5, 11 ) ] } ),
+                                                  S_OK( { 'jobs' : [] } ) ]
+    res = self.matcher.selectJobs( resourceDescription, {}, numJobs = 3 )
+    self.assertEqual( [ job['JobID'] for job in res ], [ 4, 5 ] )
+    calls = self.tqDBMock.matchAndGetJobs.call_args_list
+    self.assertEqual( [ call[0][1] for call in calls ], [ 1, 1, 1 ] )
+    self.assertEqual( calls[1][1]['negativeCond'], { 'JobType' : [ 'MCSimulation' ] } )
+
 #############################################################################
 
 class SandboxStoreTestCaseSuccess( ClientsTestCase ):
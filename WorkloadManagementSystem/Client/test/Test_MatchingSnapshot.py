@@ -0,0 +1,59 @@
+""" Test for the snapshot of the matching conditions
+"""
+
+import shutil
+import tempfile
+import unittest
+
+from mock import MagicMock, patch
+
+from DIRAC import S_OK
+from DIRAC.WorkloadManagementSystem.Client.MatchingSnapshot import MatchingSnapshot
+
+class MatchingSnapshotTestCase( unittest.TestCase ):
+  """ Base class for the MatchingSnapshot test cases
+  """
+  def setUp( self ):
+    self.jobDB = MagicMock()
+    self.jobDB.getSiteMask.return_value = S_OK( [ 'Site.A', 'Site.B' ] )
+    self.limiterPatcher = patch( 'DIRAC.WorkloadManagementSystem.Client.MatchingSnapshot.Limiter' )
+    self.opsPatcher = patch( 'DIRAC.WorkloadManagementSystem.Client.MatchingSnapshot.Operations' )
+    self.limiterPatcher.start()
+    self.opsPatcher.start()
+    self.cacheDirectory = tempfile.mkdtemp()
+
+  def tearDown( self ):
+    self.limiterPatcher.stop()
+    self.opsPatcher.stop()
+    shutil.rmtree( self.cacheDirectory )
+
+  def test_inProcess( self ):
+    matchingSnapshot = MatchingSnapshot( self.jobDB, refreshPeriod = 60 )
+    snapshot = matchingSnapshot.getSnapshot( 'vo' )[ 'Value' ]
+    self.assertEqual( snapshot[ 'Version' ], 1 )
+    self.assertEqual( snapshot[ 'SiteMask' ], [ 'Site.A', 'Site.B' ] )
+    self.assertFalse( 'RunningLimits' in snapshot )
+    self.assertTrue( matchingSnapshot.getSnapshot( 'vo' )[ 'Value' ] is snapshot )
+    self.assertEqual( self.jobDB.getSiteMask.call_count, 1 )
+    self.assertTrue( matchingSnapshot.getLimiter( 'vo' ) is matchingSnapshot.getLimiter( 'vo' ) )
+
+  def test_refresh( self ):
+    matchingSnapshot = MatchingSnapshot( self.jobDB, refreshPeriod = -1 )
+    self.assertEqual( matchingSnapshot.getSnapshot( 'vo' )[ 'Value' ][ 'Version' ], 1 )
+    self.assertEqual( matchingSnapshot.getSnapshot( 'vo' )[ 'Value' ][ 'Version' ], 2 )
+    #A failing refresh keeps the previous snapshot
+    self.jobDB.getSiteMask.return_value = { 'OK' : False, 'Message' : 'No DB' }
+    self.assertEqual( matchingSnapshot.getSnapshot( 'vo' )[ 'Value' ][ 'Version' ], 2 )
+
+  def test_shared( self ):
+    first = MatchingSnapshot( self.jobDB, refreshPeriod = 60, cacheDirectory = self.cacheDirectory )
+    second = MatchingSnapshot( self.jobDB, refreshPeriod = 60, cacheDirectory = self.cacheDirectory )
+    snapshot = first.getSnapshot( 'vo' )[ 'Value' ]
+    sharedSnapshot = second.getSnapshot( 'vo' )[ 'Value' ]
+    self.assertEqual( sharedSnapshot[ 'Version' ], snapshot[ 'Version' ] )
+    self.assertEqual( sharedSnapshot[ 'SiteMask' ], snapshot[ 'SiteMask' ] )
+    self.assertEqual( self.jobDB.getSiteMask.call_count, 1 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( MatchingSnapshotTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -9,8 +9,10 @@
     getAllJobAttributes()
     getDistinctJobAttributes()
     getAttributesForJobList()
+    getJobsData()
     getJobParameter()
     getJobParameters()
+    getJobsParameter()
     getAllJobParameters()
     getInputData()
     getJobJDL()
@@ -20,8 +22,10 @@
 
     setJobAttribute()
     setJobAttributes()
+    setJobsAttributes()
     setJobParameter()
     setJobParameters()
+    setJobsParameters()
     setJobJDL()
     setJobStatus()
     setInputData()
@@ -29,6 +33,10 @@
     insertNewJobIntoDB()
     removeJobFromDB()
 
+    getNextJobID()
+    getPartitionSummary()
+    getPartitionJobs()
+
     rescheduleJob()
     rescheduleJobs()
 
@@ -38,21 +46,26 @@
     banSiteInMask()
 
     getCounters()
+    getCachedCounters()
 """
 
 __RCSID__ = "$Id$"
 
 import sys
+import time
+import threading
 import operator
 
 from DIRAC.Core.Utilities.ClassAd.ClassAdLight               import ClassAd
 from DIRAC.Core.Utilities.ReturnValues                       import S_OK, S_ERROR
 from DIRAC.Core.Utilities                                    import Time
+from DIRAC.Core.Utilities.List                               import breakListIntoChunks
 from DIRAC.ConfigurationSystem.Client.Config                 import gConfig
 from DIRAC.ConfigurationSystem.Client.Helpers.Registry       import getVOForGroup, getVOOption, getGroupOption
 from DIRAC.Core.Base.DB                                      import DB
 from DIRAC.ConfigurationSystem.Client.Helpers.Resources      import getDIRACPlatform
 from DIRAC.WorkloadManagementSystem.Client.JobState.JobManifest   import JobManifest
+from DIRAC.WorkloadManagementSystem.private.JobCounters      import JobCounters
 
 #############################################################################
 
@@ -79,7 +92,15 @@ class JobDB( DB ):
     self.JOB_STATES = ['Received', 'Checking', 'Staging', 'Waiting', 'Matched',
                        'Running', 'Stalled', 'Done', 'Completed', 'Failed']
     self.JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
+    self.JOB_COUNTED_STATES = ['Matched', 'Running', 'Stalled']
     self.jdl2DBParameters = ['JobName', 'JobType', 'JobGroup']
+    # Tables that can be partitioned on the JobID, see JobPartitions
+    self.PARTITIONED_TABLES = ['Jobs', 'JobJDLs', 'InputData', 'JobParameters', 'OptimizerParameters',
+                               'AtticJobParameters', 'HeartBeatLoggingInfo', 'JobCommands']
+
+    self.__jobCounters = JobCounters( self.JOB_COUNTED_STATES )
+    self.__jobCountersLock = threading.Lock()
+    self.__jobCountersLastSync = 0
 
     self.log.info( "MaxReschedule:  %s" % self.maxRescheduling )
     self.log.info( "==================================================" )
@@ -141,6 +162,93 @@ class JobDB( DB ):
     except Exception as x:
       return S_ERROR( 'JobDB.getAttributesForJobList: Failed\n%s' % str( x ) )
 
+#############################################################################
+  def getJobsData( self, jobIDList, attrList = None, optParamList = None, jdl = False, columnar = False ):
+    """ Get in bulk the attributes (all of them if attrList is None), the optimizer parameters
+        (none if optParamList is None, all of them if it is empty) and the current JDL of the jobs.
+        Values keep their DB types, only blobs are converted to strings.
+
+        Returns an S_OK structure with a dictionary of dictionaries as its Value:
+        ValueDict[jobID][attribute_name] = attribute_value, plus the 'OptimizerParameters'
+        dictionary and the 'JDL' of the job if requested.
+        With columnar, the Value is { 'ParameterNames' : names, 'Records' : [ values per job ] }
+        instead, JobID being the first column
+    """
+    if attrList is None:
+      attrList = self.jobAttributeNames
+    for attrName in attrList:
+      if attrName not in self.jobAttributeNames:
+        return S_ERROR( 'JobDB.getJobsData: unknown attribute %s' % attrName )
+    try:
+      jobIDList = [ int( jobID ) for jobID in jobIDList ]
+    except ( TypeError, ValueError ):
+      return S_ERROR( 'JobDB.getJobsData: job IDs must be integers' )
+    attrList = [ attrName for attrName in attrList if attrName != 'JobID' ]
+
+    columns = [ 'j.`JobID`' ] + [ 'j.`%s`' % attrName for attrName in attrList ]
+    tables = 'Jobs j'
+    if jdl:
+      columns.append( 'jdl.`JDL`' )
+      tables += ' LEFT JOIN JobJDLs jdl ON j.JobID = jdl.JobID'
+
+    nameCond = ''
+    if optParamList:
+      paramNames = []
+      for name in optParamList:
+        ret = self._escapeString( name )
+        if not ret['OK']:
+          return ret
+        paramNames.append( ret['Value'] )
+      nameCond = ' AND Name IN ( %s )' % ','.join( paramNames )
+
+    jobsData = {}
+    for jobIDs in breakListIntoChunks( jobIDList, 1000 ):
+      jobList = ','.join( [ str( jobID ) for jobID in jobIDs ] )
+      cmd = 'SELECT %s FROM %s WHERE j.JobID IN ( %s )' % ( ', '.join( columns ), tables, jobList )
+      result = self._query( cmd )
+      if not result['OK']:
+        return result
+      for row in result['Value']:
+        jobDict = dict( zip( attrList, [ self.__blobToString( value ) for value in row[1:len( attrList ) + 1] ] ) )
+        jobDict['JobID'] = int( row[0] )
+        if jdl:
+          jobDict['JDL'] = self.__blobToString( row[-1] ) or ''
+        if optParamList is not None:
+          jobDict['OptimizerParameters'] = {}
+        jobsData[ int( row[0] ) ] = jobDict
+
+      if optParamList is None:
+        continue
+      cmd = 'SELECT JobID, Name, Value FROM OptimizerParameters WHERE JobID IN ( %s )%s' % ( jobList, nameCond )
+      result = self._query( cmd )
+      if not result['OK']:
+        return result
+      for jobID, name, value in result['Value']:
+        jobID = int( jobID )
+        if jobID in jobsData:
+          jobsData[ jobID ]['OptimizerParameters'][ name ] = self.__blobToString( value )
+
+    if not columnar:
+      return S_OK( jobsData )
+
+    paramNames = [ 'JobID' ] + attrList
+    if optParamList is not None:
+      paramNames.append( 'OptimizerParameters' )
+    if jdl:
+      paramNames.append( 'JDL' )
+    records = []
+    for jobID in sorted( jobsData ):
+      records.append( [ jobsData[ jobID ][ name ] for name in paramNames ] )
+    return S_OK( { 'ParameterNames' : paramNames, 'Records' : records } )
+
+  @staticmethod
+  def __blobToString( value ):
+    """ Blobs may come as arrays, depending on the MySQLdb version
+    """
+    if hasattr( value, 'tostring' ):
+      return value.tostring()
+    return value
+
 
 #############################################################################
   def getDistinctJobAttributes( self, attribute, condDict = None, older = None,
@@ -305,6 +413,30 @@ class JobDB( DB ):
 
         return S_OK( resultDict )
 
+#############################################################################
+  def getJobsParameter( self, jobIDList, parameter ):
+    """ Get the given parameter of the jobs in jobIDList as a { jobID : value } dictionary,
+        jobs without the parameter are not in the result
+    """
+    ret = self._escapeString( parameter )
+    if not ret['OK']:
+      return ret
+    e_parameter = ret['Value']
+
+    resultDict = {}
+    for jobChunk in breakListIntoChunks( [ int( jobID ) for jobID in jobIDList ], 1000 ):
+      cmd = "SELECT JobID, Value FROM JobParameters WHERE Name=%s AND JobID IN (%s)" % \
+            ( e_parameter, ','.join( [ str( jobID ) for jobID in jobChunk ] ) )
+      result = self._query( cmd )
+      if not result['OK']:
+        return result
+      for jobID, value in result['Value']:
+        try:
+          resultDict[jobID] = value.tostring()
+        except Exception:
+          resultDict[jobID] = value
+    return S_OK( resultDict )
+
 #############################################################################
   def getAtticJobParameters( self, jobID, paramList = None, rescheduleCounter = -1 ):
     """ Get Attic Job Parameters defined for a job with jobID.
@@ -613,8 +745,10 @@ class JobDB( DB ):
     if myDate:
       cmd += ' AND LastUpdateTime < %s' % myDate
 
+    countedValues = self.__getCountedValues( jobID, [ attrName ] )
     res = self._update( cmd )
     if res['OK']:
+      self.__updateJobCounters( countedValues, res['Value'], [ attrName ], [ attrValue ] )
       return res
     else:
       return S_ERROR( 'JobDB.setAttribute: failed to set attribute' )
@@ -651,12 +785,79 @@ class JobDB( DB ):
     if myDate:
       cmd += ' AND LastUpdateTime < %s' % myDate
 
+    countedValues = self.__getCountedValues( jobID, attrNames )
     res = self._update( cmd )
     if res['OK']:
+      self.__updateJobCounters( countedValues, res['Value'], attrNames, attrValues )
       return res
     else:
       return S_ERROR( 'JobDB.setAttributes: failed to set attribute' )
 
+#############################################################################
+  def setJobsAttributes( self, jobsAttributes, update = False ):
+    """ Set attributes of many jobs at once, jobsAttributes being { jobID : { attrName : value } }.
+        The jobs setting the same attributes are updated together by a single query per chunk.
+        The LastUpdate time stamp is refreshed if explicitly requested
+    """
+    if not jobsAttributes:
+      return S_OK( 0 )
+    for attrDict in jobsAttributes.values():
+      for attrName in attrDict:
+        if attrName not in self.jobAttributeNames:
+          return S_ERROR( 'JobDB.setJobsAttributes: unknown attribute %s' % attrName )
+
+    if self.__jobCounters.getAttributes():
+      # The job counters need the previous values of each job
+      for jobID, attrDict in jobsAttributes.items():
+        result = self.setJobAttributes( jobID, attrDict.keys(), attrDict.values(), update = update )
+        if not result['OK']:
+          return result
+      return S_OK( len( jobsAttributes ) )
+
+    groups = {}
+    for jobID, attrDict in jobsAttributes.items():
+      attrNames = tuple( sorted( attrDict ) )
+      groups.setdefault( attrNames, [] ).append( [ attrDict[ attrName ] for attrName in attrNames ] + [ int( jobID ) ] )
+    updated = 0
+    for attrNames, rows in groups.items():
+      updateFields = list( attrNames )
+      if update:
+        updateFields.append( 'LastUpdateTime' )
+        now = Time.toString( Time.dateTime() )
+        rows = [ row[:-1] + [ now, row[-1] ] for row in rows ]
+      result = self.updateMany( 'Jobs', updateFields, [ 'JobID' ], rows )
+      if not result['OK']:
+        return S_ERROR( 'JobDB.setJobsAttributes: failed to set attributes: %s' % result['Message'] )
+      updated += result['Value']
+    return S_OK( updated )
+
+#############################################################################
+  def __getCountedValues( self, jobID, attrNames ):
+    """ Get the Site, Status and counted attributes of a job before changing attrNames,
+        None if the change does not affect the job counters. jobID is already escaped
+    """
+    countedNames = self.__jobCounters.getAttributes()
+    if not countedNames:
+      return None
+    countedNames = list( set( [ 'Site', 'Status' ] + countedNames ) )
+    if not set( attrNames ).intersection( countedNames ):
+      return None
+    cmd = 'SELECT %s FROM Jobs WHERE JobID=%s' % ( ', '.join( [ '`%s`' % name for name in countedNames ] ), jobID )
+    result = self._query( cmd )
+    if not result['OK'] or not result['Value']:
+      return None
+    return dict( zip( countedNames, [ str( value ) for value in result['Value'][0] ] ) )
+
+  def __updateJobCounters( self, countedValues, numUpdated, attrNames, attrValues ):
+    """ Move the job to its new job counters once the change is done
+    """
+    if not countedValues or not numUpdated:
+      return
+    newValues = dict( countedValues )
+    for attrName, attrValue in zip( attrNames, attrValues ):
+      newValues[ attrName ] = str( attrValue )
+    self.__jobCounters.update( countedValues, newValues )
+
 #############################################################################
   def setJobStatus( self, jobID, status = '', minor = '', application = '', appCounter = None ):
     """ Set status of the job specified by its jobID
@@ -730,6 +931,34 @@ class JobDB( DB ):
     result = self._update( req )
     return result
 
+#############################################################################
+  def setEndExecTimes( self, jobDates ):
+    """ Set the EndExecTime time stamp of many jobs, jobDates being { jobID : date }
+    """
+    return self.__setExecTimes( 'EndExecTime', jobDates )
+
+  def setStartExecTimes( self, jobDates ):
+    """ Set the StartExecTime time stamp of many jobs, jobDates being { jobID : date }
+    """
+    return self.__setExecTimes( 'StartExecTime', jobDates )
+
+  def __setExecTimes( self, timeField, jobDates ):
+    """ Set the time stamp of the jobs not having it yet, by chunks of 1000 jobs
+    """
+    for jobIDs in breakListIntoChunks( jobDates.keys(), 1000 ):
+      cases = []
+      for jobID in jobIDs:
+        ret = self._escapeString( jobDates[ jobID ] )
+        if not ret['OK']:
+          return ret
+        cases.append( 'WHEN %d THEN %s' % ( int( jobID ), ret['Value'] ) )
+      req = "UPDATE Jobs SET %s = CASE JobID %s END WHERE JobID IN ( %s ) AND %s IS NULL" % \
+            ( timeField, ' '.join( cases ), ','.join( [ str( int( jobID ) ) for jobID in jobIDs ] ), timeField )
+      result = self._update( req )
+      if not result['OK']:
+        return result
+    return S_OK()
+
 #############################################################################
   def setJobParameter( self, jobID, key, value ):
     """ Set a parameter specified by name,value pair for the job JobID
@@ -778,6 +1007,32 @@ class JobDB( DB ):
 
     return result
 
+#############################################################################
+  def setJobsParameters( self, jobsParameters ):
+    """ Set parameters of many jobs, jobsParameters being { jobID : [ ( name, value ) ] },
+        with one query per chunk of 1000 parameters
+    """
+    insertValueList = []
+    for jobID, parameters in jobsParameters.items():
+      for name, value in parameters:
+        ret = self._escapeString( name )
+        if not ret['OK']:
+          return ret
+        e_name = ret['Value']
+        ret = self._escapeString( value )
+        if not ret['OK']:
+          return ret
+        e_value = ret['Value']
+        insertValueList.append( '(%d,%s,%s)' % ( int( jobID ), e_name, e_value ) )
+
+    for valueList in breakListIntoChunks( insertValueList, 1000 ):
+      cmd = 'REPLACE JobParameters (JobID,Name,Value) VALUES %s' % ', '.join( valueList )
+      result = self._update( cmd )
+      if not result['OK']:
+        return S_ERROR( 'JobDB.setJobsParameters: operation failed.' )
+
+    return S_OK()
+
 #############################################################################
   def setJobOptParameter( self, jobID, name, value ):
     """ Set an optimzer parameter specified by name,value pair for the job JobID
@@ -1275,6 +1530,55 @@ class JobDB( DB ):
 
     return result
 
+#############################################################################
+  def getNextJobID( self ):
+    """ Get the JobID the next inserted job will have
+    """
+    result = self._query( "SELECT AUTO_INCREMENT FROM INFORMATION_SCHEMA.TABLES "
+                          "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'JobJDLs'" )
+    if not result['OK']:
+      return result
+    if not result['Value'] or result['Value'][0][0] is None:
+      return S_ERROR( 'Cannot get the next JobID' )
+    return S_OK( int( result['Value'][0][0] ) )
+
+#############################################################################
+  def getFirstJobSubmission( self, fromJobID = 0 ):
+    """ Get ( JobID, SubmissionTime ) of the first job whose JobID is at least fromJobID,
+        None if there is no such job
+    """
+    result = self._query( "SELECT JobID, SubmissionTime FROM Jobs WHERE JobID >= %d "
+                          "ORDER BY JobID LIMIT 1" % int( fromJobID ) )
+    if not result['OK']:
+      return result
+    if not result['Value'] or result['Value'][0][1] is None:
+      return S_OK( None )
+    return S_OK( ( int( result['Value'][0][0] ), result['Value'][0][1] ) )
+
+#############################################################################
+  def getPartitionSummary( self, partition ):
+    """ Get the number of jobs and their last update per JobType and Status in a partition
+        of the Jobs table, as a { ( jobType, status ) : ( count, lastUpdateTime ) } dictionary
+    """
+    cmd = "SELECT JobType, Status, COUNT(*), MAX(LastUpdateTime) FROM Jobs PARTITION ( %s ) " \
+          "GROUP BY JobType, Status" % partition
+    result = self._query( cmd )
+    if not result['OK']:
+      return result
+    summary = {}
+    for jobType, status, count, lastUpdate in result['Value']:
+      summary[ ( jobType, status ) ] = ( int( count ), lastUpdate )
+    return S_OK( summary )
+
+#############################################################################
+  def getPartitionJobs( self, partition ):
+    """ Get the JobIDs of the jobs in a partition of the Jobs table
+    """
+    result = self._query( "SELECT JobID FROM Jobs PARTITION ( %s )" % partition )
+    if not result['OK']:
+      return result
+    return S_OK( [ row[0] for row in result['Value'] ] )
+
 #################################################################
   def rescheduleJobs( self, jobIDs ):
     """ Reschedule all the jobs in the given list
@@ -1852,9 +2156,11 @@ class JobDB( DB ):
     e_jobID = ret['Value']
 
     req = "UPDATE Jobs SET HeartBeatTime=UTC_TIMESTAMP(), Status='Running' WHERE JobID=%s" % e_jobID
+    countedValues = self.__getCountedValues( e_jobID, [ 'Status' ] )
     result = self._update( req )
     if not result['OK']:
       return S_ERROR( 'Failed to set the heart beat time: ' + result['Message'] )
+    self.__updateJobCounters( countedValues, result['Value'], [ 'Status' ], [ 'Running' ] )
 
     ok = True
     # FIXME: It is rather not optimal to use parameters to store the heartbeat info, must find a proper solution
@@ -1998,6 +2304,52 @@ class JobDB( DB ):
     result = self._update( req )
     return result
 
+#####################################################################################
+  def getCachedCounters( self, attName, site, statusList ):
+    """ Get the number of jobs at the site per value of the attribute, for the jobs in the
+        statuses given. For the JOB_COUNTED_STATES the numbers come from counters kept in memory,
+        updated with the changes done through this object and reconciled with the Jobs table
+        every CountersSyncPeriod seconds
+    """
+    if attName not in self.jobAttributeNames:
+      return S_ERROR( 'Attribute %s does not exist' % attName )
+
+    if not set( statusList ).issubset( self.JOB_COUNTED_STATES ):
+      result = self.getCounters( 'Jobs', [ attName ], { 'Site' : site, 'Status' : statusList } )
+      if not result['OK']:
+        return result
+      return S_OK( dict( [ ( str( attDict[ attName ] ), count ) for attDict, count in result['Value'] ] ) )
+
+    if not self.__jobCounters.hasAttribute( attName ):
+      result = self.__syncJobCounters( [ attName ] )
+      if not result['OK']:
+        return result
+    elif time.time() - self.__jobCountersLastSync > self.getCSOption( 'CountersSyncPeriod', 60 ):
+      #Only one thread reconciles, the others go on with the current counters
+      if self.__jobCountersLock.acquire( False ):
+        try:
+          self.__jobCountersLastSync = time.time()
+          result = self.__syncJobCounters( self.__jobCounters.getAttributes() )
+          if not result['OK']:
+            self.log.warn( 'Could not reconcile the job counters', result['Message'] )
+        finally:
+          self.__jobCountersLock.release()
+
+    return S_OK( self.__jobCounters.getCounters( attName, site, statusList ) )
+
+  def __syncJobCounters( self, attNames ):
+    """ (Re)set the job counters of the attributes from the Jobs table
+    """
+    for attName in attNames:
+      attList = [ 'Site', 'Status' ]
+      if attName not in attList:
+        attList.append( attName )
+      result = self.getCounters( 'Jobs', attList, { 'Status' : self.JOB_COUNTED_STATES } )
+      if not result['OK']:
+        return result
+      self.__jobCounters.setCounters( attName, result['Value'] )
+    return S_OK()
+
 #####################################################################################
   def getSummarySnapshot( self, requestedFields = False ):
     """ Get the summary snapshot for a given combination
@@ -2,8 +2,10 @@
     The following methods are provided
 
     addLoggingRecord()
+    addLoggingRecords()
     getJobLoggingInfo()
     getWMSTimeStamps()
+    getLastStatusTimes()
 """
 
 import time
@@ -29,6 +31,8 @@ class JobLoggingDB( DB ):
 
     DB.__init__( self, 'JobLoggingDB', 'WorkloadManagement/JobLoggingDB' )
     self.gLogger = gLogger
+    # Tables that can be partitioned on the JobID, see JobPartitions
+    self.PARTITIONED_TABLES = ['LoggingInfo']
 
 #############################################################################
   def addLoggingRecord( self,
@@ -48,6 +52,35 @@ class JobLoggingDB( DB ):
     event = 'status/minor/app=%s/%s/%s' % ( status, minor, application )
     self.gLogger.info( "Adding record for job " + str( jobID ) + ": '" + event + "' from " + source )
 
+    _date, time_order = self.__getStatusTime( date )
+
+    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
+          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
+           ( int( jobID ), status, minor, application, str( _date ), time_order, source )
+
+    return self._update( cmd )
+
+#############################################################################
+  def addLoggingRecords( self, records ):
+    """ Add many entries to the JobLoggingDB table at once. records is a list of
+        ( jobID, status, minor, application, date, source ) tuples, with the same
+        meaning as the arguments of addLoggingRecord
+    """
+    rows = []
+    for jobID, status, minor, application, date, source in records:
+      self.gLogger.verbose( "Adding record for job %s: 'status/minor/app=%s/%s/%s' from %s" % ( jobID, status, minor,
+                                                                                               application, source ) )
+      _date, time_order = self.__getStatusTime( date )
+      rows.append( ( int( jobID ), status, minor, application, str( _date ), time_order, source ) )
+    result = self.insertMany( 'LoggingInfo', [ 'JobId', 'Status', 'MinorStatus', 'ApplicationStatus',
+                                               'StatusTime', 'StatusTimeOrder', 'StatusSource' ], rows )
+    if not result['OK']:
+      return result
+    return S_OK()
+
+  def __getStatusTime( self, date ):
+    """ UTC datetime of the record and its order number, now if date is not given
+    """
     if not date:
       # Make the UTC datetime string and float
       _date = Time.dateTime()
@@ -74,12 +107,7 @@ class JobLoggingDB( DB ):
         _date = Time.dateTime()
         epoc = time.mktime( _date.timetuple() ) - MAGIC_EPOC_NUMBER
         time_order = round( epoc, 3 )
-
-    cmd = "INSERT INTO LoggingInfo (JobId, Status, MinorStatus, ApplicationStatus, " + \
-          "StatusTime, StatusTimeOrder, StatusSource) VALUES (%d,'%s','%s','%s','%s',%f,'%s')" % \
-           ( int( jobID ), status, minor, application, str( _date ), time_order, source )
-
-    return self._update( cmd )
+    return _date, time_order
 
 #############################################################################
   def getJobLoggingInfo( self, jobID ):
@@ -158,3 +186,17 @@ class JobLoggingDB( DB ):
       result['LastTime'] = "Unknown"
 
     return S_OK( result )
+
+#############################################################################
+  def getLastStatusTimes( self, jobIDs ):
+    """ Get the time of the last logging record of each job, as epoch
+        return a {jobID:timestamp} dictionary, without the jobs having no record
+    """
+    if not jobIDs:
+      return S_OK( {} )
+    cmd = 'SELECT JobID,MAX(StatusTimeOrder) FROM LoggingInfo WHERE JobID IN ( %s ) GROUP BY JobID' % \
+          ','.join( [ str( int( jobID ) ) for jobID in jobIDs ] )
+    resCmd = self._query( cmd )
+    if not resCmd['OK']:
+      return resCmd
+    return S_OK( dict( [ ( int( jobID ), float( etime ) + MAGIC_EPOC_NUMBER ) for jobID, etime in resCmd['Value'] ] ) )
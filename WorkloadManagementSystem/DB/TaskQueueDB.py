@@ -5,8 +5,11 @@ __RCSID__ = "$Id"
 
 import types
 import random
+import threading
+import time
 from DIRAC  import gConfig, gLogger, S_OK, S_ERROR
 from DIRAC.WorkloadManagementSystem.private.SharesCorrector import SharesCorrector
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
 from DIRAC.WorkloadManagementSystem.private.Queues import maxCPUSegments
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
 from DIRAC.Core.Utilities import List
@@ -42,6 +45,11 @@ class TaskQueueDB( DB ):
     self.__opsHelper = Operations()
     self.__ensureInsertionIsSingle = False
     self.__sharesCorrector = SharesCorrector( self.__opsHelper )
+    #In memory index of the task queues for the matching
+    self.__tqIndex = None
+    self.__tqIndexLock = threading.Lock()
+    self.__tqIndexLastSync = 0
+    self.__tqIndexOutdated = False
     result = self.__initializeDB()
     if not result[ 'OK' ]:
       raise Exception( "Can't create tables: %s" % result[ 'Message' ] )
@@ -68,6 +76,78 @@ class TaskQueueDB( DB ):
   def getValidPilotTypes( self ):
     return self.__getCSOption( "AllPilotTypes", [ 'private' ] )
 
+  def __getTaskQueueIndex( self ):
+    """ Get the in memory index of the task queues if the in memory matching is enabled,
+        synchronizing it with the DB when it is due. None means matching with SQL
+    """
+    if not self.__getCSOption( "InMemoryMatching", False ):
+      self.__tqIndex = None
+      return None
+    syncPeriod = self.__getCSOption( "InMemorySyncPeriod", 10 )
+    if self.__tqIndex and not self.__tqIndexOutdated and time.time() - self.__tqIndexLastSync < syncPeriod:
+      return self.__tqIndex
+    #Only one thread synchronizes, the rest keep using the index as it is
+    if not self.__tqIndexLock.acquire( False ):
+      return self.__tqIndex
+    try:
+      tqIndex = self.__tqIndex
+      if not tqIndex:
+        tqIndex = TaskQueueIndex( singleValueDefFields, multiValueMatchFields,
+                                  tagFields = tagMatchFields,
+                                  bannedFields = bannedJobMatchFields,
+                                  strictFields = strictRequireMatchFields )
+      self.__tqIndexOutdated = False
+      result = self.__syncTaskQueueIndex( tqIndex )
+      if not result[ 'OK' ]:
+        self.log.error( "Could not synchronize the task queues in memory", result[ 'Message' ] )
+        self.__tqIndexOutdated = True
+        return self.__tqIndex
+      if result[ 'Value' ]:
+        self.log.verbose( "Loaded %s task queues in memory, %s in total" % ( result[ 'Value' ], len( tqIndex ) ) )
+      self.__tqIndex = tqIndex
+      self.__tqIndexLastSync = time.time()
+    finally:
+      self.__tqIndexLock.release()
+    return self.__tqIndex
+
+  def __syncTaskQueueIndex( self, tqIndex ):
+    """ Bring the in memory index up to date with tq_TaskQueues: drop the deleted task queues,
+        update the priorities and load the definitions of the new ones
+    """
+    result = self._query( "SELECT TQId, OwnerDN, OwnerGroup, Setup, CPUTime, Priority, Enabled FROM `tq_TaskQueues`" )
+    if not result[ 'OK' ]:
+      return result
+    knownTQs = tqIndex.getTaskQueueIds()
+    tqsInDB = set()
+    newTQs = {}
+    for tqId, ownerDN, ownerGroup, setup, cpuTime, priority, enabled in result[ 'Value' ]:
+      tqsInDB.add( tqId )
+      if tqId in knownTQs:
+        tqIndex.setPriority( tqId, priority )
+      elif enabled >= 1:
+        #Task queues are disabled until their definition is complete
+        newTQs[ tqId ] = { 'OwnerDN' : ownerDN, 'OwnerGroup' : ownerGroup, 'Setup' : setup,
+                           'CPUTime' : cpuTime, 'Priority' : priority }
+    for tqId in knownTQs - tqsInDB:
+      tqIndex.removeTaskQueue( tqId )
+    if not newTQs:
+      return S_OK( 0 )
+    tqIdString = ", ".join( [ str( tqId ) for tqId in newTQs ] )
+    for field in multiValueDefFields:
+      result = self._query( "SELECT TQId, Value FROM `tq_TQTo%s` WHERE TQId in ( %s )" % ( field, tqIdString ) )
+      if not result[ 'OK' ]:
+        return result
+      for tqId, value in result[ 'Value' ]:
+        newTQs[ tqId ].setdefault( field, [] ).append( value )
+    for tqId in newTQs:
+      tqIndex.addTaskQueue( tqId, newTQs[ tqId ] )
+    return S_OK( len( newTQs ) )
+
+  def __removeFromTaskQueueIndex( self, tqId ):
+    tqIndex = self.__tqIndex
+    if tqIndex:
+      tqIndex.removeTaskQueue( tqId )
+
   def __initializeDB( self ):
     """
     Create the tables
@@ -129,6 +209,7 @@ class TaskQueueDB( DB ):
     result = self._update( dropSQL )
     if not result[ 'OK' ]:
       return result
+    self.__tqIndex = None
     return self._createTables( self.__tablesDesc )
 
   def __strDict( self, dDict ):
@@ -320,6 +401,7 @@ class TaskQueueDB( DB ):
     result = self._update( "DELETE FROM `tq_TaskQueues` WHERE Enabled >= 1 AND TQId not in ( SELECT DISTINCT TQId from `tq_Jobs` )", conn = connObj )
     if not result[ 'OK' ]:
       return result
+    self.__tqIndexOutdated = True
     for mvField in multiValueDefFields:
       result = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId not in ( SELECT DISTINCT TQId from `tq_TaskQueues` )" % mvField,
                              conn = connObj )
@@ -396,6 +478,8 @@ class TaskQueueDB( DB ):
         self.recalculateTQSharesForEntity( tqDefDict[ 'OwnerDN' ], tqDefDict[ 'OwnerGroup' ], connObj = connObj )
     finally:
       self.__setTaskQueueEnabled( tqId, True )
+      if newTQ:
+        self.__tqIndexOutdated = True
     return S_OK()
 
   def __insertJobInTaskQueue( self, jobId, tqId, jobPriority, checkTQExists = True, connObj = False ):
@@ -491,9 +575,28 @@ class TaskQueueDB( DB ):
     """
     Match a job
     """
+    result = self.matchAndGetJobs( tqMatchDict, 1, numJobsPerTry = numJobsPerTry,
+                                   numQueuesPerTry = numQueuesPerTry, negativeCond = negativeCond )
+    if not result[ 'OK' ]:
+      return result
+    matchData = result[ 'Value' ]
+    if not matchData[ 'matchFound' ]:
+      return S_OK( { 'matchFound' : False, 'tqMatch' : matchData[ 'tqMatch' ] } )
+    jobId, tqId = matchData[ 'jobs' ][0]
+    return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'tqMatch' : matchData[ 'tqMatch' ] } )
+
+  def matchAndGetJobs( self, tqMatchDict, numJobs, numJobsPerTry = 50, numQueuesPerTry = 10, negativeCond = {} ):
+    """
+    Match up to numJobs jobs for the same resource
+    The task queues are matched once per try, and each job is taken from a task queue chosen
+    with the same weighted random order as for a single job
+      Returns S_OK( { 'matchFound' : bool, 'jobs' : [ ( jobId, tqId ) ], 'tqMatch' : tqMatchDict } )
+    """
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
-    self.log.info( "Starting match for requirements", self.__strDict( tqMatchDict ) )
+    #The in memory matching works with the values before escaping
+    rawMatchDict = dict( tqMatchDict )
+    self.log.info( "Starting match of %s jobs for requirements" % numJobs, self.__strDict( tqMatchDict ) )
     retVal = self._checkMatchDefinition( tqMatchDict )
     if not retVal[ 'OK' ]:
       self.log.error( "TQ match request check failed", retVal[ 'Message' ] )
@@ -503,62 +606,120 @@ class TaskQueueDB( DB ):
       return S_ERROR( "Can't connect to DB: %s" % retVal[ 'Message' ] )
     connObj = retVal[ 'Value' ]
     preJobSQL = "SELECT `tq_Jobs`.JobId, `tq_Jobs`.TQId FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s AND `tq_Jobs`.Priority = %s"
-    prioSQL = "SELECT `tq_Jobs`.Priority FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
-    postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % numJobsPerTry
+    if 'JobID' in tqMatchDict:
+      preJobSQL = "%s AND `tq_Jobs`.JobId = %s " % ( preJobSQL, tqMatchDict['JobID'] )
+    jobs = []
     for _ in range( self.__maxMatchRetry ):
       if 'JobID' in tqMatchDict:
         # A certain JobID is required by the resource, so all TQ are to be considered
-        retVal = self.matchAndGetTaskQueue( tqMatchDict,
-                                            numQueuesToGet = 0,
-                                            skipMatchDictDef = True,
-                                            connObj = connObj )
-        preJobSQL = "%s AND `tq_Jobs`.JobId = %s " % ( preJobSQL, tqMatchDict['JobID'] )
+        retVal = self.__matchTaskQueues( tqMatchDict, rawMatchDict,
+                                         numQueuesToGet = 0,
+                                         connObj = connObj )
       else:
-        retVal = self.matchAndGetTaskQueue( tqMatchDict,
-                                            numQueuesToGet = numQueuesPerTry,
-                                            skipMatchDictDef = True,
-                                            negativeCond = negativeCond,
-                                            connObj = connObj )
+        retVal = self.__matchTaskQueues( tqMatchDict, rawMatchDict,
+                                         numQueuesToGet = numQueuesPerTry,
+                                         negativeCond = negativeCond,
+                                         connObj = connObj )
       if not retVal[ 'OK' ]:
         return retVal
       tqList = retVal[ 'Value' ]
       if len( tqList ) == 0:
         self.log.info( "No TQ matches requirements" )
-        return S_OK( { 'matchFound' : False, 'tqMatch' : tqMatchDict } )
-      for tqId, tqOwnerDN, tqOwnerGroup in tqList:
-        self.log.info( "Trying to extract jobs from TQ %s" % tqId )
-        retVal = self._query( prioSQL % tqId, conn = connObj )
-        if not retVal[ 'OK' ]:
-          return S_ERROR( "Can't retrieve winning priority for matching job: %s" % retVal[ 'Message' ] )
-        if len( retVal[ 'Value' ] ) == 0:
-          continue
-        prio = retVal[ 'Value' ][0][0]
-        retVal = self._query( "%s %s" % ( preJobSQL % ( tqId, prio ), postJobSQL ), conn = connObj )
-        if not retVal[ 'OK' ]:
-          return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
-        jobTQList = [ ( row[0], row[1] ) for row in retVal[ 'Value' ] ]
-        if len( jobTQList ) == 0:
-          gLogger.info( "Task queue %s seems to be empty, triggering a cleaning" % tqId )
-          self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
-        while len( jobTQList ) > 0:
-          jobId, tqId = jobTQList.pop( random.randint( 0, len( jobTQList ) - 1 ) )
-          self.log.info( "Trying to extract job %s from TQ %s" % ( jobId, tqId ) )
-          retVal = self.deleteJob( jobId, connObj = connObj )
+        break
+      emptyTQs = set()
+      while len( jobs ) < numJobs:
+        tqOrder = [ tqData for tqData in tqList if tqData[0] not in emptyTQs ]
+        if len( jobs ):
+          #Choose again amongst the matched TQs as if they were matched for this job
+          tqOrder = self.__sortByPriority( tqOrder )
+        jobId = False
+        for tqId, tqOwnerDN, tqOwnerGroup, _tqPriority in tqOrder:
+          retVal = self.__extractJob( tqId, tqOwnerDN, tqOwnerGroup, preJobSQL, numJobsPerTry, connObj )
           if not retVal[ 'OK' ]:
-            msgFix = "Could not take job"
-            msgVar = " %s out from the TQ %s: %s" % ( jobId, tqId, retVal[ 'Message' ] )
-            self.log.error( msgFix, msgVar )
-            return S_ERROR( msgFix + msgVar )
-          if retVal[ 'Value' ] == True :
-            self.log.info( "Extracted job %s with prio %s from TQ %s" % ( jobId, prio, tqId ) )
-            return S_OK( { 'matchFound' : True, 'jobId' : jobId, 'taskQueueId' : tqId, 'tqMatch' : tqMatchDict } )
-        self.log.info( "No jobs could be extracted from TQ %s" % tqId )
+            return retVal
+          jobId = retVal[ 'Value' ]
+          if jobId:
+            jobs.append( ( jobId, tqId ) )
+            break
+          emptyTQs.add( tqId )
+        if not jobId:
+          break
+      if len( jobs ) == numJobs:
+        break
+    if jobs:
+      return S_OK( { 'matchFound' : True, 'jobs' : jobs, 'tqMatch' : tqMatchDict } )
+    if len( tqList ) == 0:
+      return S_OK( { 'matchFound' : False, 'jobs' : [], 'tqMatch' : tqMatchDict } )
     self.log.info( "Could not find a match after %s match retries" % self.__maxMatchRetry )
     return S_ERROR( "Could not find a match after %s match retries" % self.__maxMatchRetry )
 
+  def __sortByPriority( self, tqList ):
+    """ Sort ( TQId, OwnerDN, OwnerGroup, Priority ) tuples in the ORDER BY RAND() / Priority order
+    """
+    sortKeys = []
+    for tqData in tqList:
+      if tqData[3] > 0:
+        sortKeys.append( ( random.random() / tqData[3], tqData ) )
+      else:
+        sortKeys.append( ( 0, tqData ) )
+    sortKeys.sort( key = lambda sortKey: sortKey[0] )
+    return [ sortKey[1] for sortKey in sortKeys ]
+
+  def __extractJob( self, tqId, tqOwnerDN, tqOwnerGroup, preJobSQL, numJobsPerTry, connObj ):
+    """ Take out of a task queue one of its jobs with the winning priority
+      Returns S_OK( jobId ), False if no job could be taken out
+    """
+    prioSQL = "SELECT `tq_Jobs`.Priority FROM `tq_Jobs` WHERE `tq_Jobs`.TQId = %s ORDER BY RAND() / `tq_Jobs`.RealPriority ASC LIMIT 1"
+    postJobSQL = " ORDER BY `tq_Jobs`.JobId ASC LIMIT %s" % numJobsPerTry
+    self.log.info( "Trying to extract jobs from TQ %s" % tqId )
+    retVal = self._query( prioSQL % tqId, conn = connObj )
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Can't retrieve winning priority for matching job: %s" % retVal[ 'Message' ] )
+    if len( retVal[ 'Value' ] ) == 0:
+      return S_OK( False )
+    prio = retVal[ 'Value' ][0][0]
+    retVal = self._query( "%s %s" % ( preJobSQL % ( tqId, prio ), postJobSQL ), conn = connObj )
+    if not retVal[ 'OK' ]:
+      return S_ERROR( "Can't begin transaction for matching job: %s" % retVal[ 'Message' ] )
+    jobTQList = [ ( row[0], row[1] ) for row in retVal[ 'Value' ] ]
+    if len( jobTQList ) == 0:
+      gLogger.info( "Task queue %s seems to be empty, triggering a cleaning" % tqId )
+      self.__deleteTQWithDelay.add( tqId, 300, ( tqId, tqOwnerDN, tqOwnerGroup ) )
+    while len( jobTQList ) > 0:
+      jobId, tqId = jobTQList.pop( random.randint( 0, len( jobTQList ) - 1 ) )
+      self.log.info( "Trying to extract job %s from TQ %s" % ( jobId, tqId ) )
+      retVal = self.deleteJob( jobId, connObj = connObj )
+      if not retVal[ 'OK' ]:
+        msgFix = "Could not take job"
+        msgVar = " %s out from the TQ %s: %s" % ( jobId, tqId, retVal[ 'Message' ] )
+        self.log.error( msgFix, msgVar )
+        return S_ERROR( msgFix + msgVar )
+      if retVal[ 'Value' ] == True :
+        self.log.info( "Extracted job %s with prio %s from TQ %s" % ( jobId, prio, tqId ) )
+        return S_OK( jobId )
+    self.log.info( "No jobs could be extracted from TQ %s" % tqId )
+    return S_OK( False )
+
+  def __matchTaskQueues( self, tqMatchDict, rawMatchDict, numQueuesToGet = 1, negativeCond = {}, connObj = False ):
+    """ Get the task queues matching the checked tqMatchDict, from memory if the in memory
+        matching is enabled (using the not escaped rawMatchDict), with SQL otherwise
+      Returns S_OK( [ ( TQId, OwnerDN, OwnerGroup, Priority ) ] )
+    """
+    tqIndex = self.__getTaskQueueIndex()
+    if tqIndex:
+      return S_OK( tqIndex.match( rawMatchDict, numQueuesToGet = numQueuesToGet, negativeCond = negativeCond,
+                                  withPriority = True ) )
+    return self.matchAndGetTaskQueue( tqMatchDict,
+                                      numQueuesToGet = numQueuesToGet,
+                                      skipMatchDictDef = True,
+                                      negativeCond = negativeCond,
+                                      connObj = connObj,
+                                      withPriority = True )
+
   def matchAndGetTaskQueue( self, tqMatchDict, numQueuesToGet = 1, skipMatchDictDef = False,
-                            negativeCond = {}, connObj = False ):
+                            negativeCond = {}, connObj = False, withPriority = False ):
     """ Get a queue that matches the requirements
+        withPriority adds the priority of the queues to the ( TQId, OwnerDN, OwnerGroup ) tuples
     """
     #Make a copy to avoid modification of original if escaping needs to be done
     tqMatchDict = dict( tqMatchDict )
@@ -573,6 +734,8 @@ class TaskQueueDB( DB ):
     retVal = self._query( matchSQL, conn = connObj )
     if not retVal[ 'OK' ]:
       return retVal
+    if withPriority:
+      return S_OK( [ ( row[0], row[1], row[2], row[3] ) for row in retVal[ 'Value' ] ] )
     return S_OK( [ ( row[0], row[1], row[2] ) for row in retVal[ 'Value' ] ] )
 
   def __generateSQLSubCond( self, sqlString, value, boolOp = 'OR' ):
@@ -729,7 +892,7 @@ class TaskQueueDB( DB ):
       sqlCondList.append( self.__generateNotSQL( sqlTables, negativeCond ) )
 
     #Generate the final query string
-    tqSqlCmd = "SELECT tq.TQId, tq.OwnerDN, tq.OwnerGroup FROM `tq_TaskQueues` tq WHERE %s" % ( " AND ".join( sqlCondList ) )
+    tqSqlCmd = "SELECT tq.TQId, tq.OwnerDN, tq.OwnerGroup, tq.Priority FROM `tq_TaskQueues` tq WHERE %s" % ( " AND ".join( sqlCondList ) )
 
     #Apply priorities
     tqSqlCmd = "%s ORDER BY RAND() / tq.Priority ASC" % tqSqlCmd
@@ -887,6 +1050,7 @@ class TaskQueueDB( DB ):
         retVal = self._update( "DELETE FROM `tq_TQTo%s` WHERE TQId = %s" % ( mvField, tqId ), conn = connObj )
         if not retVal[ 'OK' ]:
           return retVal
+      self.__removeFromTaskQueueIndex( tqId )
       self.recalculateTQSharesForEntity( tqOwnerDN, tqOwnerGroup, connObj = connObj )
       self.log.info( "Deleted empty and enabled TQ %s" % tqId )
       return S_OK( True )
@@ -924,6 +1088,7 @@ class TaskQueueDB( DB ):
       if not retVal[ 'OK' ]:
         return retVal
     if delTQ > 0:
+      self.__removeFromTaskQueueIndex( tqId )
       self.recalculateTQSharesForEntity( tqOwnerDN, tqOwnerGroup, connObj = connObj )
       return S_OK( True )
     return S_OK( False )
@@ -1170,7 +1335,11 @@ class TaskQueueDB( DB ):
     for prio in prioDict:
       tqList = ", ".join( [ str( tqId ) for tqId in prioDict[ prio ] ] )
       updateSQL = "UPDATE `tq_TaskQueues` SET Priority=%.4f WHERE TQId in ( %s )" % ( prio, tqList )
-      self._update( updateSQL, conn = connObj )
+      result = self._update( updateSQL, conn = connObj )
+      tqIndex = self.__tqIndex
+      if result[ 'OK' ] and tqIndex:
+        for tqId in prioDict[ prio ]:
+          tqIndex.setPriority( tqId, prio )
     return S_OK()
 
   def getGroupShares( self ):
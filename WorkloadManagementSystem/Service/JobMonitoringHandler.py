@@ -249,6 +249,19 @@ class JobMonitoringHandler( RequestHandler ):
       return S_OK( {} )
     return gJobDB.getAttributesForJobList( jobIDs, parameters )
 
+##############################################################################
+  types_getJobsData = [ ListType, ListType, BooleanType ]
+  @staticmethod
+  def export_getJobsData ( jobIDs, attributes, columnar ):
+    """ Get the attributes (all of them if empty) of the jobs with their types, either per job or, with columnar,
+        as { 'ParameterNames' : names, 'Records' : [ values per job ] }
+    """
+    if not jobIDs:
+      if columnar:
+        return S_OK( { 'ParameterNames' : [ 'JobID' ] + attributes, 'Records' : [] } )
+      return S_OK( {} )
+    return gJobDB.getJobsData( jobIDs, attributes or None, columnar = columnar )
+
 ##############################################################################
   types_getJobsStatus = [ ListType ]
   @staticmethod
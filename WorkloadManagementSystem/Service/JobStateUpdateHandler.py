@@ -15,16 +15,22 @@ __RCSID__ = "$Id$"
 
 from types import StringTypes, IntType, LongType, ListType, DictType
 # from types import *
+import os
 import time
-from DIRAC.Core.DISET.RequestHandler import RequestHandler
+from DIRAC.Core.DISET.RequestHandler import RequestHandler, getServiceOption
 from DIRAC.Core.Utilities import Time
-from DIRAC import gLogger, S_OK, S_ERROR
+from DIRAC.Core.Utilities.ThreadScheduler import gThreadScheduler
+from DIRAC import gLogger, gConfig, rootPath, S_OK, S_ERROR
+from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
 from DIRAC.WorkloadManagementSystem.DB.JobDB import JobDB
 from DIRAC.WorkloadManagementSystem.DB.JobLoggingDB import JobLoggingDB
+from DIRAC.WorkloadManagementSystem.private.JobStateWriteBehind import JobStateWriteBehind
 
 # This is a global instance of the JobDB class
 jobDB = False
 logDB = False
+# Write behind of the status and parameter updates, if enabled
+writeBehind = False
 
 JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
 
@@ -32,10 +38,35 @@ def initializeJobStateUpdateHandler( serviceInfo ):
 
   global jobDB
   global logDB
+  global writeBehind
   jobDB = JobDB()
   logDB = JobLoggingDB()
+
+  # Status and parameter updates are written every WriteBehindPeriod seconds if set
+  period = getServiceOption( serviceInfo, "WriteBehindPeriod", 0 )
+  if period > 0:
+    journal = getServiceOption( serviceInfo, "WriteBehindJournal", "data/JobStateUpdateJournal" ).strip()
+    if not journal.startswith( "/" ):
+      journal = os.path.realpath( "%s/%s" % ( gConfig.getValue( '/LocalSite/InstancePath', rootPath ), journal ) )
+    writeBehind = JobStateWriteBehind( jobDB, logDB, journal,
+                                       maxPending = getServiceOption( serviceInfo, "WriteBehindMaxPending", 10000 ) )
+    gMonitor.registerActivity( 'flushTime', "Time to write the buffered updates",
+                               'JobStateUpdate', "secs", gMonitor.OP_MEAN, 300 )
+    gMonitor.registerActivity( 'flushedUpdates', "Buffered updates written",
+                               'JobStateUpdate', "updates", gMonitor.OP_SUM, 300 )
+    gMonitor.registerActivity( 'updateLatency', "Delay of the oldest buffered update",
+                               'JobStateUpdate', "secs", gMonitor.OP_MEAN, 300 )
+    # Updates left in the journal by the previous run
+    writeBehind.flush()
+    gThreadScheduler.addPeriodicTask( period, writeBehind.flush )
   return S_OK()
 
+def flushPendingUpdates( jobID ):
+  """ Write the buffered updates before a direct change of the job, to keep the order
+  """
+  if writeBehind and writeBehind.hasPendingUpdates( jobID ):
+    writeBehind.flush( wait = True )
+
 class JobStateUpdateHandler( RequestHandler ):
 
   ###########################################################################
@@ -69,6 +100,7 @@ class JobStateUpdateHandler( RequestHandler ):
     if status != 'Staging':
       return S_OK( 'Job is not in Staging after %d seconds' % trials )
 
+    flushPendingUpdates( jobID )
     result = self.__setJobStatus( int( jobID ), jobStatus, minorStatus, 'StagerSystem', None )
     if not result['OK']:
       if result['Message'].find( 'does not exist' ) != -1:
@@ -84,6 +116,8 @@ class JobStateUpdateHandler( RequestHandler ):
         Set optionally the status date and source component which sends the
         status information.
     """
+    if writeBehind:
+      return writeBehind.setJobStatus( jobID, status, minorStatus, source, datetime )
     return self.__setJobStatus( int( jobID ), status, minorStatus, source, datetime )
 
   ###########################################################################
@@ -94,7 +128,10 @@ class JobStateUpdateHandler( RequestHandler ):
         status information.
     """
     for jobID in jobIDs:
-      self.__setJobStatus( int( jobID ), status, minorStatus, source, datetime )
+      if writeBehind:
+        writeBehind.setJobStatus( jobID, status, minorStatus, source, datetime )
+      else:
+        self.__setJobStatus( int( jobID ), status, minorStatus, source, datetime )
     return S_OK()
 
   def __setJobStatus( self, jobID, status, minorStatus, source, datetime ):
@@ -118,7 +155,7 @@ class JobStateUpdateHandler( RequestHandler ):
     status = result['Value']['Status']
     minorStatus = result['Value']['MinorStatus']
     if datetime:
-      result = logDB.addLoggingRecord( jobID, status, minorStatus, datetime, source )
+      result = logDB.addLoggingRecord( jobID, status, minorStatus, date = datetime, source = source )
     else:
       result = logDB.addLoggingRecord( jobID, status, minorStatus, source = source )
     return result
@@ -131,6 +168,8 @@ class JobStateUpdateHandler( RequestHandler ):
         logging information in the JobLoggingDB. The statusDict has datetime
         as a key and status information dictionary as values
     """
+    if writeBehind:
+      return writeBehind.setJobStatusBulk( jobID, statusDict )
 
     status = ""
     minor = ""
@@ -204,6 +243,7 @@ class JobStateUpdateHandler( RequestHandler ):
       result = jobDB.setStartExecTime( jobID, startDate )
 
     # Update the JobLoggingDB records
+    records = []
     for date in dates:
       sDict = statusDict[date]
       status = sDict['Status']
@@ -219,9 +259,10 @@ class JobStateUpdateHandler( RequestHandler ):
         status = "Running"
         minor = "Application"
       source = sDict['Source']
-      result = logDB.addLoggingRecord( jobID, status, minor, application, date, source )
-      if not result['OK']:
-        return result
+      records.append( ( jobID, status, minor, application, date, source ) )
+    result = logDB.addLoggingRecords( records )
+    if not result['OK']:
+      return result
 
     return S_OK()
 
@@ -255,6 +296,7 @@ class JobStateUpdateHandler( RequestHandler ):
     """ Set the application status for job specified by its JobId.
     """
 
+    flushPendingUpdates( jobID )
     result = jobDB.getJobAttributes( int( jobID ), ['Status', 'MinorStatus'] )
     if not result['OK']:
       return result
@@ -284,6 +326,8 @@ class JobStateUpdateHandler( RequestHandler ):
         for job specified by its JobId
     """
 
+    if writeBehind:
+      return writeBehind.setJobParameters( jobID, [ ( name, value ) ] )
     result = jobDB.setJobParameter( int( jobID ), name, value )
     return result
 
@@ -294,7 +338,10 @@ class JobStateUpdateHandler( RequestHandler ):
         for job specified by its JobId
     """
     for jobID in jobsParameterDict:
-      jobDB.setJobParameter( jobID, str( jobsParameterDict[jobID][0] ), str( jobsParameterDict[jobID][1] ) )
+      if writeBehind:
+        writeBehind.setJobParameters( jobID, [ jobsParameterDict[jobID] ] )
+      else:
+        jobDB.setJobParameter( jobID, str( jobsParameterDict[jobID][0] ), str( jobsParameterDict[jobID][1] ) )
     return S_OK()
 
   ###########################################################################
@@ -304,7 +351,10 @@ class JobStateUpdateHandler( RequestHandler ):
         for job specified by its JobId
     """
 
-    result = jobDB.setJobParameters( int( jobID ), parameters )
+    if writeBehind:
+      result = writeBehind.setJobParameters( jobID, parameters )
+    else:
+      result = jobDB.setJobParameters( int( jobID ), parameters )
     if not result['OK']:
       return S_ERROR( 'Failed to store some of the parameters' )
 
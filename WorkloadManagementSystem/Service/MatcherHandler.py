@@ -6,12 +6,13 @@
 
 __RCSID__ = "$Id$"
 
-from types import StringTypes, DictType, StringTypes
+import os
+from types import StringTypes, DictType, ListType, IntType, LongType
 
-from DIRAC                                               import gLogger, S_OK, S_ERROR
+from DIRAC                                               import gLogger, gConfig, rootPath, S_OK, S_ERROR
 
 from DIRAC.Core.Utilities.ThreadScheduler                import gThreadScheduler
-from DIRAC.Core.DISET.RequestHandler                     import RequestHandler
+from DIRAC.Core.DISET.RequestHandler                     import RequestHandler, getServiceOption
 
 from DIRAC.FrameworkSystem.Client.MonitoringClient       import gMonitor
 
@@ -22,10 +23,13 @@ from DIRAC.WorkloadManagementSystem.DB.PilotAgentsDB     import PilotAgentsDB
 
 from DIRAC.WorkloadManagementSystem.Client.Matcher       import Matcher
 from DIRAC.WorkloadManagementSystem.Client.Limiter       import Limiter
+from DIRAC.WorkloadManagementSystem.Client.MatchingSnapshot import MatchingSnapshot
 from DIRAC.ConfigurationSystem.Client.Helpers.Operations import Operations
+from DIRAC.ConfigurationSystem.Client.Helpers.Registry   import getVOForGroup
 
 gJobDB = False
 gTaskQueueDB = False
+gMatchingSnapshot = False
 
 
 def initializeMatcherHandler( serviceInfo ):
@@ -36,12 +40,23 @@ def initializeMatcherHandler( serviceInfo ):
   global gTaskQueueDB
   global jlDB
   global pilotAgentsDB
+  global gMatchingSnapshot
 
   gJobDB = JobDB()
   gTaskQueueDB = TaskQueueDB()
   jlDB = JobLoggingDB()
   pilotAgentsDB = PilotAgentsDB()
 
+  # The site mask is shared by all the requests, and by the Matchers of the
+  # host using the same SnapshotDirectory
+  snapshotDirectory = getServiceOption( serviceInfo, "SnapshotDirectory", "" ).strip()
+  if snapshotDirectory and not snapshotDirectory.startswith( "/" ):
+    snapshotDirectory = os.path.realpath( "%s/%s" % ( gConfig.getValue( '/LocalSite/InstancePath', rootPath ),
+                                                      snapshotDirectory ) )
+  gMatchingSnapshot = MatchingSnapshot( gJobDB,
+                                        refreshPeriod = getServiceOption( serviceInfo, "SnapshotRefreshPeriod", 10 ),
+                                        cacheDirectory = snapshotDirectory )
+
   gMonitor.registerActivity( 'matchTime', "Job matching time",
                              'Matching', "secs" , gMonitor.OP_MEAN, 300 )
   gMonitor.registerActivity( 'matchesDone', "Job Match Request",
@@ -71,6 +86,22 @@ class MatcherHandler( RequestHandler ):
   def initialize( self ):
     self.limiter = Limiter( jobDB = gJobDB )
 
+  def __getMatcher( self, credDict ):
+    """ Matcher using the Limiter and the current matching snapshot of the VO of the credentials
+    """
+    vo = getVOForGroup( credDict['group'] )
+    result = gMatchingSnapshot.getSnapshot( vo )
+    if not result['OK']:
+      self.log.error( "Cannot get the matching snapshot", result['Message'] )
+      raise RuntimeError( "Internal error" )
+    return Matcher( pilotAgentsDB = pilotAgentsDB,
+                    jobDB = gJobDB,
+                    tqDB = gTaskQueueDB,
+                    jlDB = jlDB,
+                    opsHelper = Operations( group = credDict['group'] ),
+                    limiter = gMatchingSnapshot.getLimiter( vo ),
+                    snapshot = result['Value'] )
+
 ##############################################################################
   types_requestJob = [ list( StringTypes ) + [DictType] ]
   def export_requestJob( self, resourceDescription ):
@@ -82,12 +113,7 @@ class MatcherHandler( RequestHandler ):
     credDict = self.getRemoteCredentials()
 
     try:
-      opsHelper = Operations( group = credDict['group'] )
-      matcher = Matcher( pilotAgentsDB = pilotAgentsDB,
-                         jobDB = gJobDB,
-                         tqDB = gTaskQueueDB,
-                         jlDB = jlDB,
-                         opsHelper = opsHelper )
+      matcher = self.__getMatcher( credDict )
       result = matcher.selectJob( resourceDescription, credDict )
     except RuntimeError, rte:
       self.log.error( "Error requesting job: ", rte )
@@ -102,6 +128,36 @@ class MatcherHandler( RequestHandler ):
       # FIXME: This is correctly interpreted by the JobAgent, but DErrno should be used instead
       return S_ERROR( "No match found" )
 
+##############################################################################
+  types_requestJobs = [ list( StringTypes ) + [ DictType, ListType ], [ IntType, LongType ] ]
+  def export_requestJobs( self, resourceDescriptions, numJobs ):
+    """ Serve up to numJobs jobs to a resource with several slots (or to each resource of
+        a list of them), so that they can be fetched in advance
+    """
+
+    maxJobs = self.srv_getCSOption( "MaxJobsPerRequest", 20 )
+    numJobs = max( 1, min( numJobs, maxJobs ) )
+    if not isinstance( resourceDescriptions, list ):
+      resourceDescriptions = [ resourceDescriptions ]
+    for resourceDescription in resourceDescriptions:
+      if isinstance( resourceDescription, DictType ):
+        resourceDescription['Setup'] = self.serviceInfoDict['clientSetup']
+    credDict = self.getRemoteCredentials()
+
+    try:
+      matcher = self.__getMatcher( credDict )
+      result = matcher.selectJobs( resourceDescriptions, credDict, numJobs = numJobs )
+    except RuntimeError, rte:
+      self.log.error( "Error requesting jobs: ", rte )
+      return S_ERROR( "Error requesting jobs" )
+
+    gMonitor.addMark( "matchesDone" )
+    if result:
+      gMonitor.addMark( "matchesOK", len( result ) )
+      return S_OK( result )
+    else:
+      return S_ERROR( "No match found" )
+
 ##############################################################################
   types_getActiveTaskQueues = []
   def export_getActiveTaskQueues( self ):
@@ -39,6 +39,7 @@ class OptimizationMindHandler( ExecutorMindHandler ):
     if cls.__loadTaskId:
       period = cls.srv_getCSOption( "LoadJobPeriod", 300 )
       ThreadScheduler.gThreadScheduler.setTaskPeriod( cls.__loadTaskId, period )
+    cls.__loadLaneWeights()
     if not eTypes:
       eConn = cls.getExecutorsConnected()
       eTypes = [ eType for eType in eConn if eConn[ eType ] > 0 ]
@@ -77,6 +78,19 @@ class OptimizationMindHandler( ExecutorMindHandler ):
       log.info( "Added %s/%s jobs for %s state" % ( added, len( jidList ), opState ) )
     return S_OK()
 
+  @classmethod
+  def __loadLaneWeights( cls ):
+    """ Read the weights of the lanes given as LaneWeights = lane1:weight1, lane2:weight2
+    """
+    laneWeights = {}
+    for laneWeight in cls.srv_getCSOption( "LaneWeights", [] ):
+      try:
+        lane, weight = laneWeight.split( ":" )
+        laneWeights[ lane.strip() ] = float( weight )
+      except ValueError:
+        cls.log.error( "Invalid lane weight, it should be lane:weight", laneWeight )
+    cls.setLaneWeights( laneWeights )
+
   @classmethod
   def initializeHandler( cls, serviceInfoDict ):
     try:
@@ -147,6 +161,17 @@ class OptimizationMindHandler( ExecutorMindHandler ):
     cls.log.info( "Dispatching job %s to %s" % ( jid, minorStatus ) )
     return S_OK( "WorkloadManagement/%s" % minorStatus )
 
+  @classmethod
+  def exec_taskLane( cls, jid, jobState ):
+    #Jobs of each OwnerGroup or JobType have their own lane if LaneAttribute is defined
+    laneAttribute = cls.srv_getCSOption( "LaneAttribute", "" )
+    if not laneAttribute:
+      return S_OK( False )
+    result = jobState.getAttribute( laneAttribute )
+    if not result[ 'OK' ]:
+      return result
+    return S_OK( result[ 'Value' ] )
+
   @classmethod
   def exec_prepareToSend( cls, jid, jobState, eId ):
     return jobState.recheckValidity()
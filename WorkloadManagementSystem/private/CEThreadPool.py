@@ -0,0 +1,160 @@
+""" Thread pool running the operations of the SiteDirector on several CEs at once
+
+    Utilities and classes here are used by the SiteDirector
+"""
+
+__RCSID__ = "$Id$"
+
+import time
+import threading
+
+from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC.Core.Utilities.ThreadPool import ThreadPool
+
+class CEThreadPool( object ):
+  """
+    Runs tasks, each one bound to a CE, with at most maxThreadsPerCE tasks of a CE at the same time,
+    so that a slow CE only delays its own tasks.
+
+    execute() waits for the tasks at most timeout seconds. The tasks still running then go on in
+    the background and the CE is busy: its tasks are skipped by the next execute() calls until they
+    are over. Tasks have to do all their work themselves, their results are only returned if they
+    end in time.
+
+    The time taken by the tasks is accounted per CE: see getStatistics()
+  """
+
+  def __init__( self, maxThreads = 10, maxThreadsPerCE = 1 ):
+    """
+    :param maxThreads: maximum number of tasks running at the same time, tasks are run one after
+                       the other in the calling thread if not more than 1
+    :param maxThreadsPerCE: maximum number of tasks of the same CE running at the same time
+    """
+    self.__maxThreads = maxThreads
+    self.__maxThreadsPerCE = max( 1, maxThreadsPerCE )
+    self.__threadPool = None
+    if self.__maxThreads > 1:
+      # Threads are only spawned when the pool is created or its results are processed
+      self.__threadPool = ThreadPool( self.__maxThreads, self.__maxThreads )
+    self.__condition = threading.Condition()
+    self.__busyCEs = {}
+    self.__statistics = {}
+    self.log = gLogger.getSubLogger( "CEThreadPool" )
+
+  def execute( self, tasks, timeout = 0 ):
+    """ Run the tasks, given as a list of ( ceName, taskID, function, args ), and wait for them at
+        most timeout seconds, no limit if 0.
+        Returns S_OK( { 'Results' : { taskID : result }, 'Skipped' : [ busy CEs ], 'TimedOut' : [ CEs ] } )
+    """
+    ceTasks = {}
+    for ceName, taskID, function, args in tasks:
+      ceTasks.setdefault( ceName, [] ).append( ( taskID, function, args ) )
+
+    results = {}
+    skipped = []
+    started = []
+    cycle = { 'Running' : 0 }
+    self.__condition.acquire()
+    try:
+      for ceName in ceTasks:
+        if ceName in self.__busyCEs:
+          skipped.append( ceName )
+          continue
+        nWorkers = min( self.__maxThreadsPerCE, len( ceTasks[ ceName ] ) )
+        if not self.__threadPool:
+          nWorkers = 1
+        self.__busyCEs[ ceName ] = nWorkers
+        cycle['Running'] += nWorkers
+        started.append( ( ceName, nWorkers ) )
+    finally:
+      self.__condition.release()
+    if skipped:
+      self.log.warn( "Skipping CEs still busy with previous tasks", ", ".join( skipped ) )
+
+    for ceName, nWorkers in started:
+      for _i in range( nWorkers ):
+        if not self.__threadPool:
+          self.__worker( ceName, ceTasks[ ceName ], results, cycle )
+          continue
+        result = self.__threadPool.generateJobAndQueueIt( self.__worker,
+                                                          args = ( ceName, ceTasks[ ceName ], results, cycle ) )
+        if not result['OK']:
+          # Never happens with an unlimited pending queue, but do not wait for a task never run
+          self.__workerDone( ceName, cycle )
+
+    deadline = time.time() + timeout
+    self.__condition.acquire()
+    try:
+      while cycle['Running']:
+        if timeout:
+          remaining = deadline - time.time()
+          if remaining <= 0:
+            break
+          self.__condition.wait( remaining )
+        else:
+          self.__condition.wait( 1 )
+      timedOut = [ ceName for ceName, _nWorkers in started if ceName in self.__busyCEs ]
+      results = dict( results )
+    finally:
+      self.__condition.release()
+    if timedOut:
+      self.log.warn( "Tasks still running after %s seconds" % timeout, ", ".join( timedOut ) )
+    return S_OK( { 'Results' : results, 'Skipped' : skipped, 'TimedOut' : timedOut } )
+
+  def __worker( self, ceName, tasks, results, cycle ):
+    """ Run the tasks of a CE until there is none left
+    """
+    try:
+      while True:
+        self.__condition.acquire()
+        try:
+          if not tasks:
+            break
+          taskID, function, args = tasks.pop( 0 )
+        finally:
+          self.__condition.release()
+        start = time.time()
+        try:
+          result = function( *args )
+        except Exception, excp:
+          self.log.exception( "Exception in task %s" % taskID, lException = excp )
+          result = S_ERROR( "Exception in task %s: %s" % ( taskID, excp ) )
+        taskTime = time.time() - start
+        self.__condition.acquire()
+        try:
+          results[ taskID ] = result
+          statistics = self.__statistics.setdefault( ceName, { 'Tasks' : 0, 'Failed' : 0,
+                                                               'TotalTime' : 0., 'MaxTime' : 0. } )
+          statistics['Tasks'] += 1
+          if not result or not result['OK']:
+            statistics['Failed'] += 1
+          statistics['TotalTime'] += taskTime
+          statistics['MaxTime'] = max( statistics['MaxTime'], taskTime )
+        finally:
+          self.__condition.release()
+    finally:
+      self.__workerDone( ceName, cycle )
+
+  def __workerDone( self, ceName, cycle ):
+    self.__condition.acquire()
+    try:
+      self.__busyCEs[ ceName ] -= 1
+      if not self.__busyCEs[ ceName ]:
+        del self.__busyCEs[ ceName ]
+      cycle['Running'] -= 1
+      self.__condition.notifyAll()
+    finally:
+      self.__condition.release()
+
+  def getStatistics( self, reset = False ):
+    """ Get the number of tasks, of failed tasks, the total and the maximum time of the tasks per CE,
+        as { ceName : { 'Tasks', 'Failed', 'TotalTime', 'MaxTime' } }, since the last reset
+    """
+    self.__condition.acquire()
+    try:
+      statistics = dict( [ ( ceName, dict( ceStatistics ) ) for ceName, ceStatistics in self.__statistics.items() ] )
+      if reset:
+        self.__statistics = {}
+      return statistics
+    finally:
+      self.__condition.release()
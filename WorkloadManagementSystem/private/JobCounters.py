@@ -0,0 +1,95 @@
+""" In memory counters of the jobs per site, attribute value and status, used by the JobDB
+    to answer the Limiter without grouping the Jobs table
+"""
+
+__RCSID__ = "$Id$"
+
+import threading
+
+class JobCounters( object ):
+  """
+    Number of jobs per Site and ( attribute value, Status ) for a set of statuses and for the
+    attributes registered on demand.
+
+    The counters are set from the table and then updated with the changes of the jobs known
+    by the owner. Changes done elsewhere are only taken into account when setting them again,
+    so the owner has to do it periodically.
+  """
+
+  def __init__( self, statusList ):
+    """
+    :param statusList: statuses of the jobs to count
+    """
+    self.__statusList = frozenset( statusList )
+    self.__lock = threading.Lock()
+    self.__counters = {}
+
+  def getStatusList( self ):
+    """ Statuses of the counted jobs
+    """
+    return self.__statusList
+
+  def getAttributes( self ):
+    """ Names of the attributes having counters
+    """
+    return list( self.__counters )
+
+  def hasAttribute( self, attName ):
+    return attName in self.__counters
+
+  def setCounters( self, attName, counters ):
+    """ (Re)set the counters of an attribute from a list of
+        ( { 'Site' : site, attName : value, 'Status' : status }, count ) as given by getCounters
+    """
+    attCounters = {}
+    for attDict, count in counters:
+      if attDict[ 'Status' ] not in self.__statusList:
+        continue
+      siteCounters = attCounters.setdefault( str( attDict[ 'Site' ] ), {} )
+      key = ( str( attDict[ attName ] ), attDict[ 'Status' ] )
+      siteCounters[ key ] = siteCounters.get( key, 0 ) + count
+    self.__lock.acquire()
+    try:
+      self.__counters[ attName ] = attCounters
+    finally:
+      self.__lock.release()
+
+  def getCounters( self, attName, site, statusList ):
+    """ Number of jobs at the site per value of the attribute ( as strings ), summed over the
+        given statuses. Returns None if the attribute has no counters
+    """
+    self.__lock.acquire()
+    try:
+      attCounters = self.__counters.get( attName )
+      if attCounters is None:
+        return None
+      values = {}
+      for ( value, status ), count in attCounters.get( site, {} ).items():
+        if status in statusList:
+          values[ value ] = values.get( value, 0 ) + count
+    finally:
+      self.__lock.release()
+    #Changes done elsewhere may make them drift below zero until the next reset
+    return dict( [ ( value, max( count, 0 ) ) for value, count in values.items() ] )
+
+  def update( self, oldValues, newValues ):
+    """ Move a job between counters. oldValues and newValues are dicts with the Site, the Status
+        and the values of the attributes of the job, before and after the change
+    """
+    self.__lock.acquire()
+    try:
+      for attName, attCounters in self.__counters.items():
+        oldKey = ( str( oldValues.get( attName ) ), oldValues.get( 'Status' ) )
+        newKey = ( str( newValues.get( attName ) ), newValues.get( 'Status' ) )
+        oldSite = str( oldValues.get( 'Site' ) )
+        newSite = str( newValues.get( 'Site' ) )
+        if ( oldSite, oldKey ) == ( newSite, newKey ):
+          continue
+        if oldKey[1] in self.__statusList:
+          siteCounters = attCounters.setdefault( oldSite, {} )
+          siteCounters[ oldKey ] = siteCounters.get( oldKey, 0 ) - 1
+        if newKey[1] in self.__statusList:
+          siteCounters = attCounters.setdefault( newSite, {} )
+          siteCounters[ newKey ] = siteCounters.get( newKey, 0 ) + 1
+    finally:
+      self.__lock.release()
@@ -0,0 +1,230 @@
+""" Range partitions on the JobID of the WMS tables
+
+    Utilities and classes here are used by the JobCleaningAgent
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import gzip
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+MAX_PARTITION = 'pMax'
+
+class JobPartitions( object ):
+  """
+    Partitions by range of JobID of a set of tables of a DB, all the tables having the same
+    partitions. The last one, pMax, takes the JobIDs above the last bound: new bounds are added by
+    splitting it, which copies all its rows with the table locked. The bounds should then be added
+    ahead of the JobIDs, for pMax to be empty when it is split.
+
+    A partition of old jobs can then be removed at once, optionally archived before to one
+    compressed file per table in the format of LOAD DATA INFILE.
+
+    MySQL does not allow foreign keys on partitioned tables, those of the tables are dropped when
+    the tables get partitioned.
+  """
+
+  def __init__( self, db, tables ):
+    """
+    :param db: DB holding the tables
+    :param tables: list of the tables to partition, all with the JobID in their primary key
+    """
+    self.__db = db
+    self.__tables = tables
+    self.log = gLogger.getSubLogger( "JobPartitions" )
+
+  def getTablePartitions( self, table ):
+    """ Get the partitions of a table as a list of { 'Name', 'UpperBound', 'Rows' } in JobID order,
+        the UpperBound of pMax being None. The list is empty if the table is not partitioned
+    """
+    result = self.__db._query( "SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS "
+                               "FROM INFORMATION_SCHEMA.PARTITIONS WHERE TABLE_SCHEMA = DATABASE() "
+                               "AND TABLE_NAME = '%s' ORDER BY PARTITION_ORDINAL_POSITION" % table )
+    if not result['OK']:
+      return result
+    partitions = []
+    for name, description, rows in result['Value']:
+      if not name:
+        return S_OK( [] )
+      upperBound = None
+      if description != 'MAXVALUE':
+        upperBound = int( description )
+      partitions.append( { 'Name' : name, 'UpperBound' : upperBound, 'Rows' : int( rows or 0 ) } )
+    return S_OK( partitions )
+
+  def getPartitions( self ):
+    """ Get the partitions of the first table, with their LowerBound
+    """
+    result = self.getTablePartitions( self.__tables[0] )
+    if not result['OK']:
+      return result
+    lowerBound = 0
+    for partition in result['Value']:
+      partition['LowerBound'] = lowerBound
+      lowerBound = partition['UpperBound']
+    return result
+
+  def setPartitions( self, partitions, create = False ):
+    """ Make sure that all the tables have the given partitions, as a list of ( name, upperBound )
+        in JobID order. The tables already partitioned get the partitions whose bound is above their
+        last one, partitions already removed are not created again. The tables not partitioned yet,
+        which means rebuilding them, are partitioned only if create is set, an error is returned
+        otherwise
+    """
+    toPartition = []
+    toExtend = {}
+    maxRows = {}
+    for table in self.__tables:
+      result = self.getTablePartitions( table )
+      if not result['OK']:
+        return result
+      bounds = [ partition['UpperBound'] for partition in result['Value'] if partition['UpperBound'] is not None ]
+      if not result['Value']:
+        toPartition.append( table )
+      else:
+        lastBound = max( bounds or [ 0 ] )
+        newPartitions = [ ( name, upperBound ) for name, upperBound in partitions if upperBound > lastBound ]
+        if newPartitions:
+          toExtend[ table ] = newPartitions
+          maxRows[ table ] = sum( [ partition['Rows'] for partition in result['Value'] if partition['UpperBound'] is None ] )
+
+    if toPartition:
+      if not create:
+        return S_ERROR( "Tables %s are not partitioned" % ", ".join( toPartition ) )
+      if not partitions:
+        return S_ERROR( "No partition given for %s" % ", ".join( toPartition ) )
+      # The foreign keys of all the tables have to go, also those referencing the tables to partition
+      for table in self.__tables:
+        result = self.__dropForeignKeys( table )
+        if not result['OK']:
+          return result
+      for table in toPartition:
+        self.log.info( "Partitioning table %s on the JobID" % table )
+        result = self.__db._update( "ALTER TABLE `%s` PARTITION BY RANGE ( JobID ) ( %s )" %
+                                    ( table, self.__partitionDefinitions( partitions ) ) )
+        if not result['OK']:
+          return result
+
+    for table, newPartitions in toExtend.items():
+      self.log.info( "Adding partitions to %s" % table, ", ".join( [ name for name, _ub in newPartitions ] ) )
+      if maxRows[ table ]:
+        self.log.warn( "Splitting a non empty %s, the table is locked while its rows are copied" % MAX_PARTITION,
+                       "%s: about %d rows" % ( table, maxRows[ table ] ) )
+      result = self.__db._update( "ALTER TABLE `%s` REORGANIZE PARTITION %s INTO ( %s )" %
+                                  ( table, MAX_PARTITION, self.__partitionDefinitions( newPartitions ) ) )
+      if not result['OK']:
+        return result
+    return S_OK()
+
+  @staticmethod
+  def __partitionDefinitions( partitions ):
+    definitions = [ "PARTITION %s VALUES LESS THAN ( %d )" % ( name, upperBound ) for name, upperBound in partitions ]
+    definitions.append( "PARTITION %s VALUES LESS THAN MAXVALUE" % MAX_PARTITION )
+    return ", ".join( definitions )
+
+  def __dropForeignKeys( self, table ):
+    result = self.__db._query( "SELECT CONSTRAINT_NAME FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS "
+                               "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '%s' "
+                               "AND CONSTRAINT_TYPE = 'FOREIGN KEY'" % table )
+    if not result['OK']:
+      return result
+    for row in result['Value']:
+      result = self.__db._update( "ALTER TABLE `%s` DROP FOREIGN KEY `%s`" % ( table, row[0] ) )
+      if not result['OK']:
+        return result
+    return S_OK()
+
+  def archivePartition( self, name, directory ):
+    """ Write the rows of a partition, one <table>.<partition>.tsv.gz file per table. Each file
+        starts with the names of the columns and can be loaded back with
+        LOAD DATA INFILE ... IGNORE 1 LINES ( <columns> )
+        Returns the list of the files written
+    """
+    if not os.path.isdir( directory ):
+      try:
+        os.makedirs( directory )
+      except OSError, excp:
+        return S_ERROR( "Cannot create the archive directory %s: %s" % ( directory, excp ) )
+    fileNames = []
+    for table in self.__tables:
+      result = self.__hasPartition( table, name )
+      if not result['OK']:
+        return result
+      if not result['Value']:
+        continue
+      result = self.__db._query( "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS WHERE "
+                                 "TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '%s' "
+                                 "ORDER BY ORDINAL_POSITION" % table )
+      if not result['OK']:
+        return result
+      columns = [ row[0] for row in result['Value'] ]
+      result = self.__db._queryIter( "SELECT %s FROM `%s` PARTITION ( %s )" %
+                                     ( ", ".join( [ "`%s`" % column for column in columns ] ), table, name ) )
+      if not result['OK']:
+        return result
+      rowIterator = result['Value']
+      fileName = os.path.join( directory, "%s.%s.tsv.gz" % ( table, name ) )
+      try:
+        try:
+          archive = gzip.open( fileName, "wb" )
+          try:
+            archive.write( "\t".join( columns ) + "\n" )
+            for rows in rowIterator:
+              archive.write( "".join( [ "\t".join( [ self.__escapeField( field ) for field in row ] ) + "\n"
+                                        for row in rows ] ) )
+          finally:
+            archive.close()
+        except Exception, excp:
+          return S_ERROR( "Cannot archive partition %s of %s: %s" % ( name, table, excp ) )
+      finally:
+        rowIterator.close()
+      self.log.info( "Archived partition %s of %s" % ( name, table ), "%s rows to %s" % ( rowIterator.rowsRead, fileName ) )
+      fileNames.append( fileName )
+    return S_OK( fileNames )
+
+  @staticmethod
+  def __escapeField( field ):
+    """ Field as written by SELECT INTO OUTFILE
+    """
+    if field is None:
+      return "\\N"
+    # Blobs may come as arrays, depending on the MySQLdb version
+    if hasattr( field, 'tostring' ):
+      field = field.tostring()
+    else:
+      field = str( field )
+    for char, escaped in ( ( "\\", "\\\\" ), ( "\t", "\\t" ), ( "\n", "\\n" ), ( "\r", "\\r" ), ( "\0", "\\0" ) ):
+      field = field.replace( char, escaped )
+    return field
+
+  def dropPartition( self, name ):
+    """ Remove a partition with all its rows from the tables having it
+    """
+    if name == MAX_PARTITION:
+      return S_ERROR( "Partition %s can not be removed" % MAX_PARTITION )
+    for table in self.__tables:
+      result = self.__hasPartition( table, name )
+      if not result['OK']:
+        return result
+      if result['Value']:
+        result = self.__db._update( "ALTER TABLE `%s` DROP PARTITION %s" % ( table, name ) )
+        if not result['OK']:
+          return result
+    return S_OK()
+
+  def hasPartition( self, name ):
+    """ Tell if all the tables have the partition
+    """
+    for table in self.__tables:
+      result = self.__hasPartition( table, name )
+      if not result['OK'] or not result['Value']:
+        return result
+    return S_OK( True )
+
+  def __hasPartition( self, table, name ):
+    result = self.getTablePartitions( table )
+    if not result['OK']:
+      return result
+    return S_OK( name in [ partition['Name'] for partition in result['Value'] ] )
@@ -0,0 +1,411 @@
+""" Write behind of the job status and parameter updates received by the JobStateUpdate service
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import time
+import errno
+import base64
+import threading
+
+from DIRAC import S_OK, S_ERROR, gLogger
+from DIRAC.Core.Utilities import DEncode, Time
+from DIRAC.FrameworkSystem.Client.MonitoringClient import gMonitor
+
+JOB_FINAL_STATES = ['Done', 'Completed', 'Failed']
+# Number of job IDs remembered as existing
+MAX_KNOWN_JOBS = 100000
+
+class JobStateWriteBehind( object ):
+  """
+    Buffer of status and parameter updates, written to the JobDB and the JobLoggingDB by flush()
+    with a few multi-row queries for all the jobs.
+
+    The updates are kept in arrival order and coalesced per job when flushed: the Jobs table gets the
+    last values, the JobLoggingDB one record per status update, as the JobStateUpdate service would
+    have done. Status updates are either simple ones, given the status and minor status, or bulk ones,
+    given a { date : status dict } as setJobStatusBulk, whose statuses older than the last logged one
+    only go to the JobLoggingDB.
+
+    Each update is appended to a journal before being accepted. The journal is split in segments,
+    a new one being started at each flush, and the segments of a flush are removed once written to
+    the DBs. Each process has its own journal, named after its pid, in the journal directory shared
+    by the workers of the service. The segments left by a crash, in the journal of the process or in
+    the ones of processes that are gone, are loaded again when starting. A failed flush keeps its
+    updates for the next one, so updates may be written twice, never lost.
+  """
+
+  def __init__( self, jobDB, logDB, journalDirectory, maxPending = 10000 ):
+    """
+    :param jobDB: JobDB to write to
+    :param logDB: JobLoggingDB to write to
+    :param journalDirectory: directory of the journals of the processes
+    :param maxPending: number of pending updates forcing a flush
+    """
+    self.__jobDB = jobDB
+    self.__logDB = logDB
+    self.__baseDirectory = journalDirectory
+    self.__journalDirectory = os.path.join( journalDirectory, str( os.getpid() ) )
+    self.__maxPending = maxPending
+    self.__lock = threading.Lock()
+    self.__flushLock = threading.Lock()
+    self.__updates = []
+    self.__pendingJobs = set()
+    self.__failedUpdates = []
+    self.__segments = []
+    self.__segmentNumber = 0
+    self.__journal = None
+    self.__knownJobs = set()
+    self.log = gLogger.getSubLogger( "JobStateWriteBehind" )
+
+    if not os.path.isdir( self.__journalDirectory ):
+      os.makedirs( self.__journalDirectory )
+    self.__adoptJournals()
+    self.__loadJournal()
+    self.__openSegment()
+
+  def __segmentPath( self, segmentNumber, directory = None ):
+    return os.path.join( directory or self.__journalDirectory, "segment.%012d" % segmentNumber )
+
+  @staticmethod
+  def __listSegments( directory ):
+    """ Numbers of the segments of a journal, in order
+    """
+    segmentNumbers = []
+    for fileName in os.listdir( directory ):
+      if fileName.startswith( "segment." ):
+        try:
+          segmentNumbers.append( int( fileName.split( "." )[1] ) )
+        except ValueError:
+          continue
+    return sorted( segmentNumbers )
+
+  def __adoptJournals( self ):
+    """ Move the segments of the journals of the processes that are gone at the end of the journal
+    """
+    segmentNumbers = self.__listSegments( self.__journalDirectory )
+    segmentNumber = segmentNumbers[-1] if segmentNumbers else 0
+    for dirName in os.listdir( self.__baseDirectory ):
+      if not dirName.isdigit() or int( dirName ) == os.getpid():
+        continue
+      try:
+        os.kill( int( dirName ), 0 )
+        continue
+      except OSError, excp:
+        if excp.errno != errno.ESRCH:
+          continue
+      orphanDirectory = os.path.join( self.__baseDirectory, dirName )
+      try:
+        orphanNumbers = self.__listSegments( orphanDirectory )
+      except OSError:
+        # Adopted by another worker
+        continue
+      for orphanNumber in orphanNumbers:
+        try:
+          os.rename( self.__segmentPath( orphanNumber, orphanDirectory ), self.__segmentPath( segmentNumber + 1 ) )
+        except OSError:
+          continue
+        segmentNumber += 1
+      try:
+        os.rmdir( orphanDirectory )
+      except OSError:
+        pass
+      self.log.info( "Adopted the journal of process %s" % dirName )
+
+  def __loadJournal( self ):
+    """ Take back the updates of the segments left by the previous run
+    """
+    for segmentNumber in self.__listSegments( self.__journalDirectory ):
+      segmentPath = self.__segmentPath( segmentNumber )
+      with open( segmentPath ) as segment:
+        for line in segment:
+          try:
+            update = DEncode.decode( base64.b64decode( line.strip() ) )[0]
+          except Exception:
+            # Last line of a segment being written during the crash
+            self.log.warn( "Skipping unreadable journal entry", segmentPath )
+            continue
+          self.__updates.append( update )
+          self.__pendingJobs.add( update[1] )
+      self.__segments.append( segmentPath )
+      self.__segmentNumber = segmentNumber
+    if self.__updates:
+      self.log.info( "Loaded %s updates from the journal" % len( self.__updates ) )
+
+  def __openSegment( self ):
+    self.__segmentNumber += 1
+    segmentPath = self.__segmentPath( self.__segmentNumber )
+    self.__journal = open( segmentPath, "a" )
+    self.__segments.append( segmentPath )
+
+  def __add( self, update ):
+    """ Journal and queue an update: ( kind, jobID, data, receptionTime )
+    """
+    line = base64.b64encode( DEncode.encode( update ) )
+    self.__lock.acquire()
+    try:
+      self.__journal.write( line + "\n" )
+      self.__journal.flush()
+      self.__updates.append( update )
+      self.__pendingJobs.add( update[1] )
+      numPending = len( self.__updates )
+    finally:
+      self.__lock.release()
+    if numPending >= self.__maxPending:
+      self.flush( wait = True )
+    return S_OK()
+
+  def __checkJob( self, jobID ):
+    """ Tell if the job exists, as the direct updates do. The jobs found are remembered: the updates
+        of a job removed since are dropped by the flush
+    """
+    if jobID in self.__knownJobs:
+      return S_OK( True )
+    result = self.__jobDB.getJobAttributes( jobID, [ 'Status' ] )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_OK( False )
+    if len( self.__knownJobs ) >= MAX_KNOWN_JOBS:
+      self.__knownJobs = set()
+    self.__knownJobs.add( jobID )
+    return S_OK( True )
+
+  def setJobStatus( self, jobID, status, minorStatus, source = 'Unknown', datetime = None ):
+    """ Queue a status update, datetime being the time of the update, now if not given
+    """
+    jobID = int( jobID )
+    result = self.__checkJob( jobID )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_ERROR( 'Job %d does not exist' % jobID )
+    if not datetime:
+      datetime = Time.toString( Time.dateTime() )
+    statusDict = { 'Status' : status, 'MinorStatus' : minorStatus, 'ApplicationStatus' : '', 'Source' : source }
+    return self.__add( ( 'status', jobID, { str( datetime ) : statusDict }, time.time() ) )
+
+  def setJobStatusBulk( self, jobID, statusDict ):
+    """ Queue the status updates of a { date : status dict } as given to setJobStatusBulk
+    """
+    # Checked now, a wrong update could not be written later
+    for date, sDict in statusDict.items():
+      if not isinstance( sDict, dict ):
+        return S_ERROR( "Wrong status update for %s" % date )
+      for key in ( 'Status', 'MinorStatus', 'ApplicationStatus', 'Source' ):
+        if key not in sDict:
+          return S_ERROR( "Missing %s in the status update for %s" % ( key, date ) )
+    jobID = int( jobID )
+    result = self.__checkJob( jobID )
+    if not result['OK']:
+      return result
+    if not result['Value']:
+      return S_ERROR( 'No Matching Job' )
+    return self.__add( ( 'bulk', jobID, statusDict, time.time() ) )
+
+  def setJobParameters( self, jobID, parameters ):
+    """ Queue parameters given as a list of ( name, value )
+    """
+    parameters = [ ( str( name ), str( value ) ) for name, value in parameters ]
+    return self.__add( ( 'parameters', int( jobID ), parameters, time.time() ) )
+
+  def hasPendingUpdates( self, jobID ):
+    """ Tell if updates of the job are waiting for the next flush
+    """
+    return int( jobID ) in self.__pendingJobs
+
+  def flush( self, wait = False ):
+    """ Write the pending updates. Only one flush runs at a time: without wait, nothing is done
+        if another one is running
+    """
+    if not self.__flushLock.acquire( wait ):
+      return S_OK()
+    try:
+      self.__lock.acquire()
+      try:
+        updates = self.__failedUpdates + self.__updates
+        self.__updates = []
+        self.__pendingJobs = set()
+        self.__journal.close()
+        segments = self.__segments
+        self.__segments = []
+        self.__openSegment()
+      finally:
+        self.__lock.release()
+
+      if updates:
+        start = time.time()
+        result = self.__write( updates )
+        if not result['OK']:
+          # Kept, with their segments, for the next flush
+          self.log.error( "Failed to write %s updates" % len( updates ), result['Message'] )
+          self.__failedUpdates = updates
+          self.__lock.acquire()
+          try:
+            self.__segments = segments + self.__segments
+            for update in updates:
+              self.__pendingJobs.add( update[1] )
+          finally:
+            self.__lock.release()
+          return result
+        self.__failedUpdates = []
+        flushTime = time.time() - start
+        self.log.verbose( "Wrote %s updates in %.3f seconds" % ( len( updates ), flushTime ) )
+        gMonitor.addMark( 'flushTime', flushTime )
+        gMonitor.addMark( 'flushedUpdates', len( updates ) )
+        gMonitor.addMark( 'updateLatency', time.time() - min( [ update[3] for update in updates ] ) )
+
+      for segmentPath in segments:
+        try:
+          os.unlink( segmentPath )
+        except OSError, excp:
+          self.log.warn( "Cannot remove journal segment", "%s: %s" % ( segmentPath, excp ) )
+      return S_OK()
+    finally:
+      self.__flushLock.release()
+
+  def __write( self, updates ):
+    """ Coalesce the updates per job and write them
+    """
+    statusUpdates = {}
+    jobsParameters = {}
+    bulkJobs = set()
+    for kind, jobID, data, _receptionTime in updates:
+      if kind == 'parameters':
+        jobsParameters.setdefault( jobID, {} ).update( dict( data ) )
+      else:
+        statusUpdates.setdefault( jobID, [] ).append( ( kind, data ) )
+        if kind == 'bulk':
+          bulkJobs.add( jobID )
+
+    if statusUpdates:
+      result = self.__jobDB.getJobsData( statusUpdates.keys(), [ 'Status', 'MinorStatus' ] )
+      if not result['OK']:
+        return result
+      currentStatus = dict( [ ( jobID, ( jobData['Status'], jobData['MinorStatus'] ) )
+                              for jobID, jobData in result['Value'].items() ] )
+      result = self.__logDB.getLastStatusTimes( list( bulkJobs ) )
+      if not result['OK']:
+        return result
+      lastTimes = dict( [ ( jobID, Time.toString( Time.fromEpoch( lastTime ) ) )
+                          for jobID, lastTime in result['Value'].items() ] )
+
+      attributes = { True : {}, False : {} }
+      startDates = {}
+      endDates = {}
+      records = []
+      for jobID, jobUpdates in statusUpdates.items():
+        if jobID not in currentStatus:
+          self.log.warn( "Dropping the status updates of a job that does not exist", jobID )
+          continue
+        try:
+          status, minorStatus = currentStatus[ jobID ]
+          result = self.__coalesce( jobID, jobUpdates, status, minorStatus, lastTimes.get( jobID, '' ) )
+        except Exception, excp:
+          self.log.exception( "Dropping the status updates of job %s" % jobID, lException = excp )
+          continue
+        attrDict, refreshTime, startDate, endDate, jobRecords = result
+        if attrDict:
+          attributes[ refreshTime ][ jobID ] = attrDict
+        if startDate:
+          startDates[ jobID ] = startDate
+        if endDate:
+          endDates[ jobID ] = endDate
+        records.extend( jobRecords )
+
+      for update in ( True, False ):
+        result = self.__jobDB.setJobsAttributes( attributes[ update ], update = update )
+        if not result['OK']:
+          return result
+      for method, jobDates in ( ( self.__jobDB.setStartExecTimes, startDates ),
+                                ( self.__jobDB.setEndExecTimes, endDates ) ):
+        if jobDates:
+          result = method( jobDates )
+          if not result['OK']:
+            return result
+      if records:
+        result = self.__logDB.addLoggingRecords( records )
+        if not result['OK']:
+          return result
+
+    if jobsParameters:
+      jobsParameters = dict( [ ( jobID, parameters.items() ) for jobID, parameters in jobsParameters.items() ] )
+      result = self.__jobDB.setJobsParameters( jobsParameters )
+      if not result['OK']:
+        # One job may not exist any more, do not make the others wait for it
+        failed = 0
+        for jobID, parameters in jobsParameters.items():
+          result = self.__jobDB.setJobParameters( jobID, parameters )
+          if not result['OK']:
+            self.log.warn( "Failed to set the parameters of job %s" % jobID, result['Message'] )
+            failed += 1
+        if failed == len( jobsParameters ):
+          return S_ERROR( "Failed to set the job parameters" )
+
+    return S_OK()
+
+  @staticmethod
+  def __coalesce( jobID, jobUpdates, currentStatus, currentMinor, lastTime ):
+    """ Final attributes of a job after its status updates, as the JobStateUpdate service sets them
+        one after the other. Returns the attributes, whether the LastUpdate time stamp is refreshed,
+        the StartExecTime and EndExecTime to set, and the logging records. As for the direct updates,
+        the time stamps are the last ones of a bulk update and are not changed once set, and the
+        records of the simple updates have the status and minor status of the job after the update
+    """
+    attrDict = {}
+    refreshTime = False
+    startDate = ''
+    endDate = ''
+    records = []
+    for kind, statusDict in jobUpdates:
+      dates = sorted( statusDict )
+      if kind == 'bulk':
+        refreshTime = True
+        if currentStatus == 'Stalled':
+          attrDict['Status'] = 'Running'
+        appliedDates = [ date for date in dates if date >= lastTime ]
+      else:
+        appliedDates = dates
+      startFlag = ''
+      updateStart = ''
+      updateEnd = ''
+      for date in appliedDates:
+        sDict = statusDict[date]
+        # Setting the Stalled status does not refresh the LastUpdate time stamp
+        if kind == 'status' and sDict['Status'] != 'Stalled':
+          refreshTime = True
+        if sDict['Status']:
+          attrDict['Status'] = sDict['Status']
+          if sDict['Status'] in JOB_FINAL_STATES:
+            updateEnd = date
+          if sDict['Status'] == 'Running':
+            startFlag = 'Running'
+        if sDict['MinorStatus']:
+          attrDict['MinorStatus'] = sDict['MinorStatus']
+          if sDict['MinorStatus'] == 'Application' and startFlag == 'Running':
+            updateStart = date
+        if sDict['ApplicationStatus']:
+          attrDict['ApplicationStatus'] = sDict['ApplicationStatus']
+        if sDict.get( 'ApplicationCounter' ):
+          attrDict['ApplicationNumStatus'] = sDict['ApplicationCounter']
+      startDate = startDate or updateStart
+      endDate = endDate or updateEnd
+      currentStatus = attrDict.get( 'Status', currentStatus )
+      currentMinor = attrDict.get( 'MinorStatus', currentMinor )
+
+      for date in dates:
+        sDict = statusDict[date]
+        status = sDict['Status'] or 'idem'
+        minor = sDict['MinorStatus'] or 'idem'
+        application = sDict['ApplicationStatus'] or 'idem'
+        if kind == 'status':
+          status = currentStatus
+          minor = currentMinor
+        elif sDict['ApplicationStatus']:
+          status = "Running"
+          minor = "Application"
+        records.append( ( jobID, status, minor, application, date, sDict['Source'] ) )
+      if dates and dates[-1] > lastTime:
+        lastTime = dates[-1]
+    return attrDict, refreshTime, startDate, endDate, records
@@ -0,0 +1,161 @@
+""" Cache of the pieces of the pilot wrappers written by the SiteDirector
+
+    Utilities and classes here are used by the SiteDirector
+"""
+
+__RCSID__ = "$Id$"
+
+import os
+import bz2
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+
+from DIRAC import S_OK, S_ERROR, gLogger
+
+class PilotWrapperCache( object ):
+  """
+    Keeps the compressed and encoded pilot files, keyed by their path and version ( size and
+    modification time ), and proxies, keyed by the fingerprint of their content: a renewed proxy is
+    encoded again, the encoding of the previous ones being forgotten after a while.
+
+    The pilot wrappers that can not be removed after their submission, as for the HTCondorCE which
+    transfers them later, are written in a directory under the hash of their content, a wrapper
+    already there being reused. The size of the directory is kept under maxSize bytes by removing
+    the wrappers last used the longest time ago, those used less than minAge seconds ago are kept
+    as the CE may not have transferred them yet.
+  """
+
+  def __init__( self, directory, maxSize = 100 * 1024 * 1024, minAge = 3600, maxProxies = 10 ):
+    """
+    :param directory: directory of the pilot wrappers
+    :param maxSize: maximum size in bytes of the pilot wrappers in the directory
+    :param minAge: seconds a pilot wrapper is kept after its last use
+    :param maxProxies: number of encoded proxies kept
+    """
+    self.__directory = directory
+    self.__maxSize = maxSize
+    self.__minAge = minAge
+    self.__maxProxies = maxProxies
+    self.__lock = threading.Lock()
+    self.__files = {}
+    self.__proxies = {}
+    self.__wrappers = {}
+    self.__size = 0
+    self.log = gLogger.getSubLogger( "PilotWrapperCache" )
+
+    if not os.path.isdir( self.__directory ):
+      os.makedirs( self.__directory )
+    for fileName in os.listdir( self.__directory ):
+      if fileName.endswith( '_pilotwrapper.py' ):
+        try:
+          fileStat = os.stat( os.path.join( self.__directory, fileName ) )
+        except OSError:
+          continue
+        self.__wrappers[ fileName ] = ( fileStat.st_size, fileStat.st_mtime )
+        self.__size += fileStat.st_size
+
+  def getEncodedFile( self, path ):
+    """ Get the content of the file, compressed and base64 encoded
+    """
+    fileStat = os.stat( path )
+    version = ( fileStat.st_size, fileStat.st_mtime )
+    self.__lock.acquire()
+    try:
+      if path in self.__files and self.__files[ path ][0] == version:
+        return self.__files[ path ][1]
+    finally:
+      self.__lock.release()
+    with open( path, "rb" ) as fd:
+      encoded = base64.encodestring( bz2.compress( fd.read(), 9 ) )
+    self.__lock.acquire()
+    try:
+      self.__files[ path ] = ( version, encoded )
+    finally:
+      self.__lock.release()
+    return encoded
+
+  def getEncodedProxy( self, proxy ):
+    """ Get the content of the proxy, compressed and base64 encoded
+    """
+    result = proxy.dumpAllToString()
+    if not result['OK']:
+      return result
+    proxyString = result['Value']
+    fingerprint = hashlib.sha1( proxyString ).hexdigest()
+    self.__lock.acquire()
+    try:
+      if fingerprint in self.__proxies:
+        self.__proxies[ fingerprint ][0] = time.time()
+        return S_OK( self.__proxies[ fingerprint ][1] )
+    finally:
+      self.__lock.release()
+    encoded = base64.encodestring( bz2.compress( proxyString ) )
+    self.__lock.acquire()
+    try:
+      self.__proxies[ fingerprint ] = [ time.time(), encoded ]
+      # The proxies not used lately were renewed
+      while len( self.__proxies ) > self.__maxProxies:
+        oldest = min( self.__proxies, key = lambda fp: self.__proxies[ fp ][0] )
+        del self.__proxies[ oldest ]
+    finally:
+      self.__lock.release()
+    return S_OK( encoded )
+
+  def writeWrapper( self, content ):
+    """ Write the pilot wrapper unless it is already there and return its path
+    """
+    fileName = "DIRAC_%s_pilotwrapper.py" % hashlib.sha1( content ).hexdigest()
+    path = os.path.join( self.__directory, fileName )
+    now = time.time()
+    self.__lock.acquire()
+    try:
+      if fileName in self.__wrappers and os.path.exists( path ):
+        os.utime( path, None )
+        self.__wrappers[ fileName ] = ( self.__wrappers[ fileName ][0], now )
+        return S_OK( path )
+    finally:
+      self.__lock.release()
+
+    # Written aside and renamed, a CE never gets a partial wrapper
+    try:
+      fd, tmpPath = tempfile.mkstemp( suffix = '.tmp', prefix = 'DIRAC_', dir = self.__directory )
+      try:
+        os.write( fd, content )
+      finally:
+        os.close( fd )
+      os.rename( tmpPath, path )
+    except OSError, excp:
+      return S_ERROR( "Cannot write the pilot wrapper %s: %s" % ( path, excp ) )
+
+    self.__lock.acquire()
+    try:
+      if fileName in self.__wrappers:
+        self.__size -= self.__wrappers[ fileName ][0]
+      self.__wrappers[ fileName ] = ( len( content ), now )
+      self.__size += len( content )
+      self.__cleanDirectory( now )
+    finally:
+      self.__lock.release()
+    return S_OK( path )
+
+  def __cleanDirectory( self, now ):
+    """ Remove the pilot wrappers last used the longest time ago until the size is below the limit
+    """
+    if self.__size <= self.__maxSize:
+      return
+    for fileName in sorted( self.__wrappers, key = lambda fn: self.__wrappers[ fn ][1] ):
+      if self.__size <= self.__maxSize:
+        break
+      size, lastUse = self.__wrappers[ fileName ]
+      if now - lastUse < self.__minAge:
+        self.log.verbose( "Pilot wrappers above the size limit but all recent", "%s bytes" % self.__size )
+        break
+      try:
+        os.unlink( os.path.join( self.__directory, fileName ) )
+      except OSError, excp:
+        self.log.warn( "Cannot remove pilot wrapper", "%s: %s" % ( fileName, excp ) )
+      del self.__wrappers[ fileName ]
+      self.__size -= size
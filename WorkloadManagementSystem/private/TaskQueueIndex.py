@@ -0,0 +1,281 @@
+""" In memory index of the task queue definitions, used by the TaskQueueDB to find the
+    task queues matching a resource without querying the DB
+"""
+
+__RCSID__ = "$Id$"
+
+import random
+import threading
+
+from DIRAC.Core.Security import Properties, CS
+
+class TaskQueueIndex( object ):
+  """
+    Task queue definitions indexed by setup and by the values of the multi value fields.
+
+    Definitions are dicts with the single value fields (OwnerDN, OwnerGroup, Setup, CPUTime),
+    the Priority and the lists of values of the multi value fields, named as in the TaskQueueDB
+    tables (Sites, BannedSites, Platforms...). They do not change once the task queue exists,
+    only the priority does.
+
+    The match follows the conditions of the SQL query built by the TaskQueueDB, and the task
+    queues are chosen with the same weighted random order ( RAND() / Priority ).
+  """
+
+  def __init__( self, singleValueFields, multiValueFields, tagFields = (), bannedFields = (), strictFields = () ):
+    """
+    :param singleValueFields: fields with a single value in the definitions
+    :param multiValueFields: match fields with a multi value definition field ( Site -> Sites )
+    :param tagFields: match fields requiring all the values of the task queue to be in the resource
+    :param bannedFields: match fields for which the task queue may ban values ( Site -> BannedSites )
+    :param strictFields: match fields that the resource has to define if the task queue requires them
+    """
+    self.__singleValueFields = singleValueFields
+    self.__multiValueFields = multiValueFields
+    self.__tagFields = tagFields
+    self.__bannedFields = bannedFields
+    self.__strictFields = strictFields
+    self.__lock = threading.Lock()
+    self.__taskQueues = {}
+    self.__bySetup = {}
+    self.__byValue = {}
+    self.__withoutValues = {}
+    for field in self.__indexedFields():
+      self.__byValue[ field ] = {}
+      self.__withoutValues[ field ] = set()
+
+  def __indexedFields( self ):
+    return [ "%ss" % field for field in self.__multiValueFields if field not in self.__tagFields ]
+
+  def __len__( self ):
+    return len( self.__taskQueues )
+
+  def getTaskQueueIds( self ):
+    """ Ids of the task queues in the index
+    """
+    self.__lock.acquire()
+    try:
+      return set( self.__taskQueues )
+    finally:
+      self.__lock.release()
+
+  def addTaskQueue( self, tqId, tqDef ):
+    """ Add (or replace) the definition of a task queue
+    """
+    tqData = {}
+    for field in tqDef:
+      if isinstance( tqDef[ field ], ( list, tuple, set, frozenset ) ):
+        tqData[ field ] = frozenset( [ str( value ).strip() for value in tqDef[ field ] ] )
+      else:
+        tqData[ field ] = tqDef[ field ]
+    self.__lock.acquire()
+    try:
+      self.__remove( tqId )
+      self.__taskQueues[ tqId ] = tqData
+      self.__bySetup.setdefault( tqData[ 'Setup' ], set() ).add( tqId )
+      for field in self.__indexedFields():
+        values = tqData.get( field )
+        if not values:
+          self.__withoutValues[ field ].add( tqId )
+          continue
+        for value in values:
+          self.__byValue[ field ].setdefault( value, set() ).add( tqId )
+    finally:
+      self.__lock.release()
+
+  def removeTaskQueue( self, tqId ):
+    """ Remove a task queue from the index
+    """
+    self.__lock.acquire()
+    try:
+      self.__remove( tqId )
+    finally:
+      self.__lock.release()
+
+  def __remove( self, tqId ):
+    tqData = self.__taskQueues.pop( tqId, None )
+    if not tqData:
+      return
+    self.__discard( self.__bySetup, tqData[ 'Setup' ], tqId )
+    for field in self.__indexedFields():
+      self.__withoutValues[ field ].discard( tqId )
+      for value in tqData.get( field, () ):
+        self.__discard( self.__byValue[ field ], value, tqId )
+
+  def __discard( self, indexDict, key, tqId ):
+    tqIds = indexDict.get( key )
+    if tqIds is None:
+      return
+    tqIds.discard( tqId )
+    if not tqIds:
+      indexDict.pop( key )
+
+  def setPriority( self, tqId, priority ):
+    """ Update the priority of a task queue
+    """
+    self.__lock.acquire()
+    try:
+      if tqId in self.__taskQueues:
+        self.__taskQueues[ tqId ][ 'Priority' ] = priority
+    finally:
+      self.__lock.release()
+
+  @staticmethod
+  def __toList( value ):
+    if isinstance( value, ( list, tuple ) ):
+      return [ str( subValue ).strip() for subValue in value ]
+    return [ str( value ).strip() ]
+
+  def match( self, tqMatchDict, numQueuesToGet = 1, negativeCond = None, withPriority = False ):
+    """ Get the task queues matching the resource described by tqMatchDict, as a list of
+        ( TQId, OwnerDN, OwnerGroup ) in weighted random order. numQueuesToGet = 0 means all of them
+        withPriority adds the priority of the queues to the tuples
+
+        Values are the plain ones, not escaped for MySQL
+    """
+    tqMatchDict = dict( tqMatchDict )
+    if 'Platform' not in tqMatchDict:
+      for legacyField in ( 'LHCbPlatform', 'SystemConfig' ):
+        if legacyField in tqMatchDict:
+          tqMatchDict[ 'Platform' ] = tqMatchDict[ legacyField ]
+          break
+    ownerCheck = self.__getOwnerCheck( tqMatchDict )
+
+    self.__lock.acquire()
+    try:
+      candidates = self.__getCandidates( tqMatchDict )
+      matched = []
+      for tqId in candidates:
+        tqData = self.__taskQueues[ tqId ]
+        if not ownerCheck( tqData ):
+          continue
+        if not self.__matchTaskQueue( tqData, tqMatchDict ):
+          continue
+        if negativeCond and not self.__matchNegative( tqData, negativeCond ):
+          continue
+        matched.append( ( tqId, tqData[ 'OwnerDN' ], tqData[ 'OwnerGroup' ], tqData[ 'Priority' ] ) )
+    finally:
+      self.__lock.release()
+
+    #Same order as ORDER BY RAND() / Priority
+    sortKeys = []
+    for tqTuple in matched:
+      priority = tqTuple[3]
+      if not withPriority:
+        tqTuple = tqTuple[:3]
+      if priority > 0:
+        sortKeys.append( ( random.random() / priority, tqTuple ) )
+      else:
+        sortKeys.append( ( 0, tqTuple ) )
+    sortKeys.sort( key = lambda sortKey: sortKey[0] )
+    if numQueuesToGet:
+      sortKeys = sortKeys[ :numQueuesToGet ]
+    return [ sortKey[1] for sortKey in sortKeys ]
+
+  def __getCandidates( self, tqMatchDict ):
+    """ Narrow the task queues to check with the indexes
+    """
+    candidates = set()
+    for setup in self.__toList( tqMatchDict.get( 'Setup', () ) ):
+      candidates.update( self.__bySetup.get( setup, () ) )
+    for field in self.__multiValueFields:
+      if field in self.__tagFields or not tqMatchDict.get( field ):
+        continue
+      tqField = "%ss" % field
+      fieldCandidates = set( self.__withoutValues[ tqField ] )
+      for value in self.__toList( tqMatchDict[ field ] ):
+        fieldCandidates.update( self.__byValue[ tqField ].get( value, () ) )
+      candidates.intersection_update( fieldCandidates )
+      if not candidates:
+        break
+    return candidates
+
+  def __getOwnerCheck( self, tqMatchDict ):
+    """ Function telling if the owner of a task queue is allowed by the resource
+    """
+    if 'OwnerDN' in tqMatchDict and 'OwnerGroup' in tqMatchDict:
+      dns = set( self.__toList( tqMatchDict[ 'OwnerDN' ] ) )
+      groups = {}
+      for group in self.__toList( tqMatchDict[ 'OwnerGroup' ] ):
+        groups[ group ] = Properties.JOB_SHARING in CS.getPropertiesForGroup( group )
+      def ownerCheck( tqData ):
+        if tqData[ 'OwnerGroup' ] not in groups:
+          return False
+        return groups[ tqData[ 'OwnerGroup' ] ] or tqData[ 'OwnerDN' ] in dns
+      return ownerCheck
+    conds = []
+    for field in ( 'OwnerGroup', 'OwnerDN' ):
+      if field in tqMatchDict:
+        conds.append( ( field, set( self.__toList( tqMatchDict[ field ] ) ) ) )
+    def ownerCheck( tqData ):
+      for field, values in conds:
+        if tqData[ field ] not in values:
+          return False
+      return True
+    return ownerCheck
+
+  def __matchTaskQueue( self, tqData, tqMatchDict ):
+    """ Check a task queue against the resource, as the SQL conditions do
+    """
+    if 'CPUTime' in tqMatchDict:
+      cpuTimes = tqMatchDict[ 'CPUTime' ]
+      if not isinstance( cpuTimes, ( list, tuple ) ):
+        cpuTimes = [ cpuTimes ]
+      if tqData[ 'CPUTime' ] > max( [ long( cpuTime ) for cpuTime in cpuTimes ] ):
+        return False
+
+    noValues = frozenset()
+    for field in self.__multiValueFields:
+      tqValues = tqData.get( "%ss" % field, noValues )
+      if tqMatchDict.get( field ):
+        values = self.__toList( tqMatchDict[ field ] )
+        if field in self.__tagFields:
+          #All the tags of the task queue have to be provided by the resource
+          if tqMatchDict[ field ] != 'Any' and not tqValues.issubset( values ):
+            return False
+          requiredValues = tqMatchDict.get( "Required%s" % field )
+          if requiredValues and not set( self.__toList( requiredValues ) ).issubset( tqValues ):
+            return False
+        elif tqValues and not tqValues.intersection( values ):
+          return False
+        #The task queue can ban values of the resource
+        if field in self.__bannedFields:
+          bannedByTQ = tqData.get( "Banned%ss" % field, noValues )
+          if bannedByTQ and bannedByTQ.issuperset( values ):
+            return False
+      #The resource can ban values of the task queue
+      bannedValues = tqMatchDict.get( "Banned%s" % field )
+      if bannedValues and tqValues.issuperset( self.__toList( bannedValues ) ):
+        return False
+
+    #If the resource does not define them, the task queue can not require them
+    for field in self.__strictFields:
+      if field not in tqMatchDict and tqData.get( "%ss" % field ):
+        return False
+    return True
+
+  def __matchNegative( self, tqData, negativeCond ):
+    """ Negative conditions: a dict excludes the task queues matching all its fields,
+        a list of them excludes the task queues excluded by all of them
+    """
+    if isinstance( negativeCond, ( list, tuple ) ):
+      for condDict in negativeCond:
+        if self.__matchNegativeDict( tqData, condDict ):
+          return True
+      return False
+    return self.__matchNegativeDict( tqData, negativeCond )
+
+  def __matchNegativeDict( self, tqData, condDict ):
+    checked = False
+    for field in condDict:
+      if field in self.__multiValueFields:
+        checked = True
+        tqValues = tqData.get( "%ss" % field, frozenset() )
+        if not tqValues.intersection( self.__toList( condDict[ field ] ) ):
+          return True
+      elif field in self.__singleValueFields:
+        for value in self.__toList( condDict[ field ] ):
+          checked = True
+          if value != str( tqData[ field ] ):
+            return True
+    return not checked
@@ -0,0 +1,70 @@
+""" Test for the thread pool serving the CEs of the SiteDirector
+"""
+
+import threading
+import time
+import unittest
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.private.CEThreadPool import CEThreadPool
+
+class CEThreadPoolTestCase( unittest.TestCase ):
+  """ Base class for the CEThreadPool test cases
+  """
+  def setUp( self ):
+    self.lock = threading.Lock()
+    self.running = {}
+    self.maxRunning = {}
+
+  def task( self, ceName, duration ):
+    self.lock.acquire()
+    self.running[ceName] = self.running.get( ceName, 0 ) + 1
+    self.maxRunning[ceName] = max( self.maxRunning.get( ceName, 0 ), self.running[ceName] )
+    self.lock.release()
+    time.sleep( duration )
+    self.lock.acquire()
+    self.running[ceName] -= 1
+    self.lock.release()
+    if duration < 0.01:
+      return S_ERROR( 'Too fast' )
+    return S_OK( duration )
+
+  def test_perCE( self ):
+    pool = CEThreadPool( 4, 1 )
+    tasks = [ ( 'ce1', 'q1', self.task, ( 'ce1', 0.1 ) ),
+              ( 'ce1', 'q2', self.task, ( 'ce1', 0.1 ) ),
+              ( 'ce2', 'q3', self.task, ( 'ce2', 0.1 ) ),
+              ( 'ce3', 'q4', self.task, ( 'ce3', 0 ) ) ]
+    start = time.time()
+    result = pool.execute( tasks )['Value']
+    # ce1 queues one after the other, the others in parallel
+    self.assertTrue( time.time() - start < 0.3 )
+    self.assertEqual( self.maxRunning, { 'ce1' : 1, 'ce2' : 1, 'ce3' : 1 } )
+    self.assertEqual( sorted( result['Results'] ), [ 'q1', 'q2', 'q3', 'q4' ] )
+    self.assertFalse( result['Results']['q4']['OK'] )
+    statistics = pool.getStatistics()
+    self.assertEqual( statistics['ce1']['Tasks'], 2 )
+    self.assertEqual( statistics['ce3']['Failed'], 1 )
+
+  def test_timeout( self ):
+    pool = CEThreadPool( 4, 2 )
+    result = pool.execute( [ ( 'slow', 'q1', self.task, ( 'slow', 0.5 ) ),
+                             ( 'fast', 'q2', self.task, ( 'fast', 0.05 ) ) ], timeout = 0.2 )['Value']
+    self.assertEqual( result['TimedOut'], [ 'slow' ] )
+    self.assertEqual( result['Results'].keys(), [ 'q2' ] )
+    # The slow CE is skipped while its task runs
+    result = pool.execute( [ ( 'slow', 'q1', self.task, ( 'slow', 0.05 ) ) ] )['Value']
+    self.assertEqual( result['Skipped'], [ 'slow' ] )
+    time.sleep( 0.5 )
+    result = pool.execute( [ ( 'slow', 'q1', self.task, ( 'slow', 0.05 ) ) ] )['Value']
+    self.assertEqual( result['Results'].keys(), [ 'q1' ] )
+
+  def test_sequential( self ):
+    pool = CEThreadPool( 1 )
+    result = pool.execute( [ ( 'ce1', 'q1', self.task, ( 'ce1', 0.01 ) ),
+                             ( 'ce2', 'q2', self.task, ( 'ce2', 0.01 ) ) ] )['Value']
+    self.assertEqual( sorted( result['Results'] ), [ 'q1', 'q2' ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( CEThreadPoolTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
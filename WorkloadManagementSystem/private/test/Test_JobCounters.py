@@ -0,0 +1,41 @@
+""" Test for the in memory job counters
+"""
+
+import unittest
+
+from DIRAC.WorkloadManagementSystem.private.JobCounters import JobCounters
+
+class JobCountersTestCase( unittest.TestCase ):
+  """ Base class for the JobCounters test cases
+  """
+  def setUp( self ):
+    self.counters = JobCounters( [ 'Matched', 'Running' ] )
+    self.counters.setCounters( 'JobType', [ ( { 'Site' : 'A', 'JobType' : 'MC', 'Status' : 'Running' }, 3 ),
+                                            ( { 'Site' : 'A', 'JobType' : 'MC', 'Status' : 'Matched' }, 1 ),
+                                            ( { 'Site' : 'A', 'JobType' : 'User', 'Status' : 'Running' }, 2 ),
+                                            ( { 'Site' : 'B', 'JobType' : 'MC', 'Status' : 'Running' }, 5 ) ] )
+
+  def test_getCounters( self ):
+    self.assertEqual( self.counters.getCounters( 'JobType', 'A', [ 'Matched', 'Running' ] ), { 'MC' : 4, 'User' : 2 } )
+    self.assertEqual( self.counters.getCounters( 'JobType', 'A', [ 'Matched' ] ), { 'MC' : 1 } )
+    self.assertEqual( self.counters.getCounters( 'JobType', 'C', [ 'Running' ] ), {} )
+    self.assertEqual( self.counters.getCounters( 'JobGroup', 'A', [ 'Running' ] ), None )
+
+  def test_update( self ):
+    #Waiting job matched at B
+    self.counters.update( { 'Site' : 'ANY', 'JobType' : 'User', 'Status' : 'Waiting' },
+                          { 'Site' : 'B', 'JobType' : 'User', 'Status' : 'Matched' } )
+    self.assertEqual( self.counters.getCounters( 'JobType', 'B', [ 'Matched', 'Running' ] ), { 'MC' : 5, 'User' : 1 } )
+    #Running job done at A
+    self.counters.update( { 'Site' : 'A', 'JobType' : 'MC', 'Status' : 'Running' },
+                          { 'Site' : 'A', 'JobType' : 'MC', 'Status' : 'Done' } )
+    self.assertEqual( self.counters.getCounters( 'JobType', 'A', [ 'Running' ] ), { 'MC' : 2, 'User' : 2 } )
+    #Unknown job leaving a counted status does not go below zero
+    for _i in range( 3 ):
+      self.counters.update( { 'Site' : 'A', 'JobType' : 'User', 'Status' : 'Running' },
+                            { 'Site' : 'A', 'JobType' : 'User', 'Status' : 'Failed' } )
+    self.assertEqual( self.counters.getCounters( 'JobType', 'A', [ 'Running' ] ), { 'MC' : 2, 'User' : 0 } )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( JobCountersTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
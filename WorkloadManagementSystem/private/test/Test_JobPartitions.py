@@ -0,0 +1,99 @@
+""" Test for the JobID partitions of the WMS tables
+"""
+
+import array
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from DIRAC import S_OK
+from DIRAC.WorkloadManagementSystem.private.JobPartitions import JobPartitions
+
+class FakeQueryIterator( object ):
+  """ Minimal QueryIterator
+  """
+  def __init__( self, rows ):
+    self.batches = [ rows ]
+    self.rowsRead = len( rows )
+
+  def __iter__( self ):
+    return iter( self.batches )
+
+  def close( self ):
+    pass
+
+class FakeDB( object ):
+  """ DB answering the INFORMATION_SCHEMA queries from a { table : [ ( name, bound ) ] } dictionary
+  """
+  def __init__( self, partitions ):
+    self.partitions = partitions
+    self.updates = []
+
+  def _query( self, cmd ):
+    table = cmd.split( "TABLE_NAME = '" )[-1].split( "'" )[0]
+    if 'INFORMATION_SCHEMA.PARTITIONS' in cmd:
+      if not self.partitions.get( table ):
+        return S_OK( ( ( None, None, 10 ), ) )
+      return S_OK( tuple( [ ( name, bound, 10 ) for name, bound in self.partitions[ table ] ] ) )
+    if 'INFORMATION_SCHEMA.TABLE_CONSTRAINTS' in cmd:
+      return S_OK( ( ( '%s_ibfk_1' % table, ), ) )
+    if 'INFORMATION_SCHEMA.COLUMNS' in cmd:
+      return S_OK( ( ( 'JobID', ), ( 'Value', ) ) )
+    return S_OK( () )
+
+  def _queryIter( self, cmd ):
+    return S_OK( FakeQueryIterator( [ ( 1, 'a\tb' ), ( 2, None ), ( 3, array.array( 'c', 'x\ny' ) ) ] ) )
+
+  def _update( self, cmd ):
+    self.updates.append( cmd )
+    return S_OK( 1 )
+
+class JobPartitionsTestCase( unittest.TestCase ):
+  """ Base class for the JobPartitions test cases
+  """
+  def setUp( self ):
+    self.db = FakeDB( { 'Jobs' : [ ( 'id1000', '1000' ), ( 'id2000', '2000' ), ( 'pMax', 'MAXVALUE' ) ] } )
+    self.jobPartitions = JobPartitions( self.db, [ 'Jobs', 'JobJDLs' ] )
+
+  def test_getPartitions( self ):
+    partitions = self.jobPartitions.getPartitions()['Value']
+    self.assertEqual( [ ( p['Name'], p['LowerBound'], p['UpperBound'] ) for p in partitions ],
+                      [ ( 'id1000', 0, 1000 ), ( 'id2000', 1000, 2000 ), ( 'pMax', 2000, None ) ] )
+    self.assertEqual( self.jobPartitions.getTablePartitions( 'JobJDLs' )['Value'], [] )
+
+  def test_setPartitions( self ):
+    partitions = [ ( 'id1000', 1000 ), ( 'id2000', 2000 ), ( 'id3000', 3000 ) ]
+    self.assertFalse( self.jobPartitions.setPartitions( partitions )['OK'] )
+    self.assertEqual( self.db.updates, [] )
+    result = self.jobPartitions.setPartitions( partitions, create = True )
+    self.assertTrue( result['OK'] )
+    self.assertEqual( self.db.updates[:2], [ "ALTER TABLE `Jobs` DROP FOREIGN KEY `Jobs_ibfk_1`",
+                                             "ALTER TABLE `JobJDLs` DROP FOREIGN KEY `JobJDLs_ibfk_1`" ] )
+    self.assertTrue( self.db.updates[2].startswith( "ALTER TABLE `JobJDLs` PARTITION BY RANGE ( JobID )" ) )
+    self.assertTrue( "PARTITION id1000 VALUES LESS THAN ( 1000 )" in self.db.updates[2] )
+    self.assertEqual( self.db.updates[3], "ALTER TABLE `Jobs` REORGANIZE PARTITION pMax INTO "
+                                          "( PARTITION id3000 VALUES LESS THAN ( 3000 ), "
+                                          "PARTITION pMax VALUES LESS THAN MAXVALUE )" )
+
+  def test_dropPartition( self ):
+    self.assertTrue( self.jobPartitions.dropPartition( 'id1000' )['OK'] )
+    self.assertEqual( self.db.updates, [ "ALTER TABLE `Jobs` DROP PARTITION id1000" ] )
+    self.assertFalse( self.jobPartitions.dropPartition( 'pMax' )['OK'] )
+    self.assertFalse( self.jobPartitions.hasPartition( 'id1000' )['Value'] )
+
+  def test_archivePartition( self ):
+    directory = tempfile.mkdtemp()
+    try:
+      fileNames = self.jobPartitions.archivePartition( 'id1000', directory )['Value']
+      self.assertEqual( fileNames, [ os.path.join( directory, 'Jobs.id1000.tsv.gz' ) ] )
+      archive = gzip.open( fileNames[0] )
+      self.assertEqual( archive.read(), "JobID\tValue\n1\ta\\tb\n2\t\\N\n3\tx\\ny\n" )
+      archive.close()
+    finally:
+      shutil.rmtree( directory )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( JobPartitionsTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,136 @@
+""" Test for the write behind of the job state updates
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from mock import MagicMock
+
+from DIRAC import S_OK, S_ERROR
+from DIRAC.WorkloadManagementSystem.private.JobStateWriteBehind import JobStateWriteBehind
+import DIRAC.WorkloadManagementSystem.Service.JobStateUpdateHandler as JobStateUpdateHandlerModule
+
+class JobStateWriteBehindTestCase( unittest.TestCase ):
+  """ Base class for the JobStateWriteBehind test cases
+  """
+  def setUp( self ):
+    self.journal = tempfile.mkdtemp()
+    self.jobDB = MagicMock()
+    self.jobDB.getJobsData.return_value = S_OK( { 1 : { 'Status' : 'Matched', 'MinorStatus' : 'Pilot Agent' },
+                                                  2 : { 'Status' : 'Stalled', 'MinorStatus' : 'Application' } } )
+    self.jobDB.getJobAttributes.side_effect = lambda jobID, _attributes: S_OK( { 'Status' : 'Matched' }
+                                                                               if jobID in ( 1, 2 ) else {} )
+    self.logDB = MagicMock()
+    self.logDB.getLastStatusTimes.return_value = S_OK( {} )
+    for method in ( self.jobDB.setJobsAttributes, self.jobDB.setStartExecTimes, self.jobDB.setEndExecTimes,
+                    self.jobDB.setJobsParameters, self.logDB.addLoggingRecords ):
+      method.return_value = S_OK()
+    self.writeBehind = JobStateWriteBehind( self.jobDB, self.logDB, self.journal )
+
+  def tearDown( self ):
+    shutil.rmtree( self.journal )
+
+  def test_coalesce( self ):
+    self.writeBehind.setJobStatus( 1, 'Running', 'Application', 'Test', '2016-01-01 10:00:00' )
+    self.writeBehind.setJobStatus( 1, 'Done', 'Execution Complete', 'Test', '2016-01-01 11:00:00' )
+    self.writeBehind.setJobStatusBulk( 2, { '2016-01-01 10:00:00' : { 'Status' : '', 'MinorStatus' : 'Uploading',
+                                                                    'ApplicationStatus' : '', 'Source' : 'JobWrapper' } } )
+    self.writeBehind.setJobParameters( 1, [ ( 'CPU', '1' ), ( 'Memory', '2' ) ] )
+    self.writeBehind.setJobParameters( 1, [ ( 'CPU', '3' ) ] )
+    self.assertFalse( self.writeBehind.setJobStatus( 3, 'Done', '', 'Test' )['OK'] )
+    self.assertFalse( self.writeBehind.hasPendingUpdates( 3 ) )
+    self.assertTrue( self.writeBehind.hasPendingUpdates( 1 ) )
+    self.assertFalse( self.jobDB.setJobsAttributes.called )
+
+    self.assertTrue( self.writeBehind.flush()['OK'] )
+    self.assertFalse( self.writeBehind.hasPendingUpdates( 1 ) )
+    self.jobDB.setJobsAttributes.assert_any_call( { 1 : { 'Status' : 'Done', 'MinorStatus' : 'Execution Complete' },
+                                                    2 : { 'Status' : 'Running', 'MinorStatus' : 'Uploading' } },
+                                                  update = True )
+    self.jobDB.setStartExecTimes.assert_called_with( { 1 : '2016-01-01 10:00:00' } )
+    self.jobDB.setEndExecTimes.assert_called_with( { 1 : '2016-01-01 11:00:00' } )
+    records = self.logDB.addLoggingRecords.call_args[0][0]
+    self.assertEqual( len( records ), 3 )
+    self.assertEqual( records[-1][0], 2 )
+    jobsParameters = self.jobDB.setJobsParameters.call_args[0][0]
+    self.assertEqual( sorted( jobsParameters[1] ), [ ( 'CPU', '3' ), ( 'Memory', '2' ) ] )
+
+  def test_execTimes( self ):
+    final = { 'Status' : 'Done', 'MinorStatus' : '', 'ApplicationStatus' : '', 'Source' : 'JobWrapper' }
+    self.writeBehind.setJobStatusBulk( 1, { '2016-01-01 10:00:00' : final, '2016-01-01 11:00:00' : final } )
+    self.writeBehind.setJobStatusBulk( 1, { '2016-01-01 12:00:00' : final } )
+    self.assertTrue( self.writeBehind.flush()['OK'] )
+    self.jobDB.setEndExecTimes.assert_called_with( { 1 : '2016-01-01 11:00:00' } )
+
+  def test_wrongUpdate( self ):
+    self.assertFalse( self.writeBehind.setJobStatusBulk( 1, { '2016-01-01 10:00:00' : { 'Status' : 'Done' } } )['OK'] )
+    self.assertFalse( self.writeBehind.hasPendingUpdates( 1 ) )
+
+  def test_sameRecords( self ):
+    # Status updates leaving the status or the minor status unchanged
+    updates = [ ( 'Running', 'Application', 'JobWrapper', '2016-01-01 10:00:00' ),
+                ( '', 'Uploading', 'JobWrapper', '2016-01-01 11:00:00' ),
+                ( 'Done', '', 'JobWrapper', '2016-01-01 12:00:00' ) ]
+    for status, minorStatus, source, date in updates:
+      self.writeBehind.setJobStatus( 1, status, minorStatus, source, date )
+    self.assertTrue( self.writeBehind.flush()['OK'] )
+    records = self.logDB.addLoggingRecords.call_args[0][0]
+
+    # The same updates written directly by the JobStateUpdate service
+    job = { 'Status' : 'Matched', 'MinorStatus' : 'Pilot Agent' }
+    def setJobStatus( _jobID, status, minor ):
+      job.update( [ ( name, value ) for name, value in ( ( 'Status', status ), ( 'MinorStatus', minor ) ) if value ] )
+      return S_OK()
+    jobDB = MagicMock()
+    jobDB.setJobStatus.side_effect = setJobStatus
+    jobDB.getJobAttributes.side_effect = lambda _jobID, _attributes: S_OK( dict( job ) )
+    logDB = MagicMock()
+    logDB.addLoggingRecord.return_value = S_OK()
+    handlerModule = JobStateUpdateHandlerModule
+    saved = ( handlerModule.jobDB, handlerModule.logDB, handlerModule.writeBehind )
+    handlerModule.jobDB, handlerModule.logDB, handlerModule.writeBehind = jobDB, logDB, False
+    try:
+      handler = handlerModule.JobStateUpdateHandler.__new__( handlerModule.JobStateUpdateHandler )
+      for status, minorStatus, source, date in updates:
+        self.assertTrue( handler.export_setJobStatus( 1, status, minorStatus, source, date )['OK'] )
+    finally:
+      handlerModule.jobDB, handlerModule.logDB, handlerModule.writeBehind = saved
+    directRecords = []
+    for args, kwargs in logDB.addLoggingRecord.call_args_list:
+      directRecords.append( ( args[0], args[1], args[2], kwargs.get( 'application', 'idem' ),
+                              kwargs['date'], kwargs['source'] ) )
+    self.assertEqual( records, directRecords )
+    self.assertEqual( [ record[1:3] for record in records ],
+                      [ ( 'Running', 'Application' ), ( 'Running', 'Uploading' ), ( 'Done', 'Uploading' ) ] )
+
+  def test_journal( self ):
+    self.writeBehind.setJobStatus( 1, 'Running', 'Application', 'Test' )
+    self.jobDB.getJobsData.return_value = S_ERROR( 'No DB' )
+    self.assertFalse( self.writeBehind.flush()['OK'] )
+    self.assertTrue( self.writeBehind.hasPendingUpdates( 1 ) )
+    # Restarted with the updates of the journal
+    writeBehind = JobStateWriteBehind( self.jobDB, self.logDB, self.journal )
+    self.assertTrue( writeBehind.hasPendingUpdates( 1 ) )
+    self.jobDB.getJobsData.return_value = S_OK( { 1 : { 'Status' : 'Matched', 'MinorStatus' : 'Pilot Agent' } } )
+    self.assertTrue( writeBehind.flush()['OK'] )
+    self.assertEqual( self.logDB.addLoggingRecords.call_count, 1 )
+    self.assertEqual( len( os.listdir( os.path.join( self.journal, str( os.getpid() ) ) ) ), 1 )
+
+  def test_adoptJournal( self ):
+    self.writeBehind.setJobStatus( 1, 'Running', 'Application', 'Test' )
+    # Journal left by a worker that is gone
+    process = subprocess.Popen( [ 'true' ] )
+    process.wait()
+    os.rename( os.path.join( self.journal, str( os.getpid() ) ), os.path.join( self.journal, str( process.pid ) ) )
+    writeBehind = JobStateWriteBehind( self.jobDB, self.logDB, self.journal )
+    self.assertTrue( writeBehind.hasPendingUpdates( 1 ) )
+    self.assertEqual( os.listdir( self.journal ), [ str( os.getpid() ) ] )
+    self.assertTrue( writeBehind.flush()['OK'] )
+    self.assertEqual( self.logDB.addLoggingRecords.call_count, 1 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( JobStateWriteBehindTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,77 @@
+""" Test for the cache of the pilot wrappers
+"""
+
+import base64
+import bz2
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from DIRAC import S_OK
+from DIRAC.WorkloadManagementSystem.private.PilotWrapperCache import PilotWrapperCache
+
+class FakeProxy( object ):
+  """ Proxy with a content
+  """
+  def __init__( self, content ):
+    self.content = content
+    self.dumps = 0
+
+  def dumpAllToString( self ):
+    self.dumps += 1
+    return S_OK( self.content )
+
+class PilotWrapperCacheTestCase( unittest.TestCase ):
+  """ Base class for the PilotWrapperCache test cases
+  """
+  def setUp( self ):
+    self.directory = tempfile.mkdtemp()
+    self.wrapperDirectory = os.path.join( self.directory, 'PilotWrappers' )
+    self.pilotFile = os.path.join( self.directory, 'dirac-pilot.py' )
+    with open( self.pilotFile, 'w' ) as fd:
+      fd.write( 'print "pilot"\n' )
+
+  def tearDown( self ):
+    shutil.rmtree( self.directory )
+
+  def test_encodedFiles( self ):
+    cache = PilotWrapperCache( self.wrapperDirectory )
+    encoded = cache.getEncodedFile( self.pilotFile )
+    self.assertEqual( bz2.decompress( base64.decodestring( encoded ) ), 'print "pilot"\n' )
+    self.assertTrue( cache.getEncodedFile( self.pilotFile ) is encoded )
+    # A new version of the file is encoded again
+    with open( self.pilotFile, 'w' ) as fd:
+      fd.write( 'print "new pilot"\n' )
+    self.assertEqual( bz2.decompress( base64.decodestring( cache.getEncodedFile( self.pilotFile ) ) ),
+                      'print "new pilot"\n' )
+
+  def test_encodedProxies( self ):
+    cache = PilotWrapperCache( self.wrapperDirectory, maxProxies = 1 )
+    proxy = FakeProxy( 'proxy 1' )
+    encoded = cache.getEncodedProxy( proxy )['Value']
+    self.assertTrue( cache.getEncodedProxy( proxy )['Value'] is encoded )
+    renewed = cache.getEncodedProxy( FakeProxy( 'proxy 2' ) )['Value']
+    self.assertEqual( bz2.decompress( base64.decodestring( renewed ) ), 'proxy 2' )
+    self.assertFalse( cache.getEncodedProxy( proxy )['Value'] is encoded )
+
+  def test_wrappers( self ):
+    cache = PilotWrapperCache( self.wrapperDirectory, maxSize = 25, minAge = 0 )
+    path = cache.writeWrapper( 'wrapper 1' * 2 )['Value']
+    self.assertEqual( open( path ).read(), 'wrapper 1' * 2 )
+    self.assertEqual( cache.writeWrapper( 'wrapper 1' * 2 )['Value'], path )
+    time.sleep( 0.01 )
+    # Above the size limit, the oldest wrapper goes
+    newPath = cache.writeWrapper( 'wrapper 2' * 2 )['Value']
+    self.assertFalse( os.path.exists( path ) )
+    self.assertTrue( os.path.exists( newPath ) )
+    # Wrappers already there are known after a restart
+    cache = PilotWrapperCache( self.wrapperDirectory, maxSize = 25, minAge = 3600 )
+    self.assertEqual( cache.writeWrapper( 'wrapper 2' * 2 )['Value'], newPath )
+    cache.writeWrapper( 'wrapper 3' * 2 )
+    self.assertEqual( len( os.listdir( self.wrapperDirectory ) ), 2 )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( PilotWrapperCacheTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -0,0 +1,68 @@
+""" Test for the in memory index of the task queues
+"""
+
+import unittest
+
+from mock import patch
+
+from DIRAC.WorkloadManagementSystem.private.TaskQueueIndex import TaskQueueIndex
+
+singleValueFields = ( 'OwnerDN', 'OwnerGroup', 'Setup', 'CPUTime' )
+multiValueFields = ( 'GridCE', 'Site', 'GridMiddleware', 'Platform',
+                     'PilotType', 'SubmitPool', 'JobType', 'Tag' )
+
+class TaskQueueIndexTestCase( unittest.TestCase ):
+  """ Base class for the TaskQueueIndex test cases
+  """
+  def setUp( self ):
+    self.csPatcher = patch( 'DIRAC.WorkloadManagementSystem.private.TaskQueueIndex.CS.getPropertiesForGroup',
+                            side_effect = lambda group : [ 'JobSharing' ] if group == 'shared' else [] )
+    self.csPatcher.start()
+    self.index = TaskQueueIndex( singleValueFields, multiValueFields,
+                                 tagFields = ( 'Tag', ),
+                                 bannedFields = ( 'Site', ),
+                                 strictFields = ( 'SubmitPool', 'Platform', 'PilotType', 'Tag' ) )
+    self.addTQ( 1 )
+    self.addTQ( 2, Sites = [ 'A' ] )
+    self.addTQ( 3, Sites = [ 'B' ], Platforms = [ 'p1' ] )
+    self.addTQ( 4, BannedSites = [ 'A' ] )
+    self.addTQ( 5, Tags = [ 'GPU' ] )
+    self.addTQ( 6, CPUTime = 90000 )
+    self.addTQ( 7, OwnerDN = '/other', OwnerGroup = 'shared' )
+    self.resource = { 'Setup' : 'S', 'CPUTime' : 5000, 'Site' : 'A',
+                      'OwnerDN' : '/dn', 'OwnerGroup' : [ 'g', 'shared' ] }
+
+  def tearDown( self ):
+    self.csPatcher.stop()
+
+  def addTQ( self, tqId, **kwargs ):
+    tqDef = { 'OwnerDN' : '/dn', 'OwnerGroup' : 'g', 'Setup' : 'S', 'CPUTime' : 3600, 'Priority' : 1.0 }
+    tqDef.update( kwargs )
+    self.index.addTaskQueue( tqId, tqDef )
+
+  def matchIds( self, resource, negativeCond = None ):
+    return sorted( [ tqTuple[0] for tqTuple in self.index.match( resource, 0, negativeCond = negativeCond ) ] )
+
+  def test_match( self ):
+    self.assertEqual( self.matchIds( self.resource ), [ 1, 2, 7 ] )
+    resource = dict( self.resource, Site = 'B', Platform = 'p1', Tag = [ 'GPU', 'X' ] )
+    self.assertEqual( self.matchIds( resource ), [ 1, 3, 4, 5, 7 ] )
+    resource = dict( self.resource, BannedSite = 'A' )
+    self.assertEqual( self.matchIds( resource ), [ 1, 7 ] )
+
+  def test_negativeCond( self ):
+    self.assertEqual( self.matchIds( self.resource, negativeCond = { 'Site' : 'A' } ), [ 1, 7 ] )
+    self.assertEqual( self.matchIds( self.resource, negativeCond = [ { 'Site' : 'A' }, { 'OwnerGroup' : 'other' } ] ),
+                      [ 1, 2, 7 ] )
+
+  def test_updates( self ):
+    self.index.removeTaskQueue( 1 )
+    self.assertEqual( self.matchIds( self.resource ), [ 2, 7 ] )
+    self.assertEqual( len( self.index ), 6 )
+    self.index.setPriority( 7, 0.001 )
+    self.index.setPriority( 2, 1000 )
+    self.assertEqual( self.index.match( self.resource, 1 ), [ ( 2, '/dn', 'g' ) ] )
+
+if __name__ == '__main__':
+  suite = unittest.defaultTestLoader.loadTestsFromTestCase( TaskQueueIndexTestCase )
+  testResult = unittest.TextTestRunner( verbosity = 2 ).run( suite )
@@ -74,7 +74,32 @@ class JobSubmissionCase( JobDBTestCase ):
     res = self.jobDB.getJobOptParameters( jobID )
     self.assert_( res['OK'] )
     self.assertEqual( res['Value'], {} )
-    
+
+  def test_getJobsData( self ):
+
+    jobIDs = []
+    for _i in range( 2 ):
+      res = self.jobDB.insertNewJobIntoDB( jdl, 'owner', '/DN/OF/owner', 'ownerGroup', 'someSetup' )
+      self.assert_( res['OK'] )
+      jobIDs.append( res['JobID'] )
+    res = self.jobDB.setJobOptParameter( jobIDs[0], 'Opt', 'value' )
+    self.assert_( res['OK'] )
+    res = self.jobDB.getJobsData( jobIDs, ['Status', 'RescheduleCounter'], optParamList = [], jdl = True )
+    self.assert_( res['OK'] )
+    self.assertEqual( sorted( res['Value'] ), sorted( jobIDs ) )
+    jobData = res['Value'][jobIDs[0]]
+    self.assertEqual( jobData['Status'], 'Received' )
+    self.assertEqual( jobData['RescheduleCounter'], 0 )
+    self.assertEqual( jobData['OptimizerParameters'], { 'Opt' : 'value' } )
+    self.assert_( 'JobName' in jobData['JDL'] )
+    self.assertEqual( res['Value'][jobIDs[1]]['OptimizerParameters'], {} )
+    res = self.jobDB.getJobsData( jobIDs, ['Status'], columnar = True )
+    self.assert_( res['OK'] )
+    self.assertEqual( res['Value']['ParameterNames'], ['JobID', 'Status'] )
+    self.assertEqual( res['Value']['Records'], [ [ jobID, 'Received' ] for jobID in sorted( jobIDs ) ] )
+    res = self.jobDB.getJobsData( jobIDs, ['NotAnAttribute'] )
+    self.assertFalse( res['OK'] )
+
 class JobRescheduleCase(JobDBTestCase):  
   
   def test_rescheduleJob(self):
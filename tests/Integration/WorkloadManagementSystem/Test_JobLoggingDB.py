@@ -51,6 +51,18 @@ class JobLoggingCase( JobLoggingDBTestCase ):
 
     self.jlogDB.deleteJob( 1 )
 
+  def test_bulkRecords( self ):
+
+    records = [ ( 2, "testing", 'bulk %s' % i, 'idem', '2006-04-25 14:20:1%s' % i, 'Unittest' ) for i in range( 5 ) ]
+    records.append( ( 2, "testing", 'bulk no date', 'idem', '', 'Unittest' ) )
+    result = self.jlogDB.addLoggingRecords( records )
+    self.assert_( result['OK'] )
+    result = self.jlogDB.getJobLoggingInfo( 2 )
+    self.assert_( result['OK'] )
+    self.assertEqual( [ record[1] for record in result['Value'] ], [ record[2] for record in records ] )
+
+    self.jlogDB.deleteJob( 2 )
+
 
 if __name__ == '__main__':
   suite = unittest.defaultTestLoader.loadTestsFromTestCase( JobLoggingCase )
@@ -72,6 +72,29 @@ class TQTests( TQDBTestCase ):
     result = self.tqDB.deleteTaskQueue( tq )
     self.assert_( result['OK'] )
 
+  def test_matchAndGetJobs( self ):
+    """ several jobs taken in one go
+    """
+    tqDefDict = {'OwnerDN': '/my/DN', 'OwnerGroup':'myGroup', 'Setup':'aSetup', 'CPUTime':50000}
+    for jobId in ( 124, 125, 126 ):
+      result = self.tqDB.insertJob( jobId, tqDefDict, 10 )
+      self.assert_( result['OK'] )
+
+    result = self.tqDB.matchAndGetJobs( {'Setup': 'aSetup', 'CPUTime': 300000}, 2 )
+    self.assert_( result['OK'] )
+    self.assert_( result['Value']['matchFound'] )
+    jobs = result['Value']['jobs']
+    self.assertEqual( len( jobs ), 2 )
+    self.assert_( set( [ job[0] for job in jobs ] ).issubset( [ 124, 125, 126 ] ) )
+
+    # only one left
+    result = self.tqDB.matchAndGetJobs( {'Setup': 'aSetup', 'CPUTime': 300000}, 2 )
+    self.assert_( result['OK'] )
+    self.assertEqual( len( result['Value']['jobs'] ), 1 )
+
+    result = self.tqDB.deleteTaskQueue( jobs[0][1] )
+    self.assert_( result['OK'] )
+
 
 
 if __name__ == '__main__':
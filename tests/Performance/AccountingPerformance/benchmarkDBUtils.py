@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+""" Benchmark the reshaping of the accounting buckets done for the reports by BaseReporter and
+    DBUtils, comparing the bucket by bucket implementation with the numpy one.
+
+    Options:
+      * -k : number of keys (sites, users...) in each report
+      * -r : number of repetitions, the best time is kept
+      * -p : comma separated list of reports to run (year,month,week)
+"""
+
+import copy
+import random
+import time
+from decimal import Decimal
+from optparse import OptionParser
+
+from DIRAC.AccountingSystem.private import BucketsMatrix
+from DIRAC.AccountingSystem.private.DBUtils import DBUtils
+
+# Report span, coarsest granularity and ( age, bucketLength ) of the buckets, as for the Job type
+gReports = { 'year' : ( 86400 * 365, 86400, ( ( 86400 * 8, 3600 ), ( 86400 * 365, 86400 ) ) ),
+             'month' : ( 86400 * 30, 3600, ( ( 86400 * 2, 900 ), ( 86400 * 30, 3600 ) ) ),
+             'week' : ( 86400 * 7, 900, ( ( 86400 * 7, 900 ), ) ) }
+
+def reportBuckets( reportName, numKeys ):
+  """ [ ( key, startTime, bucketLength, CPUTime, entries ) ] as returned by the DB to BaseReporter._getTimedData """
+  span, _granularity, bucketsLength = gReports[ reportName ]
+  endEpoch = 1500000000 - 1500000000 % 86400
+  rows = []
+  for keyNum in range( numKeys ):
+    ageStart = 0
+    for age, bucketLength in bucketsLength:
+      for bucketEpoch in range( endEpoch - age, endEpoch - ageStart, bucketLength ):
+        #Not all the keys have data in all the buckets
+        if random.random() < 0.8:
+          rows.append( ( 'key%s' % keyNum, bucketEpoch, bucketLength,
+                         Decimal( "%.10f" % ( random.random() * 10 ** 6 ) ), Decimal( random.randint( 1, 1000 ) ) ) )
+      ageStart = age
+  rows.sort( key = lambda row: row[1] )
+  return rows, endEpoch - span, endEpoch
+
+def timedData( dbUtils, granularity, rows, legacy ):
+  """ Group by key and reshape the buckets, as BaseReporter._getTimedData """
+  if legacy:
+    dataDict = dbUtils._groupByField( 0, rows )
+    for key in dataDict:
+      dataDict[ key ] = dbUtils._legacySumToGranularity( granularity, dataDict[ key ] )
+    return dataDict
+  matrix = BucketsMatrix.spanToGranularity( granularity, rows, keyed = True )
+  matrix.sumValues()
+  return matrix.toDataDict()
+
+def timedGauges( dbUtils, granularity, rows, legacy ):
+  """ Same with the proportional gauges, as for the efficiency plots """
+  if legacy:
+    return dbUtils._legacyCalculateProportionalGauges( timedData( dbUtils, granularity, rows, legacy ) )
+  matrix = BucketsMatrix.spanToGranularity( granularity, rows, keyed = True )
+  matrix.sumValues()
+  matrix.calculateProportionalGauges()
+  return matrix.toDataDict()
+
+def bestTime( function, arguments, repetitions ):
+  """ Best wall clock time of function( *arguments ) over the repetitions, with the last result """
+  best = None
+  for _i in xrange( repetitions ):
+    callArguments = copy.deepcopy( arguments )
+    start = time.time()
+    result = function( *callArguments )
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best, result
+
+def checkSame( name, legacyResult, result ):
+  """ Both paths have to give the same numbers """
+  for key in legacyResult:
+    for epoch in legacyResult[ key ]:
+      legacyValues = legacyResult[ key ][ epoch ]
+      values = result[ key ][ epoch ]
+      if not isinstance( legacyValues, list ):
+        legacyValues, values = [ legacyValues ], [ values ]
+      for legacyValue, value in zip( legacyValues, values ):
+        if abs( legacyValue - value ) > 1e-6 * max( 1, abs( legacyValue ) ):
+          raise Exception( "Paths give different values for %s: %s %s %s != %s" % ( name, key, epoch,
+                                                                                      legacyValue, value ) )
+    if len( legacyResult[ key ] ) != len( result[ key ] ):
+      raise Exception( "Paths give different buckets for %s: %s" % ( name, key ) )
+
+def runBenchmark( reportName, numKeys, repetitions ):
+  dbUtils = DBUtils( None, 'Benchmark' )
+  _span, granularity, _bucketsLength = gReports[ reportName ]
+  rows, _startEpoch, _endEpoch = reportBuckets( reportName, numKeys )
+  for operation, function in ( ( 'timed data', timedData ), ( 'gauges', timedGauges ) ):
+    legacyTime, legacyResult = bestTime( function, ( dbUtils, granularity, rows, True ), repetitions )
+    numpyTime, numpyResult = bestTime( function, ( dbUtils, granularity, rows, False ), repetitions )
+    checkSame( "%s %s" % ( reportName, operation ), legacyResult, numpyResult )
+    print "%-6s %-12s %9d %10.3f s %10.3f s %8.2fx" % ( reportName, operation, len( rows ),
+                                                       legacyTime, numpyTime, legacyTime / numpyTime )
+
+if __name__ == "__main__":
+  parser = OptionParser( usage = "usage: %prog [options]" )
+  parser.add_option( "-k", "--keys", dest = "keys", type = "int", default = 200,
+                     help = "Number of keys per report (default: 200)" )
+  parser.add_option( "-r", "--repeat", dest = "repeat", type = "int", default = 3,
+                     help = "Number of repetitions, the best one is kept (default: 3)" )
+  parser.add_option( "-p", "--reports", dest = "reports", default = "year,month,week",
+                     help = "Comma separated reports to run (default: year,month,week)" )
+  ( options, args ) = parser.parse_args()
+
+  if not BucketsMatrix.isAvailable():
+    raise SystemExit( "numpy is not installed, there is nothing to compare" )
+  random.seed( 1 )
+  print "%-6s %-12s %9s %12s %12s %9s" % ( 'report', 'op', 'buckets', 'loops', 'numpy', 'speedup' )
+  for reportName in options.reports.split( ',' ):
+    runBenchmark( reportName, options.keys, options.repeat )
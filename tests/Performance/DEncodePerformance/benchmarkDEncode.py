@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+""" Benchmark the encoding and decoding throughput of DEncode with realistic payloads,
+    comparing the current codec with the reference one (one table lookup and one call
+    per token), and the decoder with the single-pass one used by iterDecode.
+
+    Options:
+      * -n : number of records in each payload
+      * -r : number of repetitions, the best time is kept
+      * -p : comma separated list of payloads to run (replicas,jobs,files,ids)
+"""
+
+import datetime
+import gc
+import time
+from optparse import OptionParser
+
+from DIRAC.Core.Utilities import DEncode
+
+
+def replicasPayload( nRecords ):
+  """ Bulk getReplicas like result """
+  successful = {}
+  for i in xrange( nRecords ):
+    lfn = '/lhcb/data/2016/RAW/FULL/LHCb/COLLISION16/%06d/%06d_%08d.raw' % ( i / 1000, i / 1000, i )
+    successful[lfn] = { 'CERN-RAW' : 'srm://srm-lhcb.cern.ch/castor/cern.ch/grid%s' % lfn,
+                        'CNAF-RAW' : 'srm://storm-fe-lhcb.cr.cnaf.infn.it/t1d0%s' % lfn }
+  return { 'OK' : True, 'Value' : { 'Successful' : successful, 'Failed' : {} } }
+
+def jobsPayload( nRecords ):
+  """ getAttributesForJobList like result """
+  now = datetime.datetime.utcnow()
+  jobs = {}
+  for jobID in xrange( 1, nRecords + 1 ):
+    jobs[jobID] = { 'JobID' : jobID, 'JobName' : 'Job_%d' % jobID, 'JobGroup' : '00054321',
+                    'Status' : 'Running', 'MinorStatus' : 'Application', 'ApplicationStatus' : u'Gauss step 1',
+                    'Site' : 'LCG.CERN.ch', 'Owner' : 'someuser', 'OwnerGroup' : 'lhcb_mc',
+                    'SubmissionTime' : now, 'LastUpdateTime' : now, 'RescheduleCounter' : 0L,
+                    'CPUTime' : 1234.5, 'VerifiedFlag' : True, 'DeletedFlag' : False, 'UserPriority' : None }
+  return { 'OK' : True, 'Value' : jobs }
+
+def filesPayload( nRecords ):
+  """ getTransformationFiles like result """
+  now = datetime.datetime.utcnow()
+  files = [ { 'TransformationID' : 54321L, 'FileID' : i, 'TaskID' : i / 10, 'Status' : 'Processed',
+              'LFN' : '/lhcb/MC/2016/ALLSTREAMS.DST/00054321/0000/00054321_%08d_1.allstreams.dst' % i,
+              'UsedSE' : 'CERN-DST', 'ErrorCount' : 0, 'LastUpdate' : now, 'InsertedTime' : now }
+            for i in xrange( nRecords ) ]
+  return { 'OK' : True, 'Value' : files }
+
+def idsPayload( nRecords ):
+  """ A plain list of IDs """
+  return { 'OK' : True, 'Value' : range( nRecords ) }
+
+#Reference container codecs, as DEncode had them before the common items were inlined
+def referenceEncodeList( lValue, eList ):
+  eList.append( "l" )
+  for uObject in lValue:
+    DEncode.g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+  eList.append( "e" )
+
+def referenceEncodeTuple( lValue, eList ):
+  eList.append( "t" )
+  for uObject in lValue:
+    DEncode.g_dEncodeFunctions[ type( uObject ) ]( uObject, eList )
+  eList.append( "e" )
+
+def referenceEncodeDict( dValue, eList ):
+  eList.append( "d" )
+  for key in sorted( dValue ):
+    DEncode.g_dEncodeFunctions[ type( key ) ]( key, eList )
+    DEncode.g_dEncodeFunctions[ type( dValue[key] ) ]( dValue[key], eList )
+  eList.append( "e" )
+
+def referenceDecodeList( data, i ):
+  oL = []
+  i += 1
+  while data[ i ] != "e":
+    ob, i = DEncode.g_dDecodeFunctions[ data[ i ] ]( data, i )
+    oL.append( ob )
+  return( oL, i + 1 )
+
+def referenceDecodeTuple( data, i ):
+  oL, i = referenceDecodeList( data, i )
+  return ( tuple( oL ), i )
+
+def referenceDecodeDict( data, i ):
+  oD = {}
+  i += 1
+  while data[ i ] != "e":
+    k, i = DEncode.g_dDecodeFunctions[ data[ i ] ]( data, i )
+    oD[ k ], i = DEncode.g_dDecodeFunctions[ data[ i ] ]( data, i )
+  return ( oD, i + 1 )
+
+gReferenceEncode = { list : referenceEncodeList, tuple : referenceEncodeTuple, dict : referenceEncodeDict }
+gReferenceDecode = { 'l' : referenceDecodeList, 't' : referenceDecodeTuple, 'd' : referenceDecodeDict }
+
+def useReference( reference ):
+  """ Swap the reference container codecs in or out of the DEncode tables, return the old ones """
+  encodeSaved = dict( ( key, DEncode.g_dEncodeFunctions[ key ] ) for key in reference[0] )
+  decodeSaved = dict( ( key, DEncode.g_dDecodeFunctions[ key ] ) for key in reference[1] )
+  DEncode.g_dEncodeFunctions.update( reference[0] )
+  DEncode.g_dDecodeFunctions.update( reference[1] )
+  return ( encodeSaved, decodeSaved )
+
+gPayloads = { 'replicas' : replicasPayload, 'jobs' : jobsPayload,
+              'files' : filesPayload, 'ids' : idsPayload }
+
+def elapsedTime( function, argument ):
+  """ Wall clock time of function( argument ) """
+  start = time.time()
+  function( argument )
+  return time.time() - start
+
+def runBenchmark( name, payload, repetitions ):
+  """ Check that all the codecs agree and time them. The codecs are timed in turn at each
+      repetition, so that the load of the machine affects them alike, and, as timeit does,
+      with the garbage collector off: it would otherwise add a lot of noise
+  """
+  data = DEncode.encode( payload )
+  if DEncode.fastDecode( data ) != DEncode.decode( data ):
+    raise Exception( "Decoders decode %s differently" % name )
+  current = useReference( ( gReferenceEncode, gReferenceDecode ) )
+  try:
+    if DEncode.encode( payload ) != data or DEncode.decode( data ) != ( payload, len( data ) ):
+      raise Exception( "Reference codec encodes or decodes %s differently" % name )
+  finally:
+    useReference( current )
+  megaBytes = len( data ) / 1048576.
+  times = {}
+  gcWasEnabled = gc.isenabled()
+  gc.disable()
+  try:
+    for _i in xrange( repetitions ):
+      for key, function, argument in ( ( 'encode', DEncode.encode, payload ),
+                                       ( 'decode', DEncode.decode, data ),
+                                       ( 'fastDecode', DEncode.fastDecode, data ) ):
+        times.setdefault( key, [] ).append( elapsedTime( function, argument ) )
+      current = useReference( ( gReferenceEncode, gReferenceDecode ) )
+      try:
+        times.setdefault( 'refEncode', [] ).append( elapsedTime( DEncode.encode, payload ) )
+        times.setdefault( 'refDecode', [] ).append( elapsedTime( DEncode.decode, data ) )
+      finally:
+        useReference( current )
+  finally:
+    if gcWasEnabled:
+      gc.enable()
+  encodeTime = min( times[ 'encode' ] )
+  decodeTime = min( times[ 'decode' ] )
+  fastTime = min( times[ 'fastDecode' ] )
+  refEncodeTime = min( times[ 'refEncode' ] )
+  refDecodeTime = min( times[ 'refDecode' ] )
+  print "%-10s %8.2f MB %10.1f MB/s %10.1f MB/s %6.2fx %10.1f MB/s %10.1f MB/s %6.2fx %10.1f MB/s" % ( name, megaBytes,
+                                                                                                 megaBytes / refEncodeTime,
+                                                                                                 megaBytes / encodeTime,
+                                                                                                 refEncodeTime / encodeTime,
+                                                                                                 megaBytes / refDecodeTime,
+                                                                                                 megaBytes / decodeTime,
+                                                                                                 refDecodeTime / decodeTime,
+                                                                                                 megaBytes / fastTime )
+
+if __name__ == "__main__":
+  parser = OptionParser( usage = "usage: %prog [options]" )
+  parser.add_option( "-n", "--records", dest = "records", type = "int", default = 20000,
+                     help = "Number of records per payload (default: 20000)" )
+  parser.add_option( "-r", "--repeat", dest = "repeat", type = "int", default = 5,
+                     help = "Number of repetitions, the best one is kept (default: 5)" )
+  parser.add_option( "-p", "--payloads", dest = "payloads", default = ",".join( sorted( gPayloads ) ),
+                     help = "Comma separated payloads to run (default: all)" )
+  ( options, args ) = parser.parse_args()
+
+  print "%-10s %11s %15s %15s %7s %15s %15s %7s %15s" % ( 'payload', 'size', 'ref. encode', 'encode', 'speedup',
+                                                         'ref. decode', 'decode', 'speedup', 'single-pass' )
+  for payloadName in options.payloads.split( ',' ):
+    runBenchmark( payloadName, gPayloads[ payloadName ]( options.records ), options.repeat )